@@ -31,8 +31,11 @@ from flask_wtf.csrf import generate_csrf
 from authlib.integrations.flask_client import OAuth
 
 from utils.translations import get_translation, get_available_languages, get_language_name
+from migrations.migrate_database import migrate_database
 from routes import register_routes
 from routes.helpers import get_current_user
+from utils.profiler import init_profiler
+from services.job_queue import get_job_worker
 
 app = Flask(__name__)
 
@@ -45,6 +48,9 @@ if not secret_key:
     )
 app.config["SECRET_KEY"] = secret_key
 
+# Aplicar les migracions pendents de l'esquema abans de servir peticions
+migrate_database('techshop.db', verbose=False)
+
 # Protección CSRF para todas las peticiones POST
 csrf = CSRFProtect(app)
 
@@ -98,6 +104,14 @@ def inject_csrf_token():
 # Registrar todas las rutas desde blueprints
 register_routes(app)
 
+# Perfilador SQL por petición (cabecera X-SQL-Profile y vista /admin/sql-profile)
+init_profiler(app)
+
+# Tareas en segundo plano (factura y correo de las comandas). Con JOB_WORKER=0
+# no se arranca el hilo y las ejecuta scripts/run_jobs.py en otro proceso
+if os.environ.get("JOB_WORKER", "1") == "1":
+    get_job_worker('techshop.db').start()
+
 
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=3000)
@@ -5,9 +5,11 @@
 CREATE TABLE Product (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name VARCHAR(100),
-    price DECIMAL(10,2),
+    price DECIMAL(10,2),  -- Còpia en euros per a scripts antics
     stock INTEGER,
     company_id INTEGER,
+    price_cents INTEGER,  -- Preu en cèntims (font de veritat)
+    sku VARCHAR(64),      -- Codi del producte dins l'empresa (importacions, migració v11)
     FOREIGN KEY (company_id) REFERENCES User(id)
 );
 
@@ -28,11 +30,16 @@ CREATE TABLE User (
 -- Tabla Order: representa cada comanda realitzada
 CREATE TABLE "Order" (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    total DECIMAL(10,2),
+    total DECIMAL(10,2),  -- Còpia en euros per a scripts antics
     created_at DATETIME,
     user_id INTEGER,
+    total_cents INTEGER,  -- Total en cèntims (font de veritat)
+    idempotency_key VARCHAR(64),  -- Clau del formulari de checkout (migració v14)
+    confirmation_sent_at TIMESTAMP,  -- Correu de confirmació enviat (migració v20)
     FOREIGN KEY (user_id) REFERENCES User(id)
 );
+-- Un formulari de checkout enviat dos cops troba la comanda per la clau
+CREATE UNIQUE INDEX idx_order_idempotency_key ON "Order" (idempotency_key) WHERE idempotency_key IS NOT NULL;
 
 -- Tabla OrderItem: especifica els productes que formen part d'una comanda
 CREATE TABLE OrderItem (
@@ -40,6 +47,130 @@ CREATE TABLE OrderItem (
     order_id INTEGER,
     product_id INTEGER,
     quantity INTEGER,
+    product_name VARCHAR(100),  -- Nom del producte en el moment de la compra (migració v16)
+    unit_price_cents INTEGER,   -- Preu unitari pagat en cèntims (migració v16)
     FOREIGN KEY (order_id) REFERENCES "Order"(id),
     FOREIGN KEY (product_id) REFERENCES Product(id)
 );
+
+-- Índexs de les consultes dels serveis (migració v4)
+CREATE UNIQUE INDEX idx_user_username ON User (username);
+CREATE INDEX idx_user_email ON User (email);  -- No únic: el checkout com a convidat pot reutilitzar un email
+CREATE INDEX idx_user_dni ON User (dni);
+CREATE INDEX idx_user_nif ON User (nif);
+CREATE INDEX idx_order_user_created ON "Order" (user_id, created_at);
+CREATE INDEX idx_orderitem_order_product ON OrderItem (order_id, product_id);
+CREATE INDEX idx_orderitem_product_order ON OrderItem (product_id, order_id);
+CREATE INDEX idx_product_company ON Product (company_id);
+
+-- Paginació del catàleg per preu i per nom (migració v7)
+CREATE INDEX idx_product_price ON Product (price_cents);
+CREATE INDEX idx_product_name ON Product (name);
+
+-- Comptadors de canvis per família d'entitats (migració v6). Els triggers
+-- trg_<taula>_changes_<operació> incrementen la versió a cada escriptura i
+-- cada procés invalida les seves memòries cau quan canvia (utils/coherence.py)
+CREATE TABLE ChangeCounter (
+    entity VARCHAR(20) PRIMARY KEY,  -- 'product', 'stock', 'user', 'order' o 'image'
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Productes que només han canviat d'estoc (migració v18). Un UPDATE de Product
+-- que només toca stock incrementa la família 'stock' en lloc de 'product'
+-- (trg_product_stock_changes) i apunta aquí el producte amb la versió nova:
+-- els altres processos invaliden només aquests productes
+CREATE TABLE StockChange (
+    product_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE INDEX idx_stockchange_version ON StockChange (version);
+
+-- Cerca de text complet dels noms de producte (migració v8). Taula FTS5 de
+-- contingut extern: no duplica els noms i els triggers trg_product_search_*
+-- la mantenen al dia a cada INSERT, UPDATE del nom o DELETE de Product
+CREATE VIRTUAL TABLE ProductSearch USING fts5(
+    name,
+    content='Product',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+-- Recomptes de facetes del catàleg (migració v9): productes per empresa (0 =
+-- sense empresa), franja de preu (PRICE_BAND_LIMITS) i disponibilitat. Els
+-- triggers trg_product_facet_* els mantenen a cada escriptura de Product
+CREATE TABLE ProductFacet (
+    company_id INTEGER NOT NULL,
+    price_band INTEGER NOT NULL,
+    in_stock INTEGER NOT NULL,
+    product_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, price_band, in_stock)
+) WITHOUT ROWID;
+CREATE INDEX idx_product_company_price ON Product (company_id, price_cents);
+CREATE UNIQUE INDEX idx_product_company_sku ON Product (company_id, sku);
+-- Els NULL no es repeteixen en un índex únic: l'SKU dels productes de TechShop
+-- (sense empresa) té el seu propi índex parcial (migració v19)
+CREATE UNIQUE INDEX idx_product_sku_no_company ON Product (sku) WHERE company_id IS NULL;
+-- Catàleg filtrat per estoc, en l'ordre de cada ordenació (migració v21)
+CREATE INDEX idx_product_in_stock_id ON Product (id) WHERE stock > 0;
+CREATE INDEX idx_product_in_stock_price ON Product (price_cents) WHERE stock > 0;
+CREATE INDEX idx_product_in_stock_name ON Product (name) WHERE stock > 0;
+
+-- Índex de les imatges dels productes (migració v10): fitxers de
+-- static/img/products/<product_id> en ordre (utils/image_manifest.py)
+CREATE TABLE ProductImage (
+    product_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    PRIMARY KEY (product_id, position)
+) WITHOUT ROWID;
+
+-- Carretons guardats al servidor (migració v12): els anònims s'identifiquen
+-- pel token de la galeta de sessió i els dels usuaris pel user_id. Els
+-- anònims sense activitat durant CART_TTL segons es purguen
+CREATE TABLE Cart (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token VARCHAR(43) UNIQUE,
+    user_id INTEGER UNIQUE,
+    updated_at INTEGER NOT NULL,  -- Segons des de l'època Unix
+    FOREIGN KEY (user_id) REFERENCES User(id)
+);
+CREATE INDEX idx_cart_anonymous_updated ON Cart (updated_at) WHERE user_id IS NULL;
+
+CREATE TABLE CartItem (
+    cart_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES Cart(id)
+) WITHOUT ROWID;
+
+-- Taula de reserves d'estoc (migració v13): cada línia d'un carretó reté les
+-- seves unitats fins a expires_at; les unitats disponibles d'un producte són
+-- stock menys la suma de les reserves vigents
+CREATE TABLE StockReservation (
+    cart_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL,  -- Segons des de l'època Unix
+    PRIMARY KEY (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES Cart(id),
+    FOREIGN KEY (product_id) REFERENCES Product(id)
+) WITHOUT ROWID;
+CREATE INDEX idx_reservation_product_expiry ON StockReservation (product_id, expires_at, quantity);
+CREATE INDEX idx_reservation_expiry ON StockReservation (expires_at);
+
+-- Taula de tasques en segon pla (migració v15): factura i correu de cada
+-- comanda. run_at és quan es pot executar una tasca pendent o quan caduca la
+-- reserva d'una en execució
+CREATE TABLE Job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind VARCHAR(40) NOT NULL,
+    payload TEXT NOT NULL,  -- JSON
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',  -- pending, running, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at INTEGER NOT NULL,  -- Segons des de l'època Unix
+    last_error TEXT,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX idx_job_due ON Job (run_at) WHERE status IN ('pending', 'running');
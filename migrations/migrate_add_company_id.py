@@ -1,33 +1,24 @@
 """
 Script de migració per afegir el camp company_id a la taula Product
+Es manté per compatibilitat: ara és la migració versionada v3 de migrate_database.py
 """
 
-import sqlite3
+import os
+import sys
+
+# Permetre executar l'script directament des de l'arrel del projecte
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations.migrate_database import migrate_database
+
 
 def migrate():
-    """Afegir camp company_id a la taula Product"""
-    try:
-        conn = sqlite3.connect('techshop.db')
-        cursor = conn.cursor()
-        
-        # Verificar si la columna ja existeix
-        cursor.execute("PRAGMA table_info(Product)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'company_id' not in columns:
-            # Afegir columna company_id (NULL per productes existents, que pertanyen a l'admin)
-            cursor.execute("ALTER TABLE Product ADD COLUMN company_id INTEGER")
-            conn.commit()
-            print("✅ Columna company_id afegida a la taula Product")
-        else:
-            print("ℹ️  La columna company_id ja existeix")
-        
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"❌ Error en la migració: {str(e)}")
-        return False
+    """
+    Afegir camp company_id a la taula Product.
+    Aplica totes les migracions pendents fins a la darrera versió.
+    """
+    return migrate_database('techshop.db')
+
 
 if __name__ == "__main__":
     migrate()
-
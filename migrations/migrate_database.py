@@ -1,67 +1,884 @@
 """
-Script per migrar la base de dades existent afegint les noves columnes role i account_type
+Sistema de migracions versionades de la base de dades TechShop
+La versió de l'esquema es guarda a PRAGMA user_version i s'apliquen en ordre
+totes les migracions pendents
 """
 
-import sqlite3
 import os
+import sqlite3
+import sys
+from typing import Callable, List, Optional, Set, Tuple
+
+
+# Tipus d'una migració: (versió, descripció, funció que rep un cursor)
+Migration = Tuple[int, str, Callable[[sqlite3.Cursor], None]]
+
+# Taules que crea scripts/init_database.py. Fins que no existeixen totes no es
+# registra la versió, perquè les migracions s'han de poder tornar a aplicar
+# quan l'esquema base estigui complet.
+BASE_TABLES = {'Product', 'User', 'Order', 'OrderItem'}
+
+
+def _existing_tables(cursor: sqlite3.Cursor) -> Set[str]:
+    """
+    Obtenir els noms de les taules existents.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+
+    Returns:
+        Set[str]: Noms de les taules
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> bool:
+    """
+    Afegir una columna a una taula si la taula existeix i la columna no.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+        table (str): Nom de la taula
+        column (str): Nom de la columna
+        definition (str): Tipus i restriccions de la columna
+
+    Returns:
+        bool: True si s'ha afegit la columna
+    """
+    columns = _columns(cursor, table)
+    if not columns or column in columns:
+        return False
+    cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}')
+    return True
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    """
+    Obtenir les columnes d'una taula (llista buida si no existeix).
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+        table (str): Nom de la taula
+
+    Returns:
+        List[str]: Noms de les columnes
+    """
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    return [row[1] for row in cursor.fetchall()]
 
 
-def migrate_database():
+def _create_index(cursor: sqlite3.Cursor, name: str, table: str, columns: Tuple[str, ...],
+                  unique: bool = False, where: Optional[str] = None) -> bool:
     """
-    Migra la base de dades afegint les columnes role i account_type a la taula User.
+    Crear un índex si la taula i les columnes existeixen.
+
+    Si l'índex ha de ser únic però les dades actuals tenen duplicats, la
+    migració falla amb un missatge que indica els valors a corregir: totes
+    les bases de dades han de tenir les mateixes restriccions.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+        name (str): Nom de l'índex
+        table (str): Nom de la taula
+        columns (Tuple[str, ...]): Columnes de l'índex, en ordre
+        unique (bool): Crear un índex UNIQUE
+        where (str, optional): Condició d'un índex parcial (només hi entren
+            les files que la compleixen, també en la comprovació de duplicats)
+
+    Returns:
+        bool: True si l'índex existeix en acabar
+
+    Raises:
+        sqlite3.IntegrityError: Si l'índex és únic i hi ha valors duplicats
     """
-    if not os.path.exists('techshop.db'):
-        print("❌ No s'ha trobat techshop.db")
+    existing = _columns(cursor, table)
+    if not existing or any(column not in existing for column in columns):
         return False
-    
+
+    column_list = ", ".join(columns)
+    if unique:
+        conditions = [f"{column} IS NOT NULL" for column in columns] + ([f"({where})"] if where else [])
+        cursor.execute(
+            f'SELECT {column_list} FROM "{table}" '
+            f'WHERE {" AND ".join(conditions)} '
+            f'GROUP BY {column_list} HAVING COUNT(*) > 1 LIMIT 5'
+        )
+        duplicates = cursor.fetchall()
+        if duplicates:
+            raise sqlite3.IntegrityError(
+                f"No es pot crear l'índex únic {name}: {table}.{column_list} té valors duplicats "
+                f"({', '.join(repr(row if len(row) > 1 else row[0]) for row in duplicates)}). "
+                f"Corregeix-los i torna a migrar."
+            )
+
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    partial = f" WHERE {where}" if where else ""
+    cursor.execute(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({column_list}){partial}')
+    return True
+
+
+def _add_user_role_and_account_type(cursor: sqlite3.Cursor):
+    """Versió 1: columnes address, role i account_type a User."""
+    _add_column(cursor, 'User', 'address', "TEXT")
+    if _add_column(cursor, 'User', 'role', "VARCHAR(10) DEFAULT 'common'"):
+        cursor.execute("UPDATE User SET role = 'common' WHERE role IS NULL")
+    if _add_column(cursor, 'User', 'account_type', "VARCHAR(10) DEFAULT 'user'"):
+        cursor.execute("UPDATE User SET account_type = 'user' WHERE account_type IS NULL")
+
+
+def _add_user_dni_nif(cursor: sqlite3.Cursor):
+    """Versió 2: columnes dni i nif a User."""
+    _add_column(cursor, 'User', 'dni', "VARCHAR(20)")
+    _add_column(cursor, 'User', 'nif', "VARCHAR(20)")
+
+
+def _add_product_company_id(cursor: sqlite3.Cursor):
+    """Versió 3: columna company_id a Product."""
+    _add_column(cursor, 'Product', 'company_id', "INTEGER")
+
+
+def _add_query_indexes(cursor: sqlite3.Cursor):
+    """Versió 4: índexs per a les consultes dels serveis."""
+    # Login, registre i comprovacions d'unicitat. L'email no és únic a la base
+    # de dades: el checkout com a convidat pot reutilitzar un email existent
+    _create_index(cursor, 'idx_user_username', 'User', ('username',), unique=True)
+    _create_index(cursor, 'idx_user_email', 'User', ('email',))
+    # dni/nif poden ser buits en molts comptes: la unicitat la valida el servei
+    _create_index(cursor, 'idx_user_dni', 'User', ('dni',))
+    _create_index(cursor, 'idx_user_nif', 'User', ('nif',))
+    # Historial de comandes ordenat per data
+    _create_index(cursor, 'idx_order_user_created', 'Order', ('user_id', 'created_at'))
+    # Detall de comanda i recomanacions per producte
+    _create_index(cursor, 'idx_orderitem_order_product', 'OrderItem', ('order_id', 'product_id'))
+    _create_index(cursor, 'idx_orderitem_product_order', 'OrderItem', ('product_id', 'order_id'))
+    # Productes d'una empresa
+    _create_index(cursor, 'idx_product_company', 'Product', ('company_id',))
+
+
+def _add_cents_column(cursor: sqlite3.Cursor, table: str, legacy: str, cents: str):
+    """
+    Afegir una columna d'import en cèntims a partir d'una columna decimal antiga.
+
+    Omple les files existents i crea triggers perquè els scripts que encara
+    escriuen només la columna decimal mantinguin els cèntims al dia. Els
+    serveis escriuen les dues columnes alhora i llegeixen només els cèntims.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+        table (str): Nom de la taula
+        legacy (str): Columna decimal antiga (p. ex. price)
+        cents (str): Columna nova en cèntims (p. ex. price_cents)
+    """
+    if legacy not in _columns(cursor, table):
+        return
+    _add_column(cursor, table, cents, "INTEGER")
+
+    to_cents = f"CAST(ROUND({legacy} * 100) AS INTEGER)"
+    cursor.execute(
+        f'UPDATE "{table}" SET {cents} = {to_cents} '
+        f'WHERE {cents} IS NULL AND {legacy} IS NOT NULL'
+    )
+
+    new_cents = f"CAST(ROUND(NEW.{legacy} * 100) AS INTEGER)"
+    trigger = f"trg_{table.lower()}_{cents}"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {trigger}_insert
+        AFTER INSERT ON "{table}"
+        WHEN NEW.{cents} IS NULL AND NEW.{legacy} IS NOT NULL
+        BEGIN
+            UPDATE "{table}" SET {cents} = {new_cents} WHERE rowid = NEW.rowid;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {trigger}_update
+        AFTER UPDATE OF {legacy} ON "{table}"
+        WHEN NEW.{cents} IS NOT {new_cents}
+        BEGIN
+            UPDATE "{table}" SET {cents} = {new_cents} WHERE rowid = NEW.rowid;
+        END
+    """)
+
+
+def _add_money_cents(cursor: sqlite3.Cursor):
+    """Versió 5: imports en cèntims (price_cents a Product, total_cents a Order)."""
+    _add_cents_column(cursor, 'Product', 'price', 'price_cents')
+    _add_cents_column(cursor, 'Order', 'total', 'total_cents')
+
+
+# Família d'entitats que compta els canvis de cada taula (ChangeCounter)
+CHANGE_FAMILIES = {
+    'Product': 'product',
+    'User': 'user',
+    'Order': 'order',
+    'OrderItem': 'order',
+    'ProductImage': 'image',
+}
+
+
+def _create_change_triggers(cursor: sqlite3.Cursor, table: str, entity: str):
+    """
+    Crear els triggers que incrementen el comptador de canvis d'una taula.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor de la base de dades
+        table (str): Nom de la taula
+        entity (str): Família d'entitats de ChangeCounter
+    """
+    cursor.execute("INSERT OR IGNORE INTO ChangeCounter (entity, version) VALUES (?, 0)", (entity,))
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_changes_{operation.lower()}
+            AFTER {operation} ON "{table}"
+            BEGIN
+                UPDATE ChangeCounter SET version = version + 1 WHERE entity = '{entity}';
+            END
+        """)
+
+
+def _add_change_counters(cursor: sqlite3.Cursor):
+    """
+    Versió 6: comptadors de canvis per família d'entitats.
+
+    Cada INSERT, UPDATE o DELETE d'una taula incrementa el comptador de la seva
+    família. Els processos que tenen dades en memòria cau el consulten per
+    saber si un altre procés ha modificat la base de dades.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ChangeCounter (
+            entity VARCHAR(20) PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    tables = _existing_tables(cursor)
+    for table, entity in CHANGE_FAMILIES.items():
+        # Les taules de migracions posteriors creen els seus triggers en crear-se
+        if table in tables:
+            _create_change_triggers(cursor, table, entity)
+
+
+def _add_catalog_sort_indexes(cursor: sqlite3.Cursor):
+    """Versió 7: índexs per paginar el catàleg per preu i per nom."""
+    # L'índex inclou l'id (rowid) com a desempat: (price_cents, id) i (name, id)
+    _create_index(cursor, 'idx_product_price', 'Product', ('price_cents',))
+    _create_index(cursor, 'idx_product_name', 'Product', ('name',))
+
+
+def _add_product_search(cursor: sqlite3.Cursor):
+    """
+    Versió 8: índex de text complet FTS5 sobre el nom dels productes.
+
+    ProductSearch és una taula FTS5 de contingut extern (no duplica els noms,
+    els llegeix de Product). Els triggers la mantenen al dia a cada INSERT,
+    UPDATE del nom o DELETE de Product i es reconstrueix per indexar els
+    productes existents.
+    """
+    if 'Product' not in _existing_tables(cursor):
+        return
     try:
-        conn = sqlite3.connect('techshop.db')
-        cursor = conn.cursor()
-        
-        # Verificar si les columnes ja existeixen
-        cursor.execute("PRAGMA table_info(User)")
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        has_role = 'role' in columns
-        has_account_type = 'account_type' in columns
-        
-        if has_role and has_account_type:
-            print("✅ La base de dades ja té les columnes role i account_type")
-            conn.close()
-            return True
-        
-        print("🔄 Migrant base de dades...")
-        
-        # Afegir columnes si no existeixen
-        if not has_role:
-            try:
-                cursor.execute("ALTER TABLE User ADD COLUMN role VARCHAR(10) DEFAULT 'common'")
-                # Actualizar valores existentes
-                cursor.execute("UPDATE User SET role = 'common' WHERE role IS NULL")
-                print("✅ Columna 'role' afegida")
-            except sqlite3.Error as e:
-                print(f"⚠️  Error afegint columna 'role': {e}")
-        
-        if not has_account_type:
-            try:
-                cursor.execute("ALTER TABLE User ADD COLUMN account_type VARCHAR(10) DEFAULT 'user'")
-                # Actualizar valores existentes
-                cursor.execute("UPDATE User SET account_type = 'user' WHERE account_type IS NULL")
-                print("✅ Columna 'account_type' afegida")
-            except sqlite3.Error as e:
-                print(f"⚠️  Error afegint columna 'account_type': {e}")
-        
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ProductSearch USING fts5(
+                name,
+                content='Product',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite compilat sense FTS5: la cerca no estarà disponible
+        return
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_product_search_insert
+        AFTER INSERT ON Product
+        BEGIN
+            INSERT INTO ProductSearch (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_product_search_delete
+        AFTER DELETE ON Product
+        BEGIN
+            INSERT INTO ProductSearch (ProductSearch, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_product_search_update
+        AFTER UPDATE OF name ON Product
+        BEGIN
+            INSERT INTO ProductSearch (ProductSearch, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO ProductSearch (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    """)
+    cursor.execute("INSERT INTO ProductSearch (ProductSearch) VALUES ('rebuild')")
+
+
+# Límits superiors (exclusius, en cèntims) de les franges de preu del catàleg.
+# La darrera franja no té límit: hi ha len(PRICE_BAND_LIMITS) + 1 franges.
+PRICE_BAND_LIMITS = (2500, 5000, 10000, 25000, 50000)
+
+
+def _facet_key(row: str) -> Tuple[str, str, str]:
+    """
+    Expressions SQL de la clau de ProductFacet per a una fila de Product.
+
+    Args:
+        row (str): 'NEW' o 'OLD' (dins d'un trigger) o '' (consulta directa)
+
+    Returns:
+        Tuple[str, str, str]: (empresa, franja de preu, en estoc)
+    """
+    prefix = f"{row}." if row else ""
+    # Els scripts antics poden inserir només price: price_cents encara és NULL
+    # quan s'executa el trigger d'inserció (el trigger de la v5 l'omple després)
+    cents = f"COALESCE({prefix}price_cents, CAST(ROUND({prefix}price * 100) AS INTEGER))"
+    cases = " ".join(f"WHEN {cents} < {limit} THEN {band}" for band, limit in enumerate(PRICE_BAND_LIMITS))
+    return (
+        f"COALESCE({prefix}company_id, 0)",
+        f"CASE {cases} ELSE {len(PRICE_BAND_LIMITS)} END",
+        f"({prefix}stock > 0)",
+    )
+
+
+def _add_product_facets(cursor: sqlite3.Cursor):
+    """
+    Versió 9: recomptes de facetes del catàleg mantinguts per triggers.
+
+    ProductFacet guarda quants productes hi ha per cada combinació d'empresa,
+    franja de preu i disponibilitat. Els triggers l'actualitzen a cada INSERT,
+    DELETE o UPDATE que canvia la combinació d'un producte (p. ex. quan una
+    comanda n'esgota l'estoc), de manera que els recomptes de facetes es
+    calculen sobre unes poques files en lloc de fer GROUP BY sobre Product.
+    """
+    if not {'price_cents', 'company_id', 'stock'} <= set(_columns(cursor, 'Product')):
+        return
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ProductFacet (
+            company_id INTEGER NOT NULL,
+            price_band INTEGER NOT NULL,
+            in_stock INTEGER NOT NULL,
+            product_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (company_id, price_band, in_stock)
+        ) WITHOUT ROWID
+    """)
+
+    new_key = " AND ".join(f"{column} = {expression}" for column, expression
+                           in zip(('company_id', 'price_band', 'in_stock'), _facet_key('NEW')))
+    old_key = " AND ".join(f"{column} = {expression}" for column, expression
+                           in zip(('company_id', 'price_band', 'in_stock'), _facet_key('OLD')))
+    add_new = f"""
+            INSERT OR IGNORE INTO ProductFacet (company_id, price_band, in_stock, product_count)
+            VALUES ({", ".join(_facet_key('NEW'))}, 0);
+            UPDATE ProductFacet SET product_count = product_count + 1 WHERE {new_key};"""
+    remove_old = f"""
+            UPDATE ProductFacet SET product_count = product_count - 1 WHERE {old_key};"""
+    changed = " OR ".join(f"{new} IS NOT {old}" for new, old in zip(_facet_key('NEW'), _facet_key('OLD')))
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_product_facet_insert
+        AFTER INSERT ON Product
+        BEGIN{add_new}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_product_facet_delete
+        AFTER DELETE ON Product
+        BEGIN{remove_old}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_product_facet_update
+        AFTER UPDATE OF price_cents, stock, company_id ON Product
+        WHEN {changed}
+        BEGIN{remove_old}{add_new}
+        END
+    """)
+
+    # Recompte inicial (idempotent: es pot tornar a aplicar)
+    company, band, in_stock = _facet_key('')
+    cursor.execute("DELETE FROM ProductFacet")
+    cursor.execute(f"""
+        INSERT INTO ProductFacet (company_id, price_band, in_stock, product_count)
+        SELECT {company}, {band}, {in_stock}, COUNT(*) FROM Product GROUP BY 1, 2, 3
+    """)
+    # Filtre per empresa ordenat per preu (el filtre per franja fa servir idx_product_price)
+    _create_index(cursor, 'idx_product_company_price', 'Product', ('company_id', 'price_cents'))
+
+
+def _add_product_images(cursor: sqlite3.Cursor):
+    """
+    Versió 10: índex persistent de les imatges dels productes.
+
+    ProductImage guarda els noms dels fitxers de static/img/products/<id> en
+    ordre, de manera que renderitzar el catàleg no llista cap directori. La
+    taula es crea buida: utils/image_manifest.py la construeix a partir dels
+    fitxers el primer cop que es fa servir (o amb
+    scripts/rebuild_image_manifest.py).
+    """
+    if 'Product' not in _existing_tables(cursor):
+        return
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ProductImage (
+            product_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            PRIMARY KEY (product_id, position)
+        ) WITHOUT ROWID
+    """)
+    # Eliminar un producte també el treu de l'índex (els fitxers es conserven)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_product_images_delete
+        AFTER DELETE ON Product
+        BEGIN
+            DELETE FROM ProductImage WHERE product_id = OLD.id;
+        END
+    """)
+    if 'ChangeCounter' in _existing_tables(cursor):
+        _create_change_triggers(cursor, 'ProductImage', CHANGE_FAMILIES['ProductImage'])
+
+
+def _add_product_sku(cursor: sqlite3.Cursor):
+    """
+    Versió 11: referència (SKU) dels productes.
+
+    Les importacions massives (services/import_service.py) identifiquen els
+    productes d'una empresa pel seu SKU per actualitzar-los. L'índex és únic
+    per empresa; els productes sense SKU no hi compten.
+    """
+    _add_column(cursor, 'Product', 'sku', "VARCHAR(64)")
+    if {'company_id', 'sku'} <= set(_columns(cursor, 'Product')):
+        # La columna és nova i tota NULL: no cal comprovar duplicats. Els
+        # productes de TechShop (company_id NULL) no hi compten, perquè els
+        # NULL no es repeteixen en un índex únic: els cobreix la versió 19
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_product_company_sku ON Product (company_id, sku)"
+        )
+
+
+def _add_server_carts(cursor: sqlite3.Cursor):
+    """
+    Versió 12: carretons guardats al servidor.
+
+    Cart té una fila per carretó: els anònims s'identifiquen pel token que
+    guarda la galeta de sessió i els dels usuaris pel seu user_id (el mateix
+    carretó des de qualsevol dispositiu). CartItem en guarda les línies.
+    L'índex parcial d'updated_at permet purgar els carretons anònims caducats
+    sense recórrer els dels usuaris.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Cart (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token VARCHAR(43) UNIQUE,
+            user_id INTEGER UNIQUE,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES User(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS CartItem (
+            cart_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (cart_id, product_id),
+            FOREIGN KEY (cart_id) REFERENCES Cart(id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cart_anonymous_updated ON Cart (updated_at) WHERE user_id IS NULL"
+    )
+    # Eliminar un carretó (purga o buidatge) n'elimina les línies, i eliminar
+    # un usuari n'elimina el carretó
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_cart_delete
+        AFTER DELETE ON Cart
+        BEGIN
+            DELETE FROM CartItem WHERE cart_id = OLD.id;
+        END
+    """)
+    if 'User' in _existing_tables(cursor):
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_cart_delete
+            AFTER DELETE ON User
+            BEGIN
+                DELETE FROM Cart WHERE user_id = OLD.id;
+            END
+        """)
+
+
+def _add_stock_reservations(cursor: sqlite3.Cursor):
+    """
+    Versió 13: reserves d'estoc temporals dels carretons.
+
+    Cada línia d'un carretó reté les seves unitats fins a expires_at. Les
+    unitats disponibles d'un producte són stock menys la suma de les reserves
+    vigents, que es calcula amb l'índex cobert (product_id, expires_at,
+    quantity) sense llegir la taula. L'índex d'expires_at permet alliberar
+    les reserves caducades en bloc.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS StockReservation (
+            cart_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            PRIMARY KEY (cart_id, product_id),
+            FOREIGN KEY (cart_id) REFERENCES Cart(id),
+            FOREIGN KEY (product_id) REFERENCES Product(id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reservation_product_expiry "
+        "ON StockReservation (product_id, expires_at, quantity)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservation_expiry ON StockReservation (expires_at)")
+    # Eliminar un carretó o un producte n'allibera les reserves
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_cart_reservations_delete
+        AFTER DELETE ON Cart
+        BEGIN
+            DELETE FROM StockReservation WHERE cart_id = OLD.id;
+        END
+    """)
+    if 'Product' in _existing_tables(cursor):
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_product_reservations_delete
+            AFTER DELETE ON Product
+            BEGIN
+                DELETE FROM StockReservation WHERE product_id = OLD.id;
+            END
+        """)
+
+
+def _add_order_idempotency_keys(cursor: sqlite3.Cursor):
+    """
+    Versió 14: claus d'idempotència de les comandes.
+
+    La pàgina de checkout genera una clau per formulari; si el mateix
+    formulari s'envia dos cops (doble clic o reintent) la segona petició
+    troba la comanda existent per la clau. L'índex únic és parcial perquè
+    les comandes anteriors no en tenen.
+    """
+    _add_column(cursor, 'Order', 'idempotency_key', "VARCHAR(64)")
+    if 'idempotency_key' in _columns(cursor, 'Order'):
+        cursor.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_order_idempotency_key ON "Order" (idempotency_key) '
+            'WHERE idempotency_key IS NOT NULL'
+        )
+
+
+def _add_job_queue(cursor: sqlite3.Cursor):
+    """
+    Versió 15: cua de tasques en segon pla.
+
+    Cada fila és una tasca (p. ex. la factura i el correu d'una comanda) amb
+    el seu estat, els intents i l'últim error. run_at indica quan es pot
+    executar una tasca pendent o quan caduca la reserva d'una en execució;
+    l'índex parcial només conté les tasques per fer, de manera que trobar
+    la següent no depèn de quantes n'hi ha de fetes.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind VARCHAR(40) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at INTEGER NOT NULL,
+            last_error TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_job_due ON Job (run_at) WHERE status IN ('pending', 'running')"
+    )
+
+
+# Preu d'un producte en cèntims (els scripts antics poden deixar price_cents a NULL)
+_PRODUCT_PRICE_CENTS = "COALESCE(p.price_cents, CAST(ROUND(p.price * 100) AS INTEGER))"
+
+
+def _add_order_item_snapshots(cursor: sqlite3.Cursor):
+    """
+    Versió 16: nom i preu unitari de cada línia de comanda en el moment de la compra.
+
+    L'historial, el correu i la factura llegeixen aquestes columnes en lloc
+    de fer JOIN amb Product, que té el preu d'avui. Per a les línies
+    existents el preu pagat només es coneix amb seguretat quan la comanda
+    té una sola línia (total / quantitat); la resta s'omplen amb el preu
+    actual del producte, que és el que mostrava l'historial fins ara. Un
+    trigger omple també les línies que els scripts antics insereixen sense
+    aquestes columnes.
+    """
+    _add_column(cursor, 'OrderItem', 'product_name', "VARCHAR(100)")
+    _add_column(cursor, 'OrderItem', 'unit_price_cents', "INTEGER")
+    if not {'product_name', 'unit_price_cents'} <= set(_columns(cursor, 'OrderItem')):
+        return
+    if not {'name', 'price', 'price_cents'} <= set(_columns(cursor, 'Product')):
+        return
+    if 'total_cents' in _columns(cursor, 'Order'):
+        cursor.execute("""
+            UPDATE OrderItem SET unit_price_cents = (
+                SELECT o.total_cents / OrderItem.quantity FROM "Order" o WHERE o.id = OrderItem.order_id
+            )
+            WHERE unit_price_cents IS NULL AND quantity > 0
+              AND (SELECT COUNT(*) FROM OrderItem other WHERE other.order_id = OrderItem.order_id) = 1
+              AND (SELECT o.total_cents % OrderItem.quantity FROM "Order" o WHERE o.id = OrderItem.order_id) = 0
+        """)
+    cursor.execute(f"""
+        UPDATE OrderItem SET
+            product_name = COALESCE(product_name, (SELECT p.name FROM Product p WHERE p.id = OrderItem.product_id)),
+            unit_price_cents = COALESCE(unit_price_cents, (
+                SELECT {_PRODUCT_PRICE_CENTS} FROM Product p WHERE p.id = OrderItem.product_id
+            ))
+        WHERE product_name IS NULL OR unit_price_cents IS NULL
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_orderitem_snapshot_insert
+        AFTER INSERT ON OrderItem
+        WHEN NEW.product_name IS NULL OR NEW.unit_price_cents IS NULL
+        BEGIN
+            UPDATE OrderItem SET
+                product_name = COALESCE(NEW.product_name, (SELECT p.name FROM Product p WHERE p.id = NEW.product_id)),
+                unit_price_cents = COALESCE(NEW.unit_price_cents, (
+                    SELECT {_PRODUCT_PRICE_CENTS} FROM Product p WHERE p.id = NEW.product_id
+                ))
+            WHERE rowid = NEW.rowid;
+        END
+    """)
+
+
+def _make_user_email_index_plain(cursor: sqlite3.Cursor):
+    """
+    Versió 17: idx_user_email com a índex normal.
+
+    La versió 4 el creava únic, i el checkout com a convidat fallava amb un
+    usuari nou i un email ja registrat. Les bases de dades migrades abans
+    tenen l'índex únic: es torna a crear sense la restricció.
+    """
+    row = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'idx_user_email'"
+    ).fetchone()
+    if row and row[0] and 'UNIQUE' in row[0].upper():
+        cursor.execute("DROP INDEX idx_user_email")
+        _create_index(cursor, 'idx_user_email', 'User', ('email',))
+
+
+def _add_stock_change_family(cursor: sqlite3.Cursor):
+    """
+    Versió 18: família 'stock' separada de 'product'.
+
+    Cada comanda decrementa l'estoc, i amb el trigger de la versió 6 tots els
+    processos buidaven el catàleg sencer i tots els fragments. Ara un UPDATE
+    que només canvia l'estoc incrementa el comptador 'stock' i apunta el
+    producte a StockChange, i els altres processos invaliden només aquells
+    productes.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS StockChange (
+            product_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    _create_index(cursor, 'idx_stockchange_version', 'StockChange', ('version',))
+    cursor.execute("INSERT OR IGNORE INTO ChangeCounter (entity, version) VALUES ('stock', 0)")
+    _create_product_change_triggers(cursor)
+
+
+def _create_product_change_triggers(cursor: sqlite3.Cursor):
+    """
+    (Re)crear els triggers que separen els canvis només d'estoc de la resta.
+
+    La condició "només ha canviat l'estoc" compara totes les altres columnes
+    que té Product en aquest moment. migrate() la torna a crear després de
+    cada migració, de manera que una columna afegida més endavant no pot
+    quedar fora de la comparació (un canvi seu es prendria per un canvi
+    d'estoc i el catàleg no es buidaria).
+    """
+    unchanged = ' AND '.join(
+        f'OLD."{column}" IS NEW."{column}"' for column in _columns(cursor, 'Product') if column != 'stock'
+    )
+    stock_only = f'OLD.stock IS NOT NEW.stock AND {unchanged}'
+    cursor.execute("DROP TRIGGER IF EXISTS trg_product_changes_update")
+    cursor.execute(f"""
+        CREATE TRIGGER trg_product_changes_update
+        AFTER UPDATE ON "Product"
+        WHEN NOT ({stock_only})
+        BEGIN
+            UPDATE ChangeCounter SET version = version + 1 WHERE entity = 'product';
+        END
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_product_stock_changes")
+    cursor.execute(f"""
+        CREATE TRIGGER trg_product_stock_changes
+        AFTER UPDATE OF stock ON "Product"
+        WHEN {stock_only}
+        BEGIN
+            UPDATE ChangeCounter SET version = version + 1 WHERE entity = 'stock';
+            INSERT OR REPLACE INTO StockChange (product_id, version)
+            VALUES (NEW.id, (SELECT version FROM ChangeCounter WHERE entity = 'stock'));
+        END
+    """)
+
+
+def _add_admin_sku_index(cursor: sqlite3.Cursor):
+    """
+    Versió 19: SKU únic també per als productes de TechShop.
+
+    idx_product_company_sku no impedeix dos productes amb el mateix SKU i
+    company_id NULL (els NULL són diferents entre ells en un índex únic).
+    L'índex parcial cobreix aquest cas; si ja hi ha duplicats, la migració
+    falla i els indica.
+    """
+    _create_index(cursor, 'idx_product_sku_no_company', 'Product', ('sku',), unique=True,
+                  where='company_id IS NULL')
+
+
+def _add_order_confirmation_sent(cursor: sqlite3.Cursor):
+    """
+    Versió 20: data d'enviament del correu de confirmació de cada comanda.
+
+    Una tasca de la cua es pot executar dos cops (reserva caducada, reintent
+    després d'un error en marcar-la com a feta): amb aquesta marca el correu
+    no s'envia dues vegades.
+    """
+    _add_column(cursor, 'Order', 'confirmation_sent_at', "TIMESTAMP")
+
+
+def _add_in_stock_indexes(cursor: sqlite3.Cursor):
+    """
+    Versió 21: índexs parcials del filtre "només amb estoc".
+
+    `stock > 0` no es pot buscar en cap índex, i sense aquests índexs el
+    catàleg filtrat recorria Product sencer. Cada índex només conté els
+    productes amb estoc, en l'ordre de cada ordenació del catàleg.
+    """
+    _create_index(cursor, 'idx_product_in_stock_id', 'Product', ('id',), where='stock > 0')
+    _create_index(cursor, 'idx_product_in_stock_price', 'Product', ('price_cents',), where='stock > 0')
+    _create_index(cursor, 'idx_product_in_stock_name', 'Product', ('name',), where='stock > 0')
+
+
+# Llista ordenada de migracions. Per afegir-ne una de nova, afegir-la al final
+# amb la següent versió: totes han de ser idempotents.
+MIGRATIONS: List[Migration] = [
+    (1, "Afegir address, role i account_type a User", _add_user_role_and_account_type),
+    (2, "Afegir dni i nif a User", _add_user_dni_nif),
+    (3, "Afegir company_id a Product", _add_product_company_id),
+    (4, "Afegir índexs per a les consultes dels serveis", _add_query_indexes),
+    (5, "Guardar preus i totals en cèntims", _add_money_cents),
+    (6, "Afegir comptadors de canvis per a la coherència de les memòries cau", _add_change_counters),
+    (7, "Afegir índexs per paginar el catàleg per preu i per nom", _add_catalog_sort_indexes),
+    (8, "Afegir la cerca de text complet (FTS5) de productes", _add_product_search),
+    (9, "Afegir els recomptes de facetes del catàleg", _add_product_facets),
+    (10, "Afegir l'índex d'imatges dels productes", _add_product_images),
+    (11, "Afegir l'SKU dels productes per a les importacions", _add_product_sku),
+    (12, "Guardar els carretons al servidor", _add_server_carts),
+    (13, "Afegir les reserves d'estoc dels carretons", _add_stock_reservations),
+    (14, "Afegir les claus d'idempotència de les comandes", _add_order_idempotency_keys),
+    (15, "Afegir la cua de tasques en segon pla", _add_job_queue),
+    (16, "Guardar el nom i el preu dels productes a les línies de comanda", _add_order_item_snapshots),
+    (17, "Fer normal l'índex d'email dels usuaris", _make_user_email_index_plain),
+    (18, "Separar els canvis d'estoc en una família pròpia", _add_stock_change_family),
+    (19, "Fer únic l'SKU dels productes de TechShop", _add_admin_sku_index),
+    (20, "Marcar les comandes amb el correu de confirmació enviat", _add_order_confirmation_sent),
+    (21, "Afegir índexs parcials dels productes amb estoc", _add_in_stock_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """
+    Llegir la versió de l'esquema de la base de dades.
+
+    Args:
+        conn (sqlite3.Connection): Connexió a la base de dades
+
+    Returns:
+        int: Valor de PRAGMA user_version
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Aplicar totes les migracions pendents dins d'una transacció.
+
+    Args:
+        conn (sqlite3.Connection): Connexió sense cap transacció oberta
+
+    Returns:
+        int: Versió de l'esquema després de migrar
+    """
+    version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    cursor = conn.cursor()
+    if not BASE_TABLES <= _existing_tables(cursor):
+        # Esquema base incomplet: s'adapten les taules existents sense
+        # registrar la versió ni bloquejar la base de dades
+        for _, _, upgrade in MIGRATIONS:
+            upgrade(cursor)
         conn.commit()
-        conn.close()
-        
-        print("✅ Migració completada correctament")
-        return True
-        
+        return version
+
+    # BEGIN IMMEDIATE: si diversos processos arrenquen alhora només un migra
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_schema_version(conn)
+        for migration_version, _, upgrade in MIGRATIONS:
+            if migration_version > version:
+                upgrade(cursor)
+        if 'StockChange' in _existing_tables(cursor):
+            # Les migracions poden haver afegit columnes a Product
+            _create_product_change_triggers(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        return SCHEMA_VERSION
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def migrate_database(db_path: str = 'techshop.db', verbose: bool = True) -> bool:
+    """
+    Migrar una base de dades existent fins a la darrera versió de l'esquema.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        verbose (bool): Mostrar el progrés per pantalla
+
+    Returns:
+        bool: True si la base de dades queda a la darrera versió
+    """
+    if not os.path.exists(db_path):
+        if verbose:
+            print(f"❌ No s'ha trobat {db_path}")
+        return False
+
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            before = get_schema_version(conn)
+            after = migrate(conn)
+        finally:
+            conn.close()
     except sqlite3.Error as e:
-        print(f"❌ Error durant la migració: {e}")
+        if verbose:
+            print(f"❌ Error durant la migració: {e}")
         return False
 
+    if verbose:
+        if before == after:
+            print(f"✅ La base de dades ja és a la versió {after}")
+        else:
+            for migration_version, description, _ in MIGRATIONS:
+                if before < migration_version <= after:
+                    print(f"✅ v{migration_version}: {description}")
+            print(f"✅ Esquema migrat de la versió {before} a la {after}")
+    return after >= SCHEMA_VERSION
 
-if __name__ == '__main__':
-    migrate_database()
 
+if __name__ == '__main__':
+    success = migrate_database(sys.argv[1] if len(sys.argv) > 1 else 'techshop.db')
+    sys.exit(0 if success else 1)
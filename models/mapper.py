@@ -0,0 +1,60 @@
+"""
+Conversió de files de la base de dades a models
+Cada model defineix COLUMNS (ordre de les columnes) i from_row(); aquestes
+funcions fan la conversió de totes les files d'un cursor en una sola passada
+"""
+
+from datetime import datetime
+from typing import Any, List, Optional, Type, TypeVar
+
+T = TypeVar('T')
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """
+    Convertir un valor de data de SQLite a datetime.
+
+    Args:
+        value: Text ISO ('2024-01-01 10:00:00'), datetime o None
+
+    Returns:
+        Optional[datetime]: La data, o None si el valor és buit o no vàlid
+            (from_row() la manté a None: no s'inventa cap data)
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_all(cursor: Any, model: Type[T]) -> List[T]:
+    """
+    Convertir totes les files pendents d'un cursor en instàncies del model.
+
+    Args:
+        cursor: Cursor amb una consulta executada (columnes en l'ordre de model.COLUMNS)
+        model: Classe del model (Product, User, Order o OrderItem)
+
+    Returns:
+        List[T]: Instàncies del model
+    """
+    return list(map(model.from_row, cursor.fetchall()))
+
+
+def fetch_one(cursor: Any, model: Type[T]) -> Optional[T]:
+    """
+    Convertir la següent fila d'un cursor en una instància del model.
+
+    Args:
+        cursor: Cursor amb una consulta executada (columnes en l'ordre de model.COLUMNS)
+        model: Classe del model
+
+    Returns:
+        Optional[T]: La instància, o None si no hi ha cap fila
+    """
+    row = cursor.fetchone()
+    return model.from_row(row) if row is not None else None
@@ -5,19 +5,50 @@ Representa cada comanda realitzada
 
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, Sequence
+
+from models.mapper import parse_datetime
+from utils.money import from_cents, to_cents
 
 
 class Order:
     """Model per representar cada comanda realitzada"""
     
+    __slots__ = ('id', 'total_cents', 'created_at', 'user_id')
+    
+    # Ordre de columnes que espera from_row()
+    COLUMNS = "id, total_cents, created_at, user_id"
+    
     def __init__(self, id: Optional[int] = None, total: Decimal = Decimal('0.00'), 
-                 created_at: Optional[datetime] = None, user_id: Optional[int] = None):
+                 created_at: Optional[datetime] = None, user_id: Optional[int] = None,
+                 total_cents: Optional[int] = None):
         self.id = id
-        self.total = total
+        # El total es guarda en cèntims; `total` és la vista en euros
+        self.total_cents = total_cents if total_cents is not None else to_cents(total)
         self.created_at = created_at or datetime.now()
         self.user_id = user_id
     
+    @classmethod
+    def from_row(cls, row: Sequence) -> 'Order':
+        """
+        Construir una Order a partir d'una fila (id, total_cents, created_at, user_id, ...).
+        
+        Les columnes addicionals al final de la fila s'ignoren. Una fila sense
+        data (comandes antigues) manté created_at a None: no s'hi posa la data
+        de càrrega (les plantilles mostren "—" i el JSON null).
+        """
+        order = cls(id=row[0], total_cents=row[1] or 0, user_id=row[3])
+        order.created_at = parse_datetime(row[2])
+        return order
+    
+    @property
+    def total(self) -> Decimal:
+        """Total en euros (Decimal amb dos decimals)."""
+        return from_cents(self.total_cents)
+    
+    @total.setter
+    def total(self, value: Decimal):
+        self.total_cents = to_cents(value)
+    
     def __repr__(self):
         return f"Order(id={self.id}, total={self.total}, user_id={self.user_id})"
-
@@ -3,12 +3,17 @@ Modelo OrderItem para TechShop
 Especifica els productes que formen part d'una comanda
 """
 
-from typing import Optional
+from typing import Optional, Sequence
 
 
 class OrderItem:
     """Model per especificar els productes que formen part d'una comanda"""
     
+    __slots__ = ('id', 'order_id', 'product_id', 'quantity')
+    
+    # Ordre de columnes que espera from_row()
+    COLUMNS = "id, order_id, product_id, quantity"
+    
     def __init__(self, id: Optional[int] = None, order_id: Optional[int] = None, 
                  product_id: Optional[int] = None, quantity: int = 0):
         self.id = id
@@ -16,6 +21,14 @@ class OrderItem:
         self.product_id = product_id
         self.quantity = quantity
     
+    @classmethod
+    def from_row(cls, row: Sequence) -> 'OrderItem':
+        """
+        Construir un OrderItem a partir d'una fila (id, order_id, product_id, quantity, ...).
+        
+        Les columnes addicionals al final de la fila s'ignoren.
+        """
+        return cls(id=row[0], order_id=row[1], product_id=row[2], quantity=row[3])
+    
     def __repr__(self):
         return f"OrderItem(id={self.id}, order_id={self.order_id}, product_id={self.product_id}, quantity={self.quantity})"
-
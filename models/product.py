@@ -4,19 +4,45 @@ Gestiona la llista de productes disponibles
 """
 
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, Sequence
+
+from utils.money import from_cents, to_cents
 
 
 class Product:
     """Model per gestionar la llista de productes disponibles"""
     
+    __slots__ = ('id', 'name', 'price_cents', 'stock')
+    
+    # Ordre de columnes que espera from_row()
+    COLUMNS = "id, name, price_cents, stock"
+    
     def __init__(self, id: Optional[int] = None, name: str = "", 
-                 price: Decimal = Decimal('0.00'), stock: int = 0):
+                 price: Decimal = Decimal('0.00'), stock: int = 0,
+                 price_cents: Optional[int] = None):
         self.id = id
         self.name = name
-        self.price = price
+        # El preu es guarda en cèntims; `price` és la vista en euros
+        self.price_cents = price_cents if price_cents is not None else to_cents(price)
         self.stock = stock
     
+    @classmethod
+    def from_row(cls, row: Sequence) -> 'Product':
+        """
+        Construir un Product a partir d'una fila (id, name, price_cents, stock, ...).
+        
+        Les columnes addicionals al final de la fila s'ignoren.
+        """
+        return cls(id=row[0], name=row[1], price_cents=row[2] or 0, stock=row[3])
+    
+    @property
+    def price(self) -> Decimal:
+        """Preu en euros (Decimal amb dos decimals)."""
+        return from_cents(self.price_cents)
+    
+    @price.setter
+    def price(self, value: Decimal):
+        self.price_cents = to_cents(value)
+    
     def __repr__(self):
         return f"Product(id={self.id}, name='{self.name}', price={self.price}, stock={self.stock})"
-
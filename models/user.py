@@ -4,12 +4,20 @@ Gestiona la informació de l'usuari que fa la compra
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Sequence
+
+from models.mapper import parse_datetime
 
 
 class User:
     """Model per gestionar la informació de l'usuari que fa la compra"""
     
+    __slots__ = ('id', 'username', 'password_hash', 'email', 'address', 'role',
+                 'account_type', 'dni', 'nif', 'created_at')
+    
+    # Ordre de columnes que espera from_row() (sense password_hash)
+    COLUMNS = "id, username, email, address, role, account_type, dni, nif, created_at"
+    
     def __init__(self, id: Optional[int] = None, username: str = "", 
                  password_hash: str = "", email: str = "", 
                  address: str = "",
@@ -29,10 +37,32 @@ class User:
         self.nif = nif  # NIF per empreses
         self.created_at = created_at or datetime.now()
     
+    @classmethod
+    def from_row(cls, row: Sequence) -> 'User':
+        """
+        Construir un User a partir d'una fila amb les columnes de COLUMNS.
+        
+        Els valors NULL es substitueixen pels valors per defecte i les columnes
+        addicionals al final de la fila s'ignoren. El hash de la contrasenya
+        no es carrega mai al model. Com a Order.from_row(), una fila sense data
+        (usuaris antics) manté created_at a None en lloc de la data de càrrega.
+        """
+        user = cls(
+            id=row[0],
+            username=row[1],
+            email=row[2] or "",
+            address=row[3] or "",
+            role=row[4] or "common",
+            account_type=row[5] or "user",
+            dni=row[6] or "",
+            nif=row[7] or "",
+        )
+        user.created_at = parse_datetime(row[8])
+        return user
+    
     def is_admin(self) -> bool:
         """Verificar si l'usuari és administrador."""
         return self.role == "admin"
     
     def __repr__(self):
         return f"User(id={self.id}, username='{self.username}', email='{self.email}', role='{self.role}', account_type='{self.account_type}')"
-
@@ -12,6 +12,7 @@ from routes.profile import profile_bp
 from routes.admin import admin_bp
 from routes.company import company_bp
 from routes.utils import utils_bp
+from routes.api import api_bp
 
 # Lista de todos los blueprints para registrar
 all_blueprints = [
@@ -20,7 +21,8 @@ all_blueprints = [
     profile_bp,
     admin_bp,
     company_bp,
-    utils_bp
+    utils_bp,
+    api_bp
 ]
 
 
@@ -3,12 +3,15 @@ Rutas de administración de TechShop
 Panel de administración, CRUD de productos, usuarios y órdenes
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
 from decimal import Decimal
 
 from services.admin_service import AdminService
+from services.import_service import ImportService
 from services.user_service import UserService
 from routes.helpers import get_current_user, require_admin
+from utils.cache import get_catalog_cache_stats, get_fragment_cache
+from utils.profiler import SLOW_QUERY_MS, get_recent_profiles, get_statement_summary
 
 # Crear blueprint
 admin_bp = Blueprint('admin', __name__)
@@ -85,6 +88,36 @@ def admin_create_product():
     return render_template('admin/product_form.html', product=None)
 
 
+@admin_bp.route('/admin/products/import', methods=['GET', 'POST'])
+@require_admin
+def admin_import_products():
+    """
+    Importar productos de TechShop desde un fichero CSV o NDJSON.
+    
+    Returns:
+        str: Formulario de importación y, después de enviarlo, el informe
+    """
+    report = None
+    if request.method == 'POST':
+        products_file = request.files.get('products_file')
+        if not products_file or not products_file.filename:
+            flash("Selecciona un fitxer CSV o NDJSON", 'error')
+            return render_template('admin/product_import.html', report=None)
+        images_zip = request.files.get('images_zip')
+        import_service = ImportService(static_folder=current_app.static_folder)
+        success, message, report = import_service.import_products(
+            products_file.stream, products_file.filename, None,
+            upsert=bool(request.form.get('upsert')),
+            images_zip=images_zip.stream if images_zip and images_zip.filename else None,
+        )
+        if not success:
+            flash(message, 'error')
+        else:
+            flash(message, 'warning' if report['error_count'] else 'success')
+    
+    return render_template('admin/product_import.html', report=report)
+
+
 @admin_bp.route('/admin/products/<int:product_id>/edit', methods=['GET', 'POST'])
 @require_admin
 def admin_edit_product(product_id):
@@ -325,3 +358,29 @@ def admin_delete_order(order_id):
     
     return redirect(url_for('admin.admin_orders'))
 
+
+
+# ========== DIAGNÒSTIC SQL ==========
+
+@admin_bp.route('/admin/sql-profile')
+@require_admin
+def admin_sql_profile():
+    """
+    Vista de depuración del perfilador SQL.
+    
+    Muestra las últimas peticiones con su número de sentencias y tiempo, las
+    sentencias agrupadas por SQL normalizado y los contadores de la caché del
+    catálogo y de la caché de fragmentos HTML.
+    
+    Returns:
+        str: Página HTML con el perfil SQL de las peticiones recientes
+    """
+    profiles = get_recent_profiles()
+    statements = get_statement_summary(profiles)
+    return render_template('admin/sql_profile.html',
+                         profiles=profiles,
+                         statements=statements,
+                         slow_query_ms=SLOW_QUERY_MS,
+                         catalog_cache=get_catalog_cache_stats(),
+                         search_cache=get_catalog_cache_stats(search=True),
+                         fragment_cache=get_fragment_cache().stats())
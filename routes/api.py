@@ -0,0 +1,112 @@
+"""
+API JSON de solo lectura del catálogo de TechShop
+Listado paginado, detalle, consulta por lotes de IDs y exportación NDJSON
+"""
+
+import json
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context, url_for
+
+from services.product_service import PAGE_SIZE, ProductService
+from routes.helpers import _get_product_images, _get_filter_args, _filter_url_args, _product_json
+
+# Crear blueprint
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+# Inicializar servicios
+product_service = ProductService()
+
+
+@api_bp.route('/products')
+def list_products():
+    """
+    Página del catálogo en JSON (mismos parámetros que /products/page).
+
+    Parámetros (query string):
+        sort: 'id', 'price' o 'name'
+        after: Cursor devuelto por la página anterior
+        limit: Productos por página (máximo 100)
+        price_band, in_stock, company: Filtros del catálogo
+
+    Returns:
+        JSON: products, next (cursor siguiente o null) y next_url
+    """
+    sort = request.args.get('sort', 'id')
+    filters = _get_filter_args()
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+        products, next_cursor = product_service.get_products_page(sort, request.args.get('after'), limit, **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    next_url = None
+    if next_cursor:
+        next_url = url_for('api.list_products', sort=sort, after=next_cursor, limit=limit,
+                           **_filter_url_args(filters))
+    return jsonify({
+        'products': [_product_json(product, _get_product_images(product.id)) for product in products],
+        'next': next_cursor,
+        'next_url': next_url,
+    })
+
+
+@api_bp.route('/products/<int:product_id>')
+def get_product(product_id):
+    """
+    Detalle de un producto en JSON.
+
+    Args:
+        product_id (int): ID del producto
+
+    Returns:
+        JSON: product o error (404 si no existe)
+    """
+    product = product_service.get_product_by_id(product_id)
+    if not product:
+        return jsonify({'error': "Producte no trobat"}), 404
+    return jsonify({'product': _product_json(product, _get_product_images(product.id))})
+
+
+@api_bp.route('/products/batch')
+def get_products_batch():
+    """
+    Varios productos por ID con una sola consulta.
+
+    Parámetros (query string):
+        ids: IDs separados por comas (máximo 100)
+
+    Returns:
+        JSON: products (en el orden pedido) y missing (IDs que no existen)
+    """
+    raw_ids = [value for value in request.args.get('ids', '').split(',') if value.strip()]
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw_ids))
+        products = product_service.get_products_batch(ids)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    found = {product.id for product in products}
+    return jsonify({
+        'products': [_product_json(product, _get_product_images(product.id)) for product in products],
+        'missing': [product_id for product_id in ids if product_id not in found],
+    })
+
+
+@api_bp.route('/products/export.ndjson')
+def export_products():
+    """
+    Exportar todo el catálogo en NDJSON (un producto JSON por línea).
+
+    La respuesta se envía a medida que se leen las filas del cursor, de modo
+    que la memoria no depende del tamaño del catálogo.
+
+    Returns:
+        Response: Flujo application/x-ndjson
+    """
+    def generate():
+        for product in product_service.iter_products():
+            yield json.dumps(_product_json(product, _get_product_images(product.id)), ensure_ascii=False) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=products.ndjson'
+    return response
@@ -7,7 +7,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 
 from services.user_service import UserService
 from utils.validators import validar_dni_nie
-from routes.helpers import get_current_user
+from routes.helpers import get_current_user, login_user
 
 # Crear blueprint
 auth_bp = Blueprint('auth', __name__)
@@ -36,7 +36,7 @@ def login():
         success, user, message = user_service.authenticate_user(username, password)
         
         if success and user:
-            session['user_id'] = user.id
+            login_user(user.id)
             
             # Verificar si faltan datos obligatorios
             has_missing, missing_fields = user_service.check_missing_required_data(user.id)
@@ -111,7 +111,7 @@ def google_callback():
                 flash("Els comptes d'empresa no poden utilitzar l'inici de sessió amb Google", 'error')
                 return redirect(url_for('auth.login'))
             
-            session['user_id'] = existing_user.id
+            login_user(existing_user.id)
             
             # Verificar si faltan datos obligatorios
             has_missing, missing_fields = user_service.check_missing_required_data(existing_user.id)
@@ -191,7 +191,7 @@ def complete_google_profile():
             session.pop('google_picture', None)
             
             # Iniciar sesión
-            session['user_id'] = user.id
+            login_user(user.id)
             flash(f"Compte creat correctament amb Google! Benvingut, {username}!", 'success')
             return redirect(url_for('main.show_products'))
         else:
@@ -289,7 +289,7 @@ def register():
         
         if success and user:
             # Iniciar sesión automáticamente
-            session['user_id'] = user.id
+            login_user(user.id)
             flash(f"Compte creat correctament! Benvingut, {username}!", 'success')
             return redirect(url_for('main.show_products'))
         else:
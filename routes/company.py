@@ -7,6 +7,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from decimal import Decimal
 
 from services.company_service import CompanyService
+from services.import_service import ImportService
 from routes.helpers import get_current_user, require_company
 
 # Crear blueprint
@@ -77,6 +78,38 @@ def company_create_product():
     return render_template('company/product_form.html', product=None)
 
 
+@company_bp.route('/company/products/import', methods=['GET', 'POST'])
+@require_company
+def company_import_products():
+    """
+    Importar productos de la empresa desde un fichero CSV o NDJSON.
+    
+    Returns:
+        str: Formulario de importación y, después de enviarlo, el informe
+    """
+    user = get_current_user()
+    report = None
+    if request.method == 'POST':
+        products_file = request.files.get('products_file')
+        if not products_file or not products_file.filename:
+            flash("Selecciona un fitxer CSV o NDJSON", 'error')
+            return render_template('company/product_import.html', report=None)
+        images_zip = request.files.get('images_zip')
+        from flask import current_app
+        import_service = ImportService(static_folder=current_app.static_folder)
+        success, message, report = import_service.import_products(
+            products_file.stream, products_file.filename, user.id,
+            upsert=bool(request.form.get('upsert')),
+            images_zip=images_zip.stream if images_zip and images_zip.filename else None,
+        )
+        if not success:
+            flash(message, 'error')
+        else:
+            flash(message, 'warning' if report['error_count'] else 'success')
+    
+    return render_template('company/product_import.html', report=report)
+
+
 @company_bp.route('/company/products/<int:product_id>/edit', methods=['GET', 'POST'])
 @require_company
 def company_edit_product(product_id):
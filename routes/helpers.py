@@ -2,12 +2,32 @@
 Funciones auxiliares y decoradores para las rutas
 """
 
+import hashlib
+import os
+import time
 from functools import wraps
-from flask import session, flash, redirect, url_for
+from typing import Dict, List
+from flask import session, flash, redirect, url_for, render_template, request, current_app
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from services.cart_service import CartService
+from services.product_service import PRICE_BANDS
 from services.user_service import UserService
+from utils.cache import get_catalog_cache
+from utils.coherence import get_change_monitor
+from utils.database import DEFAULT_DB_PATH
+from utils.image_manifest import get_image_manifest
 
-# Inicializar servicio
+# Marcador del token CSRF en los fragmentos guardados (se sustituye en cada petición)
+CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+
+# Identificador del despliegue: cambiarlo descarta las ETag de plantillas anteriores
+ETAG_RELEASE = os.environ.get('ETAG_RELEASE', '')
+
+# Inicializar servicios
 user_service = UserService()
+cart_service = CartService()
 
 
 def get_current_user():
@@ -24,6 +44,20 @@ def get_current_user():
     return user_service.get_user_by_id(user_id)
 
 
+def login_user(user_id: int):
+    """
+    Iniciar la sesión de un usuario.
+    
+    Guarda su ID en la sesión y le pasa el carrito anónimo que tuviera la
+    sesión (las cantidades de un mismo producto se suman).
+    
+    Args:
+        user_id (int): ID del usuario
+    """
+    session['user_id'] = user_id
+    cart_service.merge_anonymous_cart(session)
+
+
 def require_admin(f):
     """
     Decorador para proteger rutas que requieren permisos de administrador.
@@ -67,10 +101,268 @@ def require_company(f):
     return decorated_function
 
 
+def _get_image_manifest():
+    """
+    Obtener el índice de imágenes de la base de datos de la aplicación.
+    
+    Returns:
+        ImageManifest: Índice compartido del proceso
+    """
+    return get_image_manifest(DEFAULT_DB_PATH, os.path.join(current_app.static_folder, 'img', 'products'))
+
+
+def fragment_key(kind, *parts, catalog=True):
+    """
+    Clave de un fragmento HTML cacheado para la petición actual.
+    
+    Incluye el idioma de la sesión, el tipo de visitante (las empresas ven
+    otro texto en lugar del formulario de compra) y las versiones del catálogo
+    y del índice de imágenes, de modo que cualquier cambio de productos deja
+    de servir los fragmentos anteriores.
+    
+    Args:
+        kind (str): Tipo de fragmento ('grid', 'trends', 'detail'...)
+        *parts: Parámetros de los que depende el fragmento (orden, filtros, página...)
+        catalog (bool): Incluir la versión del catálogo; un fragmento de un solo
+            producto pasa False y sus propios datos en parts, así el cambio de
+            stock de otro producto no lo invalida
+        
+    Returns:
+        tuple: Clave para utils.cache.get_fragment_cache()
+    """
+    viewer = 'buyer'
+    if session.get('user_id'):
+        user = get_current_user()
+        if user and user.account_type == 'company':
+            viewer = 'company'
+    catalog_version = get_catalog_cache(DEFAULT_DB_PATH).version() if catalog else None
+    return (kind, session.get('language', 'cat'), viewer,
+            catalog_version, _get_image_manifest().version()) + parts
+
+
+def render_fragment(template, **context):
+    """
+    Renderizar un fragmento para guardarlo en caché.
+    
+    El token CSRF, que es propio de cada sesión, se deja como marcador y se
+    rellena con fill_fragment() al servirlo.
+    
+    Args:
+        template (str): Plantilla del fragmento
+        **context: Variables de la plantilla
+        
+    Returns:
+        str: HTML renderizado con el marcador CSRF
+    """
+    return render_template(template, csrf_token=lambda: CSRF_PLACEHOLDER, **context)
+
+
+def fill_fragment(html):
+    """
+    Preparar un fragmento cacheado para la respuesta actual.
+    
+    Args:
+        html (str): HTML devuelto por render_fragment()
+        
+    Returns:
+        Markup: HTML con el token CSRF de la sesión actual
+    """
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+    return Markup(html)
+
+
+def get_data_versions():
+    """
+    Versiones actuales de las familias de datos (tabla ChangeCounter).
+    
+    Son las mismas en todos los procesos, así que sirven de validador para
+    las ETag; leerlas es una sola consulta.
+    
+    Returns:
+        Dict[str, int]: Versión de 'product', 'image', 'order', 'user'...
+    """
+    return get_change_monitor(DEFAULT_DB_PATH).current_versions()
+
+
+def make_etag(*parts):
+    """
+    Construir una ETag a partir de sus validadores.
+    
+    Args:
+        *parts: Valores de los que depende la respuesta
+        
+    Returns:
+        str: ETag (hash de las partes y del despliegue)
+    """
+    return hashlib.sha1(repr((ETAG_RELEASE,) + parts).encode('utf-8')).hexdigest()
+
+
+def page_etag(*parts):
+    """
+    ETag de una página HTML para la petición actual.
+    
+    Además de las partes indicadas, incluye lo que la plantilla base muestra
+    de cada visitante: idioma, usuario y token CSRF (que caduca, por eso se
+    añade un tramo de tiempo). Si hay mensajes flash pendientes no se genera
+    ETag, porque la página que los muestra no se puede reutilizar.
+    
+    Args:
+        *parts: Validadores del contenido (versiones, ID del producto...)
+        
+    Returns:
+        str o None: ETag o None si la página no se puede validar
+    """
+    if session.get('_flashes'):
+        return None
+    user = get_current_user() if session.get('user_id') else None
+    viewer = (user.id, user.username, user.role, user.account_type) if user else None
+    csrf_field = current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    csrf_window = int(time.time() // max(time_limit // 2, 1)) if time_limit else 0
+    return make_etag(session.get('language', 'cat'), viewer, session.get(csrf_field), csrf_window, *parts)
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Responder 304 si la petición condicional coincide con los validadores.
+    
+    Se comprueba antes de renderizar o generar nada: If-None-Match tiene
+    prioridad y, si no se envía, se usa If-Modified-Since.
+    
+    Args:
+        etag (str o None): ETag actual (None desactiva la comprobación)
+        last_modified (datetime, optional): Fecha de la última modificación
+        
+    Returns:
+        Response o None: Respuesta 304 o None si hay que generar el cuerpo
+    """
+    if etag is None:
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    """
+    Añadir ETag, Last-Modified y Cache-Control a una respuesta.
+    
+    Las respuestas son privadas (dependen de la sesión) y el navegador debe
+    revalidarlas siempre, así que un cambio nunca se sirve tarde.
+    
+    Args:
+        response (Response): Respuesta
+        etag (str o None): ETag (None no añade nada)
+        last_modified (datetime, optional): Fecha de la última modificación
+        
+    Returns:
+        Response: La misma respuesta
+    """
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _get_filter_args() -> Dict:
+    """
+    Leer los filtros del catálogo de la petición (se ignoran los no válidos).
+    
+    Returns:
+        Dict: Argumentos para ProductService (price_band, in_stock, company_id)
+    """
+    filters = {'price_band': None, 'in_stock': request.args.get('in_stock') == '1', 'company_id': None}
+    price_band = request.args.get('price_band', '')
+    if price_band.isdigit() and int(price_band) < len(PRICE_BANDS):
+        filters['price_band'] = int(price_band)
+    company = request.args.get('company', '')
+    if company.isdigit():
+        filters['company_id'] = int(company)
+    return filters
+
+
+def _filter_url_args(filters: Dict) -> Dict:
+    """
+    Parámetros de URL que conservan los filtros activos.
+    
+    Args:
+        filters (Dict): Filtros devueltos por _get_filter_args()
+        
+    Returns:
+        Dict: price_band, in_stock y company (solo los activos)
+    """
+    args = {}
+    if filters['price_band'] is not None:
+        args['price_band'] = filters['price_band']
+    if filters['in_stock']:
+        args['in_stock'] = 1
+    if filters['company_id'] is not None:
+        args['company'] = filters['company_id']
+    return args
+
+
+def _product_json(product, images: List[str]) -> Dict:
+    """
+    Datos de un producto para las respuestas JSON del catálogo.
+    
+    Args:
+        product (Product): Producto
+        images (List[str]): URLs de sus imágenes
+        
+    Returns:
+        Dict: Datos serializables del producto
+    """
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': f"{product.price:.2f}",
+        'price_cents': product.price_cents,
+        'stock': product.stock,
+        'url': url_for('main.product_detail', product_id=product.id),
+        'images': images,
+    }
+
+
+def _cart_json(priced_cart) -> Dict:
+    """
+    Datos del carrito para las respuestas JSON del carrito.
+    
+    Args:
+        priced_cart (PricedCart): Carrito con precios
+        
+    Returns:
+        Dict: Líneas, IDs que ya no existen, unidades y total
+    """
+    return {
+        'lines': [{
+            'product_id': line.product.id,
+            'name': line.product.name,
+            'quantity': line.quantity,
+            'price': f"{line.product.price:.2f}",
+            'line_total': f"{line.line_total:.2f}",
+            'stock': line.product.stock,
+            'available': line.available,
+            'in_stock': line.in_stock,
+        } for line in priced_cart.lines],
+        'missing': priced_cart.missing,
+        'count': sum(line.quantity for line in priced_cart.lines),
+        'total': f"{priced_cart.total:.2f}",
+        'total_cents': priced_cart.total_cents,
+    }
+
+
 def _get_product_images(product_id, limit=4):
     """
     Construir las rutas de imagen para un producto determinado.
     
+    Las imágenes salen del índice en memoria (utils/image_manifest.py), sin
+    listar el directorio del producto en cada renderizado.
+    
     Args:
         product_id (int): Identificador del producto.
         limit (int): Número máximo de imágenes a retornar.
@@ -78,26 +370,34 @@ def _get_product_images(product_id, limit=4):
     Returns:
         List[str]: Lista de URLs relativas a las imágenes del producto.
     """
-    from flask import url_for, current_app
-    from pathlib import Path
-    
-    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-    
-    images_dir = Path(current_app.static_folder) / 'img' / 'products' / str(product_id)
-    if not images_dir.exists():
-        return []
+    manifest = _get_image_manifest()
+    return [
+        url_for('static', filename=f'img/products/{product_id}/{filename}')
+        for filename in manifest.get_images(product_id)[:limit]
+    ]
 
-    image_urls = []
-    for image_path in sorted(images_dir.iterdir()):
-        if not image_path.is_file():
-            continue
-        if image_path.suffix.lower() not in IMAGE_EXTENSIONS:
-            continue
-        image_urls.append(
-            url_for('static', filename=f'img/products/{product_id}/{image_path.name}')
-        )
-        if len(image_urls) >= limit:
-            break
-
-    return image_urls
 
+def _order_json(order, items: List[Dict]) -> Dict:
+    """
+    Datos de una comanda del historial para las respuestas JSON.
+    
+    Args:
+        order (Order): Comanda
+        items (List[Dict]): Líneas devueltas por OrderService.get_order_history()
+        
+    Returns:
+        Dict: Datos serializables de la comanda y sus líneas
+    """
+    return {
+        'id': order.id,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+        'total': f"{order.total:.2f}",
+        'total_cents': order.total_cents,
+        'invoice_url': url_for('profile.download_invoice', order_id=order.id),
+        'items': [{
+            'product_id': item['product_id'],
+            'name': item['product_name'],
+            'quantity': item['quantity'],
+            'price': f"{item['product_price']:.2f}",
+        } for item in items],
+    }
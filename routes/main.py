@@ -3,18 +3,26 @@ Rutas principales de TechShop
 Productos, carrito, checkout y confirmación de pedidos
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response
 from pathlib import Path
-from typing import Dict, List
 
-from services.cart_service import CartService
-from services.order_service import OrderService
+from services.cart_service import MAX_UNITS_PER_PRODUCT, CartService
+from services.order_service import (
+    ORDER_ALREADY_PROCESSED, OrderService, is_valid_idempotency_key, new_idempotency_key
+)
 from services.recommendation_service import RecommendationService
-from services.product_service import ProductService
+from services.reservation_service import ReservationService
+from services.product_service import (
+    MAX_PAGE_SIZE, PAGE_SIZE, PRICE_BANDS, SORT_OPTIONS, ProductService, decode_cursor, normalize_query
+)
 from services.user_service import UserService
+from services.job_queue import get_job_worker
 from utils.invoice_generator import generate_invoice_pdf
-from utils.email_service import send_order_confirmation_email
-from routes.helpers import get_current_user, _get_product_images
+from routes.helpers import (
+    get_current_user, login_user, _cart_json, _get_product_images, _get_filter_args, _filter_url_args, _product_json,
+    fragment_key, render_fragment, fill_fragment, get_data_versions, page_etag, not_modified, with_validators
+)
+from utils.cache import get_fragment_cache
 import sqlite3
 
 # Crear blueprint
@@ -25,40 +33,256 @@ cart_service = CartService()
 order_service = OrderService()
 recommendation_service = RecommendationService()
 product_service = ProductService()
+reservation_service = ReservationService()
 user_service = UserService()
 
 
+def _get_sort_arg() -> str:
+    """
+    Leer la ordenación del catálogo de la petición ('id' si no es válida).
+    
+    Returns:
+        str: 'id', 'price' o 'name'
+    """
+    sort = request.args.get('sort', 'id')
+    return sort if sort in SORT_OPTIONS else 'id'
+
+
+def _get_cursor_arg(sort: str) -> tuple:
+    """
+    Descodificar el cursor `after` de la petición antes de usarlo.
+    
+    Se descodifica igual que en la consulta de la página siguiente y la clave
+    descodificada (no el texto recibido) es la que entra en la clave del
+    fragmento: un cursor inventado no llega a ocupar la memoria caché.
+    
+    Args:
+        sort (str): Ordenación de la petición
+        
+    Returns:
+        tuple: Valores de la clave del cursor (vacía en la primera página)
+        
+    Raises:
+        ValueError: Si la ordenación o el cursor no son válidos
+    """
+    if sort not in SORT_OPTIONS:
+        raise ValueError(f"Ordenació no vàlida: {sort}")
+    after = request.args.get('after')
+    return decode_cursor(after, sort) if after else ()
+
+
+def _get_page_arg() -> int:
+    """
+    Leer el número de página de la petición (1 si no es válido).
+    
+    Returns:
+        int: Página (empezando por 1)
+    """
+    try:
+        return max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        return 1
+
+
 @main_bp.route('/')
 def show_products():
     """
-    Ruta que obtiene todos los productos de la base de datos y los pasa a la capa de presentación.
+    Ruta que obtiene la primera página del catálogo y la pasa a la capa de presentación.
+    
+    Las páginas siguientes se cargan desde /products/page al desplazarse
+    (o con el enlace "Cargar más" si no hay JavaScript).
+    
+    La graella y las tendencias se sirven de la caché de fragmentos
+    (por idioma, versión del catálogo y página); las recomendaciones del
+    usuario y los mensajes se renderizan en cada petición.
+    
+    La ETag sale de las versiones de productos, stock, imágenes y pedidos: si el
+    navegador ya tiene la página responde 304 sin consultar ni renderizar nada.
     
     Returns:
-        str: Página HTML con la lista de productos
+        Response: Página HTML con la lista de productos (o 304)
     """
-    recommendations = recommendation_service.get_top_selling_products(limit=3)
+    versions = get_data_versions()
+    
+    def catalog_etag():
+        if not versions:
+            return None
+        return page_etag('catalog', versions.get('product'), versions.get('stock'), versions.get('image'),
+                         versions.get('order'))
+    
+    etag = catalog_etag()
+    response = not_modified(etag)
+    if response:
+        return response
+    
     user_recommendations = []
     user_id = session.get('user_id')
     if user_id:
         user_recommendations = recommendation_service.get_top_products_for_user(user_id=user_id, limit=3)
 
-    # Obtener productos mediante el servicio (siguiendo las reglas)
-    products = product_service.get_all_products()
+    sort = _get_sort_arg()
+    filters = _get_filter_args()
+    filter_args = _filter_url_args(filters)
+    after = request.args.get('after')
+    try:
+        cursor_key = _get_cursor_arg(sort)
+    except ValueError:
+        return 'Cursor de paginación no válido', 400
+    fragments = get_fragment_cache()
+
+    def render_trends():
+        recommendations = recommendation_service.get_top_selling_products(limit=3)
+        product_images = {product.id: _get_product_images(product.id) for product, total_sold in recommendations}
+        return render_fragment('_trends.html', recommendations=recommendations, product_images=product_images)
+
+    def render_grid():
+        # Obtener una página de productos mediante el servicio (coste fijo)
+        products, next_cursor = product_service.get_products_page(sort, after, **filters)
+        # Obtener imágenes solo de los productos mostrados
+        product_images = {product.id: _get_product_images(product.id) for product in products}
+        return render_fragment('_product_grid.html', products=products, product_images=product_images,
+                               sort=sort, next_cursor=next_cursor, filter_args=filter_args)
+
+    trends_html = fragments.get_or_render(fragment_key('trends'), render_trends)
+    grid_html = fragments.get_or_render(
+        fragment_key('grid', sort, tuple(sorted(filter_args.items())), cursor_key), render_grid
+    )
+    facets = product_service.get_facet_counts(**filters)
+    
+    html = render_template(
+        'products.html',
+        trends_html=fill_fragment(trends_html),
+        grid_html=fill_fragment(grid_html),
+        user_recommendations=user_recommendations,
+        sort=sort,
+        sort_options=SORT_OPTIONS,
+        filters=filters,
+        filter_args=filter_args,
+        facets=facets,
+        price_bands=PRICE_BANDS
+    )
+    # Se recalcula: el renderizado puede haber creado el token CSRF de la sesión
+    return with_validators(make_response(html), etag and catalog_etag())
+
+
+@main_bp.route('/products/page')
+def products_page():
+    """
+    Página siguiente del catálogo en JSON para el desplazamiento infinito.
+    
+    Parámetros (query string):
+        sort: 'id', 'price' o 'name'
+        after: Cursor devuelto por la página anterior
+        limit: Productos por página (máximo 100)
+        price_band, in_stock, company: Filtros del catálogo
+    
+    Returns:
+        JSON: products (datos de cada producto), html (tarjetas renderizadas),
+        next (cursor siguiente o null), next_url (URL de la página siguiente o null)
+        y facets (recuentos de cada faceta con los filtros activos)
+    """
+    sort = request.args.get('sort', 'id')
+    filters = _get_filter_args()
+    filter_args = _filter_url_args(filters)
+    after = request.args.get('after')
+    
+    def render_page():
+        products, next_cursor = product_service.get_products_page(sort, after, limit, **filters)
+        product_images = {product.id: _get_product_images(product.id) for product in products}
+        html = ''.join(
+            render_fragment('_product_card.html', product=product, images=product_images[product.id])
+            for product in products
+        )
+        return [_product_json(product, product_images[product.id]) for product in products], html, next_cursor
+    
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+        cursor_key = _get_cursor_arg(sort)
+        products_json, html, next_cursor = get_fragment_cache().get_or_render(
+            fragment_key('page', sort, tuple(sorted(filter_args.items())), cursor_key, limit), render_page
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    next_url = None
+    if next_cursor:
+        next_url = url_for('main.products_page', sort=sort, after=next_cursor, limit=limit, **filter_args)
+    facets = product_service.get_facet_counts(**filters)
+    
+    return jsonify({
+        'products': products_json,
+        'html': str(fill_fragment(html)),
+        'next': next_cursor,
+        'next_url': next_url,
+        'facets': {
+            'price_band': facets['price_band'],
+            'in_stock': facets['in_stock'],
+            'company': facets['company'],
+            'total': facets['total'],
+        },
+    })
+
+
+@main_bp.route('/search')
+def search():
+    """
+    Ruta de búsqueda de productos por nombre, ordenados por relevancia.
     
-    # Obtener imágenes para cada producto
-    product_images: Dict[int, List[str]] = {}
-    for product in products:
-        product_images[product.id] = _get_product_images(product.id)
+    Parámetros (query string):
+        q: Texto a buscar
+        page: Número de página (empezando por 1)
+    
+    Returns:
+        str: Página HTML con los resultados
+    """
+    query = normalize_query(request.args.get('q'))
+    page = _get_page_arg()
+    products, total = product_service.search_products(query, page)
+    product_images = {product.id: _get_product_images(product.id) for product in products}
     
     return render_template(
-        'products.html',
+        'search.html',
+        query=query,
         products=products,
-        recommendations=recommendations,
-        user_recommendations=user_recommendations,
-        product_images=product_images
+        product_images=product_images,
+        total=total,
+        page=page,
+        has_next=page * PAGE_SIZE < total
     )
 
 
+@main_bp.route('/search.json')
+def search_json():
+    """
+    Búsqueda de productos en JSON.
+    
+    Parámetros (query string):
+        q: Texto a buscar
+        page: Número de página (empezando por 1)
+        limit: Productos por página (máximo 100)
+    
+    Returns:
+        JSON: query (consulta normalizada), total, page, products y
+        next_page (número de la página siguiente o null)
+    """
+    query = normalize_query(request.args.get('q'))
+    page = _get_page_arg()
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    products, total = product_service.search_products(query, page, limit)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    return jsonify({
+        'query': query,
+        'total': total,
+        'page': page,
+        'products': [_product_json(product, _get_product_images(product.id)) for product in products],
+        'next_page': page + 1 if page * limit < total else None,
+    })
+
+
 @main_bp.route('/product/<int:product_id>')
 def product_detail(product_id):
     """
@@ -67,8 +291,12 @@ def product_detail(product_id):
     Args:
         product_id (int): ID del producto
         
+    La ETag es la versión del propio producto (nombre, precio, stock,
+    unidades disponibles e imágenes), así que un cambio de otro producto no
+    la invalida.
+    
     Returns:
-        str: Página HTML con el detalle del producto
+        Response: Página HTML con el detalle del producto (o 304)
     """
     # Obtener producto mediante el servicio
     product = product_service.get_product_by_id(product_id)
@@ -77,14 +305,33 @@ def product_detail(product_id):
         flash("Producte no trobat", 'error')
         return redirect(url_for('main.show_products'))
     
-    # Obtener imágenes del producto
-    product_images = _get_product_images(product_id)
+    product_images = _get_product_images(product.id)
+    # Unidades libres (stock menos reservas vigentes de los carritos)
+    available = reservation_service.get_available([product.id]).get(product.id, 0)
     
-    return render_template(
+    def detail_etag():
+        return page_etag('detail', product.id, product.name, product.price_cents, product.stock, available,
+                         tuple(product_images))
+    
+    etag = detail_etag()
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    # El cuerpo (imágenes, precio, stock y formulario) sale de la caché de fragmentos
+    detail_html = get_fragment_cache().get_or_render(
+        fragment_key('detail', product.id, product.name, product.price_cents, product.stock, available,
+                     tuple(product_images), catalog=False),
+        lambda: render_fragment('_product_detail_body.html', product=product, product_images=product_images,
+                                available=available)
+    )
+    
+    html = render_template(
         'product_detail.html',
         product=product,
-        product_images=product_images
+        detail_html=fill_fragment(detail_html)
     )
+    return with_validators(make_response(html), etag and detail_etag())
 
 
 @main_bp.route('/add_to_cart', methods=['POST'])
@@ -148,6 +395,87 @@ def remove_from_cart():
     return redirect(url_for('main.checkout'))
 
 
+# Líneas máximas por petición a /cart/lines
+MAX_CART_BATCH = 50
+
+
+def _parse_cart_lines(data) -> dict:
+    """
+    Validar el cuerpo JSON de /cart/lines.
+
+    Args:
+        data: Cuerpo JSON ({"lines": [{"product_id": 1, "quantity": 2}, ...]})
+
+    Returns:
+        dict: {product_id: quantity} (si un producto se repite, se suman)
+
+    Raises:
+        ValueError: Si el cuerpo no es válido
+    """
+    lines = data.get('lines') if isinstance(data, dict) else None
+    if not isinstance(lines, list) or not lines:
+        raise ValueError("Cal indicar almenys una línia")
+    if len(lines) > MAX_CART_BATCH:
+        raise ValueError(f"Com a màxim {MAX_CART_BATCH} línies per petició")
+
+    quantities = {}
+    for line in lines:
+        product_id = line.get('product_id') if isinstance(line, dict) else None
+        quantity = line.get('quantity') if isinstance(line, dict) else None
+        if type(product_id) is not int or type(quantity) is not int or product_id <= 0:
+            raise ValueError("Cada línia ha de tenir product_id i quantity enters")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+@main_bp.route('/cart.json')
+def cart_json():
+    """
+    Carrito con precios y stock en JSON (una sola consulta de productos).
+
+    Returns:
+        JSON: cart (lines, missing, count, total y total_cents)
+    """
+    return jsonify({'cart': _cart_json(cart_service.get_priced_cart(session))})
+
+
+@main_bp.route('/cart/lines', methods=['POST'])
+def update_cart_lines():
+    """
+    Modificar varias líneas del carrito en una sola petición JSON.
+
+    Cuerpo JSON:
+        lines: [{"product_id": 1, "quantity": 2}, ...] (máximo MAX_CART_BATCH)
+        mode: 'set' (fija la cantidad; 0 elimina la línea) o 'add' (suma a la actual)
+
+    Los cambios se aplican todos o ninguno (una sola transacción).
+
+    Returns:
+        JSON: message y cart actualizado; error y cart actual si no se ha
+        podido aplicar (400 datos inválidos, 403 empresas, 409 límite o stock)
+    """
+    user = get_current_user()
+    if user and user.account_type == 'company':
+        return jsonify({'error': "Les empreses no poden comprar productes."}), 403
+
+    data = request.get_json(silent=True)
+    mode = data.get('mode', 'set') if isinstance(data, dict) else None
+    try:
+        if mode not in ('set', 'add'):
+            raise ValueError("El mode ha de ser 'set' o 'add'")
+        quantities = _parse_cart_lines(data)
+        if any(quantity < 0 or quantity > MAX_UNITS_PER_PRODUCT for quantity in quantities.values()):
+            raise ValueError(f"Les quantitats han d'estar entre 0 i {MAX_UNITS_PER_PRODUCT}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    success, message = cart_service.set_quantities(session, quantities, add=(mode == 'add'))
+    cart = _cart_json(cart_service.get_priced_cart(session))
+    if not success:
+        return jsonify({'error': message, 'cart': cart}), 409
+    return jsonify({'message': message, 'cart': cart})
+
+
 @main_bp.route('/checkout')
 def checkout():
     """
@@ -162,22 +490,21 @@ def checkout():
         flash("Les empreses no poden comprar productes. Aquesta funcionalitat és només per usuaris individuals.", 'error')
         return redirect(url_for('main.show_products'))
     
-    cart_contents = cart_service.get_cart_contents(session)
-    cart_total = cart_service.get_cart_total(session)
-    
-    # Obtener información de los productos del carrito mediante el servicio
-    products_with_quantities = product_service.get_products_by_ids(cart_contents)
+    # Precios, stock y total del carrito con una sola consulta
+    priced_cart = cart_service.get_priced_cart(session)
     
     # Construir lista con imágenes
     cart_products = []
-    for product, quantity in products_with_quantities:
+    for line in priced_cart.lines:
         cart_products.append(
-            (product, quantity, _get_product_images(product.id))
+            (line.product, line.quantity, _get_product_images(line.product.id), line.in_stock)
         )
     
+    # Clau nova per formulari: si s'envia dos cops, es reutilitza la comanda
     return render_template('checkout.html', 
                          cart_products=cart_products, 
-                         cart_total=cart_total)
+                         cart_total=priced_cart.total,
+                         idempotency_key=new_idempotency_key())
 
 
 @main_bp.route('/process_order', methods=['POST'])
@@ -195,6 +522,16 @@ def process_order():
         flash("Les empreses no poden comprar productes. Aquesta funcionalitat és només per usuaris individuals.", 'error')
         return redirect(url_for('main.show_products'))
     
+    # Un formulari ja enviat (doble clic o reintent) no torna a crear la comanda
+    idempotency_key = request.form.get('idempotency_key', '').strip()
+    if not is_valid_idempotency_key(idempotency_key):
+        idempotency_key = None
+    if idempotency_key:
+        existing_order_id = order_service.get_order_id_by_idempotency_key(idempotency_key)
+        if existing_order_id:
+            flash(f"Comanda processada correctament! ID: {existing_order_id}", "success")
+            return redirect(url_for("main.order_confirmation", order_id=existing_order_id))
+    
     checkout_type = request.form.get('checkout_type', 'guest')
     address = request.form.get('address', '').strip()
     
@@ -217,60 +554,30 @@ def process_order():
                                             user.dni if hasattr(user, 'dni') else "", 
                                             user.nif if hasattr(user, 'nif') else "")
         
-        # Crear la comanda
-        conn = None
+        # Crear la comanda (transacció amb BEGIN IMMEDIATE i reintents si la BD està ocupada)
         try:
-            conn = sqlite3.connect('techshop.db')
-            cart_contents = cart_service.get_cart_contents(session)
-            success, message, order_id = order_service.create_order_in_transaction(
-                conn, cart_contents, user_id
-            )
+            cart_id, cart_contents = cart_service.get_checkout_cart(session)
+            success, message, order_id = order_service.create_order(cart_contents, user_id, idempotency_key,
+                                                                    cart_id)
             
             if not success:
-                conn.rollback()
                 flash(message, "error")
                 return redirect(url_for("main.checkout"))
+            if message == ORDER_ALREADY_PROCESSED:
+                # Enviament simultani del mateix formulari: l'altra petició fa la resta
+                return redirect(url_for("main.order_confirmation", order_id=order_id))
             
-            conn.commit()
             cart_service.clear_cart(session)
             
-            # Enviar email de confirmación con factura (usando servicios, siguiendo arquitectura de 3 capas)
-            user_obj = user_service.get_user_by_id(user_id)
-            if user_obj and user_obj.email:
-                # Obtener datos de la orden usando el servicio (no acceso directo a BD)
-                success_order, message_order, order = order_service.get_order_by_id(order_id)
-                if success_order and order:
-                    # Obtener items de la orden usando el servicio
-                    success_items, message_items, order_items = order_service.get_order_items_for_email(order_id)
-                    if success_items:
-                        # Generar factura PDF
-                        from utils.invoice_generator import generate_invoice_pdf
-                        invoice_pdf = generate_invoice_pdf(order_id, user_id)
-                        # Enviar email con datos ya procesados por servicios
-                        from utils.email_service import send_order_confirmation_email
-                        email_success, email_message = send_order_confirmation_email(
-                            user_obj.email, 
-                            user_obj.username, 
-                            order_id,
-                            float(order.total),
-                            order.created_at.strftime('%d/%m/%Y %H:%M') if order.created_at else 'N/A',
-                            order_items,
-                            invoice_pdf
-                        )
-                        if not email_success:
-                            print(f"⚠️ No se pudo enviar el email de confirmación: {email_message}")
+            # Factura y correo en segundo plano (tarea ORDER_PLACED_JOB creada con la comanda)
+            get_job_worker(order_service.db_path).notify()
             
             flash(f"Comanda processada correctament! ID: {order_id}", "success")
             return redirect(url_for("main.order_confirmation", order_id=order_id))
             
         except sqlite3.Error as e:
-            if conn is not None:
-                conn.rollback()
             flash(f"Error processant la comanda: {str(e)}", "error")
             return redirect(url_for("main.checkout"))
-        finally:
-            if conn is not None:
-                conn.close()
     
     # Flujo de invitado: pedir todos los campos
     else:
@@ -315,62 +622,36 @@ def process_order():
             return redirect(url_for("main.checkout"))
 
         user_id = user.id
-        session["user_id"] = user_id
 
-        # Crear la comanda utilizando el servicio
-        conn = None
+        # Crear la comanda utilizando el servicio. Se compra el carrito anónimo
+        # que se ha mostrado en el checkout: la sesión se inicia después, porque
+        # login_user() le sumaría el carrito guardado de la cuenta y se cobrarían
+        # líneas que el cliente no ha visto
         try:
-            conn = sqlite3.connect('techshop.db')
-            cart_contents = cart_service.get_cart_contents(session)
-            success, message, order_id = order_service.create_order_in_transaction(
-                conn, cart_contents, user_id
-            )
+            cart_id, cart_contents = cart_service.get_checkout_cart(session)
+            success, message, order_id = order_service.create_order(cart_contents, user_id, idempotency_key,
+                                                                    cart_id)
+            if success and message != ORDER_ALREADY_PROCESSED:
+                # Todo correcto: limpiar el carrito (el guardado de la cuenta no se toca)
+                cart_service.clear_cart(session)
+            login_user(user_id)
 
             if not success:
-                conn.rollback()
                 flash(message, "error")
                 return redirect(url_for("main.checkout"))
-
-            # Todo correcto: confirmar cambios y limpiar el carrito
-            conn.commit()
-            cart_service.clear_cart(session)
+            if message == ORDER_ALREADY_PROCESSED:
+                # Enviament simultani del mateix formulari: l'altra petició fa la resta
+                return redirect(url_for("main.order_confirmation", order_id=order_id))
             
-            # Enviar email de confirmación con factura (usando servicios, siguiendo arquitectura de 3 capas)
-            if user and user.email:
-                # Obtener datos de la orden usando el servicio (no acceso directo a BD)
-                success_order, message_order, order = order_service.get_order_by_id(order_id)
-                if success_order and order:
-                    # Obtener items de la orden usando el servicio
-                    success_items, message_items, order_items = order_service.get_order_items_for_email(order_id)
-                    if success_items:
-                        # Generar factura PDF
-                        from utils.invoice_generator import generate_invoice_pdf
-                        invoice_pdf = generate_invoice_pdf(order_id, user_id)
-                        # Enviar email con datos ya procesados por servicios
-                        from utils.email_service import send_order_confirmation_email
-                        email_success, email_message = send_order_confirmation_email(
-                            user.email, 
-                            user.username, 
-                            order_id,
-                            float(order.total),
-                            order.created_at.strftime('%d/%m/%Y %H:%M') if order.created_at else 'N/A',
-                            order_items,
-                            invoice_pdf
-                        )
-                        if not email_success:
-                            print(f"⚠️ No se pudo enviar el email de confirmación: {email_message}")
+            # Factura y correo en segundo plano (tarea ORDER_PLACED_JOB creada con la comanda)
+            get_job_worker(order_service.db_path).notify()
             
             flash(f"Comanda processada correctament! ID: {order_id}", "success")
             return redirect(url_for("main.order_confirmation", order_id=order_id))
 
         except sqlite3.Error as e:
-            if conn is not None:
-                conn.rollback()
             flash(f"Error processant la comanda: {str(e)}", "error")
             return redirect(url_for("main.checkout"))
-        finally:
-            if conn is not None:
-                conn.close()
 
 
 @main_bp.route('/order_confirmation/<int:order_id>')
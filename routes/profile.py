@@ -3,12 +3,14 @@ Rutas de perfil de usuario de TechShop
 Ver datos, editar datos, historial de compras, descargar facturas
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, make_response
+from datetime import datetime
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, make_response, jsonify
 
 from services.user_service import UserService
-from services.order_service import OrderService
+from services.order_service import HISTORY_PAGE_SIZE, OrderService
 from utils.invoice_generator import generate_invoice_pdf
-from routes.helpers import get_current_user
+from routes.helpers import get_current_user, make_etag, not_modified, with_validators, _order_json
 
 # Crear blueprint
 profile_bp = Blueprint('profile', __name__)
@@ -37,17 +39,61 @@ def profile():
         flash("Error carregant les dades del perfil", 'error')
         return redirect(url_for('main.show_products'))
     
-    # Obtener historial de compras
-    orders_with_items = order_service.get_orders_by_user_id(user.id)
-    
     section = request.args.get('section', 'view')  # view, edit, history
     
+    # Historial de compras: solo en su sección y una página cada vez (el
+    # enlace "Cargar más" sin JavaScript pasa el cursor en ?after=)
+    orders_with_items, next_cursor = [], None
+    if section == 'history':
+        try:
+            orders_with_items, next_cursor = order_service.get_order_history(user.id, request.args.get('after'))
+        except ValueError:
+            orders_with_items, next_cursor = order_service.get_order_history(user.id)
+    
     return render_template('profile.html', 
                          user=full_user, 
                          orders_with_items=orders_with_items,
+                         next_cursor=next_cursor,
                          section=section)
 
 
+@profile_bp.route('/profile/orders.json')
+def order_history_page():
+    """
+    Página siguiente del historial de compras en JSON (se carga al pulsar "Cargar más").
+    
+    Parámetros (query string):
+        after: Cursor devuelto por la página anterior
+        limit: Comandas por página (máximo 50)
+    
+    Returns:
+        JSON: orders (datos de cada comanda y sus líneas), html (comandas
+        renderizadas), next (cursor siguiente o null) y next_url (URL de la
+        página siguiente o null)
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': "Has d'iniciar sessió per veure el teu historial"}), 401
+    
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+        orders_with_items, next_cursor = order_service.get_order_history(user.id, request.args.get('after'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    html = ''.join(
+        render_template('_order_card.html', order=order, items=items)
+        for order, items in orders_with_items
+    )
+    next_url = url_for('profile.order_history_page', after=next_cursor, limit=limit) if next_cursor else None
+    return jsonify({
+        'orders': [_order_json(order, items) for order, items in orders_with_items],
+        'html': html,
+        'next': next_cursor,
+        'next_url': next_url,
+    })
+
+
 @profile_bp.route('/profile/edit', methods=['GET', 'POST'])
 def profile_edit():
     """
@@ -88,8 +134,7 @@ def profile_edit():
         flash("Error carregant les dades del perfil", 'error')
         return redirect(url_for('profile.profile'))
     
-    orders_with_items = order_service.get_orders_by_user_id(user.id)
-    return render_template('profile.html', user=full_user, section='edit', orders_with_items=orders_with_items)
+    return render_template('profile.html', user=full_user, section='edit', orders_with_items=[])
 
 
 @profile_bp.route('/profile/delete', methods=['POST'])
@@ -123,11 +168,17 @@ def download_invoice(order_id):
     """
     Generar y descargar la factura de una comanda en formato PDF.
     
+    La comanda no cambia una vez creada y sus líneas guardan el nombre y el
+    precio de la compra: la ETag depende solo de su ID y de los datos del
+    cliente que aparecen en la factura, y Last-Modified es la fecha de la
+    comanda. Una petición condicional que coincide recibe
+    304 sin generar el PDF.
+    
     Args:
         order_id (int): ID de la comanda
         
     Returns:
-        Response: PDF de la factura
+        Response: PDF de la factura (o 304)
     """
     user = get_current_user()
     if not user:
@@ -140,6 +191,13 @@ def download_invoice(order_id):
         flash("Comanda no trobada o no tens permís per accedir-hi", 'error')
         return redirect(url_for('profile.profile', section='history'))
     
+    etag = make_etag('invoice', order.id, user.username, user.email, user.address,
+                     user.account_type, user.dni, user.nif)
+    last_modified = order.created_at if isinstance(order.created_at, datetime) else None
+    response = not_modified(etag, last_modified)
+    if response:
+        return response
+    
     # Generar PDF
     print(f"🔍 Intentando generar factura para orden {order_id}, usuario {user.id}")
     pdf_data = generate_invoice_pdf(order_id, user.id)
@@ -155,5 +213,5 @@ def download_invoice(order_id):
     response.headers['Content-Type'] = 'application/pdf'
     response.headers['Content-Disposition'] = f'attachment; filename=factura_{order_id}.pdf'
     
-    return response
+    return with_validators(response, etag, last_modified)
 
@@ -0,0 +1,298 @@
+"""
+Script per auditar els plans d'execució de les consultes dels serveis
+Executa EXPLAIN QUERY PLAN sobre cada sentència SQL de services/ i informa de
+les que encara recorren una taula sencera
+"""
+
+import ast
+import importlib
+import os
+import re
+import sqlite3
+import sys
+from typing import Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+# Permetre importar els mòduls del projecte en executar l'script directament
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from migrations.migrate_database import migrate
+
+SERVICES_DIR = os.path.join(PROJECT_ROOT, 'services')
+
+# Paraules amb què comença una sentència SQL escrita en un literal
+SQL_KEYWORDS = ('SELECT ', 'INSERT ', 'UPDATE ', 'DELETE ', 'WITH ')
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'docs', 'database_schema.sql')
+
+# Índex intern d'una taula virtual al pla ('SCAN ... VIRTUAL TABLE INDEX 32:M1')
+VIRTUAL_INDEX = re.compile(r'VIRTUAL TABLE INDEX (\d+):')
+# Índex recorregut ('SCAN Product USING COVERING INDEX idx_...')
+USING_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+class Statement(NamedTuple):
+    """Sentència SQL trobada al codi font"""
+    path: str
+    line: int
+    sql: str
+
+
+def _expand_product_filters() -> List[str]:
+    """Variants de la consulta filtrada del catàleg: cada ordenació amb cada combinació de filtres."""
+    from services.product_service import PAGE_QUERIES, PRICE_BANDS, _filter_conditions, _filtered_page_sql
+    sqls = []
+    for sort in PAGE_QUERIES:
+        for price_band in (None, 0, len(PRICE_BANDS) - 1):
+            for in_stock in (False, True):
+                for company_id in (None, 0, 1):
+                    conditions, _ = _filter_conditions(price_band, in_stock, company_id)
+                    if conditions:
+                        sqls.extend(_filtered_page_sql(sort, conditions, keyset) for keyset in (False, True))
+    return sqls
+
+
+# Funcions que construeixen SQL en temps d'execució (f-strings, concatenacions)
+# i com generar-ne les variants amb arguments representatius. Una consulta
+# dinàmica d'una funció que no és aquí no es pot auditar i es compta com a omesa
+TEMPLATE_EXPANDERS: Dict[Tuple[str, str], Callable[[], List[str]]] = {
+    (os.path.join('services', 'product_service.py'), '_filtered_page_sql'): _expand_product_filters,
+}
+
+
+def _sql_prefix(node: ast.AST) -> Optional[str]:
+    """Text literal amb què comença una expressió de text (f-string, concatenació o format())."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        first = node.values[0] if node.values else None
+        return first.value if isinstance(first, ast.Constant) else ''
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        return _sql_prefix(node.left)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'format':
+        return _sql_prefix(node.func.value)
+    return None
+
+
+def _is_dynamic_sql(node: ast.AST) -> bool:
+    """Indicar si un node construeix una sentència SQL en temps d'execució."""
+    if isinstance(node, ast.Constant):
+        return False
+    prefix = _sql_prefix(node)
+    return prefix is not None and prefix.lstrip().upper().startswith(SQL_KEYWORDS)
+
+
+def collect_statements(directory: str = SERVICES_DIR) -> Tuple[List[Statement], List[Statement]]:
+    """
+    Extreure les sentències SQL del codi font.
+
+    Inclou els literals passats a execute()/executemany() i els que es
+    guarden en taules de consultes (p. ex. una per cada ordenació). Les
+    sentències dinàmiques s'avaluen quan és possible: les constants de mòdul
+    (p. ex. f-strings que en combinen d'altres) s'importen, i les funcions de
+    TEMPLATE_EXPANDERS s'expandeixen amb arguments representatius. La resta
+    es retornen com a omeses perquè l'informe no doni per bo el que no ha vist.
+
+    Args:
+        directory (str): Carpeta amb els fitxers .py a analitzar
+
+    Returns:
+        Tuple[List[Statement], List[Statement]]: (sentències a auditar,
+            sentències dinàmiques que no s'han pogut expandir), en ordre de
+            fitxer i línia
+    """
+    statements, skipped = [], []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.py'):
+            continue
+        path = os.path.join(directory, filename)
+        relpath = os.path.relpath(path, PROJECT_ROOT)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        # Sentències dinàmiques (només les més externes) i els seus fragments
+        dynamic, fragments = [], set()
+        for node in ast.walk(tree):
+            if id(node) in fragments or not _is_dynamic_sql(node):
+                continue
+            dynamic.append(node)
+            fragments.update(id(part) for part in ast.walk(node) if part is not node)
+        fragments.update(
+            id(part)
+            for node in ast.walk(tree) if isinstance(node, ast.JoinedStr)
+            for part in node.values
+        )
+
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Constant)
+                    and isinstance(node.value, str)
+                    and id(node) not in fragments
+                    and node.value.lstrip().startswith(SQL_KEYWORDS)):
+                sql = " ".join(node.value.split())
+                statements.append(Statement(relpath, node.lineno, sql))
+
+        # Funció més interna de cada sentència dinàmica (ast.walk va de fora a dins)
+        owner = {}
+        for func in ast.walk(tree):
+            if isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                owner.update((id(node), func.name) for node in ast.walk(func))
+        # Constants de mòdul: el seu valor és el de l'atribut del mòdul importat
+        constants = {
+            id(assign.value): assign.targets[0].id
+            for assign in tree.body
+            if isinstance(assign, ast.Assign) and len(assign.targets) == 1
+            and isinstance(assign.targets[0], ast.Name)
+        }
+        module = None
+        expanded = set()
+        for node in dynamic:
+            name = constants.get(id(node))
+            expander = TEMPLATE_EXPANDERS.get((relpath, owner.get(id(node))))
+            if name is not None:
+                if module is None:
+                    module = importlib.import_module(relpath[:-3].replace(os.sep, '.'))
+                statements.append(Statement(relpath, node.lineno, " ".join(getattr(module, name).split())))
+            elif expander is not None:
+                if expander not in expanded:
+                    expanded.add(expander)
+                    statements.extend(Statement(relpath, node.lineno, " ".join(sql.split()))
+                                      for sql in dict.fromkeys(expander()))
+            else:
+                skipped.append(Statement(relpath, node.lineno, ast.unparse(node)))
+    statements.sort(key=lambda s: (s.path, s.line))
+    skipped.sort(key=lambda s: (s.path, s.line))
+    return statements, skipped
+
+
+def create_schema() -> sqlite3.Connection:
+    """
+    Crear una base de dades en memòria amb l'esquema i els índexs actuals.
+
+    Returns:
+        sqlite3.Connection: Connexió a la base de dades en memòria
+    """
+    conn = sqlite3.connect(':memory:')
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    migrate(conn)
+    return conn
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> List[str]:
+    """
+    Obtenir el pla d'execució d'una sentència.
+
+    Args:
+        conn (sqlite3.Connection): Connexió amb l'esquema creat
+        sql (str): Sentència amb paràmetres '?'
+
+    Returns:
+        List[str]: Línies de detall del pla
+    """
+    params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def is_full_scan(detail: str, partial_indexes: FrozenSet[str] = frozenset()) -> bool:
+    """
+    Indicar si una línia del pla recorre una taula o un índex sencer.
+
+    Args:
+        detail (str): Línia de detall d'EXPLAIN QUERY PLAN
+        partial_indexes (FrozenSet[str]): Índexs parcials de l'esquema
+
+    Un índex parcial (CREATE INDEX ... WHERE) només conté les files que
+    compleixen la seva condició: recórrer-lo no és recórrer la taula.
+
+    Les taules virtuals (FTS5, json_each) sempre apareixen com a SCAN: si el
+    mòdul ha acceptat alguna restricció (MATCH, l'argument de json_each)
+    l'índex intern és diferent de 0 i no recorren cap taula sencera. El SCAN
+    d'una subconsulta ('SCAN (subquery-1)') recorre les files que ja ha
+    produït; el pla de la subconsulta té les seves pròpies línies.
+
+    Returns:
+        bool: True si és un SCAN (no un SEARCH)
+    """
+    if not detail.startswith('SCAN ') or 'CONSTANT ROW' in detail or detail.startswith('SCAN (subquery-'):
+        return False
+    index = USING_INDEX.search(detail)
+    if index and index.group(1) in partial_indexes:
+        return False
+    virtual = VIRTUAL_INDEX.search(detail)
+    return virtual is None or virtual.group(1) == '0'
+
+
+def audit(conn: sqlite3.Connection, statements: List[Statement]) -> Tuple[List[Tuple[Statement, List[str]]], List[Tuple[Statement, str]]]:
+    """
+    Auditar una llista de sentències.
+
+    Args:
+        conn (sqlite3.Connection): Connexió amb l'esquema creat
+        statements (List[Statement]): Sentències a analitzar
+
+    Returns:
+        Tuple: (sentències amb SCAN i les seves línies, sentències amb error)
+    """
+    scans = []
+    errors = []
+    partial_indexes = frozenset(
+        name for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        if ' WHERE ' in sql.upper()
+    )
+    for statement in statements:
+        try:
+            plan = explain(conn, statement.sql)
+        except sqlite3.Error as e:
+            errors.append((statement, str(e)))
+            continue
+        scanned = [detail for detail in plan if is_full_scan(detail, partial_indexes)]
+        if scanned:
+            scans.append((statement, scanned))
+    return scans, errors
+
+
+def main() -> int:
+    """
+    Executar l'auditoria i mostrar l'informe.
+
+    Returns:
+        int: 0 si cap consulta filtrada fa un SCAN i no se n'ha omès cap, 1 altrament
+    """
+    statements, skipped = collect_statements()
+    conn = create_schema()
+    scans, errors = audit(conn, statements)
+    conn.close()
+
+    print(f"🔎 {len(statements)} sentències SQL analitzades a services/")
+    flagged = 0
+    for statement, details in scans:
+        # Una consulta sense WHERE (llistats, recomptes, agregats) recorre la
+        # taula principal per definició; qualsevol altre SCAN és un JOIN sense índex
+        expected = ' WHERE ' not in statement.sql.upper() and len(details) == 1
+        if not expected:
+            flagged += 1
+        icon = "ℹ️ " if expected else "⚠️ "
+        print(f"\n{icon} {statement.path}:{statement.line}")
+        print(f"   {statement.sql}")
+        for detail in details:
+            print(f"   → {detail}")
+
+    for statement, error in errors:
+        print(f"\n❌ {statement.path}:{statement.line}: {error}")
+        print(f"   {statement.sql}")
+
+    for statement in skipped:
+        print(f"\n⏭️  {statement.path}:{statement.line}: SQL dinàmic sense expandir (afegir-lo a TEMPLATE_EXPANDERS)")
+        print(f"   {statement.sql}")
+
+    print()
+    if flagged or errors or skipped:
+        print(f"❌ {flagged} consultes amb filtre fan SCAN, {len(errors)} errors, "
+              f"{len(skipped)} consultes dinàmiques sense auditar")
+        return 1
+    print("✅ Cap consulta amb filtre recorre una taula sencera")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
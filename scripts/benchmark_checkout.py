@@ -0,0 +1,114 @@
+"""
+Script per mesurar el rendiment del checkout amb compradors simultanis
+Crea una base de dades temporal amb un producte molt demandat i N compradors
+que fan la comanda alhora des de fils diferents, i comprova que no es ven
+més stock del que hi ha
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Permetre importar els mòduls del projecte en executar l'script directament
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from migrations.migrate_database import migrate
+from services.order_service import OrderService
+from utils.database import close_all_pools
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'docs', 'database_schema.sql')
+HOT_PRODUCT_ID = 1
+
+
+def create_database(db_path: str, buyers: int, stock: int):
+    """
+    Crear la base de dades del benchmark.
+
+    Args:
+        db_path (str): Ruta del fitxer
+        buyers (int): Nombre de compradors (un usuari per fil)
+        stock (int): Unitats del producte demandat
+    """
+    conn = sqlite3.connect(db_path)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    migrate(conn)
+    conn.execute("INSERT INTO Product (id, name, price, price_cents, stock) VALUES (?, 'Producte demandat', 10.00, 1000, ?)",
+                 (HOT_PRODUCT_ID, stock))
+    conn.executemany("INSERT INTO User (username, password_hash, email) VALUES (?, 'hash', ?)",
+                     [(f"bench{i}", f"bench{i}@techshop.local") for i in range(buyers)])
+    conn.commit()
+    conn.close()
+
+
+def benchmark_checkout(buyers: int = 200, stock: int = 100, orders_per_buyer: int = 1, verbose: bool = True) -> bool:
+    """
+    Executar el benchmark i comprovar que l'stock final és coherent.
+
+    Args:
+        buyers (int): Fils que compren alhora
+        stock (int): Unitats inicials del producte
+        orders_per_buyer (int): Comandes d'una unitat que fa cada comprador
+        verbose (bool): Mostrar el resultat per pantalla
+
+    Returns:
+        bool: True si no s'ha venut més stock del que hi havia
+    """
+    workdir = tempfile.mkdtemp(prefix='techshop-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    try:
+        create_database(db_path, buyers, stock)
+        service = OrderService(db_path)
+        results = {'ok': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(buyers + 1)
+
+        def buyer(user_id: int):
+            start.wait()
+            for _ in range(orders_per_buyer):
+                success, message, _ = service.create_order({HOT_PRODUCT_ID: 1}, user_id)
+                key = 'ok' if success else ('rejected' if 'Stock insuficient' in message else 'errors')
+                with lock:
+                    results[key] += 1
+
+        threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in range(1, buyers + 1)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        conn = sqlite3.connect(db_path)
+        final_stock = conn.execute("SELECT stock FROM Product WHERE id = ?", (HOT_PRODUCT_ID,)).fetchone()[0]
+        sold = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM OrderItem").fetchone()[0]
+        conn.close()
+    finally:
+        close_all_pools()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    attempts = buyers * orders_per_buyer
+    consistent = sold == results['ok'] == stock - final_stock and final_stock >= 0
+    if verbose:
+        print(f"🛒 {buyers} compradors, {attempts} comandes, stock inicial {stock}")
+        print(f"⏱️  {elapsed:.2f} s ({attempts / elapsed:.0f} comandes/s)")
+        print(f"   Acceptades: {results['ok']}, sense stock: {results['rejected']}, errors: {results['errors']}")
+        print(f"   Stock final: {final_stock}, unitats venudes: {sold}")
+        print("✅ No s'ha venut més stock del disponible" if consistent else "❌ L'stock no quadra amb les comandes")
+    return consistent and results['errors'] == 0
+
+
+if __name__ == '__main__':
+    success = benchmark_checkout(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+    )
+    sys.exit(0 if success else 1)
@@ -0,0 +1,56 @@
+"""
+Script per purgar els carretons anònims caducats i les reserves d'estoc caducades
+L'aplicació ja els purga com a molt un cop cada CART_PURGE_INTERVAL segons per
+procés; aquest script permet fer-ho des de cron en instal·lacions amb poc trànsit
+"""
+
+import os
+import sqlite3
+import sys
+
+# Permetre importar els mòduls del projecte en executar l'script directament
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from services.cart_service import CART_TTL, CartService
+from services.reservation_service import ReservationService
+
+
+def purge_carts(db_path: str = 'techshop.db', ttl: int = CART_TTL, verbose: bool = True) -> bool:
+    """
+    Eliminar els carretons anònims sense activitat des de fa més de `ttl` segons
+    i les reserves d'estoc caducades.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        ttl (int): Segons d'inactivitat
+        verbose (bool): Mostrar el resultat per pantalla
+
+    Returns:
+        bool: True si la purga s'ha fet
+    """
+    if not os.path.exists(db_path):
+        if verbose:
+            print(f"❌ No s'ha trobat {db_path}")
+        return False
+
+    try:
+        purged = CartService(db_path).purge_expired_carts(ttl)
+        released = ReservationService(db_path).release_expired()
+    except sqlite3.Error as e:
+        if verbose:
+            print(f"❌ Error purgant els carretons: {e}")
+        return False
+
+    if verbose:
+        print(f"✅ {purged} carretó(ns) anònim(s) i {released} reserva(es) caducada(es) eliminat(s) de {db_path}")
+    return True
+
+
+if __name__ == '__main__':
+    success = purge_carts(
+        sys.argv[1] if len(sys.argv) > 1 else 'techshop.db',
+        int(sys.argv[2]) if len(sys.argv) > 2 else CART_TTL,
+    )
+    sys.exit(0 if success else 1)
@@ -0,0 +1,57 @@
+"""
+Script per reconstruir l'índex d'imatges dels productes
+Recorre static/img/products/<id> i substitueix el contingut de la taula
+ProductImage (p. ex. després de copiar imatges a mà o de restaurar una còpia)
+"""
+
+import os
+import sqlite3
+import sys
+
+# Permetre importar els mòduls del projecte en executar l'script directament
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.image_manifest import get_image_manifest
+
+DEFAULT_IMAGES_ROOT = os.path.join(PROJECT_ROOT, 'static', 'img', 'products')
+
+
+def rebuild_image_manifest(db_path: str = 'techshop.db', images_root: str = DEFAULT_IMAGES_ROOT,
+                           verbose: bool = True) -> bool:
+    """
+    Reconstruir l'índex d'imatges a partir dels fitxers.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        images_root (str): Directori static/img/products
+        verbose (bool): Mostrar el resultat per pantalla
+
+    Returns:
+        bool: True si l'índex s'ha reconstruït
+    """
+    if not os.path.exists(db_path):
+        if verbose:
+            print(f"❌ No s'ha trobat {db_path}")
+        return False
+
+    manifest = get_image_manifest(db_path, images_root)
+    try:
+        indexed = manifest.rebuild()
+    except sqlite3.Error as e:
+        if verbose:
+            print(f"❌ Error reconstruint l'índex d'imatges: {e}")
+        return False
+
+    if verbose:
+        print(f"✅ {indexed} imatges indexades a {db_path}")
+    return True
+
+
+if __name__ == '__main__':
+    success = rebuild_image_manifest(
+        sys.argv[1] if len(sys.argv) > 1 else 'techshop.db',
+        sys.argv[2] if len(sys.argv) > 2 else DEFAULT_IMAGES_ROOT,
+    )
+    sys.exit(0 if success else 1)
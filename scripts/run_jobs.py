@@ -0,0 +1,64 @@
+"""
+Script per executar la cua de tasques en segon pla en un procés a part
+L'aplicació ja les executa amb un fil propi; aquest script serveix per
+desplegaments amb JOB_WORKER=0 o per buidar la cua manualment (--once)
+"""
+
+import os
+import sqlite3
+import sys
+import time
+
+# Permetre importar els mòduls del projecte en executar l'script directament
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from services.job_queue import JOB_POLL_INTERVAL, JobQueue
+import services.order_service  # noqa: F401  Registra la tasca de les comandes
+
+
+def run_jobs(db_path: str = 'techshop.db', once: bool = False, verbose: bool = True) -> bool:
+    """
+    Executar les tasques pendents.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        once (bool): Buidar la cua i acabar (si no, continua esperant tasques noves)
+        verbose (bool): Mostrar el resultat per pantalla
+
+    Returns:
+        bool: True si s'ha pogut accedir a la cua
+    """
+    if not os.path.exists(db_path):
+        if verbose:
+            print(f"❌ No s'ha trobat {db_path}")
+        return False
+
+    queue = JobQueue(db_path)
+    try:
+        while True:
+            executed = queue.run_pending()
+            if verbose and executed:
+                print(f"⚙️  {executed} tasca(es) executada(es)")
+            if once:
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    except sqlite3.Error as e:
+        if verbose:
+            print(f"❌ Error executant les tasques: {e}")
+        return False
+
+    if verbose:
+        counts = queue.count_by_status()
+        summary = ", ".join(f"{status}={count}" for status, count in sorted(counts.items()))
+        print(f"✅ Estat de la cua: {summary or 'buida'}")
+    return True
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--once']
+    success = run_jobs(args[0] if args else 'techshop.db', once='--once' in sys.argv[1:])
+    sys.exit(0 if success else 1)
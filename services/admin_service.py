@@ -9,9 +9,12 @@ import string
 from decimal import Decimal
 from typing import Dict, List, Tuple, Optional
 from models import Product, User, Order, OrderItem
-from datetime import datetime
+from models.mapper import fetch_all, fetch_one
 from werkzeug.security import generate_password_hash
 from utils.validators import validar_dni_nie, validar_cif_nif
+from utils.cache import get_catalog_cache, get_entity_cache
+from utils.database import get_connection
+from utils.money import from_cents, to_cents
 
 
 class AdminService:
@@ -19,6 +22,8 @@ class AdminService:
     
     def __init__(self, db_path: str = "techshop.db"):
         self.db_path = db_path
+        self.cache = get_catalog_cache(db_path)
+        self.users = get_entity_cache(db_path, 'users', ('user',))
     
     # ========== GESTIÓ DE PRODUCTES ==========
     
@@ -30,20 +35,10 @@ class AdminService:
             List[Product]: Llista de tots els productes
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT id, name, price, stock FROM Product ORDER BY id")
-                results = cursor.fetchall()
-                
-                products = []
-                for row in results:
-                    products.append(Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3]
-                    ))
-                return products
+                cursor.execute("SELECT id, name, price_cents, stock FROM Product ORDER BY id")
+                return fetch_all(cursor, Product)
         except sqlite3.Error:
             return []
     
@@ -58,18 +53,10 @@ class AdminService:
             Product o None: El producte si existeix, None altrament
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT id, name, price, stock FROM Product WHERE id = ?", (product_id,))
-                result = cursor.fetchone()
-                
-                if result:
-                    return Product(
-                        id=result[0],
-                        name=result[1],
-                        price=Decimal(str(result[2])),
-                        stock=result[3]
-                    )
+                cursor.execute("SELECT id, name, price_cents, stock FROM Product WHERE id = ?", (product_id,))
+                return fetch_one(cursor, Product)
         except sqlite3.Error:
             pass
         
@@ -90,21 +77,27 @@ class AdminService:
         if not name or len(name.strip()) == 0:
             return False, "El nom del producte és obligatori", None
         
-        if price < 0:
+        try:
+            price_cents = to_cents(price)
+        except ValueError:
+            return False, "El preu no és vàlid", None
+        
+        if price_cents < 0:
             return False, "El preu no pot ser negatiu", None
         
         if stock < 0:
             return False, "El stock no pot ser negatiu", None
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO Product (name, price, stock) VALUES (?, ?, ?)",
-                    (name.strip(), float(price), stock)
-                )
-                product_id = cursor.lastrowid
-                conn.commit()
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "INSERT INTO Product (name, price, price_cents, stock) VALUES (?, ?, ?, ?)",
+                        (name.strip(), price_cents / 100, price_cents, stock)
+                    )
+                    product_id = cursor.lastrowid
+                self.cache.invalidate_products((product_id,))
                 return True, f"Producte creat correctament", product_id
         except sqlite3.Error as e:
             return False, f"Error creant el producte: {str(e)}", None
@@ -125,22 +118,28 @@ class AdminService:
         if not name or len(name.strip()) == 0:
             return False, "El nom del producte és obligatori"
         
-        if price < 0:
+        try:
+            price_cents = to_cents(price)
+        except ValueError:
+            return False, "El preu no és vàlid"
+        
+        if price_cents < 0:
             return False, "El preu no pot ser negatiu"
         
         if stock < 0:
             return False, "El stock no pot ser negatiu"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE Product SET name = ?, price = ?, stock = ? WHERE id = ?",
-                    (name.strip(), float(price), stock, product_id)
-                )
-                if cursor.rowcount == 0:
-                    return False, "Producte no trobat"
-                conn.commit()
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "UPDATE Product SET name = ?, price = ?, price_cents = ?, stock = ? WHERE id = ?",
+                        (name.strip(), price_cents / 100, price_cents, stock, product_id)
+                    )
+                    if cursor.rowcount == 0:
+                        return False, "Producte no trobat"
+                self.cache.invalidate_products((product_id,))
                 return True, "Producte actualitzat correctament"
         except sqlite3.Error as e:
             return False, f"Error actualitzant el producte: {str(e)}"
@@ -156,22 +155,23 @@ class AdminService:
             Tuple[bool, str]: (èxit, missatge)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                # Verificar si hi ha comandes amb aquest producte
-                cursor.execute(
-                    "SELECT COUNT(*) FROM OrderItem WHERE product_id = ?",
-                    (product_id,)
-                )
-                count = cursor.fetchone()[0]
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    # Verificar si hi ha comandes amb aquest producte
+                    cursor.execute(
+                        "SELECT COUNT(*) FROM OrderItem WHERE product_id = ?",
+                        (product_id,)
+                    )
+                    count = cursor.fetchone()[0]
                 
-                if count > 0:
-                    return False, f"No es pot eliminar el producte perquè està associat a {count} comanda(s)"
+                    if count > 0:
+                        return False, f"No es pot eliminar el producte perquè està associat a {count} comanda(s)"
                 
-                cursor.execute("DELETE FROM Product WHERE id = ?", (product_id,))
-                if cursor.rowcount == 0:
-                    return False, "Producte no trobat"
-                conn.commit()
+                    cursor.execute("DELETE FROM Product WHERE id = ?", (product_id,))
+                    if cursor.rowcount == 0:
+                        return False, "Producte no trobat"
+                self.cache.invalidate_products((product_id,))
                 return True, "Producte eliminat correctament"
         except sqlite3.Error as e:
             return False, f"Error eliminant el producte: {str(e)}"
@@ -186,45 +186,12 @@ class AdminService:
             List[User]: Llista de tots els usuaris
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                # Intentar obtener con las nuevas columnas
-                try:
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, created_at FROM User ORDER BY id"
-                    )
-                    results = cursor.fetchall()
-                    
-                    users = []
-                    for row in results:
-                        users.append(User(
-                            id=row[0],
-                            username=row[1],
-                            email=row[2] if row[2] else "",
-                            address=row[3] if row[3] else "",
-                            role=row[4] if row[4] else "common",
-                            account_type=row[5] if row[5] else "user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(row[6]) if row[6] else datetime.now()
-                        ))
-                    return users
-                except sqlite3.OperationalError:
-                    # Esquema antiguo
-                    cursor.execute("SELECT id, username, email, address, created_at FROM User ORDER BY id")
-                    results = cursor.fetchall()
-                    users = []
-                    for row in results:
-                        users.append(User(
-                            id=row[0],
-                            username=row[1],
-                            email=row[2] if row[2] else "",
-                            address=row[3] if row[3] else "",
-                            role="common",
-                            account_type="user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(row[4]) if len(row) > 4 and row[4] else datetime.now()
-                        ))
-                    return users
+                cursor.execute(
+                    "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User ORDER BY id"
+                )
+                return fetch_all(cursor, User)
         except sqlite3.Error:
             return []
     
@@ -239,42 +206,13 @@ class AdminService:
             User o None: L'usuari si existeix, None altrament
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                try:
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, created_at FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if result and len(result) >= 7:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role=result[4] if result[4] else "common",
-                            account_type=result[5] if result[5] else "user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[6]) if result[6] else datetime.now()
-                        )
-                except sqlite3.OperationalError:
-                    cursor.execute(
-                        "SELECT id, username, email, address, created_at FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if result:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role="common",
-                            account_type="user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[4]) if len(result) > 4 and result[4] else datetime.now()
-                        )
+                cursor.execute(
+                    "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User WHERE id = ?",
+                    (user_id,)
+                )
+                return fetch_one(cursor, User)
         except sqlite3.Error:
             pass
         
@@ -306,7 +244,7 @@ class AdminService:
             return False, "El rol ha de ser 'common' o 'admin'"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 # Verificar si el username ya existe en otro usuario
                 cursor.execute(
@@ -316,30 +254,16 @@ class AdminService:
                 if cursor.fetchone():
                     return False, "Aquest nom d'usuari ja està en ús"
                 
-                # Obtener el account_type actual del usuario (no se modifica)
-                try:
-                    cursor.execute("SELECT account_type FROM User WHERE id = ?", (user_id,))
-                    result = cursor.fetchone()
-                    current_account_type = result[0] if result and result[0] else 'user'
-                except (sqlite3.OperationalError, IndexError):
-                    current_account_type = 'user'
-                
-                # Intentar actualizar con las nuevas columnas (sin modificar account_type)
-                try:
-                    cursor.execute(
-                        "UPDATE User SET username = ?, email = ?, address = ?, role = ? WHERE id = ?",
-                        (username.strip(), email.strip(), address.strip(), role, user_id)
-                    )
-                except sqlite3.OperationalError:
-                    # Si las columnas no existen, actualizar sin ellas
-                    cursor.execute(
-                        "UPDATE User SET username = ?, email = ?, address = ? WHERE id = ?",
-                        (username.strip(), email.strip(), address.strip(), user_id)
-                    )
+                # Actualizar sin modificar account_type
+                cursor.execute(
+                    "UPDATE User SET username = ?, email = ?, address = ?, role = ? WHERE id = ?",
+                    (username.strip(), email.strip(), address.strip(), role, user_id)
+                )
                 
                 if cursor.rowcount == 0:
                     return False, "Usuari no trobat"
                 conn.commit()
+                self.users.delete(int(user_id))
                 return True, "Usuari actualitzat correctament"
         except sqlite3.Error as e:
             return False, f"Error actualitzant l'usuari: {str(e)}"
@@ -383,7 +307,7 @@ class AdminService:
                 return False, "DNI/NIE no vàlid. Format esperat: 8 números + lletra (DNI) o X/Y/Z + 7 números + lletra (NIE)", None, None
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Verificar si el username ya existe
@@ -402,35 +326,18 @@ class AdminService:
                 password = ''.join(secrets.choice(alphabet) for _ in range(12))
                 password_hash = generate_password_hash(password, method="pbkdf2:sha256")
                 
-                # Intentar insertar con todas las columnas disponibles
-                try:
-                    if account_type == 'company':
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, nif, created_at) "
-                            "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip(), role, account_type, nif.strip())
-                        )
-                    else:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, created_at) "
-                            "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip(), role, account_type, dni.strip())
-                        )
-                except sqlite3.OperationalError:
-                    # Si las columnas DNI/NIF no existen, insertar sin ellas
-                    try:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
-                            "VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip(), role, account_type)
-                        )
-                    except sqlite3.OperationalError:
-                        # Si las columnas role/account_type tampoco existen
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, created_at) "
-                            "VALUES (?, ?, ?, ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip())
-                        )
+                if account_type == 'company':
+                    cursor.execute(
+                        "INSERT INTO User (username, password_hash, email, address, role, account_type, nif, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                        (username.strip(), password_hash, email.strip(), address.strip(), role, account_type, nif.strip())
+                    )
+                else:
+                    cursor.execute(
+                        "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                        (username.strip(), password_hash, email.strip(), address.strip(), role, account_type, dni.strip())
+                    )
                 
                 user_id = cursor.lastrowid
                 conn.commit()
@@ -449,7 +356,7 @@ class AdminService:
             Tuple[bool, str, Optional[str]]: (èxit, missatge, nova_contrasenya)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Verificar que l'usuari existeix
@@ -488,7 +395,7 @@ class AdminService:
             Tuple[bool, str]: (èxit, missatge)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 # Verificar si hi ha comandes associades
                 cursor.execute('SELECT COUNT(*) FROM "Order" WHERE user_id = ?', (user_id,))
@@ -501,6 +408,7 @@ class AdminService:
                 if cursor.rowcount == 0:
                     return False, "Usuari no trobat"
                 conn.commit()
+                self.users.delete(int(user_id))
                 return True, "Usuari eliminat correctament"
         except sqlite3.Error as e:
             return False, f"Error eliminant l'usuari: {str(e)}"
@@ -515,20 +423,10 @@ class AdminService:
             List[Order]: Llista de totes les comandes
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT id, total, created_at, user_id FROM "Order" ORDER BY created_at DESC')
-                results = cursor.fetchall()
-                
-                orders = []
-                for row in results:
-                    orders.append(Order(
-                        id=row[0],
-                        total=Decimal(str(row[1])),
-                        created_at=datetime.fromisoformat(row[2]) if row[2] else datetime.now(),
-                        user_id=row[3]
-                    ))
-                return orders
+                cursor.execute('SELECT id, total_cents, created_at, user_id FROM "Order" ORDER BY created_at DESC')
+                return fetch_all(cursor, Order)
         except sqlite3.Error:
             return []
     
@@ -543,23 +441,13 @@ class AdminService:
             List[OrderItem]: Llista d'items de la comanda
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "SELECT id, order_id, product_id, quantity FROM OrderItem WHERE order_id = ?",
                     (order_id,)
                 )
-                results = cursor.fetchall()
-                
-                items = []
-                for row in results:
-                    items.append(OrderItem(
-                        id=row[0],
-                        order_id=row[1],
-                        product_id=row[2],
-                        quantity=row[3]
-                    ))
-                return items
+                return fetch_all(cursor, OrderItem)
         except sqlite3.Error:
             return []
     
@@ -574,7 +462,7 @@ class AdminService:
             Tuple[bool, str]: (èxit, missatge)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 # Eliminar items primero
                 cursor.execute("DELETE FROM OrderItem WHERE order_id = ?", (order_id,))
@@ -595,7 +483,7 @@ class AdminService:
             Tuple[int, int, int, Decimal]: (total_products, total_users, total_orders, total_revenue)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT COUNT(*) FROM Product")
                 total_products = cursor.fetchone()[0]
@@ -606,8 +494,8 @@ class AdminService:
                 cursor.execute('SELECT COUNT(*) FROM "Order"')
                 total_orders = cursor.fetchone()[0]
                 
-                cursor.execute('SELECT SUM(total) FROM "Order"')
-                total_revenue = Decimal(str(cursor.fetchone()[0] or 0))
+                cursor.execute('SELECT SUM(total_cents) FROM "Order"')
+                total_revenue = from_cents(cursor.fetchone()[0])
                 
                 return total_products, total_users, total_orders, total_revenue
         except sqlite3.Error:
@@ -0,0 +1,144 @@
+"""
+Càlcul de preus del carretó
+Resol totes les línies d'un carretó amb una sola consulta (WHERE id IN ...) i
+en retorna una vista amb preus, stock i totals que comparteixen el checkout,
+el total del carretó, la validació de stock i la creació de comandes.
+L'stock disponible de cada línia descompta les reserves vigents dels altres
+carretons (services/reservation_service.py)
+"""
+
+import json
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from models import Product
+from services.reservation_service import HELD_BY_OTHERS_SQL
+from utils.money import from_cents
+
+# Productes del carretó i les seves unitats disponibles per a aquest carretó
+PRICED_LINES_SQL = f"""
+    SELECT id, name, price_cents, stock, stock - {HELD_BY_OTHERS_SQL}
+    FROM Product WHERE id IN (SELECT value FROM json_each(?))
+"""
+
+
+class CartLine:
+    """Línia del carretó amb el producte actual i el seu import"""
+
+    __slots__ = ('product', 'quantity', 'available')
+
+    def __init__(self, product: Product, quantity: int, available: Optional[int] = None):
+        self.product = product
+        self.quantity = quantity
+        # Stock menys les reserves vigents dels altres carretons
+        self.available = product.stock if available is None else max(available, 0)
+
+    @property
+    def line_total_cents(self) -> int:
+        """Import de la línia en cèntims (preu actual * quantitat)."""
+        return (self.product.price_cents or 0) * self.quantity
+
+    @property
+    def line_total(self) -> Decimal:
+        """Import de la línia en euros."""
+        return from_cents(self.line_total_cents)
+
+    @property
+    def in_stock(self) -> bool:
+        """Hi ha prou unitats lliures (no retingudes per altres carretons) per a la línia."""
+        return self.available >= self.quantity
+
+    def __repr__(self):
+        return f"CartLine(product_id={self.product.id}, quantity={self.quantity})"
+
+
+class PricedCart:
+    """Carretó amb preus: línies en l'ordre del carretó, IDs inexistents i totals"""
+
+    __slots__ = ('lines', 'missing')
+
+    def __init__(self, lines: List[CartLine], missing: List[int]):
+        self.lines = lines
+        self.missing = missing
+
+    @property
+    def subtotal_cents(self) -> int:
+        """Suma de les línies en cèntims."""
+        return sum(line.line_total_cents for line in self.lines)
+
+    @property
+    def total_cents(self) -> int:
+        """Total a pagar en cèntims (igual al subtotal: no hi ha enviament ni descomptes)."""
+        return self.subtotal_cents
+
+    @property
+    def subtotal(self) -> Decimal:
+        return from_cents(self.subtotal_cents)
+
+    @property
+    def total(self) -> Decimal:
+        return from_cents(self.total_cents)
+
+    @property
+    def all_in_stock(self) -> bool:
+        """Totes les línies tenen prou stock."""
+        return all(line.in_stock for line in self.lines)
+
+    @property
+    def shortages(self) -> List[CartLine]:
+        """Línies amb més quantitat que stock disponible."""
+        return [line for line in self.lines if not line.in_stock]
+
+    def get_line(self, product_id: int) -> Optional[CartLine]:
+        """
+        Obtenir la línia d'un producte.
+
+        Args:
+            product_id (int): ID del producte
+
+        Returns:
+            CartLine: Línia del producte o None si no hi és (o no existeix)
+        """
+        for line in self.lines:
+            if line.product.id == product_id:
+                return line
+        return None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        return f"PricedCart(lines={len(self.lines)}, total_cents={self.total_cents}, missing={self.missing})"
+
+
+def price_cart(cursor, cart: Dict[int, int], cart_id: Optional[int] = None) -> PricedCart:
+    """
+    Resoldre els preus i l'stock de totes les línies d'un carretó amb una consulta.
+
+    Es pot cridar dins d'una transacció oberta (la creació de comandes
+    calcula el total amb el mateix cursor que escriu la comanda).
+
+    Args:
+        cursor: Cursor de la base de dades
+        cart (Dict[int, int]): Carretó {product_id: quantity} (les claus poden
+            arribar com a text si la sessió s'ha serialitzat en JSON)
+        cart_id (int, optional): Carretó guardat les reserves del qual no es
+            descompten (None = es descompten totes les reserves vigents)
+
+    Returns:
+        PricedCart: Línies dels productes existents i IDs que ja no existeixen
+    """
+    quantities: Dict[int, int] = {}
+    for product_id, quantity in (cart or {}).items():
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + int(quantity)
+    if not quantities:
+        return PricedCart([], [])
+
+    cursor.execute(PRICED_LINES_SQL, (int(time.time()), cart_id, json.dumps(list(quantities))))
+    by_id = {row[0]: row for row in cursor.fetchall()}
+
+    lines = [CartLine(Product.from_row(by_id[product_id]), quantity, by_id[product_id][4])
+             for product_id, quantity in quantities.items() if product_id in by_id]
+    missing = [product_id for product_id in quantities if product_id not in by_id]
+    return PricedCart(lines, missing)
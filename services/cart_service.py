@@ -1,169 +1,474 @@
 """
 Servei de gestió del carretó de compres
 Implementa la lògica de negoci per gestionar el carretó sense barrejar amb presentació o accés a dades
+
+Els carretons es guarden al servidor (taules Cart i CartItem, migració v12):
+la galeta de sessió només porta el token d'un carretó anònim, i el d'un
+usuari identificat es troba pel seu user_id des de qualsevol dispositiu.
+Cada línia reté les seves unitats amb una reserva temporal (ReservationService)
 """
 
+import os
+import secrets
 import sqlite3
+import threading
+import time
 from decimal import Decimal
-from typing import Dict, List, Tuple, Any
-from models import Product
+from typing import Any, Dict, Optional, Tuple
+from services.cart_pricing import PricedCart, price_cart
+from services.reservation_service import ReservationService
+from utils.database import get_connection
+
+# Màxim d'unitats d'un mateix producte al carretó
+MAX_UNITS_PER_PRODUCT = 5
+
+# Segons d'inactivitat després dels quals es purga un carretó anònim
+CART_TTL = int(os.environ.get("CART_TTL", str(30 * 24 * 3600)))
+# Segons mínims entre dues purgues fetes per un mateix procés
+CART_PURGE_INTERVAL = int(os.environ.get("CART_PURGE_INTERVAL", "3600"))
+
+# Clau de la sessió amb el token del carretó anònim
+CART_TOKEN_KEY = 'cart_token'
+# Clau on les versions anteriors guardaven el carretó sencer a la galeta
+LEGACY_CART_KEY = 'cart'
+
+CART_BY_USER_SQL = "SELECT id FROM Cart WHERE user_id = ?"
+CART_BY_TOKEN_SQL = "SELECT id FROM Cart WHERE token = ?"
+CART_ITEMS_SQL = "SELECT product_id, quantity FROM CartItem WHERE cart_id = ?"
+CART_ITEM_SQL = "SELECT quantity FROM CartItem WHERE cart_id = ? AND product_id = ?"
+UPSERT_ITEM_SQL = (
+    "INSERT INTO CartItem (cart_id, product_id, quantity) VALUES (?, ?, ?) "
+    "ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = excluded.quantity"
+)
+DELETE_ITEM_SQL = "DELETE FROM CartItem WHERE cart_id = ? AND product_id = ?"
+TOUCH_CART_SQL = "UPDATE Cart SET updated_at = ? WHERE id = ?"
+# El trigger trg_cart_delete n'elimina les línies
+PURGE_CARTS_SQL = "DELETE FROM Cart WHERE user_id IS NULL AND updated_at < ?"
+
+_next_purge: Dict[str, float] = {}
+_purge_lock = threading.Lock()
 
 
 class CartService:
     """Servei per gestionar el carretó de compres"""
-    
+
     def __init__(self, db_path: str = "techshop.db"):
         self.db_path = db_path
-    
-    def _get_cart(self, session: Any) -> Dict[int, int]:
+        self.reservations = ReservationService(db_path)
+
+    def _find_cart_id(self, cursor: sqlite3.Cursor, session: Any,
+                      create: bool = False) -> Tuple[Optional[int], Dict[str, Any]]:
+        """
+        Obtenir l'ID del carretó de la sessió (i crear-lo si cal).
+
+        Si la sessió té un usuari identificat i encara conserva el token d'un
+        carretó anònim (acaba d'iniciar sessió), les línies anònimes s'afegeixen
+        al carretó de l'usuari. Un carretó antic guardat a la galeta es passa
+        al servidor el primer cop que es llegeix.
+
+        La sessió no es modifica aquí: la transacció encara es pot desfer. Els
+        canvis es retornen i el cridador els aplica amb _update_session()
+        després del commit.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor de la base de dades
+            session: Sessió de Flask
+            create (bool): Crear el carretó si no existeix
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: (ID del carretó o None si no en té i no
+            s'ha de crear, canvis de la sessió {clau: valor o None per esborrar-la})
+        """
+        now = int(time.time())
+        user_id = session.get('user_id')
+        token = session.get(CART_TOKEN_KEY)
+        legacy = session.get(LEGACY_CART_KEY) or {}
+        create = create or bool(legacy)
+        changes: Dict[str, Any] = {}
+
+        cart_id = None
+        if user_id:
+            row = cursor.execute(CART_BY_USER_SQL, (user_id,)).fetchone()
+            anonymous = cursor.execute(CART_BY_TOKEN_SQL, (token,)).fetchone() if token else None
+            if row is None and (create or anonymous):
+                cursor.execute("INSERT INTO Cart (user_id, updated_at) VALUES (?, ?)", (user_id, now))
+                row = (cursor.lastrowid,)
+            if anonymous:
+                self._merge_into(cursor, anonymous[0], row[0])
+            if token:
+                changes[CART_TOKEN_KEY] = None
+            cart_id = row[0] if row else None
+        else:
+            row = cursor.execute(CART_BY_TOKEN_SQL, (token,)).fetchone() if token else None
+            if row is None and create:
+                token = secrets.token_urlsafe(32)
+                cursor.execute("INSERT INTO Cart (token, updated_at) VALUES (?, ?)", (token, now))
+                row = (cursor.lastrowid,)
+                changes[CART_TOKEN_KEY] = token
+            cart_id = row[0] if row else None
+
+        if legacy:
+            merged = self._write_quantities(cursor, cart_id, {int(product_id): quantity
+                                                              for product_id, quantity in legacy.items()}, merge=True)
+            self._reserve_best_effort(cursor, cart_id, merged)
+        if LEGACY_CART_KEY in session:
+            changes[LEGACY_CART_KEY] = None
+        return cart_id, changes
+
+    def _update_session(self, session: Any, changes: Dict[str, Any]):
+        """Aplicar a la sessió els canvis de _find_cart_id() un cop confirmada la transacció."""
+        for key, value in changes.items():
+            if value is None:
+                if key in session:
+                    del session[key]
+            else:
+                session[key] = value
+
+    def _merge_into(self, cursor: sqlite3.Cursor, source_id: int, target_id: int):
+        """Afegir les línies d'un carretó a un altre i eliminar l'origen (i les seves reserves)."""
+        items = dict(cursor.execute(CART_ITEMS_SQL, (source_id,)).fetchall())
+        cursor.execute("DELETE FROM Cart WHERE id = ?", (source_id,))
+        merged = self._write_quantities(cursor, target_id, items, merge=True)
+        self._reserve_best_effort(cursor, target_id, merged)
+
+    def _write_quantities(self, cursor: sqlite3.Cursor, cart_id: int, quantities: Dict[int, int],
+                          merge: bool = False) -> Dict[int, int]:
+        """
+        Escriure diverses línies d'un carretó amb una sola sentència per tipus.
+
+        Les línies eliminades alliberen la seva reserva; les reserves de les
+        altres línies les gestiona qui crida.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor dins de la transacció
+            cart_id (int): ID del carretó
+            quantities (Dict[int, int]): {product_id: quantitat}; 0 elimina la línia
+            merge (bool): Sumar a la quantitat actual (amb el límit per producte)
+
+        Returns:
+            Dict[int, int]: Quantitats escrites
+        """
+        if merge and quantities:
+            current = dict(cursor.execute(CART_ITEMS_SQL, (cart_id,)).fetchall())
+            quantities = {
+                product_id: min(current.get(product_id, 0) + quantity, MAX_UNITS_PER_PRODUCT)
+                for product_id, quantity in quantities.items()
+            }
+        cursor.executemany(UPSERT_ITEM_SQL, [
+            (cart_id, product_id, quantity) for product_id, quantity in quantities.items() if quantity > 0
+        ])
+        removed = [product_id for product_id, quantity in quantities.items() if quantity <= 0]
+        cursor.executemany(DELETE_ITEM_SQL, [(cart_id, product_id) for product_id in removed])
+        self.reservations.release(cursor, cart_id, removed)
+        cursor.execute(TOUCH_CART_SQL, (int(time.time()), cart_id))
+        return quantities
+
+    def _reserve_best_effort(self, cursor: sqlite3.Cursor, cart_id: int, quantities: Dict[int, int]):
+        """Reservar les línies d'un carretó fusionat; les que no hi caben es validen al checkout."""
+        for product_id, quantity in quantities.items():
+            if quantity > 0:
+                self.reservations.reserve(cursor, cart_id, product_id, quantity)
+
+    def _stock_message(self, cursor: sqlite3.Cursor, cart_id: int, product_id: int, quantity: int) -> str:
+        """Missatge d'error d'una reserva que no s'ha pogut fer."""
+        available = self.reservations.get_available([product_id], cursor, exclude_cart_id=cart_id)
+        if product_id not in available:
+            return "Producte no trobat"
+        return f"Stock insuficient. Disponible: {available[product_id]}, Sol·licitat: {quantity}"
+
+    def _get_cart(self, session: Any) -> Tuple[Optional[int], Dict[int, int]]:
         """
-        Obtenir el carretó de la sessió. Si no existeix, crear-lo buit.
-        
+        Obtenir el carretó de la sessió (buit si encara no en té).
+
         Args:
             session: Sessió de Flask
-            
+
         Returns:
-            Dict[int, int]: Carretó {product_id: quantity}
+            Tuple[int, Dict[int, int]]: (ID del carretó o None, {product_id: quantity})
         """
-        if 'cart' not in session:
-            session['cart'] = {}
-        return session['cart']
-    
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cart_id, changes = self._find_cart_id(cursor, session)
+            items = dict(cursor.execute(CART_ITEMS_SQL, (cart_id,)).fetchall()) if cart_id else {}
+            if conn.in_transaction:
+                conn.commit()
+        self._update_session(session, changes)
+        return cart_id, items
+
     def add_to_cart(self, product_id: int, quantity: int, session: Any) -> Tuple[bool, str]:
         """
         Afegir un producte al carretó.
-        
+
         Args:
             product_id (int): ID del producte a afegir
             quantity (int): Quantitat a afegir
             session: Sessió de Flask per guardar el carretó
-            
+
         Returns:
             Tuple[bool, str]: (èxit, missatge)
-            
-        Raises:
-            ValueError: Si la quantitat no és vàlida o supera el límit
         """
         if not isinstance(quantity, int) or quantity <= 0:
             return False, "La quantitat ha de ser un enter positiu"
-        
-        # Comprovar stock disponible
-        stock_ok, stock_msg = self.validate_stock(product_id, quantity)
-        if not stock_ok:
-            return False, stock_msg
-        
-        # Obtenir carretó de la sessió
-        cart = self._get_cart(session)
-        
-        # Comprovar límit de 5 unitats per producte
-        current_quantity = cart.get(product_id, 0)
-        total_quantity = current_quantity + quantity
-        
-        if total_quantity > 5:
-            return False, f"No es pot superar el límit de 5 unitats per producte. Actual: {current_quantity}, intentant afegir: {quantity}"
-        
-        # Afegir al carretó i guardar a la sessió
-        cart[product_id] = total_quantity
-        session['cart'] = cart
-        session.modified = True  # Marcar la sessió com modificada
+
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cart_id, changes = self._find_cart_id(cursor, session, create=True)
+                row = cursor.execute(CART_ITEM_SQL, (cart_id, product_id)).fetchone()
+
+                # Comprovar límit de 5 unitats per producte
+                current_quantity = row[0] if row else 0
+                total_quantity = current_quantity + quantity
+                if total_quantity > MAX_UNITS_PER_PRODUCT:
+                    conn.commit()
+                    self._update_session(session, changes)
+                    return False, f"No es pot superar el límit de 5 unitats per producte. Actual: {current_quantity}, intentant afegir: {quantity}"
+
+                # Retenir les unitats de tota la línia (descomptant les reserves d'altres carretons)
+                if not self.reservations.reserve(cursor, cart_id, product_id, total_quantity):
+                    message = self._stock_message(cursor, cart_id, product_id, total_quantity)
+                    conn.commit()
+                    self._update_session(session, changes)
+                    return False, message
+
+                self._write_quantities(cursor, cart_id, {product_id: total_quantity})
+                conn.commit()
+                self._update_session(session, changes)
+        except sqlite3.Error as e:
+            return False, f"Error accedint a la base de dades: {str(e)}"
+
+        self._maybe_purge()
         return True, f"Producte afegit al carretó. Quantitat total: {total_quantity}"
-    
+
+    def set_quantities(self, session: Any, quantities: Dict[int, int], add: bool = False) -> Tuple[bool, str]:
+        """
+        Fixar (o sumar) la quantitat de diverses línies en una sola transacció.
+
+        Si alguna línia supera el límit per producte o no té prou stock lliure
+        no es modifica cap línia.
+
+        Args:
+            session: Sessió de Flask
+            quantities (Dict[int, int]): {product_id: quantitat}; 0 elimina la línia
+            add (bool): Sumar les quantitats a les que ja hi ha al carretó
+
+        Returns:
+            Tuple[bool, str]: (èxit, missatge)
+        """
+        if any(not isinstance(quantity, int) or quantity < 0 or quantity > MAX_UNITS_PER_PRODUCT
+               for quantity in quantities.values()):
+            return False, f"Les quantitats han d'estar entre 0 i {MAX_UNITS_PER_PRODUCT}"
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cart_id, changes = self._find_cart_id(cursor, session, create=True)
+                if add:
+                    current = dict(cursor.execute(CART_ITEMS_SQL, (cart_id,)).fetchall())
+                    quantities = {product_id: current.get(product_id, 0) + quantity
+                                  for product_id, quantity in quantities.items()}
+                    for product_id, quantity in quantities.items():
+                        if quantity > MAX_UNITS_PER_PRODUCT:
+                            conn.rollback()
+                            return False, (f"No es pot superar el límit de {MAX_UNITS_PER_PRODUCT} unitats per "
+                                           f"producte. Actual: {current.get(product_id, 0)}, "
+                                           f"intentant afegir: {quantity - current.get(product_id, 0)}")
+                for product_id, quantity in quantities.items():
+                    if quantity > 0 and not self.reservations.reserve(cursor, cart_id, product_id, quantity):
+                        message = self._stock_message(cursor, cart_id, product_id, quantity)
+                        conn.rollback()
+                        return False, message
+                self._write_quantities(cursor, cart_id, quantities)
+                conn.commit()
+                self._update_session(session, changes)
+        except sqlite3.Error as e:
+            return False, f"Error accedint a la base de dades: {str(e)}"
+
+        self._maybe_purge()
+        return True, "Carretó actualitzat"
+
     def remove_from_cart(self, product_id: int, session: Any) -> Tuple[bool, str]:
         """
         Eliminar un producte del carretó.
-        
+
         Args:
             product_id (int): ID del producte a eliminar
             session: Sessió de Flask per guardar el carretó
-            
+
         Returns:
             Tuple[bool, str]: (èxit, missatge)
         """
-        cart = self._get_cart(session)
-        if product_id in cart:
-            del cart[product_id]
-            session['cart'] = cart
-            session.modified = True  # Marcar la sessió com modificada
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cart_id, changes = self._find_cart_id(cursor, session)
+                removed = cart_id is not None and \
+                    cursor.execute(DELETE_ITEM_SQL, (cart_id, product_id)).rowcount > 0
+                if removed:
+                    self.reservations.release(cursor, cart_id, [product_id])
+                    cursor.execute(TOUCH_CART_SQL, (int(time.time()), cart_id))
+                conn.commit()
+                self._update_session(session, changes)
+        except sqlite3.Error as e:
+            return False, f"Error accedint a la base de dades: {str(e)}"
+
+        if removed:
             return True, "Producte eliminat del carretó"
         else:
             return False, "Producte no trobat al carretó"
-    
+
+    def merge_anonymous_cart(self, session: Any):
+        """
+        Passar el carretó anònim de la sessió al de l'usuari que acaba d'iniciar sessió.
+
+        Les quantitats d'un mateix producte se sumen (amb el límit de 5
+        unitats). Cal cridar-la després de guardar user_id a la sessió.
+
+        Args:
+            session: Sessió de Flask
+        """
+        if not session.get('user_id') or not session.get(CART_TOKEN_KEY):
+            return
+        try:
+            with get_connection(self.db_path) as conn:
+                _, changes = self._find_cart_id(conn.cursor(), session)
+                conn.commit()
+                self._update_session(session, changes)
+        except sqlite3.Error:
+            pass  # El carretó anònim es fusionarà a la següent lectura
+
     def validate_stock(self, product_id: int, quantity: int) -> Tuple[bool, str]:
         """
         Comprovar que hi hagi prou stock disponible.
-        
+
         Args:
             product_id (int): ID del producte
             quantity (int): Quantitat necessària
-            
+
         Returns:
             Tuple[bool, str]: (disponible, missatge)
         """
         try:
-            with sqlite3.connect(self.db_path, timeout=10.0) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT stock FROM Product WHERE id = ?", (product_id,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    return False, "Producte no trobat"
-                
-                available_stock = result[0]
-                if available_stock < quantity:
-                    return False, f"Stock insuficient. Disponible: {available_stock}, Sol·licitat: {quantity}"
-                
-                return True, "Stock disponible"
-                
+            with get_connection(self.db_path) as conn:
+                line = price_cart(conn.cursor(), {product_id: quantity}).get_line(product_id)
         except sqlite3.Error as e:
             return False, f"Error accedint a la base de dades: {str(e)}"
-    
+
+        if line is None:
+            return False, "Producte no trobat"
+        if not line.in_stock:
+            return False, f"Stock insuficient. Disponible: {line.available}, Sol·licitat: {quantity}"
+        return True, "Stock disponible"
+
     def get_cart_contents(self, session: Any) -> Dict[int, int]:
         """
         Obtenir el contingut actual del carretó.
-        
+
         Args:
             session: Sessió de Flask
-        
+
         Returns:
-            Dict[int, int]: {product_id: quantity}
+            Dict[int, int]: {product_id: quantity} (buit en cas d'error)
+        """
+        try:
+            return self._get_cart(session)[1]
+        except sqlite3.Error:
+            return {}
+
+    def get_checkout_cart(self, session: Any) -> Tuple[Optional[int], Dict[int, int]]:
         """
-        cart = self._get_cart(session)
-        return cart.copy()
-    
+        Obtenir el carretó que es vol comprar i el seu ID.
+
+        La comanda es crea amb l'ID perquè les reserves del mateix carretó no
+        es descomptin de les unitats disponibles.
+
+        Args:
+            session: Sessió de Flask
+
+        Returns:
+            Tuple[int, Dict[int, int]]: (ID del carretó o None, {product_id: quantity})
+        """
+        return self._get_cart(session)
+
     def clear_cart(self, session: Any):
         """
-        Buida el carretó.
-        
+        Buida el carretó i n'allibera les reserves.
+
+        Args:
+            session: Sessió de Flask
+        """
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cart_id, changes = self._find_cart_id(cursor, session)
+                if cart_id is not None:
+                    cursor.execute("DELETE FROM CartItem WHERE cart_id = ?", (cart_id,))
+                    self.reservations.release(cursor, cart_id)
+                    cursor.execute(TOUCH_CART_SQL, (int(time.time()), cart_id))
+                conn.commit()
+                self._update_session(session, changes)
+        except sqlite3.Error:
+            pass  # Un carretó que no s'ha pogut buidar es purgarà per TTL
+
+    def get_priced_cart(self, session: Any) -> PricedCart:
+        """
+        Obtenir el carretó amb preus, stock i totals amb una sola consulta.
+
+        Una petició l'ha de calcular un sol cop i reutilitzar-lo (línies,
+        totals i avisos d'stock surten del mateix resultat).
+
         Args:
             session: Sessió de Flask
+
+        Returns:
+            PricedCart: Carretó amb preus (buit si hi ha un error de base de dades)
         """
-        session['cart'] = {}
-        session.modified = True  # Marcar la sessió com modificada
-    
+        try:
+            cart_id, cart = self._get_cart(session)
+            if not cart:
+                return PricedCart([], [])
+            with get_connection(self.db_path) as conn:
+                return price_cart(conn.cursor(), cart, cart_id)
+        except sqlite3.Error:
+            return PricedCart([], [])
+
     def get_cart_total(self, session: Any) -> Decimal:
         """
         Calcular el total del carretó.
-        
+
         Args:
             session: Sessió de Flask
-        
+
         Returns:
-            Decimal: Total del carretó
+            Decimal: Total del carretó (0.00 en cas d'error)
+        """
+        return self.get_priced_cart(session).total
+
+    def purge_expired_carts(self, ttl: int = CART_TTL) -> int:
         """
-        total = Decimal('0.00')
-        cart = self._get_cart(session)
-        
+        Eliminar els carretons anònims sense activitat des de fa més de `ttl` segons.
+
+        Els carretons dels usuaris no caduquen (es buiden en fer una comanda).
+
+        Args:
+            ttl (int): Segons d'inactivitat
+
+        Returns:
+            int: Nombre de carretons eliminats
+        """
+        with get_connection(self.db_path) as conn:
+            purged = conn.execute(PURGE_CARTS_SQL, (int(time.time()) - ttl,)).rowcount
+            conn.commit()
+        return purged
+
+    def _maybe_purge(self):
+        """Purgar els carretons i les reserves caducades com a molt un cop cada CART_PURGE_INTERVAL segons per procés."""
+        now = time.monotonic()
+        with _purge_lock:
+            if now < _next_purge.get(self.db_path, 0.0):
+                return
+            _next_purge[self.db_path] = now + CART_PURGE_INTERVAL
         try:
-            with sqlite3.connect(self.db_path, timeout=10.0) as conn:
-                cursor = conn.cursor()
-                for product_id, quantity in cart.items():
-                    cursor.execute("SELECT price FROM Product WHERE id = ?", (product_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        price = Decimal(str(result[0]))
-                        total += price * quantity
-                        
+            self.purge_expired_carts()
+            self.reservations.release_expired()
         except sqlite3.Error:
-            pass  # Retorna 0.00 en cas d'error
-            
-        return total
\ No newline at end of file
+            pass  # Es tornarà a provar a la següent purga
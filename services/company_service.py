@@ -12,6 +12,11 @@ from typing import Dict, List, Tuple, Optional
 from werkzeug.utils import secure_filename
 from PIL import Image
 from models import Product
+from models.mapper import fetch_all, fetch_one
+from utils.cache import get_catalog_cache
+from utils.database import get_connection
+from utils.image_manifest import get_image_manifest
+from utils.money import to_cents
 
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 MAX_IMAGES = 4
@@ -22,7 +27,9 @@ class CompanyService:
     
     def __init__(self, db_path: str = "techshop.db", static_folder: str = "static"):
         self.db_path = db_path
+        self.cache = get_catalog_cache(db_path)
         self.static_folder = static_folder
+        self.images = get_image_manifest(db_path, os.path.join(static_folder, 'img', 'products'))
     
     def get_company_products(self, company_id: int) -> List[Product]:
         """
@@ -35,23 +42,13 @@ class CompanyService:
             List[Product]: Llista de productes de l'empresa
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "SELECT id, name, price, stock FROM Product WHERE company_id = ? ORDER BY id",
+                    "SELECT id, name, price_cents, stock FROM Product WHERE company_id = ? ORDER BY id",
                     (company_id,)
                 )
-                results = cursor.fetchall()
-                
-                products = []
-                for row in results:
-                    products.append(Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3]
-                    ))
-                return products
+                return fetch_all(cursor, Product)
         except sqlite3.Error:
             return []
     
@@ -67,21 +64,13 @@ class CompanyService:
             Optional[Product]: Producte si existeix i pertany a l'empresa, None altrament
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "SELECT id, name, price, stock FROM Product WHERE id = ? AND company_id = ?",
+                    "SELECT id, name, price_cents, stock FROM Product WHERE id = ? AND company_id = ?",
                     (product_id, company_id)
                 )
-                row = cursor.fetchone()
-                
-                if row:
-                    return Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3]
-                    )
+                return fetch_one(cursor, Product)
         except sqlite3.Error:
             pass
         
@@ -103,21 +92,27 @@ class CompanyService:
         if not name or len(name.strip()) == 0:
             return False, "El nom del producte és obligatori", None
         
-        if price < 0:
+        try:
+            price_cents = to_cents(price)
+        except ValueError:
+            return False, "El preu no és vàlid", None
+        
+        if price_cents < 0:
             return False, "El preu no pot ser negatiu", None
         
         if stock < 0:
             return False, "El stock no pot ser negatiu", None
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO Product (name, price, stock, company_id) VALUES (?, ?, ?, ?)",
-                    (name.strip(), float(price), stock, company_id)
-                )
-                product_id = cursor.lastrowid
-                conn.commit()
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "INSERT INTO Product (name, price, price_cents, stock, company_id) VALUES (?, ?, ?, ?, ?)",
+                        (name.strip(), price_cents / 100, price_cents, stock, company_id)
+                    )
+                    product_id = cursor.lastrowid
+                self.cache.invalidate_products((product_id,))
                 return True, f"Producte creat correctament", product_id
         except sqlite3.Error as e:
             return False, f"Error creant el producte: {str(e)}", None
@@ -144,20 +139,26 @@ class CompanyService:
         if not name or len(name.strip()) == 0:
             return False, "El nom del producte és obligatori"
         
-        if price < 0:
+        try:
+            price_cents = to_cents(price)
+        except ValueError:
+            return False, "El preu no és vàlid"
+        
+        if price_cents < 0:
             return False, "El preu no pot ser negatiu"
         
         if stock < 0:
             return False, "El stock no pot ser negatiu"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE Product SET name = ?, price = ?, stock = ? WHERE id = ? AND company_id = ?",
-                    (name.strip(), float(price), stock, product_id, company_id)
-                )
-                conn.commit()
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "UPDATE Product SET name = ?, price = ?, price_cents = ?, stock = ? WHERE id = ? AND company_id = ?",
+                        (name.strip(), price_cents / 100, price_cents, stock, product_id, company_id)
+                    )
+                self.cache.invalidate_products((product_id,))
                 return True, "Producte actualitzat correctament"
         except sqlite3.Error as e:
             return False, f"Error actualitzant el producte: {str(e)}"
@@ -179,7 +180,7 @@ class CompanyService:
             return False, "Producte no trobat o no tens permís per eliminar-lo"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 # Verificar si hi ha ordres amb aquest producte
                 cursor.execute(
@@ -211,13 +212,14 @@ class CompanyService:
             return False, message
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "DELETE FROM Product WHERE id = ? AND company_id = ?",
-                    (product_id, company_id)
-                )
-                conn.commit()
+            with get_connection(self.db_path) as conn:
+                with self.cache.local_write(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "DELETE FROM Product WHERE id = ? AND company_id = ?",
+                        (product_id, company_id)
+                    )
+                self.cache.invalidate_products((product_id,))
                 
                 # Eliminar imatges del producte
                 self._delete_product_images(product_id)
@@ -291,10 +293,29 @@ class CompanyService:
                 saved_count += 1
                 next_number += 1
             except Exception as e:
+                self._refresh_images(product_id)
                 return False, f"Error guardant imatge: {str(e)}"
         
+        if not self._refresh_images(product_id):
+            return False, "Imatges guardades però no s'ha pogut actualitzar l'índex d'imatges"
         return True, f"{saved_count} imatge(s) guardada(s) correctament"
     
+    def _refresh_images(self, product_id: int) -> bool:
+        """
+        Actualitzar l'índex d'imatges d'un producte (utils/image_manifest.py).
+        
+        Args:
+            product_id (int): ID del producte
+            
+        Returns:
+            bool: True si l'índex s'ha actualitzat
+        """
+        try:
+            self.images.refresh_product(product_id)
+            return True
+        except sqlite3.Error:
+            return False
+    
     def _compress_image(self, file, output_path: Path, file_ext: str):
         """
         Comprimir una imatge per reduir el seu tamany en un 80% (deixar només el 20%).
@@ -353,4 +374,5 @@ class CompanyService:
                 images_dir.rmdir()
             except Exception:
                 pass  # Ignorar errors en l'eliminació
+        self._refresh_images(product_id)
 
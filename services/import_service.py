@@ -0,0 +1,327 @@
+"""
+Servei d'importació massiva de productes
+Llegeix fitxers CSV o NDJSON en streaming, valida les files i les insereix (o
+actualitza per SKU) amb executemany dins d'una transacció per bloc de files
+"""
+
+import csv
+import io
+import json
+import sqlite3
+import zipfile
+from decimal import Decimal, InvalidOperation
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from werkzeug.datastructures import FileStorage
+from services.company_service import ALLOWED_EXTENSIONS, MAX_IMAGES, CompanyService
+from utils.cache import get_catalog_cache
+from utils.database import get_connection
+from utils.money import to_cents
+
+# Formats acceptats segons l'extensió del fitxer
+IMPORT_FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+REQUIRED_COLUMNS = ('name', 'price', 'stock')
+
+# Files per transacció: prou grans perquè el cost del commit no domini i prou
+# petites perquè la base de dades no quedi bloquejada gaire estona
+IMPORT_CHUNK_SIZE = 1000
+# Errors que es guarden a l'informe (la resta només es compten)
+MAX_REPORTED_ERRORS = 100
+
+MAX_NAME_LENGTH = 100
+# Límits de negoci: també eviten valors que no caben en un INTEGER de SQLite
+MAX_PRICE_CENTS = 100_000_000_00 - 1  # 99.999.999,99 €
+MAX_STOCK = 1_000_000_000
+MAX_SKU_LENGTH = 64
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+# SKU ja existents d'una empresa (idx_product_company_sku, migració v11)
+EXISTING_SKUS_SQL = (
+    "SELECT sku, id FROM Product WHERE company_id = ? AND sku IN (SELECT value FROM json_each(?))"
+)
+# SKU ja existents dels productes de TechShop (company_id NULL): l'índex per
+# empresa no els cobreix, ho fa l'índex parcial idx_product_sku_no_company (v19)
+EXISTING_ADMIN_SKUS_SQL = (
+    "SELECT sku, id FROM Product WHERE company_id IS NULL AND sku IN (SELECT value FROM json_each(?))"
+)
+INSERT_PRODUCT_SQL = (
+    "INSERT INTO Product (name, price, price_cents, stock, company_id, sku) VALUES (?, ?, ?, ?, ?, ?)"
+)
+UPDATE_PRODUCT_SQL = "UPDATE Product SET name = ?, price = ?, price_cents = ?, stock = ? WHERE id = ?"
+
+ProductRow = Tuple[str, int, int, Optional[str]]
+
+
+def _read_rows(stream: Any, fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Llegir les files d'un fitxer d'importació sense carregar-lo sencer.
+
+    Args:
+        stream: Fitxer binari (p. ex. FileStorage.stream)
+        fmt (str): 'csv' o 'ndjson'
+
+    Yields:
+        Tuple[int, Dict, str]: (número de línia, fila o None, error o None)
+
+    Raises:
+        ValueError: Si falten columnes obligatòries o el fitxer no és UTF-8
+    """
+    if fmt == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.DictReader(text)
+            missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"Falten columnes obligatòries: {', '.join(missing)}")
+            for row in reader:
+                yield reader.line_num, row, None
+        finally:
+            # No tancar el fitxer original en alliberar l'embolcall
+            text.detach()
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line.decode('utf-8-sig'))
+        except ValueError:
+            yield line_number, None, "JSON no vàlid"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Cada línia ha de ser un objecte JSON"
+            continue
+        yield line_number, row, None
+
+
+def _parse_row(row: Dict) -> Tuple[Optional[ProductRow], Optional[str]]:
+    """
+    Validar una fila amb les mateixes regles que el formulari de producte.
+
+    Args:
+        row (Dict): Valors de la fila (name, price, stock i sku opcional)
+
+    Returns:
+        Tuple[ProductRow, str]: ((nom, preu en cèntims, stock, sku), None) o (None, error)
+    """
+    name = str(row.get('name') or '').strip()
+    if not name:
+        return None, "El nom del producte és obligatori"
+    if len(name) > MAX_NAME_LENGTH:
+        return None, f"El nom no pot superar {MAX_NAME_LENGTH} caràcters"
+
+    try:
+        price_cents = to_cents(Decimal(str(row.get('price', '')).strip()))
+    except (InvalidOperation, ValueError, OverflowError):
+        return None, "El preu no és vàlid"
+    if price_cents < 0:
+        return None, "El preu no pot ser negatiu"
+    if price_cents > MAX_PRICE_CENTS:
+        return None, f"El preu no pot superar {MAX_PRICE_CENTS // 100} €"
+
+    try:
+        stock = int(str(row.get('stock', '')).strip())
+    except ValueError:
+        return None, "El stock no és vàlid"
+    if stock < 0:
+        return None, "El stock no pot ser negatiu"
+    if stock > MAX_STOCK:
+        return None, f"El stock no pot superar {MAX_STOCK} unitats"
+
+    sku = str(row.get('sku') or '').strip() or None
+    if sku and len(sku) > MAX_SKU_LENGTH:
+        return None, f"L'SKU no pot superar {MAX_SKU_LENGTH} caràcters"
+    return (name, price_cents, stock, sku), None
+
+
+class ImportService:
+    """Servei per importar productes de forma massiva (administradors i empreses)"""
+
+    def __init__(self, db_path: str = "techshop.db", static_folder: str = "static"):
+        self.db_path = db_path
+        self.static_folder = static_folder
+        self.cache = get_catalog_cache(db_path)
+
+    def import_products(self, stream: Any, filename: str, company_id: Optional[int] = None,
+                        upsert: bool = False, images_zip: Any = None) -> Tuple[bool, str, Dict]:
+        """
+        Importar productes des d'un fitxer CSV o NDJSON.
+
+        Les files vàlides s'escriuen per blocs de IMPORT_CHUNK_SIZE, cadascun
+        en una transacció amb executemany; les no vàlides s'indiquen a
+        l'informe amb el número de línia i no aturen la importació. Si una
+        fila té un SKU que l'empresa ja fa servir, amb `upsert` s'actualitza
+        aquell producte i sense `upsert` es rebutja.
+
+        Args:
+            stream: Fitxer binari amb les files (columnes name, price, stock i sku opcional)
+            filename (str): Nom del fitxer (l'extensió indica el format)
+            company_id (int, optional): Empresa propietària (None = productes de TechShop)
+            upsert (bool): Actualitzar els productes amb un SKU existent
+            images_zip: ZIP opcional amb imatges SKU.jpg, SKU_2.jpg o SKU/1.jpg
+
+        Returns:
+            Tuple[bool, str, Dict]: (èxit, missatge, informe amb rows, inserted,
+            updated, images, error_count i errors [(línia, missatge)])
+        """
+        report = {'rows': 0, 'inserted': 0, 'updated': 0, 'images': 0, 'error_count': 0, 'errors': []}
+        fmt = IMPORT_FORMATS.get(Path(filename or '').suffix.lower())
+        if fmt is None:
+            return False, "Format no suportat: el fitxer ha de ser CSV o NDJSON", report
+
+        seen_skus, written_skus = set(), set()
+        batch: List[Tuple[int, ProductRow]] = []
+        try:
+            with get_connection(self.db_path) as conn:
+                for line, row, error in _read_rows(stream, fmt):
+                    report['rows'] += 1
+                    values = None
+                    if error is None:
+                        values, error = _parse_row(row)
+                    if values and values[3]:
+                        if values[3] in seen_skus:
+                            values, error = None, "SKU repetit al fitxer"
+                        else:
+                            seen_skus.add(values[3])
+                    if error:
+                        self._add_error(report, line, error)
+                        continue
+                    batch.append((line, values))
+                    if len(batch) >= IMPORT_CHUNK_SIZE:
+                        self._write_chunk(conn, batch, company_id, upsert, report, written_skus)
+                        batch = []
+                if batch:
+                    self._write_chunk(conn, batch, company_id, upsert, report, written_skus)
+        except UnicodeDecodeError:
+            return False, "El fitxer ha d'estar codificat en UTF-8", report
+        except ValueError as e:
+            return False, str(e), report
+        except sqlite3.Error as e:
+            return False, f"Error important els productes: {str(e)}", report
+        finally:
+            if report['inserted'] or report['updated']:
+                self.cache.clear()
+
+        if images_zip is not None and written_skus:
+            self._attach_images(images_zip, company_id, written_skus, report)
+
+        message = (f"{report['inserted']} producte(s) creat(s), {report['updated']} actualitzat(s) "
+                   f"i {report['error_count']} fila(es) amb errors")
+        return True, message, report
+
+    def _write_chunk(self, conn: sqlite3.Connection, batch: List[Tuple[int, ProductRow]],
+                     company_id: Optional[int], upsert: bool, report: Dict, written_skus: set):
+        """
+        Escriure un bloc de files vàlides en una sola transacció.
+
+        Args:
+            conn (sqlite3.Connection): Connexió sense transacció oberta
+            batch: Files (línia, valors) del bloc
+            company_id (int, optional): Empresa propietària
+            upsert (bool): Actualitzar els SKU existents
+            report (Dict): Informe que s'actualitza
+            written_skus (set): SKU guardats (s'hi afegeixen els del bloc)
+        """
+        skus = [values[3] for _, values in batch if values[3]]
+        existing = dict(self._existing_skus(conn, company_id, skus)) if skus else {}
+
+        inserts, updates = [], []
+        for line, (name, price_cents, stock, sku) in batch:
+            if sku in existing:
+                if not upsert:
+                    self._add_error(report, line, "Ja existeix un producte amb aquest SKU")
+                    continue
+                updates.append((name, price_cents / 100, price_cents, stock, existing[sku]))
+            else:
+                inserts.append((name, price_cents / 100, price_cents, stock, company_id, sku))
+
+        try:
+            conn.executemany(INSERT_PRODUCT_SQL, inserts)
+            conn.executemany(UPDATE_PRODUCT_SQL, updates)
+            conn.commit()
+        except sqlite3.IntegrityError as e:
+            # Una altra escriptura ha fet servir el mateix SKU: es descarta el bloc
+            conn.rollback()
+            for line, _ in batch:
+                self._add_error(report, line, f"No s'ha pogut guardar la fila: {str(e)}")
+            return
+        report['inserted'] += len(inserts)
+        report['updated'] += len(updates)
+        written_skus.update(row[5] for row in inserts if row[5])
+        written_skus.update(sku for _, (_, _, _, sku) in batch if sku in existing and upsert)
+
+    def _existing_skus(self, conn: sqlite3.Connection, company_id: Optional[int],
+                       skus: List[str]) -> List[Tuple[str, int]]:
+        """
+        Buscar els productes que ja fan servir uns SKU.
+
+        Args:
+            conn (sqlite3.Connection): Connexió a la base de dades
+            company_id (int, optional): Empresa propietària (None = TechShop)
+            skus (List[str]): SKU a buscar
+
+        Returns:
+            List[Tuple[str, int]]: Parells (sku, id del producte)
+        """
+        if company_id is None:
+            return conn.execute(EXISTING_ADMIN_SKUS_SQL, (json.dumps(skus),)).fetchall()
+        return conn.execute(EXISTING_SKUS_SQL, (company_id, json.dumps(skus))).fetchall()
+
+    def _attach_images(self, images_zip: Any, company_id: Optional[int], skus: set, report: Dict):
+        """
+        Guardar les imatges d'un ZIP als productes importats.
+
+        Args:
+            images_zip: Fitxer ZIP
+            company_id (int, optional): Empresa propietària
+            skus (set): SKU de les files importades
+            report (Dict): Informe que s'actualitza
+        """
+        try:
+            archive = zipfile.ZipFile(images_zip)
+        except (zipfile.BadZipFile, OSError):
+            self._add_error(report, None, "El fitxer d'imatges no és un ZIP vàlid")
+            return
+
+        with archive:
+            entries: Dict[str, List[zipfile.ZipInfo]] = {}
+            for info in sorted(archive.infolist(), key=lambda item: item.filename):
+                path = PurePosixPath(info.filename)
+                if info.is_dir() or '..' in path.parts or path.suffix.lower() not in ALLOWED_EXTENSIONS:
+                    continue
+                # SKU/1.jpg, SKU.jpg o SKU_2.jpg
+                sku = path.parts[0] if len(path.parts) > 1 else path.stem
+                if sku not in skus and '_' in sku:
+                    sku = sku.rsplit('_', 1)[0]
+                if sku in skus:
+                    entries.setdefault(sku, []).append(info)
+            if not entries:
+                return
+
+            with get_connection(self.db_path) as conn:
+                ids = dict(self._existing_skus(conn, company_id, list(entries)))
+            company_service = CompanyService(self.db_path, self.static_folder)
+            for sku, infos in entries.items():
+                if sku not in ids:
+                    continue
+                files = []
+                for info in infos[:MAX_IMAGES]:
+                    if info.file_size > MAX_IMAGE_BYTES:
+                        self._add_error(report, None, f"{sku}: la imatge {info.filename} és massa gran")
+                        continue
+                    files.append(FileStorage(stream=io.BytesIO(archive.read(info)),
+                                             filename=PurePosixPath(info.filename).name))
+                if not files:
+                    continue
+                success, message = company_service.save_product_images(ids[sku], files)
+                if success:
+                    report['images'] += 1
+                else:
+                    self._add_error(report, None, f"{sku}: {message}")
+
+    def _add_error(self, report: Dict, line: Optional[int], message: str):
+        """Afegir un error a l'informe (només es guarden els primers MAX_REPORTED_ERRORS)."""
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append((line, message))
@@ -0,0 +1,299 @@
+"""
+Cua de tasques en segon pla
+Guarda les tasques a la taula Job (migració v15) perquè sobrevisquin a un
+reinici, i un fil treballador (o scripts/run_jobs.py) les executa amb
+reintents i espera exponencial
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from utils.database import get_connection
+
+# Intents d'una tasca abans de marcar-la com a fallida
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "6"))
+# Espera abans del primer reintent i espera màxima entre reintents (segons)
+JOB_BACKOFF = int(os.environ.get("JOB_BACKOFF", "30"))
+JOB_BACKOFF_MAX = int(os.environ.get("JOB_BACKOFF_MAX", "3600"))
+# Segons que una tasca en execució queda reservada; mentre s'executa es
+# renova cada terç de JOB_LEASE, i si el treballador mor un altre la torna a
+# agafar quan caduca
+JOB_LEASE = int(os.environ.get("JOB_LEASE", "300"))
+# Segons entre dues consultes de la cua quan no hi ha avisos
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "5"))
+
+# Estats d'una tasca
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+ENQUEUE_SQL = (
+    "INSERT INTO Job (kind, payload, status, attempts, run_at, created_at, updated_at) "
+    "VALUES (?, ?, 'pending', 0, ?, ?, ?)"
+)
+# Les tasques en execució amb la reserva caducada es tornen a agafar (idx_job_due)
+NEXT_JOB_SQL = (
+    "SELECT id, kind, payload, attempts FROM Job "
+    "WHERE status IN ('pending', 'running') AND run_at <= ? ORDER BY run_at LIMIT 1"
+)
+CLAIM_JOB_SQL = (
+    "UPDATE Job SET status = 'running', attempts = attempts + 1, run_at = ?, updated_at = ? WHERE id = ?"
+)
+# Només renova la reserva de qui la té (un altre treballador hauria incrementat attempts)
+RENEW_JOB_SQL = "UPDATE Job SET run_at = ?, updated_at = ? WHERE id = ? AND status = 'running' AND attempts = ?"
+COMPLETE_JOB_SQL = "UPDATE Job SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?"
+RETRY_JOB_SQL = "UPDATE Job SET status = ?, run_at = ?, last_error = ?, updated_at = ? WHERE id = ?"
+JOB_STATUS_SQL = "SELECT id, kind, status, attempts, run_at, last_error, updated_at FROM Job WHERE id = ?"
+JOB_COUNTS_SQL = "SELECT status, COUNT(*) FROM Job GROUP BY status"
+
+# Funcions que executen cada tipus de tasca: handler(db_path, payload).
+# Han de llançar una excepció si la tasca s'ha de tornar a intentar.
+JOB_HANDLERS: Dict[str, Callable[[str, Dict], None]] = {}
+
+
+class Job(NamedTuple):
+    """Tasca reservada per executar-la"""
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+def register_job_handler(kind: str, handler: Callable[[str, Dict], None]):
+    """
+    Registrar la funció que executa un tipus de tasca.
+
+    Args:
+        kind (str): Tipus de tasca
+        handler: Funció handler(db_path, payload)
+    """
+    JOB_HANDLERS[kind] = handler
+
+
+def retry_delay(attempts: int) -> int:
+    """Segons d'espera abans del reintent després de `attempts` intents."""
+    return min(JOB_BACKOFF * (2 ** max(attempts - 1, 0)), JOB_BACKOFF_MAX)
+
+
+class JobQueue:
+    """Cua de tasques guardada a la base de dades"""
+
+    def __init__(self, db_path: str = "techshop.db"):
+        self.db_path = db_path
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], cursor: Optional[sqlite3.Cursor] = None,
+                delay: int = 0) -> int:
+        """
+        Afegir una tasca a la cua.
+
+        Amb `cursor` la tasca s'escriu dins de la transacció de qui crida (p.
+        ex. la de la comanda): només s'executarà si aquesta fa commit.
+
+        Args:
+            kind (str): Tipus de tasca (clau de JOB_HANDLERS)
+            payload (Dict): Dades de la tasca (serialitzables en JSON)
+            cursor (sqlite3.Cursor, optional): Cursor d'una transacció oberta
+            delay (int): Segons abans de poder-la executar
+
+        Returns:
+            int: ID de la tasca
+        """
+        now = int(time.time())
+        params = (kind, json.dumps(payload), now + delay, now, now)
+        if cursor is not None:
+            cursor.execute(ENQUEUE_SQL, params)
+            return cursor.lastrowid
+        with get_connection(self.db_path) as conn:
+            return conn.execute(ENQUEUE_SQL, params).lastrowid
+
+    def claim(self) -> Optional[Job]:
+        """
+        Reservar la següent tasca pendent (o amb la reserva caducada).
+
+        La lectura i la reserva es fan amb el bloqueig d'escriptura pres
+        (BEGIN IMMEDIATE): dos treballadors no poden agafar la mateixa tasca.
+
+        Returns:
+            Job: Tasca reservada o None si no n'hi ha cap a punt
+        """
+        now = int(time.time())
+        with get_connection(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(NEXT_JOB_SQL, (now,)).fetchone()
+            if not row:
+                return None
+            job_id, kind, payload, attempts = row
+            conn.execute(CLAIM_JOB_SQL, (now + JOB_LEASE, now, job_id))
+        return Job(job_id, kind, json.loads(payload), attempts + 1)
+
+    def complete(self, job: Job):
+        """Marcar una tasca com a feta."""
+        with get_connection(self.db_path) as conn:
+            conn.execute(COMPLETE_JOB_SQL, (int(time.time()), job.id))
+
+    def fail(self, job: Job, error: str) -> str:
+        """
+        Registrar l'error d'una tasca i programar-ne el reintent.
+
+        Args:
+            job (Job): Tasca que ha fallat
+            error (str): Descripció de l'error
+
+        Returns:
+            str: Nou estat ('pending' si es tornarà a intentar, 'failed' si s'han esgotat els intents)
+        """
+        now = int(time.time())
+        status = JOB_FAILED if job.attempts >= JOB_MAX_ATTEMPTS else JOB_PENDING
+        with get_connection(self.db_path) as conn:
+            conn.execute(RETRY_JOB_SQL, (status, now + retry_delay(job.attempts), error[:1000], now, job.id))
+        return status
+
+    def run_job(self, job: Job) -> bool:
+        """
+        Executar una tasca reservada i registrar-ne el resultat.
+
+        Args:
+            job (Job): Tasca reservada amb claim()
+
+        Returns:
+            bool: True si s'ha completat
+        """
+        handler = JOB_HANDLERS.get(job.kind)
+        if handler is None:
+            self.fail(job, f"Tipus de tasca desconegut: {job.kind}")
+            return False
+        # Una tasca llarga no ha de perdre la reserva: un altre treballador la
+        # tornaria a executar (p. ex. enviaria el correu dos cops)
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lease, args=(job, finished), daemon=True)
+        heartbeat.start()
+        try:
+            handler(self.db_path, job.payload)
+        except Exception as e:
+            self.fail(job, f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}")
+            return False
+        finally:
+            finished.set()
+            heartbeat.join()
+        self.complete(job)
+        return True
+
+    def _renew_lease(self, job: Job, finished: threading.Event):
+        """Allargar la reserva d'una tasca cada terç de JOB_LEASE fins que acabi."""
+        while not finished.wait(JOB_LEASE / 3):
+            now = int(time.time())
+            try:
+                with get_connection(self.db_path) as conn:
+                    conn.execute(RENEW_JOB_SQL, (now + JOB_LEASE, now, job.id, job.attempts))
+            except sqlite3.Error:
+                pass  # Base de dades ocupada: es torna a provar al següent interval
+
+    def run_pending(self, limit: Optional[int] = None) -> int:
+        """
+        Executar les tasques a punt fins que no en quedi cap (o fins a `limit`).
+
+        Args:
+            limit (int, optional): Màxim de tasques a executar
+
+        Returns:
+            int: Nombre de tasques executades (completades o no)
+        """
+        executed = 0
+        while limit is None or executed < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.run_job(job)
+            executed += 1
+        return executed
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Obtenir l'estat d'una tasca.
+
+        Args:
+            job_id (int): ID de la tasca
+
+        Returns:
+            Dict: id, kind, status, attempts, run_at, last_error i updated_at (None si no existeix)
+        """
+        with get_connection(self.db_path) as conn:
+            row = conn.execute(JOB_STATUS_SQL, (job_id,)).fetchone()
+        if not row:
+            return None
+        return dict(zip(('id', 'kind', 'status', 'attempts', 'run_at', 'last_error', 'updated_at'), row))
+
+    def count_by_status(self) -> Dict[str, int]:
+        """Nombre de tasques de cada estat."""
+        with get_connection(self.db_path) as conn:
+            return dict(conn.execute(JOB_COUNTS_SQL).fetchall())
+
+
+class JobWorker:
+    """Fil que executa les tasques de la cua en segon pla"""
+
+    def __init__(self, db_path: str = "techshop.db", poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = JobQueue(db_path)
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Engegar el fil (si encara no està en marxa)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="techshop-jobs", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Avisar que hi ha una tasca nova perquè no s'esperi a la següent consulta."""
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Aturar el fil després de la tasca en curs."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.queue.run_pending()
+            except sqlite3.Error:
+                pass  # Base de dades ocupada o no disponible: es torna a provar a la següent volta
+            self._wake.wait(self.poll_interval)
+
+
+_workers: Dict[str, JobWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_job_worker(db_path: str = "techshop.db") -> JobWorker:
+    """
+    Obtenir el treballador compartit d'una base de dades (sense engegar-lo).
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        JobWorker: Treballador únic per procés i ruta
+    """
+    key = os.path.abspath(db_path)
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is None:
+            worker = JobWorker(db_path)
+            _workers[key] = worker
+    return worker
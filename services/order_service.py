@@ -3,11 +3,152 @@ Servei de gestió de comandes
 Implementa la lògica de negoci per crear comandes sense barrejar amb presentació o accés a dades
 """
 
+import base64
+import json
+import os
+import random
+import re
+import secrets
 import sqlite3
+import time
 from decimal import Decimal
 from datetime import datetime
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from models import Order, OrderItem
+from models.mapper import fetch_all, fetch_one
+from services.cart_pricing import price_cart
+from services.job_queue import JobQueue, register_job_handler
+from services.reservation_service import ReservationService
+from utils.cache import get_catalog_cache
+from utils.database import get_connection
+from utils.email_service import send_order_confirmation_email
+from utils.invoice_generator import generate_invoice_pdf
+from utils.money import format_cents, from_cents
+
+# Intents d'una comanda quan la base de dades està ocupada per altres escriptures
+CHECKOUT_MAX_ATTEMPTS = int(os.environ.get("CHECKOUT_MAX_ATTEMPTS", "5"))
+# Espera abans del primer reintent i espera màxima entre reintents (segons)
+CHECKOUT_BACKOFF = float(os.environ.get("CHECKOUT_BACKOFF", "0.02"))
+CHECKOUT_BACKOFF_MAX = float(os.environ.get("CHECKOUT_BACKOFF_MAX", "0.5"))
+
+# Tasca en segon pla de cada comanda nova: factura PDF i correu de confirmació
+ORDER_PLACED_JOB = 'order_placed'
+
+# Missatge de create_order quan la clau d'idempotència ja té una comanda
+ORDER_ALREADY_PROCESSED = "Comanda ja processada"
+
+ORDER_BY_KEY_SQL = 'SELECT id FROM "Order" WHERE idempotency_key = ?'
+INSERT_ORDER_SQL = (
+    'INSERT INTO "Order" (total, total_cents, created_at, user_id, idempotency_key) VALUES (?, ?, ?, ?, ?)'
+)
+ORDER_BUYER_SQL = "SELECT username, email FROM User WHERE id = ?"
+# Marca del correu de confirmació enviat (migració v20)
+CONFIRMATION_SENT_SQL = 'SELECT confirmation_sent_at FROM "Order" WHERE id = ?'
+MARK_CONFIRMATION_SENT_SQL = 'UPDATE "Order" SET confirmation_sent_at = ? WHERE id = ?'
+# Cada línia guarda el nom i el preu pagat (migració v16): l'historial, el correu
+# i la factura no depenen dels canvis posteriors del catàleg
+INSERT_ORDER_ITEM_SQL = (
+    "INSERT INTO OrderItem (order_id, product_id, quantity, product_name, unit_price_cents) VALUES (?, ?, ?, ?, ?)"
+)
+# Línies de diverses comandes en una sola consulta (els IDs arriben com a llista JSON)
+ORDER_ITEMS_SQL = (
+    "SELECT id, order_id, product_id, quantity, product_name, unit_price_cents "
+    "FROM OrderItem WHERE order_id IN (SELECT value FROM json_each(?)) ORDER BY order_id, id"
+)
+ORDER_ITEMS_BY_NAME_SQL = (
+    "SELECT product_id, quantity, product_name, unit_price_cents "
+    "FROM OrderItem WHERE order_id = ? ORDER BY product_name"
+)
+# Historial de comandes per conjunt de claus (created_at, id), de més nova a més
+# antiga, amb idx_order_user_created (l'id és el rowid de l'índex). Les comandes
+# antigues sense data (NULL) van al final: la pàgina següent uneix les comandes
+# amb data anteriors al cursor i les primeres sense data, cada part amb l'índex.
+HISTORY_FIRST_PAGE_SQL = (
+    'SELECT id, total_cents, created_at, user_id FROM "Order" WHERE user_id = ? '
+    'ORDER BY created_at DESC, id DESC LIMIT ?'
+)
+HISTORY_NEXT_PAGE_SQL = """
+    SELECT id, total_cents, created_at, user_id FROM (
+        SELECT * FROM (
+            SELECT id, total_cents, created_at, user_id FROM "Order"
+            WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT id, total_cents, created_at, user_id FROM "Order"
+            WHERE user_id = ? AND created_at IS NULL ORDER BY id DESC LIMIT ?
+        )
+    ) ORDER BY created_at DESC, id DESC LIMIT ?
+"""
+HISTORY_UNDATED_PAGE_SQL = (
+    'SELECT id, total_cents, created_at, user_id FROM "Order" '
+    'WHERE user_id = ? AND created_at IS NULL AND id < ? ORDER BY id DESC LIMIT ?'
+)
+# Comandes per pàgina de l'historial
+HISTORY_PAGE_SIZE = 10
+MAX_HISTORY_PAGE_SIZE = 50
+
+# Només descompta si queda prou stock: una línia sense stock no modifica cap fila
+DECREMENT_STOCK_SQL = "UPDATE Product SET stock = stock - ? WHERE id = ? AND stock >= ?"
+
+
+# Format de les claus d'idempotència (secrets.token_urlsafe(32) en genera de 43 caràcters)
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def encode_history_cursor(created_at: Any, order_id: int) -> str:
+    """
+    Codificar la posició després d'una comanda de l'historial com a text opac per a la URL.
+
+    Args:
+        created_at: Data de la comanda tal com és a la base de dades (text o None)
+        order_id (int): ID de la comanda
+
+    Returns:
+        str: Cursor en base64 (segur per a URLs)
+    """
+    data = json.dumps([created_at, order_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_history_cursor(cursor: str) -> Tuple[Optional[str], int]:
+    """
+    Descodificar un cursor creat per encode_history_cursor().
+
+    Args:
+        cursor (str): Cursor rebut a la URL
+
+    Returns:
+        Tuple[Optional[str], int]: (created_at, id) de l'última comanda de la pàgina anterior
+
+    Raises:
+        ValueError: Si el cursor no és vàlid
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Cursor de paginació no vàlid") from e
+    if not isinstance(data, list) or len(data) != 2 or not isinstance(data[1], int) or \
+            not (data[0] is None or isinstance(data[0], str)):
+        raise ValueError("Cursor de paginació no vàlid")
+    return data[0], data[1]
+
+
+def new_idempotency_key() -> str:
+    """Generar la clau d'idempotència d'un formulari de checkout."""
+    return secrets.token_urlsafe(32)
+
+
+def is_valid_idempotency_key(key: Optional[str]) -> bool:
+    """Indicar si una clau rebuda d'un formulari té el format esperat."""
+    return bool(key) and IDEMPOTENCY_KEY_PATTERN.match(key) is not None
+
+
+def _is_busy(error: sqlite3.Error) -> bool:
+    """Indicar si un error és SQLITE_BUSY/SQLITE_LOCKED (un altre procés té el bloqueig d'escriptura)."""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
 
 
 class OrderService:
@@ -15,68 +156,233 @@ class OrderService:
     
     def __init__(self, db_path: str = "techshop.db"):
         self.db_path = db_path
+        self.cache = get_catalog_cache(db_path)
+        self.jobs = JobQueue(db_path)
+        self.reservations = ReservationService(db_path)
 
     def create_order_in_transaction(
-        self, conn: sqlite3.Connection, cart: Dict[int, int], user_id: int
+        self, conn: sqlite3.Connection, cart: Dict[int, int], user_id: int,
+        idempotency_key: Optional[str] = None, cart_id: Optional[int] = None
     ) -> Tuple[bool, str, int]:
         """
         Crear una nova comanda utilitzant una connexió existent.
 
+        Si la connexió no té cap transacció oberta se n'obre una amb
+        BEGIN IMMEDIATE: el bloqueig d'escriptura es pren abans de llegir
+        l'stock, de manera que dues comandes simultànies no poden vendre les
+        mateixes unitats. L'stock es descompta amb un UPDATE condicionat
+        (stock >= quantitat) i les línies s'insereixen amb executemany.
+        Les unitats retingudes per les reserves vigents d'altres carretons no
+        es poden vendre: només compten com a lliures les de `cart_id` (el
+        carretó que es compra), que s'alliberen amb la comanda.
+        La factura i el correu es deixen a la cua de tasques (ORDER_PLACED_JOB)
+        dins de la mateixa transacció.
+
         Aquesta funció NO fa commit/rollback: és responsabilitat del codi
         que la crida (permetent transaccions que inclouen usuari + comanda).
+        Si retorna error, el codi que la crida ha de fer rollback.
+        Després del commit s'ha de cridar invalidate_catalog(cart) perquè el
+        catàleg en memòria cau no mostri l'estoc anterior.
+
+        Si ja hi ha una comanda amb la mateixa `idempotency_key` es retorna
+        (True, ORDER_ALREADY_PROCESSED, id) sense tornar a calcular ni
+        descomptar res, encara que el carretó ja estigui buit; com que la
+        comprovació es fa amb el bloqueig d'escriptura pres, dos enviaments
+        simultanis no creen dues comandes.
+
+        Raises:
+            sqlite3.OperationalError: Si no es pot obtenir el bloqueig (base de dades ocupada)
         """
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+
+        # La clau es comprova abans que el carretó: en un doble enviament, la
+        # primera petició ja l'ha buidat i la segona ha de trobar la comanda
+        if idempotency_key:
+            row = cursor.execute(ORDER_BY_KEY_SQL, (idempotency_key,)).fetchone()
+            if row:
+                return True, ORDER_ALREADY_PROCESSED, row[0]
+
         if not cart:
             return False, "El carretó està buit", 0
 
-        cursor = conn.cursor()
-
         # Verificar que l'usuari existeix
         cursor.execute("SELECT id FROM User WHERE id = ?", (user_id,))
         if not cursor.fetchone():
             return False, "Usuari no trobat", 0
 
-        # Calcular total de la comanda
-        total = self._calculate_order_total(cart, cursor)
-        if total == Decimal("0.00"):
+        # Preus i unitats lliures de totes les línies amb una consulta (ja amb el bloqueig pres)
+        priced = price_cart(cursor, cart, cart_id)
+        if priced.missing:
+            return False, f"Producte no trobat: {priced.missing[0]}", 0
+        if priced.shortages:
+            line = priced.shortages[0]
+            return False, (f"Stock insuficient per a {line.product.name}. "
+                           f"Disponible: {line.available}, Sol·licitat: {line.quantity}"), 0
+        total_cents = priced.total_cents
+        if total_cents == 0:
             return False, "Error calculant el total de la comanda", 0
 
         # Crear la comanda
-        cursor.execute(
-            'INSERT INTO "Order" (total, created_at, user_id) VALUES (?, ?, ?)',
-            (float(total), datetime.now(), user_id),
-        )
+        cursor.execute(INSERT_ORDER_SQL, (total_cents / 100, total_cents, datetime.now(), user_id, idempotency_key))
         order_id = cursor.lastrowid
 
         # Crear les línies de comanda i actualitzar inventari
-        for product_id, quantity in cart.items():
-            # Crear OrderItem
-            cursor.execute(
-                "INSERT INTO OrderItem (order_id, product_id, quantity) VALUES (?, ?, ?)",
-                (order_id, product_id, quantity),
-            )
+        cursor.executemany(INSERT_ORDER_ITEM_SQL, [
+            (order_id, line.product.id, line.quantity, line.product.name, line.product.price_cents)
+            for line in priced.lines
+        ])
+        cursor.executemany(DECREMENT_STOCK_SQL, [
+            (line.quantity, line.product.id, line.quantity) for line in priced.lines
+        ])
+        if cursor.rowcount != len(priced.lines):
+            return False, "Stock insuficient per completar la comanda", 0
+        if cart_id is not None:
+            self.reservations.release(cursor, cart_id)
+
+        # Factura i correu en segon pla: la tasca només existeix si la comanda fa commit
+        self.jobs.enqueue(ORDER_PLACED_JOB, {'order_id': order_id}, cursor)
+
+        # Invalidació prèvia al commit: les lectures d'aquest procés ja no
+        # reutilitzen l'estoc anterior (el codi que fa commit torna a invalidar)
+        self.invalidate_catalog(cart)
+        return True, f"Comanda creada correctament. Total: {format_cents(total_cents)}", order_id
+
+    def invalidate_catalog(self, cart: Dict[int, int]):
+        """
+        Invalidar a la memòria cau del catàleg els productes d'una comanda.
+
+        Args:
+            cart (Dict[int, int]): Carretó {product_id: quantity} de la comanda
+        """
+        self.cache.invalidate_products(cart.keys(), names_changed=False)
+
+    def create_order(self, cart: Dict[int, int], user_id: int,
+                     idempotency_key: Optional[str] = None,
+                     cart_id: Optional[int] = None) -> Tuple[bool, str, int]:
+        """
+        Crear una nova comanda en la seva pròpia transacció.
 
-            # Actualitzar inventari
-            cursor.execute(
-                "UPDATE Product SET stock = stock - ? WHERE id = ?",
-                (quantity, product_id),
-            )
+        Si la base de dades està ocupada (SQLITE_BUSY) es torna a intentar
+        fins a CHECKOUT_MAX_ATTEMPTS cops amb una espera exponencial amb
+        jitter limitada a CHECKOUT_BACKOFF_MAX segons.
 
-        return True, f"Comanda creada correctament. Total: {total}", order_id
+        Args:
+            cart (Dict[int, int]): Carretó {product_id: quantity}
+            user_id (int): ID del comprador
+            idempotency_key (str, optional): Clau del formulari de checkout; si
+                ja té una comanda, el missatge és ORDER_ALREADY_PROCESSED
+            cart_id (int, optional): Carretó guardat que es compra (les seves
+                reserves compten com a pròpies; None = cap reserva és pròpia)
+
+        Returns:
+            Tuple[bool, str, int]: (èxit, missatge, ID de la comanda o 0)
+        """
+        for attempt in range(CHECKOUT_MAX_ATTEMPTS):
+            try:
+                with get_connection(self.db_path) as conn:
+                    # L'estoc descomptat s'invalida aquí mateix amb precisió: el
+                    # monitor de canvis no l'ha de tornar a invalidar
+                    with self.cache.local_write(conn):
+                        result = self.create_order_in_transaction(conn, cart, user_id, idempotency_key, cart_id)
+                        if not result[0]:
+                            conn.rollback()
+                if result[0] and result[1] != ORDER_ALREADY_PROCESSED:
+                    self.invalidate_catalog(cart)
+                return result
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == CHECKOUT_MAX_ATTEMPTS - 1:
+                    return False, f"Error creant la comanda: {str(e)}", 0
+                delay = min(CHECKOUT_BACKOFF * (2 ** attempt), CHECKOUT_BACKOFF_MAX)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+            except sqlite3.Error as e:
+                return False, f"Error creant la comanda: {str(e)}", 0
+        return False, "Error creant la comanda: base de dades ocupada", 0
 
-    def create_order(self, cart: Dict[int, int], user_id: int) -> Tuple[bool, str, int]:
+    def send_order_confirmation(self, order_id: int) -> Tuple[bool, str]:
         """
-        Versió compatible que crea una nova comanda obrint la seva pròpia connexió.
-        Es manté per compatibilitat amb els tests i altres usos.
+        Generar la factura d'una comanda i enviar-la per correu al comprador.
+
+        L'executa la cua de tasques (ORDER_PLACED_JOB) després del commit de
+        la comanda, fora de la petició HTTP. És idempotent: si la comanda ja
+        té confirmation_sent_at (la tasca s'ha tornat a executar) no envia res.
+
+        Args:
+            order_id (int): ID de la comanda
+
+        Returns:
+            Tuple[bool, str]: (èxit, missatge); si falla, la tasca es reintenta
         """
+        success, message, order = self.get_order_by_id(order_id)
+        if not success:
+            return False, message
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                return self.create_order_in_transaction(conn, cart, user_id)
+            with get_connection(self.db_path) as conn:
+                sent = conn.execute(CONFIRMATION_SENT_SQL, (order_id,)).fetchone()
+                buyer = conn.execute(ORDER_BUYER_SQL, (order.user_id,)).fetchone()
         except sqlite3.Error as e:
-            return False, f"Error creant la comanda: {str(e)}", 0
+            return False, f"Error accedint al comprador: {str(e)}"
+        if sent and sent[0]:
+            return True, "La confirmació ja s'havia enviat"
+        if not buyer or not buyer[1]:
+            return True, "El comprador no té correu: no s'envia la confirmació"
+
+        success, message, order_items = self.get_order_items_for_email(order_id)
+        if not success:
+            return False, message
+        invoice_pdf = generate_invoice_pdf(order_id, order.user_id, self.db_path)
+        success, message = send_order_confirmation_email(
+            buyer[1],
+            buyer[0],
+            order_id,
+            order.total,
+            order.created_at.strftime('%d/%m/%Y %H:%M') if order.created_at else '—',
+            order_items,
+            invoice_pdf,
+        )
+        if success:
+            try:
+                with get_connection(self.db_path) as conn:
+                    conn.execute(MARK_CONFIRMATION_SENT_SQL, (datetime.now(), order_id))
+                    conn.commit()
+            except sqlite3.Error:
+                pass  # El correu ja s'ha enviat: un reintent només el repetiria si la marca no s'ha pogut guardar
+        return success, message
+
+    def get_order_id_by_idempotency_key(self, idempotency_key: str) -> Optional[int]:
+        """
+        Obtenir la comanda creada amb una clau d'idempotència.
+
+        Args:
+            idempotency_key (str): Clau del formulari de checkout
+
+        Returns:
+            int: ID de la comanda o None si la clau encara no s'ha fet servir
+        """
+        try:
+            with get_connection(self.db_path) as conn:
+                row = conn.execute(ORDER_BY_KEY_SQL, (idempotency_key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _calculate_order_total_cents(self, cart: Dict[int, int], cursor) -> int:
+        """
+        Calcular el total de la comanda en cèntims sumant price_cents * quantity.
+        
+        Args:
+            cart (Dict[int, int]): Carretó amb {product_id: quantity}
+            cursor: Cursor de la base de dades
+            
+        Returns:
+            int: Total de la comanda en cèntims
+        """
+        return price_cart(cursor, cart).total_cents
     
     def _calculate_order_total(self, cart: Dict[int, int], cursor) -> Decimal:
         """
-        Calcular el total de la comanda sumant price * quantity de cada producte.
+        Calcular el total de la comanda en euros.
         
         Args:
             cart (Dict[int, int]): Carretó amb {product_id: quantity}
@@ -85,16 +391,7 @@ class OrderService:
         Returns:
             Decimal: Total de la comanda
         """
-        total = Decimal('0.00')
-        
-        for product_id, quantity in cart.items():
-            cursor.execute("SELECT price FROM Product WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            if result:
-                price = Decimal(str(result[0]))
-                total += price * quantity
-        
-        return total
+        return from_cents(self._calculate_order_total_cents(cart, cursor))
     
     def get_order_by_id(self, order_id: int) -> Tuple[bool, str, Order]:
         """
@@ -107,24 +404,17 @@ class OrderService:
             Tuple[bool, str, Order]: (èxit, missatge, comanda)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "SELECT id, total, created_at, user_id FROM \"Order\" WHERE id = ?",
+                    "SELECT id, total_cents, created_at, user_id FROM \"Order\" WHERE id = ?",
                     (order_id,)
                 )
-                result = cursor.fetchone()
+                order = fetch_one(cursor, Order)
                 
-                if not result:
+                if not order:
                     return False, "Comanda no trobada", None
                 
-                order = Order(
-                    id=result[0],
-                    total=Decimal(str(result[1])),
-                    created_at=datetime.fromisoformat(result[2]),
-                    user_id=result[3]
-                )
-                
                 return True, "Comanda trobada", order
                 
         except sqlite3.Error as e:
@@ -134,57 +424,97 @@ class OrderService:
         """
         Obtenir totes les comandes d'un usuari específic.
         
+        Per a la pàgina de perfil fer servir get_order_history(), que llegeix
+        només una pàgina.
+        
         Args:
             user_id (int): ID de l'usuari
             
         Returns:
-            list: Llista de tuples (Order, items) on items és una llista de OrderItem amb informació del producte
+            list: Llista de tuples (Order, items) on items és una llista de OrderItem amb el nom i el preu de la compra
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                # Obtenir totes les comandes de l'usuari
-                cursor.execute(
-                    'SELECT id, total, created_at, user_id FROM "Order" WHERE user_id = ? ORDER BY created_at DESC',
-                    (user_id,)
-                )
-                orders_data = cursor.fetchall()
-                
-                orders_with_items = []
-                for row in orders_data:
-                    order = Order(
-                        id=row[0],
-                        total=Decimal(str(row[1])),
-                        created_at=datetime.fromisoformat(row[2]) if row[2] else datetime.now(),
-                        user_id=row[3]
-                    )
-                    
-                    # Obtenir items de la comanda amb informació del producte
-                    cursor.execute("""
-                        SELECT oi.id, oi.order_id, oi.product_id, oi.quantity, p.name, p.price
-                        FROM OrderItem oi
-                        JOIN Product p ON oi.product_id = p.id
-                        WHERE oi.order_id = ?
-                    """, (order.id,))
-                    items_data = cursor.fetchall()
-                    
-                    items = []
-                    for item_row in items_data:
-                        items.append({
-                            'id': item_row[0],
-                            'order_id': item_row[1],
-                            'product_id': item_row[2],
-                            'quantity': item_row[3],
-                            'product_name': item_row[4],
-                            'product_price': Decimal(str(item_row[5]))
-                        })
-                    
-                    orders_with_items.append((order, items))
-                
-                return orders_with_items
+                # LIMIT -1: sense límit
+                cursor.execute(HISTORY_FIRST_PAGE_SQL, (user_id, -1))
+                orders = fetch_all(cursor, Order)
+                return self._with_items(cursor, orders)
         except sqlite3.Error as e:
             return []
     
+    def get_order_history(self, user_id: int, after: Optional[str] = None,
+                          limit: int = HISTORY_PAGE_SIZE) -> Tuple[list, Optional[str]]:
+        """
+        Obtenir una pàgina de l'historial de comandes d'un usuari amb les seves línies.
+        
+        Dues consultes per pàgina, sigui quina sigui la posició o la mida de
+        l'historial: les comandes per conjunt de claus (created_at, id) i les
+        línies de totes elles amb un sol IN.
+        
+        Args:
+            user_id (int): ID de l'usuari
+            after (str, optional): Cursor de la pàgina anterior (None per a la primera)
+            limit (int): Comandes per pàgina (entre 1 i MAX_HISTORY_PAGE_SIZE)
+            
+        Returns:
+            Tuple[list, Optional[str]]: (llista de tuples (Order, items) com
+                get_orders_by_user_id(), cursor de la pàgina següent o None si és l'última)
+            
+        Raises:
+            ValueError: Si el cursor no és vàlid
+        """
+        limit = max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+        if after:
+            created_at, order_id = decode_history_cursor(after)
+            if created_at is None:
+                sql, params = HISTORY_UNDATED_PAGE_SQL, (user_id, order_id, limit + 1)
+            else:
+                sql, params = HISTORY_NEXT_PAGE_SQL, (user_id, created_at, order_id, limit + 1,
+                                                      user_id, limit + 1, limit + 1)
+        else:
+            sql, params = HISTORY_FIRST_PAGE_SQL, (user_id, limit + 1)
+        
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                # Es llegeix una fila de més per saber si hi ha pàgina següent
+                rows = cursor.execute(sql, params).fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                orders_with_items = self._with_items(cursor, [Order.from_row(row) for row in rows])
+        except sqlite3.Error:
+            return [], None
+        
+        if not has_more:
+            return orders_with_items, None
+        return orders_with_items, encode_history_cursor(rows[-1][2], rows[-1][0])
+    
+    def _with_items(self, cursor: sqlite3.Cursor, orders: List[Order]) -> list:
+        """
+        Afegir a cada comanda les seves línies amb una sola consulta.
+        
+        Args:
+            cursor (sqlite3.Cursor): Cursor de la connexió oberta
+            orders (List[Order]): Comandes
+            
+        Returns:
+            list: Llista de tuples (Order, items) en l'ordre de `orders`
+        """
+        items_by_order: Dict[int, list] = {order.id: [] for order in orders}
+        if orders:
+            cursor.execute(ORDER_ITEMS_SQL, (json.dumps(list(items_by_order)),))
+            for item_row in cursor.fetchall():
+                items_by_order[item_row[1]].append({
+                    'id': item_row[0],
+                    'order_id': item_row[1],
+                    'product_id': item_row[2],
+                    'quantity': item_row[3],
+                    'product_name': item_row[4],
+                    'product_price': from_cents(item_row[5])
+                })
+        return [(order, items_by_order[order.id]) for order in orders]
+    
     def get_order_items_for_email(self, order_id: int) -> Tuple[bool, str, list]:
         """
         Obtenir items d'una comanda amb informació del producte per enviar per email.
@@ -196,15 +526,9 @@ class OrderService:
             Tuple[bool, str, list]: (èxit, missatge, llista d'items amb product_id, quantity, name, price)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT oi.product_id, oi.quantity, p.name, p.price
-                    FROM OrderItem oi
-                    JOIN Product p ON oi.product_id = p.id
-                    WHERE oi.order_id = ?
-                    ORDER BY p.name
-                """, (order_id,))
+                cursor.execute(ORDER_ITEMS_BY_NAME_SQL, (order_id,))
                 items = cursor.fetchall()
                 
                 items_list = []
@@ -213,9 +537,19 @@ class OrderService:
                         'product_id': item[0],
                         'quantity': item[1],
                         'name': item[2],
-                        'price': Decimal(str(item[3]))
+                        'price': from_cents(item[3])
                     })
                 
                 return True, "Items obtinguts correctament", items_list
         except sqlite3.Error as e:
-            return False, f"Error accedint als items: {str(e)}", []
\ No newline at end of file
+            return False, f"Error accedint als items: {str(e)}", []
+
+
+def _run_order_placed_job(db_path: str, payload: Dict):
+    """Tasca ORDER_PLACED_JOB: factura i correu d'una comanda (llança una excepció per reintentar-la)."""
+    success, message = OrderService(db_path).send_order_confirmation(payload['order_id'])
+    if not success:
+        raise RuntimeError(message)
+
+
+register_job_handler(ORDER_PLACED_JOB, _run_order_placed_job)
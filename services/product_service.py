@@ -3,10 +3,226 @@ Servei de gestió de productes
 Implementa la lògica de negoci per a les operacions relacionades amb productes
 """
 
+import base64
+import json
+import re
 import sqlite3
-from decimal import Decimal
-from typing import List, Optional, Tuple
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from migrations.migrate_database import PRICE_BAND_LIMITS
 from models import Product
+from models.mapper import fetch_all, fetch_one
+from utils.cache import get_catalog_cache
+from utils.database import get_connection
+
+
+# Mida de pàgina del catàleg
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Consultes de paginació per conjunt de claus (keyset): (primera pàgina,
+# pàgines següents). Cada ordenació té un índex i l'id desempata, de manera que
+# cada pàgina llegeix només les files que mostra, sigui quina sigui la posició.
+PAGE_QUERIES = {
+    'id': (
+        "SELECT id, name, price_cents, stock FROM Product ORDER BY id LIMIT ?",
+        "SELECT id, name, price_cents, stock FROM Product WHERE id > ? ORDER BY id LIMIT ?",
+    ),
+    'price': (
+        "SELECT id, name, price_cents, stock FROM Product ORDER BY price_cents, id LIMIT ?",
+        "SELECT id, name, price_cents, stock FROM Product WHERE (price_cents, id) > (?, ?) ORDER BY price_cents, id LIMIT ?",
+    ),
+    'name': (
+        "SELECT id, name, price_cents, stock FROM Product ORDER BY name, id LIMIT ?",
+        "SELECT id, name, price_cents, stock FROM Product WHERE (name, id) > (?, ?) ORDER BY name, id LIMIT ?",
+    ),
+}
+SORT_OPTIONS = tuple(PAGE_QUERIES)
+
+# Parts de les consultes de pàgina amb filtres (mateixos índexs que PAGE_QUERIES;
+# el filtre per empresa fa servir idx_product_company_price i el d'estoc els
+# índexs parcials idx_product_in_stock_*)
+KEYSET_CONDITIONS = {
+    'id': "id > ?",
+    'price': "(price_cents, id) > (?, ?)",
+    'name': "(name, id) > (?, ?)",
+}
+ORDER_COLUMNS = {'id': "id", 'price': "price_cents, id", 'name': "name, id"}
+# Límit superior de la franja més cara: amb un rang obert el planificador
+# estima que la franja és massa gran i recorre la taula en lloc de buscar a
+# idx_product_price (cap enter de SQLite el supera)
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+# Franges de preu en cèntims: (mínim inclòs, màxim exclòs o None). Els límits
+# són els de la taula ProductFacet (migració v9)
+PRICE_BANDS = tuple(zip((0,) + PRICE_BAND_LIMITS, PRICE_BAND_LIMITS + (None,)))
+
+# Recomptes de facetes (poques files: empreses x franges x disponibilitat).
+# L'empresa 0 agrupa els productes sense empresa (creats per l'administrador)
+FACETS_SQL = (
+    "SELECT f.company_id, f.price_band, f.in_stock, f.product_count, u.username "
+    "FROM ProductFacet f LEFT JOIN User u ON u.id = f.company_id"
+)
+
+# Cerca de text complet (taula FTS5 ProductSearch, migració v8)
+MAX_SEARCH_QUERY_LENGTH = 100
+MAX_SEARCH_TERMS = 8
+MAX_SEARCH_RESULTS = 1000
+SEARCH_IDS_SQL = (
+    "SELECT rowid FROM ProductSearch WHERE ProductSearch MATCH ? ORDER BY rank LIMIT ?"
+)
+# Productes d'una llista d'IDs en una sola consulta (pàgines de cerca i lots
+# de l'API): els IDs arriben com a llista JSON
+PRODUCTS_BY_IDS_SQL = (
+    "SELECT id, name, price_cents, stock FROM Product WHERE id IN (SELECT value FROM json_each(?))"
+)
+
+# Exportació del catàleg: files llegides del cursor per blocs
+EXPORT_SQL = "SELECT id, name, price_cents, stock FROM Product ORDER BY id"
+EXPORT_BATCH_SIZE = 1000
+
+
+def _sort_key(product: Product, sort: str) -> Tuple:
+    """Valors de l'última fila d'una pàgina que continuen la paginació."""
+    if sort == 'price':
+        return (product.price_cents, product.id)
+    if sort == 'name':
+        return (product.name, product.id)
+    return (product.id,)
+
+
+def encode_cursor(product: Product, sort: str) -> str:
+    """
+    Codificar la posició després d'un producte com a text opac per a la URL.
+    
+    Args:
+        product (Product): Darrer producte de la pàgina
+        sort (str): Ordenació ('id', 'price' o 'name')
+        
+    Returns:
+        str: Cursor en base64 (segur per a URLs)
+    """
+    data = json.dumps([sort, *_sort_key(product, sort)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, ...]:
+    """
+    Descodificar un cursor creat per encode_cursor().
+    
+    Args:
+        cursor (str): Cursor rebut a la URL
+        sort (str): Ordenació de la petició
+        
+    Returns:
+        Tuple: Valors de la clau (paràmetres de la consulta de pàgina següent)
+        
+    Raises:
+        ValueError: Si el cursor no és vàlid o és d'una altra ordenació
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Cursor de paginació no vàlid") from e
+    expected = 2 if sort == 'id' else 3
+    if not isinstance(data, list) or len(data) != expected or data[0] != sort or not isinstance(data[-1], int):
+        raise ValueError("Cursor de paginació no vàlid")
+    # Només valors simples: la clau també forma part de la clau dels fragments
+    if not all(value is None or isinstance(value, (int, float, str)) for value in data[1:]):
+        raise ValueError("Cursor de paginació no vàlid")
+    return tuple(data[1:])
+
+
+def _filter_conditions(price_band: Optional[int] = None, in_stock: bool = False,
+                       company_id: Optional[int] = None) -> Tuple[List[str], List[Any]]:
+    """
+    Condicions WHERE i paràmetres dels filtres del catàleg.
+    
+    Args:
+        price_band (int, optional): Índex de la franja de PRICE_BANDS
+        in_stock (bool): Només productes amb estoc
+        company_id (int, optional): Empresa propietària (0 = sense empresa)
+        
+    Returns:
+        Tuple[List[str], List[Any]]: (condicions, paràmetres)
+        
+    Raises:
+        ValueError: Si la franja de preu no existeix
+    """
+    conditions, params = [], []
+    if price_band is not None:
+        if not 0 <= price_band < len(PRICE_BANDS):
+            raise ValueError(f"Franja de preu no vàlida: {price_band}")
+        low, high = PRICE_BANDS[price_band]
+        conditions.append("price_cents >= ?")
+        params.append(low)
+        if high is not None:
+            conditions.append("price_cents < ?")
+            params.append(high)
+        else:
+            conditions.append("price_cents <= ?")
+            params.append(MAX_SQLITE_INTEGER)
+    if in_stock:
+        conditions.append("stock > 0")
+    if company_id is not None:
+        if company_id:
+            conditions.append("company_id = ?")
+            params.append(company_id)
+        else:
+            conditions.append("company_id IS NULL")
+    return conditions, params
+
+
+def _filtered_page_sql(sort: str, conditions: List[str], keyset: bool) -> str:
+    """
+    Consulta d'una pàgina del catàleg amb filtres.
+    
+    scripts/audit_query_plans.py l'expandeix amb totes les combinacions de
+    filtres per auditar-ne els plans.
+    
+    Args:
+        sort (str): Ordenació ('id', 'price' o 'name')
+        conditions (List[str]): Condicions de _filter_conditions()
+        keyset (bool): Si la pàgina continua després d'un cursor
+        
+    Returns:
+        str: Sentència amb paràmetres (filtres, clau del cursor i límit)
+    """
+    if keyset:
+        conditions = [*conditions, KEYSET_CONDITIONS[sort]]
+    return (f"SELECT id, name, price_cents, stock FROM Product WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {ORDER_COLUMNS[sort]} LIMIT ?")
+
+
+def normalize_query(query: Optional[str]) -> str:
+    """
+    Normalitzar una consulta de cerca (minúscules i espais simples).
+    
+    Consultes equivalents comparteixen així la mateixa entrada de la memòria cau.
+    
+    Args:
+        query (str): Text introduït per l'usuari
+        
+    Returns:
+        str: Consulta normalitzada (pot ser buida)
+    """
+    if not query:
+        return ''
+    return ' '.join(str(query).lower().split())[:MAX_SEARCH_QUERY_LENGTH]
+
+
+def _match_expression(query: str) -> str:
+    """
+    Expressió MATCH d'FTS5: cada paraula com a prefix entre cometes.
+    
+    Els accents s'eliminen com fa el tokenitzador de ProductSearch, de manera
+    que 'Portàtil' i 'portatil' comparteixen l'entrada de la memòria cau.
+    """
+    decomposed = unicodedata.normalize('NFKD', query)
+    query = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    terms = re.findall(r'\w+', query)[:MAX_SEARCH_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
 
 
 class ProductService:
@@ -14,35 +230,26 @@ class ProductService:
     
     def __init__(self, db_path: str = "techshop.db"):
         self.db_path = db_path
+        self.cache = get_catalog_cache(db_path)
     
     def get_all_products(self) -> List[Product]:
         """
         Obtenir tots els productes disponibles.
         
+        El llistat es serveix des de la memòria cau del catàleg (utils/cache.py)
+        i només es llegeix de la base de dades quan ha caducat o s'ha invalidat.
+        
         Returns:
             List[Product]: Llista de tots els productes
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, price, stock FROM Product ORDER BY id")
-                results = cursor.fetchall()
-                
-                products = []
-                for row in results:
-                    products.append(Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3]
-                    ))
-                return products
+            return self.cache.get_all_products(self._load_all_products)
         except sqlite3.Error:
             return []
     
     def get_product_by_id(self, product_id: int) -> Optional[Product]:
         """
-        Obtenir un producte per ID.
+        Obtenir un producte per ID (des de la memòria cau del catàleg).
         
         Args:
             product_id (int): ID del producte
@@ -51,25 +258,222 @@ class ProductService:
             Optional[Product]: Producte si existeix, None altrament
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            return self.cache.get_product(product_id, lambda: self._load_product(product_id))
+        except (sqlite3.Error, TypeError, ValueError):
+            return None
+    
+    def get_products_page(self, sort: str = 'id', after: Optional[str] = None,
+                          limit: int = PAGE_SIZE, price_band: Optional[int] = None,
+                          in_stock: bool = False,
+                          company_id: Optional[int] = None) -> Tuple[List[Product], Optional[str]]:
+        """
+        Obtenir una pàgina del catàleg amb paginació per conjunt de claus.
+        
+        A diferència d'OFFSET, el cost de cada pàgina no depèn de la seva
+        posició ni de la mida del catàleg: la consulta comença a l'índex just
+        després de l'últim producte de la pàgina anterior.
+        
+        Args:
+            sort (str): Ordenació ('id', 'price' o 'name')
+            after (str, optional): Cursor de la pàgina anterior (None per a la primera)
+            limit (int): Productes per pàgina (entre 1 i MAX_PAGE_SIZE)
+            price_band (int, optional): Filtrar per franja de preu (índex de PRICE_BANDS)
+            in_stock (bool): Només productes amb estoc
+            company_id (int, optional): Filtrar per empresa (0 = sense empresa)
+            
+        Returns:
+            Tuple[List[Product], Optional[str]]: (productes, cursor de la pàgina
+                següent o None si és l'última)
+            
+        Raises:
+            ValueError: Si l'ordenació, el cursor o la franja de preu no són vàlids
+        """
+        if sort not in PAGE_QUERIES:
+            raise ValueError(f"Ordenació no vàlida: {sort}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        key = decode_cursor(after, sort) if after else ()
+        conditions, params = _filter_conditions(price_band, in_stock, company_id)
+        if conditions:
+            sql = _filtered_page_sql(sort, conditions, bool(key))
+        else:
+            first_page_sql, next_page_sql = PAGE_QUERIES[sort]
+            sql = next_page_sql if key else first_page_sql
+        
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                # Es llegeix una fila de més per saber si hi ha pàgina següent
+                cursor.execute(sql, (*params, *key, limit + 1))
+                products = fetch_all(cursor, Product)
+        except sqlite3.Error:
+            return [], None
+        
+        if len(products) <= limit:
+            return products, None
+        products = products[:limit]
+        return products, encode_cursor(products[-1], sort)
+    
+    def get_facet_counts(self, price_band: Optional[int] = None, in_stock: bool = False,
+                         company_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Obtenir els recomptes de les facetes del catàleg per als filtres actius.
+        
+        Els recomptes surten de la taula ProductFacet (mantinguda per triggers,
+        migració v9) guardada a la memòria cau del catàleg, sense cap GROUP BY
+        sobre Product. Cada faceta es compta amb els altres filtres aplicats,
+        de manera que es veu quants productes quedarien en canviar-ne el valor.
+        
+        Args:
+            price_band (int, optional): Franja de preu seleccionada
+            in_stock (bool): Filtre de disponibilitat actiu
+            company_id (int, optional): Empresa seleccionada (0 = sense empresa)
+            
+        Returns:
+            Dict[str, Any]: 'price_band' {franja: n}, 'in_stock' {1|0: n},
+                'company' {company_id: n}, 'company_names' {company_id: nom}
+                i 'total' (productes que compleixen tots els filtres)
+        """
+        try:
+            rows = self.cache.get_facets(self._load_facets)
+        except sqlite3.Error:
+            rows = ()
+        
+        facets: Dict[str, Any] = {'price_band': {}, 'in_stock': {}, 'company': {}, 'company_names': {}, 'total': 0}
+        for company, band, stock, count, username in rows:
+            facets['company_names'][company] = username
+            match_company = company_id is None or company == company_id
+            match_band = price_band is None or band == price_band
+            match_stock = not in_stock or bool(stock)
+            if match_company and match_stock:
+                facets['price_band'][band] = facets['price_band'].get(band, 0) + count
+            if match_company and match_band:
+                facets['in_stock'][stock] = facets['in_stock'].get(stock, 0) + count
+            if match_band and match_stock:
+                facets['company'][company] = facets['company'].get(company, 0) + count
+            if match_company and match_band and match_stock:
+                facets['total'] += count
+        return facets
+    
+    def _load_facets(self) -> Tuple[Tuple[int, int, int, int, Optional[str]], ...]:
+        """Llegir els recomptes no buits de ProductFacet amb el nom de cada empresa."""
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(FACETS_SQL)
+            return tuple(row for row in cursor.fetchall() if row[3] > 0)
+    
+    def search_products(self, query: str, page: int = 1,
+                        limit: int = PAGE_SIZE) -> Tuple[List[Product], int]:
+        """
+        Cercar productes pel nom, ordenats per rellevància (bm25).
+        
+        La cerca fa servir l'índex FTS5 ProductSearch, sense recórrer la taula
+        Product. La llista d'IDs ordenats de cada consulta normalitzada es
+        guarda a la memòria cau del catàleg, de manera que canviar de pàgina o
+        repetir una cerca només llegeix les files de la pàgina.
+        
+        Args:
+            query (str): Text a cercar (cada paraula es tracta com a prefix)
+            page (int): Número de pàgina (començant per 1)
+            limit (int): Productes per pàgina (entre 1 i MAX_PAGE_SIZE)
+            
+        Returns:
+            Tuple[List[Product], int]: (productes de la pàgina, total de resultats)
+        """
+        expression = _match_expression(normalize_query(query))
+        if not expression:
+            return [], 0
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        page = max(1, int(page))
+        
+        try:
+            ids = self.cache.get_search_results(expression, lambda: self._search_ids(expression))
+            page_ids = ids[(page - 1) * limit:page * limit]
+            if not page_ids:
+                return [], len(ids)
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT id, name, price, stock FROM Product WHERE id = ?",
-                    (product_id,)
-                )
-                row = cursor.fetchone()
-                
-                if row:
-                    return Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3]
-                    )
+                cursor.execute(PRODUCTS_BY_IDS_SQL, (json.dumps(page_ids),))
+                by_id = {product.id: product for product in fetch_all(cursor, Product)}
         except sqlite3.Error:
-            pass
+            return [], 0
         
-        return None
+        # Mantenir l'ordre de rellevància (IN no conserva l'ordre de la llista)
+        return [by_id[product_id] for product_id in page_ids if product_id in by_id], len(ids)
+    
+    def get_products_batch(self, product_ids: List[int]) -> List[Product]:
+        """
+        Obtenir diversos productes per ID amb una sola consulta.
+        
+        Args:
+            product_ids (List[int]): IDs dels productes (com a molt MAX_PAGE_SIZE)
+            
+        Returns:
+            List[Product]: Productes existents en l'ordre demanat (sense repetits)
+            
+        Raises:
+            ValueError: Si hi ha més de MAX_PAGE_SIZE IDs o algun no és un enter
+        """
+        ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+        if len(ids) > MAX_PAGE_SIZE:
+            raise ValueError(f"Com a molt {MAX_PAGE_SIZE} productes per consulta")
+        if not ids:
+            return []
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(PRODUCTS_BY_IDS_SQL, (json.dumps(ids),))
+                by_id = {product.id: product for product in fetch_all(cursor, Product)}
+        except sqlite3.Error:
+            return []
+        return [by_id[product_id] for product_id in ids if product_id in by_id]
+    
+    def iter_products(self, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Product]:
+        """
+        Recórrer tot el catàleg per ordre d'ID amb memòria constant.
+        
+        Les files es llegeixen del cursor de SQLite per blocs de `batch_size`,
+        sense carregar el catàleg sencer ni passar per la memòria cau. La
+        connexió queda ocupada fins que s'acaba (o es tanca) el generador.
+        
+        Args:
+            batch_size (int): Files per lectura del cursor
+            
+        Yields:
+            Product: Cada producte del catàleg
+        """
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(EXPORT_SQL)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Product.from_row(row)
+    
+    def _search_ids(self, expression: str) -> Tuple[int, ...]:
+        """Llegir els IDs que coincideixen amb una cerca, del més al menys rellevant."""
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(SEARCH_IDS_SQL, (expression, MAX_SEARCH_RESULTS))
+            return tuple(row[0] for row in cursor.fetchall())
+    
+    def _load_all_products(self) -> List[Product]:
+        """Llegir tots els productes de la base de dades."""
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, price_cents, stock FROM Product ORDER BY id")
+            return fetch_all(cursor, Product)
+    
+    def _load_product(self, product_id: int) -> Optional[Product]:
+        """Llegir un producte de la base de dades."""
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, name, price_cents, stock FROM Product WHERE id = ?",
+                (product_id,)
+            )
+            return fetch_one(cursor, Product)
     
     def get_products_by_ids(self, product_ids: List[int]) -> List[Tuple[Product, int]]:
         """
@@ -90,27 +494,12 @@ class ProductService:
         else:
             items = product_ids
         
-        products_with_quantities = []
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                for product_id, quantity in items:
-                    cursor.execute(
-                        "SELECT id, name, price, stock FROM Product WHERE id = ?",
-                        (product_id,)
-                    )
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        product = Product(
-                            id=row[0],
-                            name=row[1],
-                            price=Decimal(str(row[2])),
-                            stock=row[3]
-                        )
-                        products_with_quantities.append((product, quantity))
+                cursor.execute(PRODUCTS_BY_IDS_SQL, (json.dumps([int(product_id) for product_id, _ in items]),))
+                by_id = {product.id: product for product in fetch_all(cursor, Product)}
         except sqlite3.Error:
-            pass
+            return []
         
-        return products_with_quantities
-
+        return [(by_id[int(product_id)], quantity) for product_id, quantity in items if int(product_id) in by_id]
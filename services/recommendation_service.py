@@ -1,13 +1,16 @@
 """
 Servei de recomanacions de productes basat en les vendes històriques.
 Implementa la lògica per obtenir els productes més venuts sense barrejar cap codi de presentació.
+Els resultats es guarden a una memòria cau que invaliden les comandes (família
+'order') i els canvis del catàleg.
 """
 
 import sqlite3
-from decimal import Decimal
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from models import Product
+from utils.cache import get_catalog_cache, get_entity_cache
+from utils.database import get_connection
 
 
 class RecommendationService:
@@ -21,6 +24,14 @@ class RecommendationService:
             db_path (str): Ruta a la base de dades SQLite.
         """
         self.db_path = db_path
+        self.catalog = get_catalog_cache(db_path)
+        self.cache = get_entity_cache(db_path, 'recommendations', ('order',))
+
+    def _cached(self, key: tuple, loader):
+        # La versió del catàleg recull al moment les comandes i els canvis de
+        # productes d'aquest procés; la família 'order' els dels altres
+        # Un error de lectura (None) no es guarda i es tracta com a llista buida
+        return list(self.cache.get(key + (self.catalog.version(),), loader) or [])
 
     def get_top_selling_products(self, limit: int = 3) -> List[Tuple[Product, int]]:
         """
@@ -34,13 +45,15 @@ class RecommendationService:
         """
         if limit <= 0:
             return []
+        return self._cached(('top', limit), lambda: self._load_top_selling(limit))
 
+    def _load_top_selling(self, limit: int) -> Optional[List[Tuple[Product, int]]]:
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """
-                    SELECT p.id, p.name, p.price, p.stock, SUM(oi.quantity) AS total_sold
+                    SELECT p.id, p.name, p.price_cents, p.stock, SUM(oi.quantity) AS total_sold
                     FROM OrderItem oi
                     INNER JOIN Product p ON p.id = oi.product_id
                     GROUP BY oi.product_id
@@ -49,23 +62,13 @@ class RecommendationService:
                     """,
                     (limit,),
                 )
-                rows = cursor.fetchall()
-
-                recommendations: List[Tuple[Product, int]] = []
-                for row in rows:
-                    product = Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3],
-                    )
-                    total_sold = int(row[4]) if row[4] is not None else 0
-                    recommendations.append((product, total_sold))
-
-                return recommendations
+                return [
+                    (Product.from_row(row), int(row[4] or 0))
+                    for row in cursor.fetchall()
+                ]
 
         except sqlite3.Error:
-            return []
+            return None
 
     def get_top_products_for_user(self, user_id: int, limit: int = 3) -> List[Tuple[Product, int]]:
         """
@@ -80,13 +83,15 @@ class RecommendationService:
         """
         if limit <= 0 or user_id is None:
             return []
+        return self._cached(('user', int(user_id), limit), lambda: self._load_top_for_user(user_id, limit))
 
+    def _load_top_for_user(self, user_id: int, limit: int) -> Optional[List[Tuple[Product, int]]]:
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """
-                    SELECT p.id, p.name, p.price, p.stock, SUM(oi.quantity) AS total_sold
+                    SELECT p.id, p.name, p.price_cents, p.stock, SUM(oi.quantity) AS total_sold
                     FROM "Order" o
                     INNER JOIN OrderItem oi ON oi.order_id = o.id
                     INNER JOIN Product p ON p.id = oi.product_id
@@ -97,21 +102,11 @@ class RecommendationService:
                     """,
                     (user_id, limit,),
                 )
-                rows = cursor.fetchall()
-
-                recommendations: List[Tuple[Product, int]] = []
-                for row in rows:
-                    product = Product(
-                        id=row[0],
-                        name=row[1],
-                        price=Decimal(str(row[2])),
-                        stock=row[3],
-                    )
-                    total_sold = int(row[4]) if row[4] is not None else 0
-                    recommendations.append((product, total_sold))
-
-                return recommendations
+                return [
+                    (Product.from_row(row), int(row[4] or 0))
+                    for row in cursor.fetchall()
+                ]
 
         except sqlite3.Error:
-            return []
+            return None
 
@@ -0,0 +1,122 @@
+"""
+Servei de reserves d'estoc
+Les línies dels carretons retenen unitats durant RESERVATION_TTL segons, de
+manera que les unitats disponibles d'un producte són stock menys les reserves
+vigents d'altres carretons (taula StockReservation, migració v13)
+"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+from utils.database import get_connection
+
+# Segons que una línia del carretó reté les seves unitats des de l'últim canvi
+RESERVATION_TTL = int(os.environ.get("RESERVATION_TTL", "900"))
+
+# Reservar només si hi ha prou unitats lliures: la comprovació i l'escriptura
+# són una sola sentència, de manera que dues reserves simultànies no poden
+# retenir les mateixes unitats
+RESERVE_SQL = """
+    INSERT INTO StockReservation (cart_id, product_id, quantity, expires_at)
+    SELECT ?, id, ?, ? FROM Product
+    WHERE id = ? AND stock - COALESCE((
+        SELECT SUM(quantity) FROM StockReservation
+        WHERE product_id = Product.id AND expires_at > ? AND cart_id != ?
+    ), 0) >= ?
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET
+        quantity = excluded.quantity, expires_at = excluded.expires_at
+"""
+# Unitats d'un producte retingudes per les reserves vigents dels altres
+# carretons (paràmetres: ara, carretó exclòs o None); la suma surt de l'índex
+# cobert de les reserves. També la fa servir el càlcul de preus del carretó
+HELD_BY_OTHERS_SQL = """COALESCE((
+        SELECT SUM(quantity) FROM StockReservation
+        WHERE product_id = Product.id AND expires_at > ? AND cart_id IS NOT ?
+    ), 0)"""
+# Unitats disponibles
+AVAILABLE_SQL = f"""
+    SELECT id, stock - {HELD_BY_OTHERS_SQL}
+    FROM Product WHERE id IN (SELECT value FROM json_each(?))
+"""
+RELEASE_CART_SQL = "DELETE FROM StockReservation WHERE cart_id = ?"
+RELEASE_LINE_SQL = "DELETE FROM StockReservation WHERE cart_id = ? AND product_id = ?"
+RELEASE_EXPIRED_SQL = "DELETE FROM StockReservation WHERE expires_at <= ?"
+
+
+class ReservationService:
+    """Servei per retenir i alliberar unitats d'estoc per carretó"""
+
+    def __init__(self, db_path: str = "techshop.db", ttl: int = RESERVATION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+
+    def reserve(self, cursor: sqlite3.Cursor, cart_id: int, product_id: int, quantity: int) -> bool:
+        """
+        Retenir `quantity` unitats d'un producte per a un carretó (substitueix la reserva anterior).
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor dins de la transacció del carretó
+            cart_id (int): ID del carretó
+            product_id (int): ID del producte
+            quantity (int): Unitats totals de la línia
+
+        Returns:
+            bool: True si s'han pogut retenir (False si no hi ha prou unitats lliures o el producte no existeix)
+        """
+        now = int(time.time())
+        cursor.execute(RESERVE_SQL, (cart_id, quantity, now + self.ttl, product_id, now, cart_id, quantity))
+        return cursor.rowcount > 0
+
+    def release(self, cursor: sqlite3.Cursor, cart_id: int, product_ids: Optional[Iterable[int]] = None):
+        """
+        Alliberar les reserves d'un carretó.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor dins de la transacció del carretó
+            cart_id (int): ID del carretó
+            product_ids (Iterable[int], optional): Productes a alliberar (None = tots)
+        """
+        if product_ids is None:
+            cursor.execute(RELEASE_CART_SQL, (cart_id,))
+        else:
+            cursor.executemany(RELEASE_LINE_SQL, [(cart_id, product_id) for product_id in product_ids])
+
+    def get_available(self, product_ids: List[int], cursor: Optional[sqlite3.Cursor] = None,
+                      exclude_cart_id: Optional[int] = None) -> Dict[int, int]:
+        """
+        Obtenir les unitats disponibles (stock menys reserves vigents) de diversos productes.
+
+        Args:
+            product_ids (List[int]): IDs dels productes
+            cursor (sqlite3.Cursor, optional): Cursor a reutilitzar (si no, s'obre una connexió)
+            exclude_cart_id (int, optional): Carretó les reserves del qual no es descompten
+
+        Returns:
+            Dict[int, int]: {product_id: unitats disponibles} (mai negatiu; sense els IDs inexistents)
+        """
+        if not product_ids:
+            return {}
+        params = (int(time.time()), exclude_cart_id, json.dumps([int(product_id) for product_id in product_ids]))
+        if cursor is None:
+            with get_connection(self.db_path) as conn:
+                rows = conn.execute(AVAILABLE_SQL, params).fetchall()
+        else:
+            rows = cursor.execute(AVAILABLE_SQL, params).fetchall()
+        return {product_id: max(available, 0) for product_id, available in rows}
+
+    def release_expired(self) -> int:
+        """
+        Alliberar en bloc totes les reserves caducades.
+
+        Les reserves caducades ja no compten com a retingudes; eliminar-les
+        només manté la taula petita.
+
+        Returns:
+            int: Nombre de reserves eliminades
+        """
+        with get_connection(self.db_path) as conn:
+            released = conn.execute(RELEASE_EXPIRED_SQL, (int(time.time()),)).rowcount
+            conn.commit()
+        return released
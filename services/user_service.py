@@ -8,9 +8,11 @@ import secrets
 import string
 from typing import Tuple, Optional, List
 from models import User
-from datetime import datetime
+from models.mapper import fetch_one
 from utils.validators import validar_dni_nie, validar_cif_nif
 from werkzeug.security import generate_password_hash
+from utils.cache import get_entity_cache
+from utils.database import get_connection
 
 
 class UserService:
@@ -18,6 +20,9 @@ class UserService:
     
     def __init__(self, db_path: str = "techshop.db"):
         self.db_path = db_path
+        # Usuaris per ID (get_current_user es consulta a cada petició); un
+        # canvi de la família 'user' d'un altre procés la buida
+        self.cache = get_entity_cache(db_path, 'users', ('user',))
     
     def update_user_profile(self, user_id: int, username: str, email: str, 
                            address: str, dni: str = "", nif: str = "") -> Tuple[bool, str]:
@@ -44,7 +49,7 @@ class UserService:
         # Validar DNI/NIF segons el tipus de compte
         cursor = None
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT account_type FROM User WHERE id = ?", (user_id,))
                 result = cursor.fetchone()
@@ -60,7 +65,7 @@ class UserService:
             pass  # Continuar amb la validació normal
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Verificar si el username ya existe en otro usuario
@@ -81,55 +86,43 @@ class UserService:
                 
                 # Verificar si el DNI ya existe en otro usuario (si se proporciona)
                 if dni:
-                    try:
-                        cursor.execute(
-                            "SELECT id FROM User WHERE dni = ? AND id != ?",
-                            (dni.strip().upper(), user_id)
-                        )
-                        if cursor.fetchone():
-                            return False, "Aquest DNI/NIE ja està registrat en un altre compte"
-                    except sqlite3.OperationalError:
-                        pass  # Si la columna DNI no existe, continuar
+                    cursor.execute(
+                        "SELECT id FROM User WHERE dni = ? AND id != ?",
+                        (dni.strip().upper(), user_id)
+                    )
+                    if cursor.fetchone():
+                        return False, "Aquest DNI/NIE ja està registrat en un altre compte"
                 
                 # Verificar si el NIF ya existe en otro usuario (si se proporciona)
                 if nif:
-                    try:
-                        cursor.execute(
-                            "SELECT id FROM User WHERE nif = ? AND id != ?",
-                            (nif.strip().upper(), user_id)
-                        )
-                        if cursor.fetchone():
-                            return False, "Aquest NIF/CIF ja està registrat en un altre compte"
-                    except sqlite3.OperationalError:
-                        pass  # Si la columna NIF no existe, continuar
+                    cursor.execute(
+                        "SELECT id FROM User WHERE nif = ? AND id != ?",
+                        (nif.strip().upper(), user_id)
+                    )
+                    if cursor.fetchone():
+                        return False, "Aquest NIF/CIF ja està registrat en un altre compte"
                 
                 # Obtener account_type del usuario
                 cursor.execute("SELECT account_type FROM User WHERE id = ?", (user_id,))
                 result = cursor.fetchone()
                 account_type = result[0] if result and result[0] else 'user'
                 
-                # Actualizar según las columnas disponibles
-                try:
-                    if account_type == 'company':
-                        cursor.execute(
-                            "UPDATE User SET username = ?, email = ?, address = ?, nif = ? WHERE id = ?",
-                            (username.strip(), email.strip(), address.strip(), nif.strip(), user_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE User SET username = ?, email = ?, address = ?, dni = ? WHERE id = ?",
-                            (username.strip(), email.strip(), address.strip(), dni.strip(), user_id)
-                        )
-                except sqlite3.OperationalError:
-                    # Si las columnas DNI/NIF no existen, actualizar sin ellas
+                # Actualizar según el tipo de cuenta
+                if account_type == 'company':
+                    cursor.execute(
+                        "UPDATE User SET username = ?, email = ?, address = ?, nif = ? WHERE id = ?",
+                        (username.strip(), email.strip(), address.strip(), nif.strip(), user_id)
+                    )
+                else:
                     cursor.execute(
-                        "UPDATE User SET username = ?, email = ?, address = ? WHERE id = ?",
-                        (username.strip(), email.strip(), address.strip(), user_id)
+                        "UPDATE User SET username = ?, email = ?, address = ?, dni = ? WHERE id = ?",
+                        (username.strip(), email.strip(), address.strip(), dni.strip(), user_id)
                     )
                 
                 if cursor.rowcount == 0:
                     return False, "Usuari no trobat"
                 conn.commit()
+                self.cache.delete(int(user_id))
                 return True, "Perfil actualitzat correctament"
         except sqlite3.Error as e:
             return False, f"Error actualitzant el perfil: {str(e)}"
@@ -145,38 +138,23 @@ class UserService:
             Tuple[bool, List[str]]: (hi ha dades faltants, llista de camps faltants)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Obtener datos del usuario
-                try:
-                    cursor.execute(
-                        "SELECT account_type, email, address, dni, nif FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if not result:
-                        return True, ["usuari_no_trobat"]
-                    
-                    account_type = result[0] or "user"
-                    email = result[1]
-                    address = result[2]
-                    dni = result[3]
-                    nif = result[4]
-                except sqlite3.OperationalError:
-                    # Si las columnas no existen, verificar solo campos básicos
-                    cursor.execute(
-                        "SELECT email, address FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if not result:
-                        return True, ["usuari_no_trobat"]
-                    email = result[0]
-                    address = result[1]
-                    account_type = "user"
-                    dni = ""
-                    nif = ""
+                cursor.execute(
+                    "SELECT account_type, email, address, dni, nif FROM User WHERE id = ?",
+                    (user_id,)
+                )
+                result = cursor.fetchone()
+                if not result:
+                    return True, ["usuari_no_trobat"]
+                
+                account_type = result[0] or "user"
+                email = result[1]
+                address = result[2]
+                dni = result[3]
+                nif = result[4]
                 
                 missing_fields = []
                 
@@ -209,48 +187,20 @@ class UserService:
             user_id (int): ID de l'usuari
             
         Returns:
-            User o None: L'usuari si existeix, None altrament
+            User o None: L'usuari si existeix, None altrament (compartit amb
+                la memòria cau, s'ha de tractar com a només lectura)
         """
+        return self.cache.get(int(user_id), lambda: self._load_user(user_id))
+    
+    def _load_user(self, user_id: int) -> Optional[User]:
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                try:
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if result and len(result) >= 9:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role=result[4] if result[4] else "common",
-                            account_type=result[5] if result[5] else "user",
-                            dni=result[6] if result[6] else "",
-                            nif=result[7] if result[7] else "",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[8]) if result[8] else datetime.now()
-                        )
-                except sqlite3.OperationalError:
-                    # Sin DNI/NIF
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, created_at FROM User WHERE id = ?",
-                        (user_id,)
-                    )
-                    result = cursor.fetchone()
-                    if result and len(result) >= 7:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role=result[4] if result[4] else "common",
-                            account_type=result[5] if result[5] else "user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[6]) if result[6] else datetime.now()
-                        )
+                cursor.execute(
+                    "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User WHERE id = ?",
+                    (user_id,)
+                )
+                return fetch_one(cursor, User)
         except sqlite3.Error:
             pass
         
@@ -267,45 +217,13 @@ class UserService:
             User o None: L'usuari si existeix, None altrament
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                try:
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User WHERE email = ?",
-                        (email.lower(),)
-                    )
-                    result = cursor.fetchone()
-                    if result and len(result) >= 9:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role=result[4] if result[4] else "common",
-                            account_type=result[5] if result[5] else "user",
-                            dni=result[6] if result[6] else "",
-                            nif=result[7] if result[7] else "",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[8]) if result[8] else datetime.now()
-                        )
-                except sqlite3.OperationalError:
-                    # Sin DNI/NIF
-                    cursor.execute(
-                        "SELECT id, username, email, address, role, account_type, created_at FROM User WHERE email = ?",
-                        (email.lower(),)
-                    )
-                    result = cursor.fetchone()
-                    if result and len(result) >= 7:
-                        return User(
-                            id=result[0],
-                            username=result[1],
-                            email=result[2] if result[2] else "",
-                            address=result[3] if result[3] else "",
-                            role=result[4] if result[4] else "common",
-                            account_type=result[5] if result[5] else "user",
-                            password_hash="",
-                            created_at=datetime.fromisoformat(result[6]) if result[6] else datetime.now()
-                        )
+                cursor.execute(
+                    "SELECT id, username, email, address, role, account_type, dni, nif, created_at FROM User WHERE email = ?",
+                    (email.lower(),)
+                )
+                return fetch_one(cursor, User)
         except sqlite3.Error:
             pass
         
@@ -333,18 +251,14 @@ class UserService:
             return False, "Email no vàlid"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Buscar usuari per DNI i email (han de coincidir)
-                try:
-                    cursor.execute(
-                        "SELECT id, username, email FROM User WHERE dni = ? AND email = ?",
-                        (dni.upper(), email.strip().lower())
-                    )
-                except sqlite3.OperationalError:
-                    # Si la columna DNI no existe, retornar error
-                    return False, "El sistema no suporta la recuperació de contrasenya per DNI"
+                cursor.execute(
+                    "SELECT id, username, email FROM User WHERE dni = ? AND email = ?",
+                    (dni.upper(), email.strip().lower())
+                )
                 
                 result = cursor.fetchone()
                 
@@ -395,55 +309,21 @@ class UserService:
         from werkzeug.security import check_password_hash
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
-                try:
-                    cursor.execute(
-                        "SELECT id, username, password_hash, email, address, role, account_type, dni, nif, created_at FROM User WHERE username = ?",
-                        (username,)
-                    )
-                    result = cursor.fetchone()
-                except sqlite3.OperationalError:
-                    cursor.execute(
-                        "SELECT id, username, password_hash, email, address, role, account_type, created_at FROM User WHERE username = ?",
-                        (username,)
-                    )
-                    result = cursor.fetchone()
+                cursor.execute(
+                    "SELECT id, username, email, address, role, account_type, dni, nif, created_at, password_hash FROM User WHERE username = ?",
+                    (username,)
+                )
+                result = cursor.fetchone()
                 
                 if not result:
                     return False, None, "Nom d'usuari o contrasenya incorrectes"
                 
-                user_id = result[0]
-                stored_hash = result[2]
-                
-                if not check_password_hash(stored_hash, password):
+                if not check_password_hash(result[9], password):
                     return False, None, "Nom d'usuari o contrasenya incorrectes"
                 
-                # Construir objecte User
-                try:
-                    user = User(
-                        id=result[0],
-                        username=result[1],
-                        email=result[3] if result[3] else "",
-                        address=result[4] if result[4] else "",
-                        role=result[5] if result[5] else "common",
-                        account_type=result[6] if result[6] else "user",
-                        dni=result[7] if len(result) > 7 and result[7] else "",
-                        nif=result[8] if len(result) > 8 and result[8] else "",
-                        password_hash="",
-                        created_at=datetime.fromisoformat(result[9] if len(result) > 9 and result[9] else datetime.now().isoformat())
-                    )
-                except (IndexError, ValueError):
-                    user = User(
-                        id=result[0],
-                        username=result[1],
-                        email=result[3] if len(result) > 3 and result[3] else "",
-                        address=result[4] if len(result) > 4 and result[4] else "",
-                        role=result[5] if len(result) > 5 and result[5] else "common",
-                        account_type=result[6] if len(result) > 6 and result[6] else "user",
-                        password_hash="",
-                        created_at=datetime.fromisoformat(result[7] if len(result) > 7 and result[7] else datetime.now().isoformat())
-                    )
+                user = User.from_row(result)
                 
                 return True, user, "Autenticació correcta"
         except sqlite3.Error as e:
@@ -466,7 +346,7 @@ class UserService:
         from werkzeug.security import generate_password_hash
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Comprovar si l'usuari ja existeix
@@ -480,14 +360,12 @@ class UserService:
                         return False, None, "Contrasenya incorrecta per a l'usuari indicat"
                     
                     # Actualitzar dades de contacte
-                    try:
-                        cursor.execute(
-                            "UPDATE User SET email = ?, address = ? WHERE id = ?",
-                            (email, address, user_id)
-                        )
-                    except sqlite3.OperationalError:
-                        pass
+                    cursor.execute(
+                        "UPDATE User SET email = ?, address = ? WHERE id = ?",
+                        (email, address, user_id)
+                    )
                     conn.commit()
+                    self.cache.delete(int(user_id))
                     
                     # Obtenir usuari actualitzat
                     user = self.get_user_by_id(user_id)
@@ -495,18 +373,11 @@ class UserService:
                 else:
                     # Registrar nou usuari
                     password_hash = generate_password_hash(password, method="pbkdf2:sha256")
-                    try:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
-                            "VALUES (?, ?, ?, ?, 'common', 'user', datetime('now'))",
-                            (username, password_hash, email, address)
-                        )
-                    except sqlite3.OperationalError:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, created_at) "
-                            "VALUES (?, ?, ?, ?, datetime('now'))",
-                            (username, password_hash, email, address)
-                        )
+                    cursor.execute(
+                        "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
+                        "VALUES (?, ?, ?, ?, 'common', 'user', datetime('now'))",
+                        (username, password_hash, email, address)
+                    )
                     
                     user_id = cursor.lastrowid
                     conn.commit()
@@ -557,7 +428,7 @@ class UserService:
                 return False, None, "DNI/NIE no vàlid. Format esperat: 8 números + lletra (DNI) o X/Y/Z + 7 números + lletra (NIE)"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Comprovar si l'usuari ja existeix
@@ -572,44 +443,23 @@ class UserService:
                 
                 # Comprovar si el DNI ja existeix (si s'ha proporcionat)
                 if dni:
-                    try:
-                        cursor.execute("SELECT id FROM User WHERE dni = ? AND id != ?", (dni.strip().upper(), 0))
-                        if cursor.fetchone():
-                            return False, None, "Aquest DNI/NIE ja està registrat en un altre compte"
-                    except sqlite3.OperationalError:
-                        pass  # Si la columna DNI no existe, continuar
+                    cursor.execute("SELECT id FROM User WHERE dni = ? AND id != ?", (dni.strip().upper(), 0))
+                    if cursor.fetchone():
+                        return False, None, "Aquest DNI/NIE ja està registrat en un altre compte"
                 
                 # Comprovar si el NIF ja existeix (si s'ha proporcionat)
                 if nif:
-                    try:
-                        cursor.execute("SELECT id FROM User WHERE nif = ? AND id != ?", (nif.strip().upper(), 0))
-                        if cursor.fetchone():
-                            return False, None, "Aquest NIF/CIF ja està registrat en un altre compte"
-                    except sqlite3.OperationalError:
-                        pass  # Si la columna NIF no existe, continuar
+                    cursor.execute("SELECT id FROM User WHERE nif = ? AND id != ?", (nif.strip().upper(), 0))
+                    if cursor.fetchone():
+                        return False, None, "Aquest NIF/CIF ja està registrat en un altre compte"
                 
                 # Crear usuari
                 password_hash = generate_password_hash(password, method="pbkdf2:sha256")
-                try:
-                    cursor.execute(
-                        "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, nif, created_at) "
-                        "VALUES (?, ?, ?, ?, 'common', ?, ?, ?, datetime('now'))",
-                        (username.strip(), password_hash, email.strip(), address.strip(), account_type, dni.strip(), nif.strip())
-                    )
-                except sqlite3.OperationalError:
-                    # Si las columnas no existen, insertar sin ellas
-                    try:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
-                            "VALUES (?, ?, ?, ?, 'common', ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip(), account_type)
-                        )
-                    except sqlite3.OperationalError:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, created_at) "
-                            "VALUES (?, ?, ?, ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip(), address.strip())
-                        )
+                cursor.execute(
+                    "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, nif, created_at) "
+                    "VALUES (?, ?, ?, ?, 'common', ?, ?, ?, datetime('now'))",
+                    (username.strip(), password_hash, email.strip(), address.strip(), account_type, dni.strip(), nif.strip())
+                )
                 
                 user_id = cursor.lastrowid
                 conn.commit()
@@ -660,7 +510,7 @@ class UserService:
             return False, None, "DNI/NIE no vàlid"
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Comprovar si l'usuari ja existeix
@@ -675,36 +525,25 @@ class UserService:
                 
                 # Comprovar si el DNI ja existeix (si s'ha proporcionat)
                 if dni:
-                    try:
-                        cursor.execute("SELECT id FROM User WHERE dni = ? AND id != ?", (dni.strip().upper(), 0))
-                        if cursor.fetchone():
-                            return False, None, "Aquest DNI/NIE ja està registrat en un altre compte"
-                    except sqlite3.OperationalError:
-                        pass  # Si la columna DNI no existe, continuar
+                    cursor.execute("SELECT id FROM User WHERE dni = ? AND id != ?", (dni.strip().upper(), 0))
+                    if cursor.fetchone():
+                        return False, None, "Aquest DNI/NIE ja està registrat en un altre compte"
                 
                 # Crear usuari sense contrasenya (OAuth)
                 # Generar un hash aleatori per a la contrasenya (no s'utilitzarà)
                 random_password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
                 password_hash = generate_password_hash(random_password, method="pbkdf2:sha256")
                 
-                try:
-                    if dni:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, created_at) "
-                            "VALUES (?, ?, ?, ?, 'common', 'user', ?, datetime('now'))",
-                            (username.strip(), password_hash, email.strip().lower(), address.strip(), dni.strip().upper())
-                        )
-                    else:
-                        cursor.execute(
-                            "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
-                            "VALUES (?, ?, ?, ?, 'common', 'user', datetime('now'))",
-                            (username.strip(), password_hash, email.strip().lower(), address.strip())
-                        )
-                except sqlite3.OperationalError:
-                    # Si las columnas no existen, insertar sin ellas
+                if dni:
+                    cursor.execute(
+                        "INSERT INTO User (username, password_hash, email, address, role, account_type, dni, created_at) "
+                        "VALUES (?, ?, ?, ?, 'common', 'user', ?, datetime('now'))",
+                        (username.strip(), password_hash, email.strip().lower(), address.strip(), dni.strip().upper())
+                    )
+                else:
                     cursor.execute(
-                        "INSERT INTO User (username, password_hash, email, address, created_at) "
-                        "VALUES (?, ?, ?, ?, datetime('now'))",
+                        "INSERT INTO User (username, password_hash, email, address, role, account_type, created_at) "
+                        "VALUES (?, ?, ?, ?, 'common', 'user', datetime('now'))",
                         (username.strip(), password_hash, email.strip().lower(), address.strip())
                     )
                 
@@ -740,7 +579,7 @@ class UserService:
             Tuple[bool, str]: (èxit, missatge)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # Verificar que el usuario existe
@@ -761,6 +600,7 @@ class UserService:
                 cursor.execute("DELETE FROM User WHERE id = ?", (user_id,))
                 
                 conn.commit()
+                self.cache.delete(int(user_id))
                 return True, "Compte eliminat correctament"
         except sqlite3.Error as e:
             return False, f"Error eliminant el compte: {str(e)}"
@@ -12,12 +12,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Validació dels camps de quantitat
-    const quantityInputs = document.querySelectorAll('.quantity-input');
-    quantityInputs.forEach(input => {
-        input.addEventListener('input', function() {
-            validateQuantityInput(this);
-        });
-    });
+    bindQuantityInputs(document);
 
     // Carrusel de tendències
     const trendCarousels = document.querySelectorAll('.trend-carousel');
@@ -69,63 +64,118 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Galeria de productes: canviar imatge principal segons miniatures
-    const productCards = document.querySelectorAll('.product-card');
-    productCards.forEach(card => {
-        const mainImage = card.querySelector('.product-main-image');
-        if (!mainImage) return;
+    document.querySelectorAll('.product-card').forEach(initProductGallery);
 
-        const defaultSrc = mainImage.getAttribute('data-default') || mainImage.getAttribute('src');
-        const thumbs = Array.from(card.querySelectorAll('.product-thumb'));
-        const gallery = card.querySelector('.product-gallery');
+    // Animació d'afegir al carretó
+    bindAddToCartForms(document);
 
-        if (thumbs.length === 0) {
-            return;
-        }
+    // Formularis del carretó enviats com a JSON (sense recarregar la pàgina)
+    bindCartForms(document);
 
-        const setActiveThumb = (activeThumb) => {
-            thumbs.forEach(thumb => thumb.classList.remove('is-active'));
-            if (activeThumb) {
-                activeThumb.classList.add('is-active');
-            }
-        };
+    // Desplaçament infinit del catàleg
+    initInfiniteScroll();
 
-        const defaultThumb = thumbs.find(thumb => thumb.dataset.image === defaultSrc) || thumbs[0];
+    // Pàgines anteriors de l'historial de comandes del perfil
+    initOrderHistoryPaging();
 
-        thumbs.forEach(thumb => {
-            const targetSrc = thumb.dataset.image;
-            if (!targetSrc) {
-                return;
-            }
+    // Gestió del checkout: mostrar/ocultar seccions segons l'elecció
+    const btnLogin = document.getElementById('btn-login');
+    const btnGuest = document.getElementById('btn-guest');
+    const btnBackFromLogin = document.getElementById('btn-back-from-login');
+    const btnBackFromGuest = document.getElementById('btn-back-from-guest');
+    const checkoutChoice = document.getElementById('checkout-choice');
+    const loginSection = document.getElementById('login-section');
+    const guestSection = document.getElementById('guest-section');
 
-            const showImage = () => {
-                mainImage.src = targetSrc;
-                setActiveThumb(thumb);
-            };
+    if (btnLogin && checkoutChoice && loginSection) {
+        btnLogin.addEventListener('click', function() {
+            checkoutChoice.style.display = 'none';
+            loginSection.style.display = 'block';
+        });
+    }
 
-            thumb.addEventListener('mouseenter', showImage);
-            thumb.addEventListener('focus', showImage);
+    if (btnGuest && checkoutChoice && guestSection) {
+        btnGuest.addEventListener('click', function() {
+            checkoutChoice.style.display = 'none';
+            guestSection.style.display = 'block';
         });
+    }
 
-        const resetToDefault = () => {
-            mainImage.src = defaultSrc;
-            setActiveThumb(defaultThumb);
-        };
+    if (btnBackFromLogin && checkoutChoice && loginSection) {
+        btnBackFromLogin.addEventListener('click', function() {
+            loginSection.style.display = 'none';
+            checkoutChoice.style.display = 'block';
+        });
+    }
 
-        if (gallery) {
-            gallery.addEventListener('mouseleave', resetToDefault);
-            gallery.addEventListener('focusout', (event) => {
-                if (!gallery.contains(event.relatedTarget)) {
-                    resetToDefault();
-                }
-            });
+    if (btnBackFromGuest && checkoutChoice && guestSection) {
+        btnBackFromGuest.addEventListener('click', function() {
+            guestSection.style.display = 'none';
+            checkoutChoice.style.display = 'block';
+        });
+    }
+});
+
+/**
+ * Galeria d'una targeta de producte: canviar imatge principal segons miniatures
+ */
+function initProductGallery(card) {
+    const mainImage = card.querySelector('.product-main-image');
+    if (!mainImage) return;
+
+    const defaultSrc = mainImage.getAttribute('data-default') || mainImage.getAttribute('src');
+    const thumbs = Array.from(card.querySelectorAll('.product-thumb'));
+    const gallery = card.querySelector('.product-gallery');
+
+    if (thumbs.length === 0) {
+        return;
+    }
+
+    const setActiveThumb = (activeThumb) => {
+        thumbs.forEach(thumb => thumb.classList.remove('is-active'));
+        if (activeThumb) {
+            activeThumb.classList.add('is-active');
         }
+    };
+
+    const defaultThumb = thumbs.find(thumb => thumb.dataset.image === defaultSrc) || thumbs[0];
+
+    thumbs.forEach(thumb => {
+        const targetSrc = thumb.dataset.image;
+        if (!targetSrc) {
+            return;
+        }
+
+        const showImage = () => {
+            mainImage.src = targetSrc;
+            setActiveThumb(thumb);
+        };
+
+        thumb.addEventListener('mouseenter', showImage);
+        thumb.addEventListener('focus', showImage);
     });
 
-    // Animació d'afegir al carretó
-    const cartIcon = document.getElementById('cart-icon');
-    const addToCartForms = document.querySelectorAll('.add-to-cart-form');
+    const resetToDefault = () => {
+        mainImage.src = defaultSrc;
+        setActiveThumb(defaultThumb);
+    };
+
+    if (gallery) {
+        gallery.addEventListener('mouseleave', resetToDefault);
+        gallery.addEventListener('focusout', (event) => {
+            if (!gallery.contains(event.relatedTarget)) {
+                resetToDefault();
+            }
+        });
+    }
+}
 
-    addToCartForms.forEach(form => {
+/**
+ * Animació d'afegir al carretó per als formularis de dins de root
+ */
+function bindAddToCartForms(root) {
+    const cartIcon = document.getElementById('cart-icon');
+    root.querySelectorAll('.add-to-cart-form').forEach(form => {
         form.addEventListener('submit', function(event) {
             if (!cartIcon) {
                 return;
@@ -168,49 +218,220 @@ document.addEventListener('DOMContentLoaded', function() {
                 cartIcon.classList.remove('cart-icon-bump');
             }, 600);
 
-            setTimeout(() => {
-                HTMLFormElement.prototype.submit.call(form);
-            }, 350);
+            // Amb data-cart-url el formulari l'envia bindCartForms
+            if (!form.dataset.cartUrl) {
+                setTimeout(() => {
+                    HTMLFormElement.prototype.submit.call(form);
+                }, 350);
+            }
         });
     });
+}
 
-    // Gestió del checkout: mostrar/ocultar seccions segons l'elecció
-    const btnLogin = document.getElementById('btn-login');
-    const btnGuest = document.getElementById('btn-guest');
-    const btnBackFromLogin = document.getElementById('btn-back-from-login');
-    const btnBackFromGuest = document.getElementById('btn-back-from-guest');
-    const checkoutChoice = document.getElementById('checkout-choice');
-    const loginSection = document.getElementById('login-section');
-    const guestSection = document.getElementById('guest-section');
-
-    if (btnLogin && checkoutChoice && loginSection) {
-        btnLogin.addEventListener('click', function() {
-            checkoutChoice.style.display = 'none';
-            loginSection.style.display = 'block';
+/**
+ * Enviar els formularis del carretó (data-cart-url) a /cart/lines en JSON
+ * i actualitzar la pàgina amb el carretó retornat. Si la petició falla per
+ * la xarxa, el formulari s'envia de la manera habitual.
+ */
+function bindCartForms(root) {
+    root.querySelectorAll('form[data-cart-url]').forEach(form => {
+        form.addEventListener('submit', function(event) {
+            event.preventDefault();
+            const mode = form.dataset.cartMode || 'set';
+            const quantityInput = form.querySelector('[name="quantity"]');
+            if (quantityInput && !validateQuantityInput(quantityInput)) {
+                return;
+            }
+            const line = {
+                product_id: parseInt(form.querySelector('[name="product_id"]').value, 10),
+                quantity: quantityInput ? parseInt(quantityInput.value, 10) : 0
+            };
+            const csrfInput = form.querySelector('[name="csrf_token"]');
+
+            updateCartLines(form.dataset.cartUrl, [line], mode, csrfInput ? csrfInput.value : '')
+                .then(({ ok, data }) => {
+                    if (!ok) {
+                        showError(data.error);
+                        return;
+                    }
+                    showConfirmation(data.message);
+                    if (mode === 'set') {
+                        renderCheckoutCart(form, data.cart);
+                    }
+                })
+                .catch(() => HTMLFormElement.prototype.submit.call(form));
         });
-    }
+    });
+}
 
-    if (btnGuest && checkoutChoice && guestSection) {
-        btnGuest.addEventListener('click', function() {
-            checkoutChoice.style.display = 'none';
-            guestSection.style.display = 'block';
-        });
+/**
+ * Aplicar un lot de canvis al carretó amb una sola petició JSON
+ * (mode 'add' suma les quantitats; 'set' les fixa i 0 elimina la línia)
+ */
+function updateCartLines(url, lines, mode, csrfToken) {
+    return fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'X-CSRFToken': csrfToken
+        },
+        body: JSON.stringify({ mode: mode, lines: lines })
+    }).then(response => {
+        if (response.status >= 500 || !(response.headers.get('Content-Type') || '').includes('json')) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json().then(data => ({ ok: response.ok, data: data }));
+    });
+}
+
+/**
+ * Actualitzar el resum del checkout amb el carretó retornat pel servidor
+ */
+function renderCheckoutCart(form, cart) {
+    const productId = parseInt(form.querySelector('[name="product_id"]').value, 10);
+    if (!cart.lines.some(line => line.product_id === productId)) {
+        const item = form.closest('.cart-item');
+        if (item) {
+            item.remove();
+        }
+    }
+    if (cart.lines.length === 0) {
+        // El checkout buit es mostra amb la plantilla del servidor
+        window.location.reload();
+        return;
+    }
+    const total = document.querySelector('.cart-total-amount');
+    if (total) {
+        total.textContent = cart.total;
     }
+}
 
-    if (btnBackFromLogin && checkoutChoice && loginSection) {
-        btnBackFromLogin.addEventListener('click', function() {
-            loginSection.style.display = 'none';
-            checkoutChoice.style.display = 'block';
+/**
+ * Validació dels camps de quantitat de dins de root
+ */
+function bindQuantityInputs(root) {
+    root.querySelectorAll('.quantity-input').forEach(input => {
+        input.addEventListener('input', function() {
+            validateQuantityInput(this);
         });
+    });
+}
+
+/**
+ * Carregar més pàgines del catàleg en arribar al final de la llista
+ * (/products/page retorna les targetes ja renderitzades i la URL següent)
+ */
+function initInfiniteScroll() {
+    const more = document.querySelector('.products-more');
+    const grid = document.querySelector('.products-grid');
+    if (!more || !grid || !('IntersectionObserver' in window)) {
+        return;
     }
 
-    if (btnBackFromGuest && checkoutChoice && guestSection) {
-        btnBackFromGuest.addEventListener('click', function() {
-            guestSection.style.display = 'none';
-            checkoutChoice.style.display = 'block';
-        });
+    let loading = false;
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadNextPage();
+        }
+    }, { rootMargin: '400px' });
+
+    const loadNextPage = () => {
+        const url = more.dataset.nextUrl;
+        if (loading || !url) {
+            return;
+        }
+        loading = true;
+        more.classList.add('is-loading');
+
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                const template = document.createElement('template');
+                template.innerHTML = data.html;
+                const cards = Array.from(template.content.querySelectorAll('.product-card'));
+                cards.forEach(card => {
+                    grid.appendChild(card);
+                    initProductGallery(card);
+                    bindAddToCartForms(card);
+                    bindCartForms(card);
+                    bindQuantityInputs(card);
+                });
+
+                if (data.next_url) {
+                    more.dataset.nextUrl = data.next_url;
+                } else {
+                    observer.disconnect();
+                    more.remove();
+                }
+            })
+            .catch(() => {
+                // L'enllaç "Carregar més" continua funcionant sense JavaScript
+                observer.disconnect();
+            })
+            .finally(() => {
+                loading = false;
+                more.classList.remove('is-loading');
+            });
+    };
+
+    observer.observe(more);
+}
+
+/**
+ * Carregar les comandes anteriors de l'historial en prémer "Carregar més"
+ * (/profile/orders.json retorna les comandes ja renderitzades i la URL següent)
+ */
+function initOrderHistoryPaging() {
+    const more = document.querySelector('.orders-more');
+    const list = document.querySelector('.orders-list');
+    if (!more || !list) {
+        return;
     }
-});
+    const link = more.querySelector('a');
+
+    link.addEventListener('click', event => {
+        const url = more.dataset.nextUrl;
+        if (!url || more.classList.contains('is-loading')) {
+            return;
+        }
+        event.preventDefault();
+        more.classList.add('is-loading');
+
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                const template = document.createElement('template');
+                template.innerHTML = data.html;
+                template.content.querySelectorAll('.order-card').forEach(card => list.appendChild(card));
+
+                if (data.next_url) {
+                    more.dataset.nextUrl = data.next_url;
+                    link.href = link.href.replace(/after=[^&]*/, `after=${encodeURIComponent(data.next)}`);
+                } else {
+                    more.remove();
+                }
+            })
+            .catch(() => {
+                // Sense JSON, l'enllaç carrega la pàgina següent de l'historial
+                delete more.dataset.nextUrl;
+                window.location.href = link.href;
+            })
+            .finally(() => {
+                more.classList.remove('is-loading');
+            });
+    });
+}
 
 /**
  * Validar el formulari de checkout
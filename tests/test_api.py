@@ -0,0 +1,81 @@
+"""
+Tests para la API JSON del catálogo (routes/api.py)
+"""
+
+import json
+
+from tests.test_common import *
+
+
+def _insert_products(names):
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    ids = []
+    for name in names:
+        cursor.execute("INSERT INTO Product (name, price, stock) VALUES (?, 10.00, 3)", (name,))
+        ids.append(cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def _delete_products(ids):
+    conn = sqlite3.connect("techshop.db")
+    conn.executemany("DELETE FROM Product WHERE id = ?", [(product_id,) for product_id in ids])
+    conn.commit()
+    conn.close()
+
+
+def test_api_list_and_detail():
+    """El listado pagina con cursor y el detalle devuelve 404 si el producto no existe."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    ids = _insert_products(["API 1", "API 2"])
+    try:
+        page = client.get("/api/products?limit=1")
+        data = page.get_json() or {}
+        detail = client.get(f"/api/products/{ids[0]}")
+        missing = client.get("/api/products/999999999")
+        bad = client.get("/api/products?sort=stock")
+    finally:
+        _delete_products(ids)
+    ok_page = assert_equals(page.status_code, 200) and assert_equals(len(data.get("products", [])), 1) and \
+              assert_true(data.get("next_url", "").startswith("/api/products"), "Falta la URL siguiente")
+    ok_detail = assert_equals((detail.get_json() or {}).get("product", {}).get("name"), "API 1") and \
+                assert_equals(missing.status_code, 404) and assert_equals(bad.status_code, 400)
+    return ok_page and ok_detail
+
+
+def test_api_batch_keeps_order():
+    """El lote devuelve los productos en el orden pedido, sin repetidos, e indica los que faltan."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    ids = _insert_products(["Lot A", "Lot B"])
+    try:
+        resp = client.get(f"/api/products/batch?ids={ids[1]},999999999,{ids[0]},{ids[1]}")
+        too_many = client.get("/api/products/batch?ids=" + ",".join(str(i) for i in range(1, 102)))
+        invalid = client.get("/api/products/batch?ids=1,x")
+    finally:
+        _delete_products(ids)
+    data = resp.get_json() or {}
+    ok_batch = assert_equals([p["id"] for p in data.get("products", [])], [ids[1], ids[0]]) and \
+               assert_equals(data.get("missing"), [999999999])
+    return ok_batch and assert_equals(too_many.status_code, 400) and assert_equals(invalid.status_code, 400)
+
+
+def test_api_export_ndjson():
+    """La exportación envía un producto JSON por línea, ordenados por ID."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    ids = _insert_products(["Export 1", "Export 2"])
+    try:
+        resp = client.get("/api/products/export.ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+    finally:
+        _delete_products(ids)
+    products = [json.loads(line) for line in lines]
+    exported = [p["id"] for p in products]
+    return assert_equals(resp.status_code, 200) and \
+           assert_true(resp.mimetype == "application/x-ndjson", "Tipus MIME incorrecte") and \
+           assert_true(set(ids) <= set(exported), "Falten productes a l'exportació") and \
+           assert_equals(exported, sorted(exported))
@@ -0,0 +1,322 @@
+"""
+Tests para la caché del catálogo de productos (utils/cache.py)
+"""
+
+import time
+
+from tests.test_common import *
+from utils.cache import MISSING, CatalogCache, EntityCache, FragmentCache, TTLCache, get_catalog_cache
+from utils.coherence import ChangeMonitor, get_change_monitor
+from utils.database import get_connection
+
+
+def _insert_product(product_id, name, price, stock):
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, ?, ?)",
+                 (product_id, name, price, stock))
+    conn.commit()
+    conn.close()
+
+
+def test_cache_ttl_and_size_bound():
+    """Les entrades caduquen i les menys usades s'expulsen en superar el límit."""
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)  # expulsa 'b', la menys usada
+    ok_lru = assert_true(cache.get('b') is MISSING, "'b' hauria d'haver estat expulsada") and \
+             assert_equals(cache.get('a'), 1) and assert_equals(cache.get('c'), 3)
+
+    expired = TTLCache(max_size=2, ttl=0.01)
+    expired.set('x', 1)
+    time.sleep(0.02)
+    ok_ttl = assert_true(expired.get('x') is MISSING, "L'entrada hauria d'haver caducat")
+
+    stats = cache.stats()
+    ok_stats = assert_equals(stats['evictions'], 1) and assert_equals(stats['hits'], 3) and \
+               assert_equals(stats['misses'], 1) and assert_equals(expired.stats()['expirations'], 1)
+    return ok_lru and ok_ttl and ok_stats
+
+
+def test_cache_stale_load_not_stored():
+    """Una càrrega que coincideix amb una invalidació no es guarda."""
+    cache = CatalogCache(max_size=10, ttl=60)
+
+    def loader():
+        cache.invalidate_products([1])
+        return ['antic']
+
+    first = cache.get_all_products(loader)
+    second = cache.get_all_products(lambda: ['nou'])
+    return assert_equals(first, ['antic']) and assert_equals(second, ['nou'], "No s'ha de guardar el resultat antic")
+
+
+def test_cache_product_service_hits():
+    """ProductService serveix el catàleg des de la memòria cau."""
+    init_test_db()
+    _insert_product(1, 'Cau', 10.00, 5)
+    service = ProductService('test.db')
+    service.get_all_products()
+    service.get_product_by_id(1)
+    before = service.cache.stats()
+
+    products = service.get_all_products()
+    product = service.get_product_by_id('1')  # els carretons de la sessió usen text
+    after = service.cache.stats()
+    return assert_equals(len(products), 1) and assert_equals(product.name, 'Cau') and \
+           assert_equals(after['hits'] - before['hits'], 2, "Les dues lectures haurien de ser hits") and \
+           assert_equals(after['misses'], before['misses'])
+
+
+def test_cache_admin_write_invalidates():
+    """Crear, modificar i eliminar productes des d'AdminService invalida la memòria cau."""
+    init_test_db()
+    service = ProductService('test.db')
+    admin = AdminService('test.db')
+    ok_empty = assert_equals(service.get_all_products(), [])
+    ok_missing = assert_true(service.get_product_by_id(1) is None)
+
+    _, _, product_id = admin.create_product('Nou', Decimal('5.00'), 3)
+    ok_created = assert_equals(len(service.get_all_products()), 1) and \
+                 assert_true(service.get_product_by_id(product_id) is not None, "El producte nou s'hauria de veure")
+
+    admin.update_product(product_id, 'Canviat', Decimal('6.00'), 2)
+    product = service.get_product_by_id(product_id)
+    ok_updated = assert_equals(product.name, 'Canviat') and assert_equals(product.price, Decimal('6.00'))
+
+    admin.delete_product(product_id)
+    ok_deleted = assert_true(service.get_product_by_id(product_id) is None) and \
+                 assert_equals(service.get_all_products(), [])
+    return ok_empty and ok_missing and ok_created and ok_updated and ok_deleted
+
+
+def test_cache_order_invalidates_stock():
+    """Una comanda invalida l'estoc dels productes comprats."""
+    init_test_db()
+    _insert_product(1, 'Estoc', 10.00, 5)
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO User (id, username, password_hash, email) VALUES (1, 'comprador', 'h', 'c@e.com')")
+    conn.commit()
+    conn.close()
+
+    service = ProductService('test.db')
+    ok_before = assert_equals(service.get_product_by_id(1).stock, 5)
+    success, _, _ = OrderService('test.db').create_order({1: 2}, 1)
+    return ok_before and assert_true(success) and \
+           assert_equals(service.get_product_by_id(1).stock, 3, "L'estoc en memòria cau hauria d'estar actualitzat") and \
+           assert_equals(service.get_all_products()[0].stock, 3)
+
+
+def test_cache_is_shared_per_database():
+    """Tots els serveis d'una mateixa base de dades comparteixen la memòria cau."""
+    return assert_true(get_catalog_cache('test.db') is ProductService('test.db').cache) and \
+           assert_true(get_catalog_cache('test.db') is not get_catalog_cache('altra.db'))
+
+
+def test_cache_detects_other_process_writes():
+    """Una escriptura d'un altre procés (una altra connexió) invalida el catàleg."""
+    init_test_db()
+    _insert_product(1, 'Original', 10.00, 5)
+    service = ProductService('test.db')
+    monitor = get_change_monitor('test.db')
+    interval = monitor.interval
+    monitor.interval = 0
+    try:
+        monitor.poll(force=True)  # descarta l'espera de consultes anteriors
+        ok_before = assert_equals(service.get_product_by_id(1).name, 'Original')
+        conn = sqlite3.connect('test.db')
+        conn.execute("UPDATE Product SET name = 'Remot', price = 12.00 WHERE id = 1")
+        conn.commit()
+        conn.close()
+        product = service.get_product_by_id(1)
+        listed = service.get_all_products()
+    finally:
+        monitor.interval = interval
+    return ok_before and assert_equals(product.name, 'Remot', "No s'ha detectat el canvi remot") and \
+           assert_equals(product.price, Decimal('12.00')) and assert_equals(listed[0].name, 'Remot')
+
+
+def test_cache_coherence_only_affected_family():
+    """Només s'avisen les famílies d'entitats que han canviat."""
+    init_test_db()
+    get_catalog_cache('test.db')  # aplica les migracions a la base de dades nova
+    monitor = ChangeMonitor('test.db', interval=60)
+    notified = []
+    monitor.subscribe('product', lambda: notified.append('product'))
+    monitor.subscribe('user', lambda: notified.append('user'))
+    monitor.poll(force=True)
+
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('familia', 'h', 'f@e.com')")
+    conn.commit()
+    conn.close()
+    skipped = monitor.poll()  # dins de l'interval: no consulta
+    changed = monitor.poll(force=True)
+    return assert_equals(skipped, []) and assert_equals(changed, ['user']) and \
+           assert_equals(notified, ['user'], "Només s'ha d'invalidar la família 'user'")
+
+
+def test_cache_remote_stock_change_invalidates_only_product():
+    """Un canvi d'estoc d'un altre procés invalida només aquell producte, no tot el catàleg."""
+    init_test_db()
+    _insert_product(1, 'Teclat', 20.00, 5)
+    _insert_product(2, 'Ratolí', 10.00, 5)
+    monitor = ChangeMonitor('test.db', interval=60)
+    cache = CatalogCache(max_size=10, ttl=60, monitor=monitor)
+    monitor.poll(force=True)
+    cache.get_product(1, lambda: 'teclat')
+    cache.get_product(2, lambda: 'ratolí')
+    cache.get_search_results('teclat', lambda: (1,))
+
+    with get_connection('test.db') as conn:
+        conn.execute("UPDATE Product SET stock = stock - 1 WHERE id = 2")
+        conn.commit()
+    changed = monitor.poll(force=True)
+    return assert_equals(changed, ['stock']) and \
+           assert_equals(cache.get_product(1, lambda: 'nou'), 'teclat', "El producte 1 no ha canviat") and \
+           assert_equals(cache.get_product(2, lambda: 'nou'), 'nou', "El producte 2 s'ha d'invalidar") and \
+           assert_equals(cache.get_search_results('teclat', lambda: ()), (1,), "Un canvi d'estoc no buida les cerques")
+
+
+def test_cache_local_writes_not_invalidated_again():
+    """Les escriptures d'aquest procés (local_write) no tornen a buidar el catàleg en consultar els comptadors."""
+    init_test_db()
+    _insert_product(1, 'Teclat', 20.00, 5)
+    _insert_product(2, 'Ratolí', 10.00, 5)
+    monitor = ChangeMonitor('test.db', interval=60)
+    cache = CatalogCache(max_size=10, ttl=60, monitor=monitor)
+    order_notified = []
+    monitor.subscribe('order', lambda: order_notified.append('order'))
+    monitor.poll(force=True)
+
+    with get_connection('test.db') as conn:
+        with cache.local_write(conn):
+            conn.execute("UPDATE Product SET stock = stock - 1 WHERE id = 2")
+            conn.execute("UPDATE Product SET name = 'Teclat nou' WHERE id = 1")
+            conn.execute('INSERT INTO "Order" (total, total_cents, user_id) VALUES (1, 100, NULL)')
+    cache.invalidate_products((1, 2))
+    cache.get_product(1, lambda: 'teclat nou')
+    cache.get_product(2, lambda: 'ratolí')
+    invalidations = cache.invalidations
+    local = monitor.poll(force=True)
+
+    # Un canvi d'un altre procés entremig d'escriptures locals sí que s'avisa
+    with get_connection('test.db') as conn:
+        with cache.local_write(conn):
+            conn.execute("UPDATE Product SET stock = stock + 1 WHERE id = 2")
+    remote = sqlite3.connect('test.db')
+    remote.execute("UPDATE Product SET stock = stock - 1 WHERE id = 1")
+    remote.commit()
+    remote.close()
+    changed = monitor.poll(force=True)
+    return assert_equals(local, ['order'], "Només s'avisa la família que no invalida qui escriu") and \
+           assert_equals(order_notified, ['order']) and \
+           assert_equals(cache.invalidations, invalidations + 1, "Només el canvi remot invalida") and \
+           assert_equals(changed, ['stock']) and \
+           assert_equals(cache.get_product(2, lambda: 'nou'), 'ratolí', "El producte 2 només l'ha canviat aquest procés") and \
+           assert_equals(cache.get_product(1, lambda: 'nou'), 'nou', "El producte 1 l'ha canviat un altre procés")
+
+
+def test_cache_entities_follow_their_families():
+    """Les entitats en memòria cau es buiden amb els canvis remots de la seva família."""
+    init_test_db()
+    get_catalog_cache('test.db')
+    monitor = ChangeMonitor('test.db', interval=60)
+    users = EntityCache(('user',), max_size=10, ttl=60, monitor=monitor)
+    monitor.poll(force=True)
+    loads = []
+
+    def load(value):
+        loads.append(value)
+        return value
+
+    users.get(1, lambda: load('anna'))
+    users.get(1, lambda: load('altre'))
+    users.get(2, lambda: load(None))  # None no es guarda
+    users.get(2, lambda: load(None))
+    conn = sqlite3.connect('test.db')
+    conn.execute('INSERT INTO "Order" (total, user_id) VALUES (1.00, 1)')
+    conn.commit()
+    monitor.poll(force=True)
+    after_order = users.get(1, lambda: load('comanda'))
+    conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('remot', 'h', 'r@e.com')")
+    conn.commit()
+    conn.close()
+    monitor.poll(force=True)
+    after_user = users.get(1, lambda: load('remota'))
+    users.delete(1)
+    after_delete = users.get(1, lambda: load('local'))
+    return assert_equals(loads, ['anna', None, None, 'remota', 'local']) and \
+           assert_equals(after_order, 'anna', "Una comanda no ha de buidar els usuaris") and \
+           assert_equals(after_user, 'remota') and assert_equals(after_delete, 'local')
+
+
+def test_cache_user_and_recommendations_services():
+    """get_user_by_id i les recomanacions es serveixen de la memòria cau fins que canvien."""
+    init_test_db()
+    _insert_product(1, 'Portàtil', 500.00, 5)
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO User (id, username, password_hash, email) VALUES (1, 'cauusuari', 'h', 'cau@example.com')")
+    conn.commit()
+    conn.close()
+    users = UserService('test.db')
+    get_change_monitor('test.db').poll(force=True)  # versions de la base de dades nova
+    first = users.get_user_by_id(1)
+    cached = users.get_user_by_id(1)
+    users.update_user_profile(1, 'cauusuari2', 'cau@example.com', 'Carrer 1')
+    renamed = users.get_user_by_id(1)
+
+    recommendations = RecommendationService('test.db')
+    empty = recommendations.get_top_selling_products(limit=3)
+    conn = sqlite3.connect('test.db')
+    conn.execute('INSERT INTO "Order" (id, total, user_id) VALUES (1, 500.00, 1)')
+    conn.execute("INSERT INTO OrderItem (order_id, product_id, quantity) VALUES (1, 1, 2)")
+    conn.commit()
+    conn.close()
+    stale = recommendations.get_top_selling_products(limit=3)
+    get_change_monitor('test.db').poll(force=True)  # un altre procés ha fet la comanda
+    fresh = recommendations.get_top_selling_products(limit=3)
+    return assert_true(cached is first, "La segona lectura ha de venir de la memòria cau") and \
+           assert_equals(renamed.username, 'cauusuari2', "L'actualització ha d'invalidar l'usuari") and \
+           assert_equals(empty, []) and assert_equals(stale, [], "Sense avís, el resultat ve de la memòria cau") and \
+           assert_equals([(product.id, sold) for product, sold in fresh], [(1, 2)])
+
+
+def test_cache_search_results():
+    """Les cerques repetides es serveixen de la memòria cau; un canvi d'estoc no les invalida."""
+    init_test_db()
+    _insert_product(1, 'Portàtil', 500.00, 5)
+    service = ProductService('test.db')
+    service.search_products('portatil')
+    before = service.cache.search_stats()
+    products, total = service.search_products('Portàtil ')  # mateixa consulta normalitzada
+    service.cache.invalidate_products([1], names_changed=False)
+    service.search_products('portatil')
+    after_stock = service.cache.search_stats()
+    service.cache.invalidate_products([1])
+    service.search_products('portatil')
+    after_name = service.cache.search_stats()
+    return assert_equals(total, 1) and assert_equals(products[0].name, 'Portàtil') and \
+           assert_equals(after_stock['hits'] - before['hits'], 2, "Les cerques repetides haurien de ser hits") and \
+           assert_equals(after_name['misses'] - after_stock['misses'], 1, "Un canvi de nom ha de buidar les cerques")
+
+
+def test_cache_fragments_follow_catalog_version():
+    """Els fragments es renderitzen un cop per clau i la versió del catàleg canvia amb cada invalidació."""
+    catalog = CatalogCache(max_size=10, ttl=60)
+    fragments = FragmentCache(max_size=10, ttl=60)
+    renders = []
+
+    def render():
+        renders.append(catalog.version())
+        return '<p>graella</p>'
+
+    first = fragments.get_or_render(('grid', 'cat', catalog.version()), render)
+    fragments.get_or_render(('grid', 'cat', catalog.version()), render)
+    fragments.get_or_render(('grid', 'eng', catalog.version()), render)
+    catalog.invalidate_products([1], names_changed=False)
+    fragments.get_or_render(('grid', 'cat', catalog.version()), render)
+    stats = fragments.stats()
+    return assert_equals(first, '<p>graella</p>') and assert_equals(renders, [0, 0, 1]) and \
+           assert_equals(stats['hits'], 1) and assert_equals(stats['misses'], 3)
@@ -3,6 +3,8 @@ Tests para Cart Service
 """
 
 from tests.test_common import *
+from utils.database import get_connection
+from utils.cache import clear_catalog_caches
 
 def test_cart_add():
     service = CartService('test.db')
@@ -44,6 +46,69 @@ def test_cart_add_multiple_calls_respect_limit_and_stock():
     return all(conditions)
 
 
+def test_cart_add_checks_stock_for_total_quantity():
+    """L'estoc es comprova per a la quantitat total de la línia, no només per a la que s'afegeix."""
+    service = CartService('test.db')
+    session = MockSession()
+    conn = sqlite3.connect('test.db', timeout=10.0)
+    conn.execute("DELETE FROM Product WHERE id = 91")
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (91, 'Poc stock', 10.00, 3)")
+    conn.commit()
+    conn.close()
+    success1, _ = service.add_to_cart(91, 2, session)
+    success2, message = service.add_to_cart(91, 2, session)
+    return assert_true(success1) and assert_false(success2, "2 + 2 unitats superen l'stock de 3") and \
+           assert_true("Stock insuficient" in message, message) and \
+           assert_equals(service.get_cart_contents(session).get(91), 2)
+
+
+def test_cart_legacy_cookie_cart_moves_to_server():
+    """Un carretó antic guardat a la galeta (claus en text) passa al servidor i la sessió només guarda el token."""
+    service = CartService('test.db')
+    session = MockSession()
+    conn = sqlite3.connect('test.db', timeout=10.0)
+    conn.execute("DELETE FROM Product WHERE id = 92")
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (92, 'Sessió', 10.00, 10)")
+    conn.commit()
+    conn.close()
+    session['cart'] = {'92': 1}
+    success, _ = service.add_to_cart(92, 1, session)
+    return assert_true(success) and assert_equals(service.get_cart_contents(session), {92: 2}) and \
+           assert_false('cart' in session, "El carretó ja no s'ha de guardar a la galeta") and \
+           assert_true('cart_token' in session, "Falta el token del carretó")
+
+
+def test_cart_priced_cart_single_query():
+    """El carretó amb preus resol totes les línies amb una consulta i marca les que no tenen stock."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.executemany("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, ?, 10)",
+                     [(1, 'A', 10.00), (2, 'B', 2.50), (3, 'C', 1.00), (999, 'Retirat', 1.00)])
+    conn.commit()
+    service = CartService('test.db')
+    session = MockSession()
+    service.set_quantities(session, {3: 1, 1: 2, 999: 1, 2: 2})
+    # Després d'afegir-los, l'estoc baixa i un producte es retira del catàleg
+    conn.executemany("UPDATE Product SET stock = ? WHERE id = ?", [(5, 1), (1, 2), (0, 3)])
+    conn.execute("DELETE FROM Product WHERE id = 999")
+    conn.commit()
+    conn.close()
+    priced = service.get_priced_cart(session)
+
+    from services.cart_pricing import price_cart
+    statements = []
+    with get_connection('test.db') as traced:
+        traced.set_trace_callback(statements.append)
+        price_cart(traced.cursor(), {1: 1, 2: 1, 3: 1})
+        traced.set_trace_callback(None)
+    ok_lines = assert_equals([(line.product.id, line.quantity) for line in priced.lines], [(1, 2), (2, 2), (3, 1)]) and \
+               assert_equals(priced.missing, [999]) and assert_equals(priced.total_cents, 2600) and \
+               assert_equals(service.get_cart_total(session), Decimal('26.00'))
+    ok_stock = assert_equals([line.product.id for line in priced.shortages], [2, 3]) and \
+               assert_false(priced.all_in_stock)
+    return ok_lines and ok_stock and assert_equals(len(statements), 1, "Una sola consulta per a tot el carretó")
+
+
 def test_cart_stock():
     service = CartService('test.db')
     session = MockSession()
@@ -166,6 +231,7 @@ def test_cart_remove_nonexistent():
 def test_cart_validate_stock_db_error():
     """Simular un error de BD a validate_stock i comprovar que es gestiona bé."""
     service = CartService('test.db')
+    close_all_pools()  # Forçar connexions noves: les del pool ja estan obertes
     original_connect = sqlite3.connect
 
     def failing_connect(*args, **kwargs):
@@ -330,6 +396,62 @@ def test_web_full_checkout_flow_creates_order_and_clears_cart():
 
 
 
+def test_web_guest_checkout_does_not_charge_saved_cart():
+    """
+    Un invitat que introdueix les credencials d'un compte amb un carretó guardat
+    només paga el carretó que ha vist al checkout; el carretó guardat es conserva.
+    """
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+
+    with get_connection("techshop.db") as conn:
+        conn.execute("INSERT OR REPLACE INTO Product (id, name, price, stock) VALUES (210, 'Vista', 9.99, 10)")
+        conn.execute("INSERT OR REPLACE INTO Product (id, name, price, stock) VALUES (211, 'Guardada', 50.00, 10)")
+        old = conn.execute("SELECT id FROM User WHERE username = 'returning_guest'").fetchone()
+        if old:
+            conn.execute("DELETE FROM CartItem WHERE cart_id IN (SELECT id FROM Cart WHERE user_id = ?)", (old[0],))
+            conn.execute("DELETE FROM Cart WHERE user_id = ?", (old[0],))
+            conn.execute("DELETE FROM User WHERE id = ?", (old[0],))
+        user_id = conn.execute(
+            "INSERT INTO User (username, password_hash, email) VALUES ('returning_guest', ?, 'returning@test.com')",
+            (generate_password_hash("Password123"),)
+        ).lastrowid
+        cart_id = conn.execute("INSERT INTO Cart (user_id, updated_at) VALUES (?, 0)", (user_id,)).lastrowid
+        conn.execute("INSERT INTO CartItem (cart_id, product_id, quantity) VALUES (?, 211, 3)", (cart_id,))
+
+    client = app.test_client()
+    client.post("/add_to_cart", data={"product_id": 210, "quantity": 1})
+    client.get("/checkout")
+    resp = client.post(
+        "/process_order",
+        data={
+            "checkout_type": "guest",
+            "username": "returning_guest",
+            "password": "Password123",
+            "email": "returning@test.com",
+            "address": "Carrer de Prova 123, Barcelona",
+        },
+    )
+
+    with get_connection("techshop.db") as conn:
+        order = conn.execute(
+            'SELECT id, total_cents FROM "Order" WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,)
+        ).fetchone()
+        items = conn.execute("SELECT product_id, quantity FROM OrderItem WHERE order_id = ?", (order[0],)).fetchall() \
+            if order else []
+        saved = conn.execute(
+            "SELECT product_id, quantity FROM CartItem WHERE cart_id = (SELECT id FROM Cart WHERE user_id = ?)",
+            (user_id,)
+        ).fetchall()
+    with client.session_transaction() as sess:
+        logged_in = sess.get("user_id")
+
+    return assert_equals(resp.status_code, 302) and assert_true(order is not None, "S'ha de crear la comanda") and \
+           assert_equals(items, [(210, 1)]) and assert_equals(order[1], 999) and \
+           assert_equals(saved, [(211, 3)]) and assert_equals(logged_in, user_id)
+
+
+
 def test_security_cart_manipulation():
     """Intentar manipular el carrito directamente en la sesión."""
     app.config["TESTING"] = True
@@ -424,3 +546,153 @@ def test_company_cannot_add_to_cart():
     )
 
 
+
+
+def test_cart_purge_expired_anonymous_carts():
+    """La purga elimina els carretons anònims caducats (i les seves línies) però no els dels usuaris."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'A', 1.00, 10)")
+    conn.commit()
+    conn.close()
+    service = CartService('test.db')
+    old_session, new_session, user_session = MockSession(), MockSession(), MockSession()
+    user_session['user_id'] = 42
+    for session in (old_session, new_session, user_session):
+        service.add_to_cart(1, 1, session)
+    conn = sqlite3.connect('test.db')
+    conn.execute("UPDATE Cart SET updated_at = updated_at - 1000 WHERE token = ? OR user_id = 42",
+                 (old_session['cart_token'],))
+    conn.commit()
+    purged = service.purge_expired_carts(ttl=500)
+    remaining = conn.execute("SELECT COUNT(*) FROM CartItem").fetchone()[0]
+    conn.close()
+    return assert_equals(purged, 1) and assert_equals(remaining, 2) and \
+           assert_equals(service.get_cart_contents(old_session), {}) and \
+           assert_equals(service.get_cart_contents(user_session), {1: 1})
+
+
+def test_cart_merged_on_login_and_shared_between_devices():
+    """En iniciar sessió el carretó anònim se suma al de l'usuari, que es veu des d'un altre dispositiu."""
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM User WHERE username = 'test_cart_merge'")
+    cursor.execute(
+        "INSERT INTO User (username, password_hash, email, address, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
+        ("test_cart_merge", generate_password_hash("Test1234"), "cart_merge@test.com", "Carrer Major 1, Girona")
+    )
+    user_id = cursor.lastrowid
+    cursor.execute("INSERT INTO Product (name, price, stock) VALUES ('Merge A', 10.00, 10)")
+    product_a = cursor.lastrowid
+    cursor.execute("INSERT INTO Product (name, price, stock) VALUES ('Merge B', 5.00, 10)")
+    product_b = cursor.lastrowid
+    conn.commit()
+    conn.close()
+
+    laptop, phone = app.test_client(), app.test_client()
+    try:
+        with phone.session_transaction() as sess:
+            sess["user_id"] = user_id
+        phone.post("/add_to_cart", data={"product_id": product_a, "quantity": 1})
+        laptop.post("/add_to_cart", data={"product_id": product_a, "quantity": 2})
+        laptop.post("/add_to_cart", data={"product_id": product_b, "quantity": 1})
+        with laptop.session_transaction() as sess:
+            anonymous_session = dict(sess)
+        laptop.post("/login", data={"username": "test_cart_merge", "password": "Test1234"})
+        with laptop.session_transaction() as sess:
+            merged_session = dict(sess)
+        contents = CartService().get_cart_contents({"user_id": user_id})
+    finally:
+        conn = sqlite3.connect("techshop.db")
+        conn.execute("DELETE FROM User WHERE id = ?", (user_id,))  # trg_user_cart_delete elimina el carretó
+        conn.execute("DELETE FROM Product WHERE id IN (?, ?)", (product_a, product_b))
+        conn.commit()
+        leftover = conn.execute("SELECT COUNT(*) FROM Cart WHERE user_id = ?", (user_id,)).fetchone()[0]
+        conn.close()
+        clear_catalog_caches()
+    ok_session = assert_true("cart_token" in anonymous_session and "cart" not in anonymous_session,
+                             "La galeta només ha de portar el token del carretó") and \
+                 assert_false("cart_token" in merged_session, "El token anònim s'ha de descartar en iniciar sessió")
+    return ok_session and assert_equals(contents, {product_a: 3, product_b: 1}) and assert_equals(leftover, 0)
+
+
+def test_cart_set_quantities_add_mode_all_or_nothing():
+    """En mode suma, si una línia supera el límit no es modifica cap línia."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'A', 1.00, 10)")
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (2, 'B', 1.00, 10)")
+    conn.commit()
+    conn.close()
+    service = CartService('test.db')
+    session = MockSession()
+    service.set_quantities(session, {1: 4})
+    ok_added, _ = service.set_quantities(session, {1: 1, 2: 2}, add=True)
+    ok_over, message = service.set_quantities(session, {2: 1, 1: 1}, add=True)
+    return assert_true(ok_added) and assert_false(ok_over, "Supera el límit de 5 unitats") and \
+           assert_true("límit" in message, message) and \
+           assert_equals(service.get_cart_contents(session), {1: 5, 2: 2})
+
+
+def test_cart_session_unchanged_when_update_rolls_back():
+    """Si set_quantities es desfà, la sessió no guarda el token d'un carretó que no existeix."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'A', 1.00, 1)")
+    conn.execute("INSERT INTO User (id, username, password_hash, email) VALUES (1, 'sessio', 'h', 's@e.com')")
+    conn.commit()
+    conn.close()
+    service = CartService('test.db')
+    anonymous = MockSession()
+    ok_new, _ = service.set_quantities(anonymous, {1: 3})  # només n'hi ha 1
+    token_after_rollback = anonymous.get('cart_token')
+
+    service.set_quantities(anonymous, {1: 1})
+    token = anonymous.get('cart_token')
+    anonymous['user_id'] = 1  # acaba d'iniciar sessió: la fusió es desfà amb la resta
+    ok_merge, _ = service.set_quantities(anonymous, {1: 2})
+    kept_token = anonymous.get('cart_token')
+    contents = service.get_cart_contents(anonymous)
+    return assert_false(ok_new, "No hi ha prou stock") and \
+           assert_equals(token_after_rollback, None, "La sessió no ha de guardar el token d'un carretó desfet") and \
+           assert_false(ok_merge) and assert_equals(kept_token, token, "El token anònim es conserva fins al commit") and \
+           assert_equals(contents, {1: 1}) and assert_equals(anonymous.get('cart_token'), None)
+
+
+def test_web_cart_lines_json_batch():
+    """/cart/lines aplica un lot de línies i retorna el carretó amb preus en JSON."""
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    ids = []
+    for name, price in (("JSON A", 2.50), ("JSON B", 10.00)):
+        cursor.execute("INSERT INTO Product (name, price, stock) VALUES (?, ?, 3)", (name, price))
+        ids.append(cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    client = app.test_client()
+    try:
+        added = client.post("/cart/lines", json={"mode": "add", "lines": [
+            {"product_id": ids[0], "quantity": 2}, {"product_id": ids[1], "quantity": 1}]})
+        short = client.post("/cart/lines", json={"mode": "add", "lines": [{"product_id": ids[1], "quantity": 3}]})
+        removed = client.post("/cart/lines", json={"lines": [{"product_id": ids[0], "quantity": 0}]})
+        invalid = client.post("/cart/lines", json={"lines": [{"product_id": ids[0], "quantity": "x"}]})
+        current = client.get("/cart.json").get_json() or {}
+    finally:
+        conn = sqlite3.connect("techshop.db")
+        conn.executemany("DELETE FROM Product WHERE id = ?", [(product_id,) for product_id in ids])
+        conn.commit()
+        conn.close()
+        clear_catalog_caches()
+    cart = (added.get_json() or {}).get("cart", {})
+    ok_added = assert_equals(added.status_code, 200) and assert_equals(cart.get("count"), 3) and \
+               assert_equals(cart.get("total"), "15.00")
+    ok_short = assert_equals(short.status_code, 409) and \
+               assert_equals((short.get_json() or {}).get("cart", {}).get("count"), 3)
+    ok_removed = assert_equals([line["product_id"] for line in (removed.get_json() or {})["cart"]["lines"]],
+                               [ids[1]])
+    return ok_added and ok_short and ok_removed and assert_equals(invalid.status_code, 400) and \
+           assert_equals(current.get("cart", {}).get("total"), "10.00")
@@ -6,6 +6,9 @@ import os
 from decimal import Decimal
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Las tareas en segundo plano se ejecutan explícitamente en los tests (JobQueue.run_pending)
+os.environ.setdefault("JOB_WORKER", "0")
+
 from app import app  # para tests de integración Flask
 from models import Product, User, Order, OrderItem
 from services.cart_service import CartService
@@ -16,6 +19,9 @@ from services.user_service import UserService
 from services.admin_service import AdminService
 from services.product_service import ProductService
 from services.company_service import CompanyService
+from utils.database import close_all_pools
+from utils.cache import clear_catalog_caches
+from utils.image_manifest import clear_image_manifests
 
 
 class MockSession:
@@ -137,6 +143,9 @@ def init_test_db():
     """Inicializa una base de datos de prueba"""
     if os.path.exists('test.db'):
         os.remove('test.db')
+    # El catálogo y el índice de imágenes pertenecen a la base de datos anterior
+    clear_catalog_caches()
+    clear_image_manifests()
     
     conn = sqlite3.connect('test.db')
     cursor = conn.cursor()
@@ -254,5 +263,6 @@ __all__ = [
     'app', 'Product', 'User', 'Order', 'OrderItem',
     'CartService', 'OrderService', 'RecommendationService',
     'validar_dni', 'validar_nie', 'validar_cif', 'validar_dni_nie', 'validar_cif_nif',
-    'UserService', 'AdminService', 'ProductService', 'CompanyService'
+    'UserService', 'AdminService', 'ProductService', 'CompanyService',
+    'close_all_pools'
 ]
\ No newline at end of file
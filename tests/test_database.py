@@ -0,0 +1,85 @@
+"""
+Tests para el gestor de conexiones (utils/database.py)
+"""
+
+from tests.test_common import *
+from utils.database import ConnectionPool
+
+
+def test_database_pool_reuses_connection():
+    """El pool reutilitza la mateixa connexió en peticions consecutives."""
+    if os.path.exists('test.db'): os.remove('test.db')
+    pool = ConnectionPool('test.db', pool_size=2)
+
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE Product (id INTEGER PRIMARY KEY, name TEXT, price REAL, stock INTEGER)')
+        first_id = id(conn)
+    with pool.connection() as conn:
+        second_id = id(conn)
+
+    stats = pool.stats()
+    pool.close_all()
+
+    ok_same = assert_equals(first_id, second_id, "S'ha de reutilitzar la connexió")
+    ok_hits = assert_equals(stats['hits'], 1, "Hi ha d'haver un hit")
+    ok_misses = assert_equals(stats['misses'], 1, "Hi ha d'haver un miss")
+    return ok_same and ok_hits and ok_misses
+
+
+def test_database_pool_configures_pragmas():
+    """Les connexions del pool es configuren amb WAL i synchronous=NORMAL."""
+    if os.path.exists('test.db'): os.remove('test.db')
+    pool = ConnectionPool('test.db')
+
+    with pool.connection() as conn:
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+        busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+    pool.close_all()
+
+    ok_wal = assert_equals(journal_mode.lower(), 'wal', "El mode de journal ha de ser WAL")
+    ok_sync = assert_equals(synchronous, 1, "synchronous ha de ser NORMAL (1)")
+    ok_busy = assert_true(busy_timeout > 0, "busy_timeout ha d'estar configurat")
+    return ok_wal and ok_sync and ok_busy
+
+
+def test_database_pool_rollback_on_error():
+    """Si hi ha una excepció dins del context es fa rollback."""
+    if os.path.exists('test.db'): os.remove('test.db')
+    pool = ConnectionPool('test.db')
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE Product (id INTEGER PRIMARY KEY, name TEXT, price REAL, stock INTEGER)')
+
+    try:
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO Product (name, price, stock) VALUES ('X', 1.0, 1)")
+            raise sqlite3.OperationalError("error simulat")
+    except sqlite3.OperationalError:
+        pass
+
+    with pool.connection() as conn:
+        count = conn.execute('SELECT COUNT(*) FROM Product').fetchone()[0]
+    pool.close_all()
+
+    return assert_equals(count, 0, "La inserció s'ha de desfer")
+
+
+def test_database_pool_detects_replaced_file():
+    """Si el fitxer de la base de dades es substitueix, el pool no reutilitza connexions antigues."""
+    if os.path.exists('test.db'): os.remove('test.db')
+    pool = ConnectionPool('test.db')
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE Old (id INTEGER PRIMARY KEY)')
+
+    pool.close_all()
+    os.remove('test.db')
+    raw = sqlite3.connect('test.db')
+    raw.execute('CREATE TABLE New (id INTEGER PRIMARY KEY)')
+    raw.commit()
+    raw.close()
+
+    with pool.connection() as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    pool.close_all()
+
+    return assert_true('New' in tables and 'Old' not in tables, "S'ha de veure el fitxer nou")
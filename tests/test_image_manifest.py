@@ -0,0 +1,108 @@
+"""
+Tests para el índice de imágenes de los productos (utils/image_manifest.py)
+"""
+
+import io
+import shutil
+import tempfile
+from pathlib import Path
+
+from tests.test_common import *
+from utils.image_manifest import ImageManifest, get_image_manifest
+
+
+class _Upload:
+    """Fitxer pujat mínim (com els FileStorage de Flask)."""
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._data = io.BytesIO(data)
+
+    def seek(self, position):
+        self._data.seek(position)
+
+    def read(self):
+        return self._data.read()
+
+
+def _png_bytes():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), (255, 0, 0)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _setup(products=(1, 2)):
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.executemany("INSERT INTO Product (id, name, price, stock) VALUES (?, 'Foto', 1.00, 1)",
+                     [(product_id,) for product_id in products])
+    conn.commit()
+    conn.close()
+    return tempfile.mkdtemp()
+
+
+def test_image_manifest_builds_from_existing_tree():
+    """Un índex buit es construeix a partir dels directoris existents i després no llegeix el disc."""
+    static = _setup()
+    try:
+        root = Path(static) / 'img' / 'products'
+        for name in ('2.jpg', '1.jpg', 'notes.txt'):
+            (root / '1').mkdir(parents=True, exist_ok=True)
+            (root / '1' / name).write_bytes(b'x')
+        (root / '99').mkdir()
+        (root / '99' / '1.jpg').write_bytes(b'x')  # producte inexistent
+
+        manifest = get_image_manifest('test.db', str(root))
+        ok_images = assert_equals(manifest.get_images(1), ('1.jpg', '2.jpg'), "Ordre o filtre d'extensions incorrecte")
+        shutil.rmtree(root / '1')  # l'índex ja no depèn del disc
+        ok_cached = assert_equals(manifest.get_images('1'), ('1.jpg', '2.jpg'))
+        ok_missing = assert_equals(manifest.get_images(2), ()) and assert_equals(manifest.get_images(99), ())
+        stats = manifest.stats()
+        return ok_images and ok_cached and ok_missing and assert_equals(stats['rebuilds'], 1) and \
+               assert_equals(stats['images'], 2)
+    finally:
+        shutil.rmtree(static)
+
+
+def test_image_manifest_company_service_updates():
+    """CompanyService actualitza l'índex en guardar i eliminar imatges."""
+    static = _setup(products=())
+    try:
+        conn = sqlite3.connect('test.db')
+        conn.execute("INSERT INTO User (id, username, password_hash, email, account_type) VALUES (5, 'empresa', 'h', 'e@e.com', 'company')")
+        conn.commit()
+        conn.close()
+        service = CompanyService('test.db', static_folder=static)
+        _, _, product_id = service.create_product(5, 'Amb fotos', Decimal('9.99'), 3)
+        success, _ = service.save_product_images(product_id, [_Upload('a.png', _png_bytes()), _Upload('b.png', _png_bytes())])
+        ok_saved = assert_true(success) and assert_equals(service.images.get_images(product_id), ('1.jpg', '2.jpg'))
+
+        fresh = ImageManifest('test.db', str(Path(static) / 'img' / 'products'))
+        ok_persisted = assert_equals(fresh.get_images(product_id), ('1.jpg', '2.jpg'), "L'índex s'ha de guardar a la base de dades")
+
+        service.delete_product(product_id, 5)
+        fresh.invalidate()
+        return ok_saved and ok_persisted and assert_equals(service.images.get_images(product_id), ()) and \
+               assert_equals(fresh.get_images(product_id), ())
+    finally:
+        shutil.rmtree(static)
+
+
+def test_image_manifest_rebuild_replaces_contents():
+    """La reconstrucció substitueix l'índex pel contingut actual del disc."""
+    static = _setup()
+    try:
+        root = Path(static) / 'img' / 'products'
+        (root / '1').mkdir(parents=True)
+        (root / '1' / '1.jpg').write_bytes(b'x')
+        manifest = get_image_manifest('test.db', str(root))
+        ok_first = assert_equals(manifest.get_images(1), ('1.jpg',))
+
+        shutil.rmtree(root / '1')
+        (root / '2').mkdir()
+        (root / '2' / '1.webp').write_bytes(b'x')
+        indexed = manifest.rebuild()
+        return ok_first and assert_equals(indexed, 1) and assert_equals(manifest.get_images(1), ()) and \
+               assert_equals(manifest.get_images(2), ('1.webp',))
+    finally:
+        shutil.rmtree(static)
@@ -0,0 +1,192 @@
+"""
+Tests para la importación masiva de productos (services/import_service.py)
+"""
+
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+
+from tests.test_common import *
+from utils.cache import clear_catalog_caches
+from utils.database import get_connection
+import services.import_service as import_module
+from services.import_service import ImportService
+
+
+def _products(columns="name, price, stock, company_id, sku"):
+    conn = sqlite3.connect('test.db')
+    rows = conn.execute(f"SELECT {columns} FROM Product ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+def _png_bytes():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), (0, 0, 255)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_import_csv_reports_bad_rows():
+    """Las filas válidas de un CSV se insertan y las no válidas se informan con su línea."""
+    init_test_db()
+    csv_data = (
+        "name,price,stock,sku\n"
+        "Teclat,19.99,5,KB-1\n"
+        ",10.00,1,\n"
+        "Ratolí,abc,1,\n"
+        "Pantalla,120.50,2,MON-1\n"
+        "Còpia,1.00,1,KB-1\n"
+    ).encode('utf-8')
+    service = ImportService('test.db')
+    success, message, report = service.import_products(io.BytesIO(csv_data), 'productes.csv', company_id=7)
+    rows = _products()
+    ok_report = assert_true(success, message) and assert_equals(report['rows'], 5) and \
+                assert_equals(report['inserted'], 2) and assert_equals(report['error_count'], 3) and \
+                assert_equals([line for line, _ in report['errors']], [3, 4, 6])
+    return ok_report and assert_equals(rows, [('Teclat', 19.99, 5, 7, 'KB-1'), ('Pantalla', 120.5, 2, 7, 'MON-1')])
+
+
+def test_import_ndjson_and_missing_columns():
+    """NDJSON admite líneas inválidas sueltas; un CSV sin columnas obligatorias se rechaza entero."""
+    init_test_db()
+    ndjson = b'{"name": "Cable", "price": "3.50", "stock": 10}\nno es json\n\n[1, 2]\n{"name": "Hub", "price": 25, "stock": 1}\n'
+    service = ImportService('test.db')
+    success, _, report = service.import_products(io.BytesIO(ndjson), 'productes.ndjson')
+    bad_success, bad_message, _ = service.import_products(io.BytesIO(b"name,stock\nX,1\n"), 'productes.csv')
+    wrong_format, _, _ = service.import_products(io.BytesIO(b""), 'productes.xlsx')
+    ok_ndjson = assert_true(success, "La importació NDJSON hauria de funcionar") and \
+                assert_equals(report['inserted'], 2) and assert_equals([line for line, _ in report['errors']], [2, 4])
+    return ok_ndjson and assert_false(bad_success, "Falta la columna price") and \
+           assert_true('price' in bad_message, bad_message) and assert_false(wrong_format, "Format no suportat")
+
+
+def test_import_upsert_by_sku():
+    """Sin upsert un SKU existente se rechaza; con upsert se actualiza el producto de la misma empresa."""
+    init_test_db()
+    service = ImportService('test.db')
+    service.import_products(io.BytesIO(b"name,price,stock,sku\nSSD,50,3,SSD-1\n"), 'a.csv', company_id=1)
+    service.import_products(io.BytesIO(b"name,price,stock,sku\nSSD altre,60,1,SSD-1\n"), 'a.csv', company_id=2)
+    _, _, rejected = service.import_products(io.BytesIO(b"name,price,stock,sku\nSSD 2,45,9,SSD-1\n"), 'a.csv', company_id=1)
+    _, _, updated = service.import_products(io.BytesIO(b"name,price,stock,sku\nSSD 2,45,9,SSD-1\n"), 'a.csv',
+                                            company_id=1, upsert=True)
+    rows = _products()
+    ok_rejected = assert_equals(rejected['inserted'] + rejected['updated'], 0) and assert_equals(rejected['error_count'], 1)
+    return ok_rejected and assert_equals(updated['updated'], 1) and \
+           assert_equals(rows, [('SSD 2', 45.0, 9, 1, 'SSD-1'), ('SSD altre', 60.0, 1, 2, 'SSD-1')])
+
+
+def test_import_rejects_out_of_range_numbers():
+    """Un preu o un stock enorme és un error de fila, no un error de tota la importació."""
+    init_test_db()
+    ndjson = (b'{"name": "Car", "price": 1e25, "stock": 1}\n'
+              b'{"name": "Molts", "price": "1.00", "stock": 100000000000000000000}\n'
+              b'{"name": "Infinit", "price": "Infinity", "stock": 1}\n'
+              b'{"name": "Normal", "price": "2.00", "stock": 3}\n')
+    success, message, report = ImportService('test.db').import_products(io.BytesIO(ndjson), 'productes.ndjson')
+    return assert_true(success, message) and assert_equals(report['inserted'], 1) and \
+           assert_equals([line for line, _ in report['errors']], [1, 2, 3]) and \
+           assert_equals(_products("name, stock"), [('Normal', 3)])
+
+
+def test_import_admin_reimport_by_sku():
+    """Els productes de TechShop (sense empresa) també s'identifiquen per SKU en tornar a importar."""
+    init_test_db()
+    service = ImportService('test.db')
+    csv_data = b"name,price,stock,sku\nCable,3.50,10,CB-1\n"
+    service.import_products(io.BytesIO(csv_data), 'a.csv')
+    _, _, rejected = service.import_products(io.BytesIO(csv_data), 'a.csv')
+    _, _, updated = service.import_products(io.BytesIO(b"name,price,stock,sku\nCable USB,4,8,CB-1\n"), 'a.csv',
+                                            upsert=True)
+    service.import_products(io.BytesIO(csv_data), 'a.csv', company_id=3)  # una empresa pot fer servir el mateix SKU
+    with get_connection('test.db') as conn:
+        try:
+            conn.execute("INSERT INTO Product (name, price, stock, sku) VALUES ('Còpia', 1, 1, 'CB-1')")
+            duplicate_allowed = True
+        except sqlite3.IntegrityError:
+            duplicate_allowed = False
+        conn.rollback()
+    rows = _products()
+    return assert_equals(rejected['error_count'], 1) and assert_equals(updated['updated'], 1) and \
+           assert_false(duplicate_allowed, "L'índex ha d'impedir SKU repetits sense empresa") and \
+           assert_equals(rows, [('Cable USB', 4.0, 8, None, 'CB-1'), ('Cable', 3.5, 10, 3, 'CB-1')])
+
+
+def test_import_writes_in_chunks():
+    """Las filas se escriben en bloques de IMPORT_CHUNK_SIZE y un SKU repetido en otro bloque se detecta."""
+    init_test_db()
+    original = import_module.IMPORT_CHUNK_SIZE
+    import_module.IMPORT_CHUNK_SIZE = 2
+    try:
+        lines = [json.dumps({'name': f'P{i}', 'price': i, 'stock': 1, 'sku': f'S{i}'}) for i in range(5)]
+        lines.append(json.dumps({'name': 'Repetit', 'price': 1, 'stock': 1, 'sku': 'S0'}))
+        service = ImportService('test.db')
+        _, _, report = service.import_products(io.BytesIO('\n'.join(lines).encode()), 'p.jsonl')
+    finally:
+        import_module.IMPORT_CHUNK_SIZE = original
+    return assert_equals(report['inserted'], 5) and assert_equals(report['errors'], [(6, "SKU repetit al fitxer")]) and \
+           assert_equals(len(_products()), 5)
+
+
+def test_import_attaches_zip_images():
+    """Las imágenes del ZIP se asocian por SKU y se ignoran rutas con '..' y SKU desconocidos."""
+    init_test_db()
+    static = tempfile.mkdtemp()
+    try:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('CAM-1.png', _png_bytes())
+            zf.writestr('CAM-1_2.png', _png_bytes())
+            zf.writestr('ALTRE.png', _png_bytes())
+            zf.writestr('../CAM-1.png', _png_bytes())
+        archive.seek(0)
+        service = ImportService('test.db', static)
+        _, _, report = service.import_products(io.BytesIO(b"name,price,stock,sku\nCamera,99,1,CAM-1\n"),
+                                               'c.csv', images_zip=archive)
+        product_id = _products("id")[0][0]
+        images = sorted(os.listdir(os.path.join(static, 'img', 'products', str(product_id))))
+    finally:
+        shutil.rmtree(static, ignore_errors=True)
+    return assert_equals(report['images'], 1) and assert_equals(len(images), 2)
+
+
+def test_web_company_import():
+    """Una empresa importa un CSV desde el formulario y ve el informe; un usuario normal no tiene acceso."""
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM User WHERE username = 'test_import'")
+    cursor.execute(
+        "INSERT INTO User (username, password_hash, email, account_type, created_at) VALUES (?, ?, ?, 'company', datetime('now'))",
+        ("test_import", generate_password_hash("Test123"), "test_import@test.com")
+    )
+    company_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+
+    client = app.test_client()
+    try:
+        with client.session_transaction() as sess:
+            sess["user_id"] = company_id
+        form = client.get("/company/products/import")
+        resp = client.post("/company/products/import", data={
+            "products_file": (io.BytesIO(b"name,price,stock,sku\nImportat,12.00,4,IMP-1\nSense preu,,1,\n"), "p.csv"),
+        }, content_type="multipart/form-data")
+        conn = sqlite3.connect("techshop.db")
+        imported = conn.execute("SELECT name, price_cents FROM Product WHERE company_id = ?", (company_id,)).fetchall()
+        conn.close()
+        anonymous = app.test_client().get("/company/products/import")
+    finally:
+        conn = sqlite3.connect("techshop.db")
+        conn.execute("DELETE FROM Product WHERE company_id = ?", (company_id,))
+        conn.execute("DELETE FROM User WHERE id = ?", (company_id,))
+        conn.commit()
+        conn.close()
+        clear_catalog_caches()
+    ok_form = assert_equals(form.status_code, 200) and assert_equals(resp.status_code, 200)
+    ok_report = assert_true(b"Sense preu" not in resp.data and b"El preu no" in resp.data, "Falta l'error de la fila 3")
+    return ok_form and ok_report and assert_equals(imported, [("Importat", 1200)]) and \
+           assert_true(anonymous.status_code in (302, 401, 403), "Cal ser empresa per importar")
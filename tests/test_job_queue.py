@@ -0,0 +1,175 @@
+"""
+Tests para la cola de tareas en segundo plano (services/job_queue.py)
+"""
+
+import threading
+import time
+
+from tests.test_common import *
+import services.order_service as order_module
+import services.job_queue as job_module
+from services.job_queue import JOB_BACKOFF, JOB_HANDLERS, JobQueue, register_job_handler
+
+
+def _reset_queue():
+    init_test_db()
+    JobQueue('test.db').count_by_status()  # aplica les migracions
+
+
+def _make_due(job_id):
+    conn = sqlite3.connect('test.db')
+    conn.execute("UPDATE Job SET run_at = 0 WHERE id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+
+
+def test_job_queue_runs_and_records_status():
+    """Una tasca encuada s'executa amb el seu payload i queda com a feta."""
+    _reset_queue()
+    seen = []
+    register_job_handler('test_ok', lambda db_path, payload: seen.append((db_path, payload)))
+    queue = JobQueue('test.db')
+    job_id = queue.enqueue('test_ok', {'value': 7})
+    executed = queue.run_pending()
+    job = queue.get_job(job_id)
+    JOB_HANDLERS.pop('test_ok', None)
+    return assert_equals(executed, 1) and assert_equals(seen, [('test.db', {'value': 7})]) and \
+           assert_equals((job['status'], job['attempts']), ('done', 1))
+
+
+def test_job_queue_retries_with_backoff_then_fails():
+    """Una tasca que falla es reprograma amb espera exponencial i, esgotats els intents, queda fallida."""
+    _reset_queue()
+
+    def failing(db_path, payload):
+        raise RuntimeError("SMTP no disponible")
+
+    register_job_handler('test_fail', failing)
+    queue = JobQueue('test.db')
+    job_id = queue.enqueue('test_fail', {})
+    before = int(time.time())
+    queue.run_pending()
+    first = queue.get_job(job_id)
+    not_due = queue.run_pending()  # encara no toca reintentar-la
+    saved = job_module.JOB_MAX_ATTEMPTS
+    job_module.JOB_MAX_ATTEMPTS = 2
+    try:
+        _make_due(job_id)
+        queue.run_pending()
+    finally:
+        job_module.JOB_MAX_ATTEMPTS = saved
+        JOB_HANDLERS.pop('test_fail', None)
+    final = queue.get_job(job_id)
+    return assert_equals((first['status'], first['attempts']), ('pending', 1)) and \
+           assert_true(first['run_at'] >= before + JOB_BACKOFF, "El reintent s'ha d'esperar JOB_BACKOFF segons") and \
+           assert_true("SMTP no disponible" in first['last_error'], first['last_error']) and \
+           assert_equals(not_due, 0) and assert_equals((final['status'], final['attempts']), ('failed', 2))
+
+
+def test_job_queue_reclaims_expired_lease():
+    """Si el treballador mor amb una tasca en execució, es torna a agafar quan caduca la reserva."""
+    _reset_queue()
+    queue = JobQueue('test.db')
+    job_id = queue.enqueue('test_lease', {})
+    first = queue.claim()
+    still_leased = queue.claim()
+    _make_due(job_id)
+    second = queue.claim()
+    return assert_equals(first.id, job_id) and assert_true(still_leased is None, "La reserva encara és vigent") and \
+           assert_equals((second.id, second.attempts), (job_id, 2))
+
+
+def test_job_queue_concurrent_workers_run_each_job_once():
+    """Diversos treballadors simultanis no executen dues vegades la mateixa tasca."""
+    _reset_queue()
+    runs = []
+    lock = threading.Lock()
+
+    def record(db_path, payload):
+        with lock:
+            runs.append(payload['n'])
+
+    register_job_handler('test_concurrent', record)
+    queue = JobQueue('test.db')
+    for n in range(30):
+        queue.enqueue('test_concurrent', {'n': n})
+    workers = [threading.Thread(target=JobQueue('test.db').run_pending) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    JOB_HANDLERS.pop('test_concurrent', None)
+    return assert_equals(sorted(runs), list(range(30))) and assert_equals(queue.count_by_status(), {'done': 30})
+
+
+def test_job_queue_order_placed_sends_invoice_in_background():
+    """La comanda deixa la tasca de factura i correu a la cua; una comanda rebutjada no en deixa cap."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Factura', 10.00, 1)")
+    conn.execute("INSERT INTO User (id, username, password_hash, email) VALUES (1, 'buyer', 'hash', 'buyer@test.com')")
+    conn.commit()
+    conn.close()
+    sent = []
+    original = (order_module.generate_invoice_pdf, order_module.send_order_confirmation_email)
+    order_module.generate_invoice_pdf = lambda order_id, user_id, db_path: b"%PDF"
+    order_module.send_order_confirmation_email = lambda *args: sent.append(args) or (True, "Enviat")
+    try:
+        order_service = OrderService('test.db')
+        success, _, order_id = order_service.create_order({1: 1}, 1)
+        rejected, _, _ = order_service.create_order({1: 1}, 1)
+        pending = JobQueue('test.db').count_by_status()
+        JobQueue('test.db').run_pending()
+        done = JobQueue('test.db').count_by_status()
+    finally:
+        order_module.generate_invoice_pdf, order_module.send_order_confirmation_email = original
+    return assert_true(success) and assert_false(rejected) and assert_equals(pending, {'pending': 1}) and \
+           assert_equals(done, {'done': 1}) and assert_equals(len(sent), 1) and \
+           assert_equals((sent[0][0], sent[0][2], sent[0][6]), ('buyer@test.com', order_id, b"%PDF"))
+
+
+def test_job_queue_renews_lease_while_running():
+    """Una tasca que dura més que JOB_LEASE renova la reserva: cap altre treballador la torna a agafar."""
+    _reset_queue()
+    claimed = []
+
+    def slow(db_path, payload):
+        time.sleep(2.5)
+        claimed.append(JobQueue('test.db').claim())
+
+    register_job_handler('test_slow', slow)
+    saved = job_module.JOB_LEASE
+    job_module.JOB_LEASE = 2
+    try:
+        queue = JobQueue('test.db')
+        job_id = queue.enqueue('test_slow', {})
+        executed = queue.run_pending()
+    finally:
+        job_module.JOB_LEASE = saved
+        JOB_HANDLERS.pop('test_slow', None)
+    job = queue.get_job(job_id)
+    return assert_equals(executed, 1) and assert_equals(claimed, [None]) and \
+           assert_equals((job['status'], job['attempts']), ('done', 1))
+
+
+def test_job_queue_order_placed_sends_confirmation_once():
+    """Si la tasca de la comanda s'executa dos cops, el correu de confirmació només s'envia una vegada."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Factura', 10.00, 1)")
+    conn.execute("INSERT INTO User (id, username, password_hash, email) VALUES (1, 'buyer', 'hash', 'buyer@test.com')")
+    conn.commit()
+    conn.close()
+    sent = []
+    original = (order_module.generate_invoice_pdf, order_module.send_order_confirmation_email)
+    order_module.generate_invoice_pdf = lambda order_id, user_id, db_path: b"%PDF"
+    order_module.send_order_confirmation_email = lambda *args: sent.append(args) or (True, "Enviat")
+    try:
+        order_service = OrderService('test.db')
+        _, _, order_id = order_service.create_order({1: 1}, 1)
+        first = order_service.send_order_confirmation(order_id)
+        second = order_service.send_order_confirmation(order_id)
+    finally:
+        order_module.generate_invoice_pdf, order_module.send_order_confirmation_email = original
+    return assert_true(first[0]) and assert_equals(second, (True, "La confirmació ja s'havia enviat")) and \
+           assert_equals(len(sent), 1)
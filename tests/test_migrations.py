@@ -0,0 +1,305 @@
+"""
+Tests para las migraciones versionadas (migrations/migrate_database.py)
+"""
+
+from tests.test_common import *
+from migrations.migrate_database import SCHEMA_VERSION, get_schema_version, migrate
+from services.user_service import UserService
+from scripts.audit_query_plans import audit, collect_statements, create_schema
+
+
+def _create_legacy_schema():
+    """Crear una base de dades amb l'esquema original, sense columnes noves."""
+    if os.path.exists('test.db'): os.remove('test.db')
+    conn = sqlite3.connect('test.db')
+    conn.executescript("""
+        CREATE TABLE Product (id INTEGER PRIMARY KEY, name TEXT, price REAL, stock INTEGER);
+        CREATE TABLE User (id INTEGER PRIMARY KEY, username TEXT, password_hash TEXT, email TEXT, created_at TEXT);
+        CREATE TABLE "Order" (id INTEGER PRIMARY KEY, total REAL, created_at TEXT, user_id INTEGER);
+        CREATE TABLE OrderItem (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, quantity INTEGER);
+        INSERT INTO User (username, password_hash, email) VALUES ('legacy', 'x', 'legacy@test.com');
+    """)
+    conn.commit()
+    return conn
+
+
+def test_migrations_upgrade_legacy_schema():
+    """Una base de dades antiga es migra a la darrera versió i conserva les dades."""
+    conn = _create_legacy_schema()
+    version = migrate(conn)
+    user_columns = [row[1] for row in conn.execute('PRAGMA table_info(User)')]
+    product_columns = [row[1] for row in conn.execute('PRAGMA table_info(Product)')]
+    role = conn.execute("SELECT role, account_type FROM User WHERE username = 'legacy'").fetchone()
+    stored = get_schema_version(conn)
+    conn.close()
+
+    ok_version = assert_equals(version, SCHEMA_VERSION, "S'ha d'arribar a la darrera versió")
+    ok_stored = assert_equals(stored, SCHEMA_VERSION, "La versió s'ha de guardar a user_version")
+    ok_columns = assert_true(
+        all(c in user_columns for c in ('address', 'role', 'account_type', 'dni', 'nif')),
+        "User ha de tenir les columnes noves"
+    )
+    ok_company = assert_true('company_id' in product_columns, "Product ha de tenir company_id")
+    ok_defaults = assert_equals(role, ('common', 'user'), "Els usuaris existents han de rebre els valors per defecte")
+    return ok_version and ok_stored and ok_columns and ok_company and ok_defaults
+
+
+def test_migrations_are_idempotent():
+    """Tornar a migrar una base de dades actualitzada no canvia res."""
+    conn = _create_legacy_schema()
+    migrate(conn)
+    try:
+        version = migrate(conn)
+        ok = assert_equals(version, SCHEMA_VERSION, "La segona migració no ha de fallar")
+    except sqlite3.Error as e:
+        ok = assert_true(False, f"La segona migració ha fallat: {e}")
+    conn.close()
+    return ok
+
+
+def test_migrations_applied_by_pool():
+    """El pool de connexions aplica les migracions pendents abans de servir consultes."""
+    _create_legacy_schema().close()
+    close_all_pools()
+    user_service = UserService('test.db')
+    user = user_service.get_user_by_email('legacy@test.com')
+    close_all_pools()
+
+    ok_user = assert_true(user is not None, "L'usuari s'ha de trobar amb la consulta de l'esquema nou")
+    ok_role = assert_true(user is not None and user.role == 'common', "El rol ha de ser 'common'")
+    return ok_user and ok_role
+
+
+def test_migrations_create_query_indexes():
+    """La migració d'índexs crea els índexs de les consultes i username és únic."""
+    conn = _create_legacy_schema()
+    migrate(conn)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    try:
+        conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('legacy', 'x', 'other@test.com')")
+        duplicate_rejected = False
+    except sqlite3.IntegrityError:
+        duplicate_rejected = True
+    conn.close()
+
+    expected = {'idx_user_username', 'idx_user_email', 'idx_user_dni', 'idx_user_nif',
+                'idx_order_user_created', 'idx_orderitem_order_product',
+                'idx_orderitem_product_order', 'idx_product_company'}
+    ok_indexes = assert_true(expected <= indexes, f"Falten índexs: {expected - indexes}")
+    ok_unique = assert_true(duplicate_rejected, "No s'han de poder repetir noms d'usuari")
+    return ok_indexes and ok_unique
+
+
+def test_migrations_indexes_with_duplicate_data():
+    """Els emails repetits es conserven (índex normal); els noms d'usuari repetits aturen la migració."""
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('legacy2', 'x', 'legacy@test.com')")
+    conn.commit()
+    version = migrate(conn)
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'idx_user_email'").fetchone()
+    conn.close()
+
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('legacy', 'x', 'other@test.com')")
+    conn.commit()
+    try:
+        migrate(conn)
+        error = ""
+    except sqlite3.IntegrityError as e:
+        error = str(e)
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+
+    ok_version = assert_equals(version, SCHEMA_VERSION, "La migració ha de completar-se")
+    ok_index = assert_true(row is not None and 'UNIQUE' not in row[0], "L'índex d'email ha de ser normal")
+    ok_failed = assert_true("idx_user_username" in error and "legacy" in error, f"Error inesperat: {error!r}")
+    ok_rollback = assert_true('idx_user_username' not in indexes, "La migració fallida no ha de deixar canvis")
+    return ok_version and ok_index and ok_failed and ok_rollback
+
+
+def test_migrations_user_email_index_made_plain():
+    """La versió 17 substitueix l'índex únic d'email de les bases de dades migrades abans."""
+    conn = _create_legacy_schema()
+    migrate(conn)
+    conn.execute("DROP INDEX idx_user_email")
+    conn.execute("CREATE UNIQUE INDEX idx_user_email ON User (email)")
+    conn.execute("PRAGMA user_version = 16")
+    conn.commit()
+    migrate(conn)
+    conn.execute("INSERT INTO User (username, password_hash, email) VALUES ('other', 'x', 'legacy@test.com')")
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'idx_user_email'").fetchone()
+    conn.close()
+    return assert_true(row is not None and 'UNIQUE' not in row[0], "L'índex d'email ha de ser normal")
+
+
+def test_migrations_service_queries_use_indexes():
+    """Cap consulta amb WHERE dels serveis recorre una taula sencera."""
+    statements, skipped = collect_statements()
+    conn = create_schema()
+    scans, errors = audit(conn, statements)
+    conn.close()
+
+    filtered = [statement for statement, _ in scans if ' WHERE ' in statement.sql.upper()]
+    ok_found = assert_true(len(statements) > 0, "S'han de trobar sentències SQL als serveis")
+    ok_dynamic = assert_true(
+        any('stock > 0' in statement.sql for statement in statements),
+        "Les consultes filtrades del catàleg (f-strings) s'han d'expandir"
+    )
+    ok_skipped = assert_equals(skipped, [], "Cap consulta dinàmica pot quedar sense auditar")
+    ok_errors = assert_equals(errors, [], "Totes les sentències han de ser vàlides")
+    ok_scans = assert_equals(filtered, [], "Les consultes amb filtre han de fer servir índexs")
+    return ok_found and ok_dynamic and ok_skipped and ok_errors and ok_scans
+
+
+def test_migrations_audit_reports_unexpanded_dynamic_sql():
+    """L'auditoria compta com a omeses les consultes dinàmiques que no sap expandir."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'dynamic_service.py'), 'w', encoding='utf-8') as f:
+            f.write(
+                'TABLE_SQL = "SELECT id FROM Product WHERE id = ?"\n'
+                'def load(cursor, column):\n'
+                '    cursor.execute(f"SELECT {column} FROM Product WHERE id = ?", (1,))\n'
+                '    cursor.execute("SELECT name FROM Product WHERE " + column + " = ?", (1,))\n'
+            )
+        statements, skipped = collect_statements(directory)
+    return assert_equals([statement.sql for statement in statements], ["SELECT id FROM Product WHERE id = ?"]) and \
+           assert_equals([statement.line for statement in skipped], [3, 4])
+
+
+def test_migrations_money_cents_backfill_and_sync():
+    """La migració de cèntims omple les files existents i sincronitza els escriptors antics."""
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'P1', 19.99, 5)")
+    conn.execute('INSERT INTO "Order" (id, total, user_id) VALUES (1, 39.98, 1)')
+    conn.commit()
+    migrate(conn)
+
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (2, 'P2', 0.29, 5)")
+    conn.execute("UPDATE Product SET price = 10.5 WHERE id = 1")
+    conn.commit()
+    products = conn.execute("SELECT id, price_cents FROM Product ORDER BY id").fetchall()
+    order_cents = conn.execute('SELECT total_cents FROM "Order" WHERE id = 1').fetchone()[0]
+    conn.close()
+
+    ok_products = assert_equals(products, [(1, 1050), (2, 29)], "price_cents no sincronitzat")
+    ok_order = assert_equals(order_cents, 3998, "total_cents no omplert")
+    return ok_products and ok_order
+
+
+def test_migrations_change_counters():
+    """Els triggers de ChangeCounter compten les escriptures per família d'entitats."""
+    conn = _create_legacy_schema()
+    migrate(conn)
+    before = dict(conn.execute("SELECT entity, version FROM ChangeCounter").fetchall())
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'P1', 1.00, 5)")
+    conn.execute("DELETE FROM Product WHERE id = 1")
+    conn.execute('INSERT INTO "Order" (id, total, user_id) VALUES (1, 1.00, 1)')
+    conn.commit()
+    after = dict(conn.execute("SELECT entity, version FROM ChangeCounter").fetchall())
+    conn.close()
+
+    ok_families = assert_equals(sorted(before), ['image', 'order', 'product', 'stock', 'user'])
+    ok_product = assert_true(after['product'] >= before['product'] + 2, "Product no ha incrementat el comptador")
+    ok_order = assert_true(after['order'] > before['order'], "Order no ha incrementat el comptador")
+    ok_user = assert_equals(after['user'], before['user'], "User no s'ha modificat")
+    return ok_families and ok_product and ok_order and ok_user
+
+
+def test_migrations_stock_changes_own_family():
+    """Un UPDATE que només canvia l'estoc incrementa 'stock' i apunta el producte a StockChange."""
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'P1', 1.00, 5)")
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (2, 'P2', 2.00, 5)")
+    conn.commit()
+    migrate(conn)
+    counters = lambda: dict(conn.execute("SELECT entity, version FROM ChangeCounter").fetchall())
+    before = counters()
+    conn.execute("UPDATE Product SET stock = stock - 1 WHERE id = 2")
+    conn.commit()
+    after_stock = counters()
+    changed = conn.execute("SELECT product_id, version FROM StockChange").fetchall()
+    conn.execute("UPDATE Product SET name = 'Nou', stock = 9 WHERE id = 1")
+    conn.commit()
+    after_name = counters()
+    conn.close()
+
+    ok_stock = assert_equals(after_stock['stock'], before['stock'] + 1, "El canvi d'estoc ha d'incrementar 'stock'") and \
+               assert_equals(after_stock['product'], before['product'], "Un canvi d'estoc no ha de tocar 'product'") and \
+               assert_equals(changed, [(2, after_stock['stock'])])
+    ok_name = assert_true(after_name['product'] > after_stock['product'], "Un canvi de nom ha d'incrementar 'product'") and \
+              assert_equals(after_name['stock'], after_stock['stock'])
+    return ok_stock and ok_name
+
+
+def test_migrations_stock_trigger_covers_later_product_columns():
+    """Una columna de Product afegida per una migració posterior no es pren per un canvi d'estoc."""
+    import migrations.migrate_database as migrate_module
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'P1', 1.00, 5)")
+    conn.commit()
+    migrate(conn)
+    saved = (migrate_module.MIGRATIONS, migrate_module.SCHEMA_VERSION)
+    later = saved[1] + 1
+    migrate_module.MIGRATIONS = saved[0] + [
+        (later, "Color dels productes", lambda cursor: cursor.execute("ALTER TABLE Product ADD COLUMN color TEXT")),
+    ]
+    migrate_module.SCHEMA_VERSION = later
+    try:
+        migrate(conn)
+    finally:
+        migrate_module.MIGRATIONS, migrate_module.SCHEMA_VERSION = saved
+    counters = lambda: dict(conn.execute("SELECT entity, version FROM ChangeCounter").fetchall())
+    before = counters()
+    conn.execute("UPDATE Product SET color = 'vermell' WHERE id = 1")
+    conn.commit()
+    after = counters()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Product)")]
+    trigger = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'trg_product_changes_update'").fetchone()[0]
+    conn.close()
+    missing = [column for column in columns if column != 'stock' and f'OLD."{column}"' not in trigger]
+    return assert_equals(after['product'], before['product'] + 1, "Un canvi de color ha d'incrementar 'product'") and \
+           assert_equals(after['stock'], before['stock']) and \
+           assert_equals(missing, [], "La condició del trigger ha de comparar totes les columnes de Product")
+
+
+def test_migrations_product_facets_stay_in_sync():
+    """Els triggers de ProductFacet mantenen els mateixos recomptes que un GROUP BY."""
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Antic', 12.00, 0)")
+    conn.commit()
+    migrate(conn)
+    conn.execute("INSERT INTO Product (id, name, price, stock, company_id) VALUES (2, 'Empresa', 60.00, 3, 1)")
+    conn.execute("INSERT INTO Product (id, name, price, price_cents, stock) VALUES (3, 'Car', 700.00, 70000, 1)")
+    conn.execute("UPDATE Product SET price = 30.00 WHERE id = 1")  # només price: el trigger v5 omple els cèntims
+    conn.execute("UPDATE Product SET stock = 4 WHERE id = 1")
+    conn.execute("UPDATE Product SET stock = 0 WHERE id = 2")
+    conn.execute("DELETE FROM Product WHERE id = 3")
+    conn.commit()
+    facets = conn.execute(
+        "SELECT company_id, price_band, in_stock, product_count FROM ProductFacet "
+        "WHERE product_count > 0 ORDER BY 1, 2, 3"
+    ).fetchall()
+    conn.close()
+    return assert_equals(facets, [(0, 1, 1, 1), (1, 2, 0, 1)], "Els recomptes no coincideixen amb els productes")
+
+
+def test_migrations_order_item_snapshots_backfill():
+    """La migració v16 guarda el nom i el preu de les línies existents i de les que insereixen els scripts antics."""
+    conn = _create_legacy_schema()
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Teclat', 30.00, 5), (2, 'Ratolí', 9.50, 5)")
+    # Comanda 1: una línia pagada a 25 € (el preu ha canviat); comanda 2: dues línies
+    conn.execute('INSERT INTO "Order" (id, total, user_id) VALUES (1, 50.00, 1), (2, 39.50, 1)')
+    conn.execute("INSERT INTO OrderItem (order_id, product_id, quantity) VALUES (1, 1, 2), (2, 1, 1), (2, 2, 1)")
+    conn.commit()
+    migrate(conn)
+    conn.execute("INSERT INTO OrderItem (order_id, product_id, quantity) VALUES (3, 2, 1)")
+    conn.commit()
+    rows = conn.execute(
+        "SELECT order_id, product_id, product_name, unit_price_cents FROM OrderItem ORDER BY id"
+    ).fetchall()
+    conn.close()
+    return assert_equals(rows, [
+        (1, 1, 'Teclat', 2500), (2, 1, 'Teclat', 3000), (2, 2, 'Ratolí', 950), (3, 2, 'Ratolí', 950)
+    ], "Les línies no tenen el nom i el preu esperats")
+
@@ -36,6 +36,12 @@ def test_user_created_at_default():
     return assert_true(u.created_at is not None, "created_at no hauria de ser None per defecte")
 
 
+def test_user_without_date_keeps_created_at_none():
+    """Com les comandes, un usuari antic sense data no rep la data de càrrega."""
+    legacy = User.from_row((7, "antic", None, None, None, None, None, None, None))
+    return assert_true(legacy.created_at is None, "Una fila sense data ha de quedar sense data")
+
+
 def test_order():
     o = Order(id=1, total=Decimal('100.00'), user_id=1)
     return assert_equals(o.id, 1) and assert_equals(o.total, Decimal('100.00'))
@@ -47,6 +53,57 @@ def test_order_created_at_default():
     return assert_true(o.created_at is not None, "created_at de l'ordre no hauria de ser None")
 
 
+def test_order_without_date_keeps_created_at_none():
+    """Una comanda antiga sense data no se n'inventa cap: la plantilla mostra "—" i el JSON null."""
+    from flask import render_template
+    from routes.helpers import _order_json
+    legacy = Order.from_row((3, 5000, None, 1))
+    with app.test_request_context():
+        card = render_template('_order_card.html', order=legacy, items=[], _=lambda key: key)
+        data = _order_json(legacy, [])
+    return assert_true(legacy.created_at is None, "Una fila sense data ha de quedar sense data") and \
+           assert_true('<p class="order-date">—</p>' in card, "La plantilla ha de mostrar '—'") and \
+           assert_equals(data['created_at'], None)
+
+
+def test_models_use_slots():
+    """Els models declaren __slots__: no tenen __dict__ ni accepten atributs nous."""
+    p = Product(id=1, name="Slot", price=Decimal('1.00'), stock=1)
+    try:
+        p.color = "vermell"
+        rejected = False
+    except AttributeError:
+        rejected = True
+    return assert_false(hasattr(p, '__dict__'), "Product no hauria de tenir __dict__") and \
+           assert_true(rejected, "No s'haurien de poder afegir atributs nous")
+
+
+def test_from_row_defaults():
+    """from_row substitueix els NULL pels valors per defecte."""
+    from models.mapper import parse_datetime
+    u = User.from_row((5, "fila", None, None, None, None, None, None, "2024-01-02 10:00:00"))
+    p = Product.from_row((3, "Fila", None, 2))
+    o = Order.from_row((4, 1250, "no és una data", 5))
+    return assert_equals(u.email, "") and assert_equals(u.role, "common") and \
+           assert_equals(u.account_type, "user") and assert_equals(u.password_hash, "") and \
+           assert_equals(u.created_at, parse_datetime("2024-01-02 10:00:00")) and \
+           assert_equals(p.price, Decimal('0.00')) and \
+           assert_equals(o.total, Decimal('12.50')) and assert_true(o.created_at is None)
+
+
+def test_fetch_all_maps_rows():
+    """fetch_all i fetch_one converteixen les files d'un cursor en models."""
+    from models.mapper import fetch_all, fetch_one
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE OrderItem (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, quantity INTEGER)")
+    conn.executemany("INSERT INTO OrderItem VALUES (?, ?, ?, ?)", [(1, 9, 1, 2), (2, 9, 2, 1)])
+    items = fetch_all(conn.execute(f"SELECT {OrderItem.COLUMNS} FROM OrderItem ORDER BY id"), OrderItem)
+    missing = fetch_one(conn.execute(f"SELECT {OrderItem.COLUMNS} FROM OrderItem WHERE id = 99"), OrderItem)
+    conn.close()
+    return assert_equals(len(items), 2) and assert_equals(items[0].quantity, 2) and \
+           assert_equals(items[1].product_id, 2) and assert_true(missing is None)
+
+
 def test_cart_add_product_not_found():
     """Intentar afegir un producte que no existeix a BD ha de fallar amb missatge adequat."""
     service = CartService('test.db')
@@ -97,7 +154,7 @@ def test_cart_total_with_missing_product():
     conn.close()
     # Afegim un producte vàlid i un d'inexistent
     service.add_to_cart(20, 1, session)
-    session['cart'][21] = 2  # 21 no existeix a BD
+    service.set_quantities(session, {21: 2})  # 21 no existeix a BD
     total = service.get_cart_total(session)
     return assert_equals(total, Decimal('100.00'), "Només s'ha de comptar el producte existent")
 
@@ -273,6 +330,7 @@ def test_order_tx_user_not_found():
 def test_order_create_db_error():
     """Simular error de BD en create_order i comprovar que es retorna error adequat."""
     order_service = OrderService('test.db')
+    close_all_pools()  # Forçar connexions noves: les del pool ja estan obertes
     original_connect = sqlite3.connect
 
     def failing_connect(*args, **kwargs):
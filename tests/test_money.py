@@ -0,0 +1,61 @@
+"""
+Tests para la representación de importes en céntimos (utils/money.py)
+"""
+
+from tests.test_common import *
+from utils.money import format_cents, from_cents, to_cents
+
+
+def test_money_to_cents_rounds_half_up():
+    """Els imports en euros es converteixen a cèntims arrodonint a la unitat."""
+    ok_decimal = assert_equals(to_cents(Decimal('19.99')), 1999, "Decimal mal convertit")
+    ok_float = assert_equals(to_cents(0.29), 29, "Float mal convertit")
+    ok_round = assert_equals(to_cents('1.005'), 101, "S'ha d'arrodonir cap amunt")
+    ok_none = assert_equals(to_cents(None), 0, "None ha de ser 0")
+    return ok_decimal and ok_float and ok_round and ok_none
+
+
+def test_money_to_cents_invalid():
+    """Un import no numèric llença ValueError."""
+    try:
+        to_cents('abc')
+        return assert_true(False, "S'esperava ValueError")
+    except ValueError:
+        return True
+
+
+def test_money_from_cents_and_format():
+    """Els cèntims es mostren com a euros amb dos decimals."""
+    ok_decimal = assert_equals(from_cents(1050), Decimal('10.50'), "from_cents incorrecte")
+    ok_text = assert_equals(format_cents(5), '0.05', "format_cents incorrecte")
+    ok_none = assert_equals(from_cents(None), Decimal('0.00'), "None ha de ser 0.00")
+    return ok_decimal and ok_text and ok_none
+
+
+def test_money_models_store_cents():
+    """Product i Order guarden cèntims i exposen price/total en euros."""
+    product = Product(id=1, name="P", price=Decimal('19.99'), stock=1)
+    from_db = Product(id=2, name="Q", price_cents=250, stock=1)
+    order = Order(id=1, total_cents=4295, user_id=1)
+
+    ok_product = assert_equals(product.price_cents, 1999, "price_cents incorrecte")
+    ok_view = assert_equals(from_db.price, Decimal('2.50'), "price incorrecte")
+    ok_order = assert_equals(order.total, Decimal('42.95'), "total incorrecte")
+    return ok_product and ok_view and ok_order
+
+
+def test_money_cart_total_sums_cents():
+    """El total del carretó se suma en cèntims sense errors d'arrodoniment."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    cursor = conn.cursor()
+    for product_id in range(1, 11):
+        cursor.execute("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, 0.1, 10)",
+                       (product_id, f"P{product_id}"))
+    conn.commit()
+    conn.close()
+
+    session = MockSession()
+    session['cart'] = {product_id: 1 for product_id in range(1, 11)}
+    total = CartService('test.db').get_cart_total(session)
+    return assert_equals(total, Decimal('1.00'), "10 x 0.10 ha de sumar exactament 1.00")
@@ -3,6 +3,7 @@ Tests para Order Service
 """
 
 from tests.test_common import *
+from utils.cache import clear_catalog_caches
 
 def test_web_process_order_missing_fields_no_order_created():
     """
@@ -154,3 +155,252 @@ def test_user_service_delete_user_account_with_orders():
     return ok_success and ok_user_deleted and ok_orders_deleted and ok_items_deleted
 
 
+
+
+def _setup_hot_product(stock, buyers):
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Hot', 10.00, ?)", (stock,))
+    conn.executemany("INSERT INTO User (id, username, password_hash, email) VALUES (?, ?, 'hash', 'b@test.com')",
+                     [(user_id, f"buyer{user_id}") for user_id in range(1, buyers + 1)])
+    conn.commit()
+    conn.close()
+
+
+def test_order_concurrent_checkouts_never_oversell():
+    """Diverses comandes simultànies no venen més unitats que l'stock, i les que tenen reserva sempre compren."""
+    import threading
+    _setup_hot_product(stock=5, buyers=12)
+    order_service = OrderService('test.db')
+    cart_service = CartService('test.db')
+    # Els compradors 1-3 retenen una unitat cadascun abans de pagar
+    holders = {}
+    for user_id in (1, 2, 3):
+        session = MockSession()
+        cart_service.add_to_cart(1, 1, session)
+        holders[user_id] = cart_service.get_checkout_cart(session)[0]
+    results = []
+    lock = threading.Lock()
+
+    def buyer(user_id):
+        result = order_service.create_order({1: 1}, user_id, cart_id=holders.get(user_id))
+        with lock:
+            results.append((user_id,) + result)
+
+    threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in range(1, 13)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conn = sqlite3.connect('test.db')
+    stock = conn.execute("SELECT stock FROM Product WHERE id = 1").fetchone()[0]
+    orders = conn.execute('SELECT COUNT(*) FROM "Order"').fetchone()[0]
+    conn.close()
+    failures = [message for _, success, message, _ in results if not success]
+    served_holders = sorted(user_id for user_id, success, _, _ in results if success and user_id in holders)
+    return assert_equals(len(results) - len(failures), 5) and assert_equals(stock, 0) and \
+           assert_equals(orders, 5) and \
+           assert_equals(served_holders, [1, 2, 3], "Els carretons amb reserva s'han de servir sempre") and \
+           assert_true(all("Stock insuficient" in message for message in failures), str(failures))
+
+
+def test_order_checkout_respects_other_carts_holds():
+    """Un carretó que reté l'última unitat la compra; un altre sense reserva no la pot vendre."""
+    _setup_hot_product(stock=1, buyers=2)
+    carts, orders = CartService('test.db'), OrderService('test.db')
+    late, holder = MockSession(), MockSession()
+    carts.add_to_cart(1, 1, late)
+    conn = sqlite3.connect('test.db')
+    conn.execute("UPDATE StockReservation SET expires_at = expires_at - 10000")  # la reserva de 'late' caduca
+    conn.commit()
+    conn.close()
+    ok_hold, _ = carts.add_to_cart(1, 1, holder)  # 'holder' reté l'última unitat
+
+    late_cart_id, late_cart = carts.get_checkout_cart(late)
+    late_priced = carts.get_priced_cart(late)
+    late_ok, late_message, _ = orders.create_order(late_cart, 1, cart_id=late_cart_id)
+    holder_cart_id, holder_cart = carts.get_checkout_cart(holder)
+    holder_ok, holder_message, _ = orders.create_order(holder_cart, 2, cart_id=holder_cart_id)
+    conn = sqlite3.connect('test.db')
+    stock, holds = conn.execute("SELECT (SELECT stock FROM Product WHERE id = 1), "
+                                "(SELECT COUNT(*) FROM StockReservation WHERE cart_id = ?)",
+                                (holder_cart_id,)).fetchone()
+    conn.close()
+    return assert_true(ok_hold) and assert_false(late_priced.all_in_stock, "El checkout ha d'avisar que no en queden") and \
+           assert_false(late_ok, "No es pot vendre una unitat retinguda per un altre carretó") and \
+           assert_true("Disponible: 0" in late_message, late_message) and \
+           assert_true(holder_ok, holder_message) and assert_equals(stock, 0) and \
+           assert_equals(holds, 0, "La comanda allibera les reserves del carretó comprat")
+
+
+def test_order_shortfall_writes_nothing():
+    """Si una línia no té prou stock no es crea la comanda ni es descompta cap altra línia."""
+    _setup_hot_product(stock=2, buyers=1)
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (2, 'Other', 5.00, 10)")
+    conn.commit()
+    conn.close()
+    success, message, order_id = OrderService('test.db').create_order({2: 3, 1: 3}, 1)
+    missing_ok, missing_message, _ = OrderService('test.db').create_order({2: 1, 999: 1}, 1)
+    conn = sqlite3.connect('test.db')
+    stocks = dict(conn.execute("SELECT id, stock FROM Product").fetchall())
+    counts = conn.execute('SELECT (SELECT COUNT(*) FROM "Order"), (SELECT COUNT(*) FROM OrderItem)').fetchone()
+    conn.close()
+    return assert_false(success) and assert_equals(order_id, 0) and \
+           assert_true("Disponible: 2" in message, message) and \
+           assert_false(missing_ok) and assert_true("999" in missing_message, missing_message) and \
+           assert_equals(stocks, {1: 2, 2: 10}) and assert_equals(counts, (0, 0))
+
+
+def test_order_retries_when_database_busy():
+    """Si un altre procés té el bloqueig d'escriptura, la comanda espera i es reintenta."""
+    import threading
+    import services.order_service as order_module
+    import utils.database as database
+    _setup_hot_product(stock=3, buyers=1)
+    blocker = sqlite3.connect('test.db', check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    timer = threading.Timer(0.3, blocker.commit)
+    original = (database.BUSY_TIMEOUT_MS, order_module.CHECKOUT_MAX_ATTEMPTS, order_module.CHECKOUT_BACKOFF)
+    # Connexions sense busy_timeout: els primers intents fallen amb SQLITE_BUSY
+    close_all_pools()
+    database.BUSY_TIMEOUT_MS, order_module.CHECKOUT_MAX_ATTEMPTS, order_module.CHECKOUT_BACKOFF = 0, 10, 0.1
+    try:
+        timer.start()
+        success, message, _ = OrderService('test.db').create_order({1: 1}, 1)
+    finally:
+        timer.join()
+        blocker.close()
+        database.BUSY_TIMEOUT_MS, order_module.CHECKOUT_MAX_ATTEMPTS, order_module.CHECKOUT_BACKOFF = original
+        close_all_pools()
+    return assert_true(success, message)
+
+
+def test_order_history_keeps_price_paid():
+    """L'historial i el correu mostren el nom i el preu de la compra encara que el producte canviï."""
+    _setup_hot_product(stock=5, buyers=1)
+    order_service = OrderService('test.db')
+    success, message, order_id = order_service.create_order({1: 2}, 1)
+    conn = sqlite3.connect('test.db')
+    conn.execute("UPDATE Product SET name = 'Renamed', price = 99.00, price_cents = 9900 WHERE id = 1")
+    conn.commit()
+    conn.close()
+    history = order_service.get_orders_by_user_id(1)
+    _, _, email_items = order_service.get_order_items_for_email(order_id)
+    item = history[0][1][0] if history and history[0][1] else {}
+    return assert_true(success, message) and \
+           assert_equals((item.get('product_name'), item.get('product_price')), ('Hot', Decimal('10.00'))) and \
+           assert_equals([(i['name'], i['price']) for i in email_items], [('Hot', Decimal('10.00'))])
+
+
+def test_order_history_pages_by_date_and_id():
+    """L'historial es pagina per (created_at, id) sense repetir ni saltar comandes, amb les seves línies."""
+    from utils.database import get_connection
+    _setup_hot_product(stock=50, buyers=2)
+    dates = ['2024-01-01 10:00:00', '2024-01-02 10:00:00', '2024-01-02 10:00:00', '2024-01-02 10:00:00',
+             '2024-01-03 10:00:00', None, None]
+    # Connexió del pool: la base de dades de prova ja té l'esquema migrat
+    with get_connection('test.db') as conn:
+        for order_id, created_at in enumerate(dates, start=1):
+            conn.execute('INSERT INTO "Order" (id, total, total_cents, created_at, user_id) VALUES (?, ?, ?, ?, 1)',
+                         (order_id, order_id * 10, order_id * 1000, created_at))
+            conn.execute("INSERT INTO OrderItem (order_id, product_id, quantity, product_name, unit_price_cents) "
+                         "VALUES (?, 1, ?, 'Hot', 1000)", (order_id, order_id))
+        conn.execute('INSERT INTO "Order" (id, total, total_cents, created_at, user_id) VALUES (8, 10, 1000, ?, 2)',
+                     (dates[4],))
+    order_service = OrderService('test.db')
+    pages, after = [], None
+    while len(pages) < 10:
+        page, after = order_service.get_order_history(1, after, limit=2)
+        pages.append([(order.id, [item['quantity'] for item in items]) for order, items in page])
+        if after is None:
+            break
+    try:
+        order_service.get_order_history(1, 'no-és-un-cursor')
+        ok_invalid = assert_true(False, "Un cursor no vàlid ha de llançar ValueError")
+    except ValueError:
+        ok_invalid = True
+    return assert_equals(pages, [
+        [(5, [5]), (4, [4])], [(3, [3]), (2, [2])], [(1, [1]), (7, [7])], [(6, [6])]
+    ]) and ok_invalid and \
+        assert_equals([order.id for order, _ in order_service.get_orders_by_user_id(1)], [5, 4, 3, 2, 1, 7, 6])
+
+
+def test_order_idempotency_key_reuses_order():
+    """Una clau d'idempotència repetida retorna la comanda original sense descomptar stock."""
+    from services.order_service import ORDER_ALREADY_PROCESSED
+    _setup_hot_product(stock=5, buyers=1)
+    order_service = OrderService('test.db')
+    key = "k" * 43
+    first = order_service.create_order({1: 2}, 1, key)
+    second = order_service.create_order({1: 2}, 1, key)
+    conn = sqlite3.connect('test.db')
+    stock = conn.execute("SELECT stock FROM Product WHERE id = 1").fetchone()[0]
+    orders = conn.execute('SELECT COUNT(*) FROM "Order"').fetchone()[0]
+    conn.close()
+    return assert_true(first[0]) and assert_equals(second, (True, ORDER_ALREADY_PROCESSED, first[2])) and \
+           assert_equals(stock, 3) and assert_equals(orders, 1) and \
+           assert_equals(order_service.get_order_id_by_idempotency_key(key), first[2])
+
+
+def test_order_idempotency_key_wins_over_emptied_cart():
+    """El segon enviament d'un formulari, amb el carretó ja buidat pel primer, retorna la comanda original."""
+    from services.order_service import ORDER_ALREADY_PROCESSED
+    _setup_hot_product(stock=5, buyers=1)
+    order_service = OrderService('test.db')
+    key = "e" * 43
+    first = order_service.create_order({1: 1}, 1, key)
+    second = order_service.create_order({}, 1, key)
+    without_key = order_service.create_order({}, 1, "f" * 43)
+    return assert_true(first[0]) and assert_equals(second, (True, ORDER_ALREADY_PROCESSED, first[2])) and \
+           assert_equals(without_key, (False, "El carretó està buit", 0))
+
+
+def test_web_process_order_double_submit_creates_one_order():
+    """Reenviar el mateix formulari de checkout no crea una segona comanda ni torna a encuar la factura."""
+    import re
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO User (username, password_hash, email) VALUES ('test_idem_order', 'hash', 'idem@test.com')")
+    user_id = cursor.lastrowid
+    cursor.execute("INSERT INTO Product (name, price, stock) VALUES ('Idem Product', 20.00, 10)")
+    product_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+
+    client = app.test_client()
+    try:
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        client.post("/add_to_cart", data={"product_id": product_id, "quantity": 2})
+        page = client.get("/checkout").get_data(as_text=True)
+        key = re.search(r'name="idempotency_key" value="([^"]+)"', page).group(1)
+        form = {"checkout_type": "authenticated", "address": "Carrer Idempotent 1, Barcelona", "idempotency_key": key}
+        first = client.post("/process_order", data=form)
+        client.post("/add_to_cart", data={"product_id": product_id, "quantity": 1})
+        second = client.post("/process_order", data=form)
+        conn = sqlite3.connect("techshop.db")
+        orders = conn.execute('SELECT COUNT(*) FROM "Order" WHERE user_id = ?', (user_id,)).fetchone()[0]
+        stock = conn.execute("SELECT stock FROM Product WHERE id = ?", (product_id,)).fetchone()[0]
+        jobs = conn.execute(
+            "SELECT COUNT(*) FROM Job WHERE kind = 'order_placed' AND json_extract(payload, '$.order_id') IN "
+            "(SELECT id FROM \"Order\" WHERE user_id = ?)", (user_id,)
+        ).fetchone()[0]
+        conn.close()
+        cart = CartService().get_cart_contents({"user_id": user_id})
+    finally:
+        conn = sqlite3.connect("techshop.db")
+        conn.execute("DELETE FROM Job WHERE json_extract(payload, '$.order_id') IN "
+                     "(SELECT id FROM \"Order\" WHERE user_id = ?)", (user_id,))
+        conn.execute("DELETE FROM OrderItem WHERE order_id IN (SELECT id FROM \"Order\" WHERE user_id = ?)", (user_id,))
+        conn.execute('DELETE FROM "Order" WHERE user_id = ?', (user_id,))
+        conn.execute("DELETE FROM User WHERE id = ?", (user_id,))
+        conn.execute("DELETE FROM Product WHERE id = ?", (product_id,))
+        conn.commit()
+        conn.close()
+        clear_catalog_caches()
+    return assert_equals(second.headers.get("Location"), first.headers.get("Location")) and \
+           assert_equals(orders, 1) and assert_equals(stock, 8) and assert_equals(jobs, 1) and \
+           assert_equals(cart, {product_id: 1})
@@ -3,6 +3,8 @@ Tests para Product Service
 """
 
 from tests.test_common import *
+from migrations.migrate_database import migrate
+from services.product_service import MAX_PAGE_SIZE
 
 def test_product_service_get_all_products():
     """Verificar que ProductService obtiene todos los productos."""
@@ -95,3 +97,124 @@ def test_product_service_get_products_by_ids_dict():
 
 # ========== TESTS DE COMPANY SERVICE ==========
 
+
+
+def test_product_service_products_page_keyset():
+    """La paginació per conjunt de claus recorre el catàleg sense repetir ni saltar productes."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    rows = [(1, 'Delta', 30.0), (2, 'Alfa', 10.0), (3, 'Charlie', 10.0), (4, 'Bravo', 5.5), (5, 'Eco', 20.0)]
+    conn.executemany("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, ?, 1)", rows)
+    conn.commit()
+    conn.close()
+
+    service = ProductService('test.db')
+    expected = {'id': [1, 2, 3, 4, 5], 'price': [4, 2, 3, 5, 1], 'name': [2, 4, 3, 1, 5]}
+    ok = True
+    for sort, ids in expected.items():
+        seen, cursor, pages = [], None, 0
+        while True:
+            products, cursor = service.get_products_page(sort, cursor, limit=2)
+            seen.extend(p.id for p in products)
+            pages += 1
+            if cursor is None:
+                break
+        ok = assert_equals(seen, ids, f"Ordre incorrecte per {sort}") and assert_equals(pages, 3) and ok
+    return ok
+
+
+def test_product_service_products_page_invalid():
+    """Una ordenació o un cursor no vàlids llancen ValueError."""
+    init_test_db()
+    service = ProductService('test.db')
+    product = Product(id=1, name='P', price_cents=100, stock=1)
+    from services.product_service import encode_cursor
+    errors = 0
+    for sort, after in (('stock', None), ('id', 'no-és-un-cursor'), ('price', encode_cursor(product, 'name'))):
+        try:
+            service.get_products_page(sort, after)
+        except ValueError:
+            errors += 1
+    return assert_equals(errors, 3, "Cada cas no vàlid ha de llançar ValueError")
+
+
+def test_product_service_search_ranking_and_sync():
+    """La cerca FTS5 troba prefixos sense accents, ordena per rellevància i segueix els canvis."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    rows = [(1, 'Càmera'), (2, 'Funda protectora per a càmera digital'), (3, 'Ratolí sense fil'), (4, 'Teclat')]
+    conn.executemany("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, 10.0, 1)", rows)
+    conn.commit()
+    conn.close()
+
+    service = ProductService('test.db')
+    products, total = service.search_products('  CAM ')
+    ok_found = assert_equals(total, 2) and assert_equals([p.id for p in products], [1, 2], "bm25 ha de prioritzar el nom més curt")
+    page, _ = service.search_products('cam', page=2, limit=1)
+    ok_page = assert_equals([p.id for p in page], [2])
+    ok_empty = assert_equals(service.search_products('!!!'), ([], 0))
+
+    admin = AdminService('test.db')
+    admin.update_product(4, 'Teclat i càmera web', Decimal('10.00'), 1)
+    admin.delete_product(1)
+    _, total_after = service.search_products('cam')
+    renamed, _ = service.search_products('web')
+    return ok_found and ok_page and ok_empty and assert_equals(total_after, 2, "La cerca ha de reflectir els canvis") and \
+           assert_equals([p.id for p in renamed], [4])
+
+
+def test_product_service_filters_and_facets():
+    """Els filtres de preu, estoc i empresa es combinen i les facetes compten amb els altres filtres."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    migrate(conn)  # company_id i ProductFacet
+    conn.execute("INSERT INTO User (id, username, password_hash, email, account_type) VALUES (9, 'venedor', 'h', 'v@e.com', 'company')")
+    rows = [(1, 'Barat', 10.0, 5, None), (2, 'Esgotat', 15.0, 0, 9), (3, 'Mitjà', 40.0, 2, 9), (4, 'Car', 600.0, 1, None)]
+    conn.executemany("INSERT INTO Product (id, name, price, stock, company_id) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    service = ProductService('test.db')
+    cheap, _ = service.get_products_page('price', price_band=0)
+    stocked, _ = service.get_products_page('id', in_stock=True, company_id=9)
+    own, _ = service.get_products_page('id', company_id=0)
+    first, cursor = service.get_products_page('price', limit=1, in_stock=True)
+    second, _ = service.get_products_page('price', cursor, limit=1, in_stock=True)
+    ok_pages = assert_equals([p.id for p in cheap], [1, 2]) and assert_equals([p.id for p in stocked], [3]) and \
+               assert_equals([p.id for p in own], [1, 4]) and assert_equals([p.id for p in first + second], [1, 3])
+
+    facets = service.get_facet_counts(in_stock=True, company_id=9)
+    ok_facets = assert_equals(facets['total'], 1) and assert_equals(facets['price_band'], {1: 1}) and \
+                assert_equals(facets['in_stock'], {0: 1, 1: 1}) and assert_equals(facets['company'], {0: 2, 9: 1}) and \
+                assert_equals(facets['company_names'][9], 'venedor')
+
+    AdminService('test.db').update_product(3, 'Mitjà', Decimal('40.00'), 0)
+    ok_updated = assert_equals(service.get_facet_counts(in_stock=True)['company'], {0: 2}, "Les facetes han de seguir l'estoc")
+    try:
+        service.get_products_page('id', price_band=99)
+        ok_invalid = assert_true(False, "Una franja inexistent ha de llançar ValueError")
+    except ValueError:
+        ok_invalid = True
+    return ok_pages and ok_facets and ok_updated and ok_invalid
+
+
+def test_product_service_batch_and_export():
+    """El lot llegeix els IDs amb una sola consulta i l'exportació recorre tot el catàleg per blocs."""
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.executemany("INSERT INTO Product (id, name, price, stock) VALUES (?, ?, 1.0, 1)",
+                     [(i, f'Producte {i}') for i in range(1, 8)])
+    conn.commit()
+    conn.close()
+
+    service = ProductService('test.db')
+    batch = service.get_products_batch([5, 99, 2, 5])
+    exported = [p.id for p in service.iter_products(batch_size=3)]
+    try:
+        service.get_products_batch(range(MAX_PAGE_SIZE + 1))
+        too_many = False
+    except ValueError:
+        too_many = True
+    return assert_equals([p.id for p in batch], [5, 2], "Ordre demanat, sense repetits ni inexistents") and \
+           assert_equals(exported, list(range(1, 8))) and \
+           assert_true(too_many, "Més de MAX_PAGE_SIZE IDs ha de llançar ValueError")
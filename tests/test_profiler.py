@@ -0,0 +1,76 @@
+"""
+Tests para el perfilador SQL por petición (utils/profiler.py)
+"""
+
+from tests.test_common import *
+from utils.cache import clear_catalog_caches
+from utils.profiler import (PROFILE_HEADER, RequestProfile, clear_profiles, get_recent_profiles,
+                            get_statement_summary, normalize_sql, write_slow_queries)
+
+
+def test_profiler_normalize_sql():
+    """Els literals es substitueixen per '?' i els espais es compacten."""
+    sql = normalize_sql("SELECT *  FROM User\n WHERE id = 42 AND name = 'o''hara'")
+    return assert_equals(sql, "SELECT * FROM User WHERE id = ? AND name = ?", "SQL normalitzat incorrecte")
+
+
+def test_profiler_response_header():
+    """Cada resposta inclou el nombre de consultes i el temps SQL."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    clear_catalog_caches()  # amb la portada a la memòria cau no hi hauria cap consulta
+    resp = client.get("/")
+    header = resp.headers.get(PROFILE_HEADER, "")
+    queries = int(header.split(";")[0].split("=")[1]) if header.startswith("queries=") else 0
+
+    ok_header = assert_true(header.startswith("queries="), f"Falta la capçalera {PROFILE_HEADER}")
+    ok_count = assert_true(queries > 0, "La portada ha d'executar consultes")
+    ok_timing = assert_true("sql;dur=" in resp.headers.get("Server-Timing", ""), "Falta Server-Timing")
+    return ok_header and ok_count and ok_timing
+
+
+def test_profiler_records_recent_requests():
+    """Les peticions amb SQL queden a l'historial amb les sentències agrupades."""
+    app.config["TESTING"] = True
+    clear_profiles()
+    client = app.test_client()
+    for _ in range(2):
+        clear_catalog_caches()  # sense memòria cau, totes dues peticions consulten
+        client.get("/")
+    profiles = get_recent_profiles()
+    summary = get_statement_summary(profiles)
+
+    ok_profiles = assert_equals(len(profiles), 2, "S'han de guardar les dues peticions")
+    ok_summary = assert_true(
+        any(entry["count"] >= 2 for entry in summary),
+        "Les sentències repetides s'han d'agrupar"
+    )
+    return ok_profiles and ok_summary
+
+
+def test_profiler_slow_query_log():
+    """Les sentències per sobre del llindar s'escriuen al registre."""
+    log_path = 'test_slow_queries.log'
+    if os.path.exists(log_path): os.remove(log_path)
+    profile = RequestProfile("GET", "/")
+    fast = profile.record("SELECT 1")
+    fast.duration_ms = 1.0
+    slow = profile.record("SELECT * FROM Product WHERE id = 7")
+    slow.duration_ms = 250.0
+
+    written = write_slow_queries(profile, threshold_ms=100, log_path=log_path)
+    with open(log_path, encoding='utf-8') as f:
+        content = f.read()
+    os.remove(log_path)
+
+    ok_count = assert_equals(written, 1, "Només s'ha d'escriure la sentència lenta")
+    ok_content = assert_true("SELECT * FROM Product WHERE id = ?" in content, "El registre ha de tenir el SQL normalitzat")
+    return ok_count and ok_content
+
+
+def test_profiler_admin_view_requires_admin():
+    """La vista de perfil SQL només és accessible per administradors."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    resp = client.get("/admin/sql-profile")
+    return assert_equals(resp.status_code, 302, "Un usuari anònim ha de ser redirigit")
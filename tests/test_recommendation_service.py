@@ -89,6 +89,7 @@ def test_recommendations_no_sales():
 def test_recommendations_db_error_returns_empty():
     """Si hi ha un error de BD, el servei de recomanacions ha de retornar llista buida."""
     service = RecommendationService('test.db')
+    close_all_pools()  # Forçar connexions noves: les del pool ja estan obertes
     original_connect = sqlite3.connect
 
     def failing_connect(*args, **kwargs):
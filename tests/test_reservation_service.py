@@ -0,0 +1,109 @@
+"""
+Tests para las reservas de estoc de los carritos (services/reservation_service.py)
+"""
+
+import threading
+
+from tests.test_common import *
+from services.reservation_service import AVAILABLE_SQL, ReservationService
+from utils.cache import clear_catalog_caches
+
+
+def _setup_product(stock):
+    init_test_db()
+    conn = sqlite3.connect('test.db')
+    conn.execute("INSERT INTO Product (id, name, price, stock) VALUES (1, 'Oferta', 10.00, ?)", (stock,))
+    conn.commit()
+    conn.close()
+
+
+def test_reservation_holds_units_for_other_carts():
+    """Les unitats retingudes per un carretó no les pot afegir un altre, fins que les allibera."""
+    _setup_product(5)
+    service = CartService('test.db')
+    first, second = MockSession(), MockSession()
+    ok_first, _ = service.add_to_cart(1, 4, first)
+    ok_second, message = service.add_to_cart(1, 2, second)
+    available_held = service.reservations.get_available([1])
+    ok_own, _ = service.add_to_cart(1, 1, first)  # el mateix carretó pot ampliar la seva reserva
+    service.remove_from_cart(1, first)
+    ok_after_release, _ = service.add_to_cart(1, 2, second)
+    return assert_true(ok_first) and assert_false(ok_second, "Només queda 1 unitat lliure") and \
+           assert_true("Disponible: 1" in message, message) and assert_equals(available_held, {1: 1}) and \
+           assert_true(ok_own) and assert_true(ok_after_release, "En eliminar la línia s'allibera la reserva")
+
+
+def test_reservation_expired_holds_released_in_bulk():
+    """Les reserves caducades no compten i release_expired les elimina totes d'un cop."""
+    _setup_product(3)
+    service = CartService('test.db')
+    for _ in range(3):
+        service.add_to_cart(1, 1, MockSession())
+    full = service.reservations.get_available([1])
+    conn = sqlite3.connect('test.db')
+    conn.execute("UPDATE StockReservation SET expires_at = expires_at - 10000")
+    conn.commit()
+    expired = service.reservations.get_available([1])
+    released = ReservationService('test.db').release_expired()
+    remaining = conn.execute("SELECT COUNT(*) FROM StockReservation").fetchone()[0]
+    conn.close()
+    return assert_equals(full, {1: 0}) and assert_equals(expired, {1: 3}) and \
+           assert_equals(released, 3) and assert_equals(remaining, 0)
+
+
+def test_reservation_concurrent_carts_never_oversell():
+    """Diversos carretons simultanis no poden retenir més unitats que l'estoc."""
+    _setup_product(5)
+    service = CartService('test.db')
+    results = []
+    lock = threading.Lock()
+
+    def buyer():
+        ok, _ = service.add_to_cart(1, 1, MockSession())
+        with lock:
+            results.append(ok)
+
+    threads = [threading.Thread(target=buyer) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conn = sqlite3.connect('test.db')
+    held = conn.execute("SELECT SUM(quantity) FROM StockReservation WHERE product_id = 1").fetchone()[0]
+    conn.close()
+    return assert_equals(results.count(True), 5) and assert_equals(held, 5)
+
+
+def test_reservation_available_uses_covering_index():
+    """Les unitats disponibles se sumen des de l'índex cobert, sense llegir la taula de reserves."""
+    _setup_product(1)
+    ReservationService('test.db').get_available([1])  # aplica les migracions
+    conn = sqlite3.connect('test.db')
+    plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + AVAILABLE_SQL, (0, None, "[1]")))
+    conn.close()
+    return assert_true("COVERING INDEX idx_reservation_product_expiry" in plan, plan)
+
+
+def test_web_product_page_shows_available_units():
+    """La fitxa del producte mostra l'estoc menys les reserves dels carretons."""
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO Product (name, price, stock) VALUES ('Reserva web', 10.00, 7)")
+    product_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    buyer, visitor = app.test_client(), app.test_client()
+    try:
+        before = visitor.get(f"/product/{product_id}").get_data(as_text=True)
+        buyer.post("/add_to_cart", data={"product_id": product_id, "quantity": 3})
+        after = visitor.get(f"/product/{product_id}").get_data(as_text=True)
+    finally:
+        conn = sqlite3.connect("techshop.db")
+        conn.execute("DELETE FROM Product WHERE id = ?", (product_id,))
+        conn.commit()
+        conn.close()
+        clear_catalog_caches()
+    return assert_true('max="5"' in before, "Sense reserves hi ha 7 unitats") and \
+           assert_true('max="4"' in after, "Amb 3 unitats reservades en queden 4")
@@ -23,6 +23,16 @@ from tests import test_validators
 from tests import test_web_routes
 from tests import test_security
 from tests import test_integration
+from tests import test_database
+from tests import test_migrations
+from tests import test_profiler
+from tests import test_money
+from tests import test_cache
+from tests import test_image_manifest
+from tests import test_api
+from tests import test_import_service
+from tests import test_reservation_service
+from tests import test_job_queue
 
 
 def collect_all_tests():
@@ -43,6 +53,16 @@ def collect_all_tests():
         (test_web_routes, "Web"),
         (test_security, "Security"),
         (test_integration, "Integration"),
+        (test_database, "Database"),
+        (test_migrations, "Migrations"),
+        (test_profiler, "Profiler"),
+        (test_money, "Money"),
+        (test_cache, "Cache"),
+        (test_image_manifest, "ImageManifest"),
+        (test_api, "API"),
+        (test_import_service, "Import"),
+        (test_reservation_service, "Reservations"),
+        (test_job_queue, "Jobs"),
     ]
     
     for test_module, category_prefix in test_modules:
@@ -58,6 +58,18 @@ def test_user_service_create_or_get_user():
 
 
 
+def test_user_service_create_or_get_user_reused_email():
+    """El checkout com a convidat accepta un usuari nou amb un email ja registrat."""
+    init_test_db()
+    service = UserService('test.db')
+    first = service.create_or_get_user('guest_one', 'GuestPass123', 'shared@test.com', 'Address 1')
+    second = service.create_or_get_user('guest_two', 'GuestPass123', 'shared@test.com', 'Address 2')
+    updated = service.create_or_get_user('guest_one', 'GuestPass123', 'shared@test.com', 'Address 3')
+    return assert_true(first[0], first[2]) and assert_true(second[0], second[2]) and \
+           assert_true(updated[0], updated[2])
+
+
+
 def test_user_service_create_user():
     """Verificar que UserService crea un nuevo usuario."""
     if os.path.exists('test.db'): os.remove('test.db')
@@ -3,6 +3,9 @@ Tests para Web Routes
 """
 
 from tests.test_common import *
+from routes.helpers import CSRF_PLACEHOLDER, fill_fragment
+from utils.cache import get_catalog_cache, get_fragment_cache
+from utils.coherence import get_change_monitor
 
 def test_web_get_products_page():
     """La pàgina principal de productes ha de carregar sense errors."""
@@ -12,6 +15,96 @@ def test_web_get_products_page():
     return assert_equals(resp.status_code, 200, "La portada ha de respondre 200")
 
 
+def test_web_products_page_json():
+    """L'endpoint de desplaçament infinit retorna una pàgina en JSON amb el cursor següent."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    resp = client.get("/products/page?sort=price&limit=1")
+    data = resp.get_json() or {}
+    bad = client.get("/products/page?sort=stock")
+    bad_cursor = client.get("/products/page?after=xyz")
+    ok_status = assert_equals(resp.status_code, 200, "L'endpoint ha de respondre 200")
+    ok_keys = assert_true(all(k in data for k in ("products", "html", "next", "next_url")), "Falten claus al JSON")
+    ok_limit = assert_true(len(data.get("products", [])) <= 1, "S'ha de respectar el límit")
+    ok_bad = assert_equals(bad.status_code, 400) and assert_equals(bad_cursor.status_code, 400)
+    return ok_status and ok_keys and ok_limit and ok_bad
+
+
+def test_web_products_page_filters():
+    """Los filtros se aplican a la página JSON y se conservan en la URL siguiente."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    resp = client.get("/products/page?in_stock=1&price_band=0&limit=1")
+    data = resp.get_json() or {}
+    html = client.get("/?in_stock=1&price_band=abc")
+    products = data.get("products", [])
+    ok_status = assert_equals(resp.status_code, 200) and assert_equals(html.status_code, 200)
+    ok_filtered = assert_true(all(p["stock"] > 0 and p["price_cents"] < 2500 for p in products), "Productos fuera del filtro")
+    ok_next = assert_true(data.get("next_url") is None or "in_stock=1" in data["next_url"], "La URL siguiente ha de conservar los filtros")
+    ok_facets = assert_true("total" in data.get("facets", {}), "Faltan las facetas")
+    return ok_status and ok_filtered and ok_next and ok_facets
+
+
+def test_web_bad_cursor_is_not_cached():
+    """Un cursor inventado responde 400 y no añade fragmentos a la caché."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    fragments = get_fragment_cache()
+    client.get("/")
+    before = fragments.stats()
+    html = client.get("/?after=inventat")
+    wrong_sort = client.get("/?sort=price&after=WyJpZCIsMV0")  # cursor de sort=id
+    nested = client.get("/products/page?sort=price&after=WyJwcmljZSIsWzFdLDJd")  # ["price",[1],2]
+    after = fragments.stats()
+    ok_status = assert_equals(html.status_code, 400) and assert_equals(wrong_sort.status_code, 400) and \
+                assert_equals(nested.status_code, 400)
+    ok_cache = assert_equals(after["size"], before["size"], "Un cursor no válido no ha de crear entradas") and \
+               assert_equals(after["misses"], before["misses"])
+    return ok_status and ok_cache
+
+
+def test_web_search():
+    """La búsqueda responde en HTML y en JSON con la consulta normalizada."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    page = client.get("/search?q=Test&page=x")
+    resp = client.get("/search.json?q=%20%20TEST%20&limit=2")
+    data = resp.get_json() or {}
+    ok_page = assert_equals(page.status_code, 200, "La página de búsqueda ha de responder 200")
+    ok_json = assert_equals(resp.status_code, 200) and assert_equals(data.get("query"), "test") and \
+              assert_true(all(k in data for k in ("total", "page", "products", "next_page")), "Falten claus al JSON")
+    ok_limit = assert_true(len(data.get("products", [])) <= 2, "S'ha de respectar el límit")
+    return ok_page and ok_json and ok_limit
+
+
+def test_web_fragment_cache():
+    """La graella y las tendencias se cachean por idioma y se descartan al cambiar el catálogo."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    fragments = get_fragment_cache()
+    client.get("/")
+    get_change_monitor("techshop.db").poll(force=True)  # descarta cambios de tests anteriores
+    client.get("/")
+    before = fragments.stats()
+    client.get("/")
+    after_hit = fragments.stats()
+    with client.session_transaction() as sess:
+        sess["language"] = "eng"
+    client.get("/")
+    after_lang = fragments.stats()
+    get_catalog_cache("techshop.db").invalidate_products([])
+    client.get("/")
+    after_change = fragments.stats()
+    with app.test_request_context():
+        html = str(fill_fragment(f'<input name="csrf_token" value="{CSRF_PLACEHOLDER}">'))
+    ok_hit = assert_equals(after_hit["hits"] - before["hits"], 2, "Graella i tendències haurien de ser hits") and \
+             assert_equals(after_hit["misses"], before["misses"])
+    ok_lang = assert_equals(after_lang["misses"] - after_hit["misses"], 2, "Un altre idioma es renderitza a part")
+    ok_change = assert_equals(after_change["misses"] - after_lang["misses"], 2, "Un canvi del catàleg descarta els fragments")
+    ok_csrf = assert_true(CSRF_PLACEHOLDER not in html and 'value=""' not in html, "El token CSRF s'ha d'omplir")
+    return ok_hit and ok_lang and ok_change and ok_csrf
+
+
 
 def test_web_login_success():
     """Login exitós amb credencials vàlides."""
@@ -568,5 +661,120 @@ def test_web_login_redirects_to_complete_data_if_missing():
     return ok_redirect and ok_profile
 
 
+def test_web_conditional_get_catalog():
+    """La portada responde 304 a If-None-Match hasta que cambian los productos o el idioma."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    first = client.get("/")
+    etag = first.headers.get("ETag", "").strip('"')
+    cached = client.get("/", headers={"If-None-Match": f'"{etag}"'})
+    conn = sqlite3.connect("techshop.db")
+    conn.execute("UPDATE ChangeCounter SET version = version + 1 WHERE entity = 'product'")  # escritura de otro proceso
+    conn.commit()
+    conn.close()
+    changed = client.get("/", headers={"If-None-Match": f'"{etag}"'})
+    with client.session_transaction() as sess:
+        sess["language"] = "eng"
+    other_lang = client.get("/", headers={"If-None-Match": changed.headers.get("ETag", "")})
+    ok_headers = assert_true(etag != "", "Falta la ETag") and \
+                 assert_true("no-cache" in first.headers.get("Cache-Control", ""), "La portada se ha de revalidar siempre")
+    ok_cached = assert_equals(cached.status_code, 304) and assert_equals(cached.data, b"")
+    ok_changed = assert_equals(changed.status_code, 200, "Un cambio de productos cambia la ETag") and \
+                 assert_equals(other_lang.status_code, 200, "Otro idioma cambia la ETag")
+    return ok_headers and ok_cached and ok_changed
+
+
+def test_web_conditional_get_product_and_invoice():
+    """El detalle usa la versión del producto y la factura responde 304 sin generar el PDF."""
+    app.config["TESTING"] = True
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO Product (name, price, stock) VALUES ('Condicional', 10.00, 5)")
+    product_id = cursor.lastrowid
+    cursor.execute(
+        "INSERT INTO User (username, password_hash, email, address, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
+        ("conditional_user", generate_password_hash("Test123"), "conditional@test.com", "Carrer 1")
+    )
+    user_id = cursor.lastrowid
+    cursor.execute('INSERT INTO "Order" (total_cents, created_at, user_id) VALUES (1000, ?, ?)', ("2024-01-01 10:00:00", user_id))
+    order_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    
+    client = app.test_client()
+    first = client.get(f"/product/{product_id}")
+    etag = first.headers.get("ETag", "")
+    cached = client.get(f"/product/{product_id}", headers={"If-None-Match": etag})
+    conn = sqlite3.connect("techshop.db")
+    conn.execute("UPDATE Product SET stock = 4 WHERE id = ?", (product_id,))
+    conn.commit()
+    conn.close()
+    ProductService("techshop.db").cache.clear()  # sin esperar al intervalo de coherencia
+    changed = client.get(f"/product/{product_id}", headers={"If-None-Match": etag})
+    
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    invoice = client.get(f"/profile/invoice/{order_id}",
+                         headers={"If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT"})
+    
+    conn = sqlite3.connect("techshop.db")
+    conn.execute('DELETE FROM "Order" WHERE id = ?', (order_id,))
+    conn.execute("DELETE FROM User WHERE id = ?", (user_id,))
+    conn.execute("DELETE FROM Product WHERE id = ?", (product_id,))
+    conn.commit()
+    conn.close()
+    ok_detail = assert_equals(first.status_code, 200) and assert_equals(cached.status_code, 304) and \
+                assert_equals(changed.status_code, 200, "Un cambio de stock cambia la ETag del producto")
+    ok_invoice = assert_equals(invoice.status_code, 304, "La factura no se regenera si no ha cambiado")
+    return ok_detail and ok_invoice
+
+
+
+def test_web_profile_order_history_json():
+    """El perfil mostra una pàgina de l'historial i /profile/orders.json retorna les següents."""
+    app.config["TESTING"] = True
+    conn = sqlite3.connect("techshop.db")
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO User (username, password_hash, email, address, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
+        ("history_user", generate_password_hash("Test123"), "history@test.com", "Carrer 1")
+    )
+    user_id = cursor.lastrowid
+    order_ids = []
+    for day in range(1, 13):
+        cursor.execute('INSERT INTO "Order" (total_cents, created_at, user_id) VALUES (1000, ?, ?)',
+                       (f"2024-01-{day:02d} 10:00:00", user_id))
+        order_ids.append(cursor.lastrowid)
+        cursor.execute("INSERT INTO OrderItem (order_id, product_id, quantity, product_name, unit_price_cents) "
+                       "VALUES (?, 1, 1, 'Historial', 1000)", (cursor.lastrowid,))
+    conn.commit()
+    conn.close()
+    
+    client = app.test_client()
+    anonymous = client.get("/profile/orders.json")
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    page = client.get("/profile?section=history")
+    html = page.get_data(as_text=True)
+    first = client.get("/profile/orders.json?limit=5").get_json()
+    second = client.get(first["next_url"]).get_json() if first.get("next_url") else {}
+    invalid = client.get("/profile/orders.json?after=xyz")
+    
+    conn = sqlite3.connect("techshop.db")
+    conn.execute("DELETE FROM OrderItem WHERE order_id IN (SELECT id FROM \"Order\" WHERE user_id = ?)", (user_id,))
+    conn.execute('DELETE FROM "Order" WHERE user_id = ?', (user_id,))
+    conn.execute("DELETE FROM User WHERE id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+    newest_first = list(reversed(order_ids))
+    return assert_equals(anonymous.status_code, 401) and assert_equals(page.status_code, 200) and \
+           assert_equals(html.count('class="order-card"'), 10, "La primera pàgina del perfil té 10 comandes") and \
+           assert_true("orders-more" in html, "Falta l'enllaç a la pàgina següent") and \
+           assert_equals([order["id"] for order in first["orders"]], newest_first[:5]) and \
+           assert_equals([order["id"] for order in second.get("orders", [])], newest_first[5:10]) and \
+           assert_equals(first["orders"][0]["items"][0]["name"], "Historial") and \
+           assert_equals(first["html"].count('class="order-card"'), 5) and \
+           assert_equals(invalid.status_code, 400)
+
 if __name__ == '__main__':
     exit(0 if main() else 1)
\ No newline at end of file
@@ -0,0 +1,573 @@
+"""
+Memòria cau en procés del catàleg de productes
+Guarda el llistat complet, els productes per ID i els resultats de cerca amb
+caducitat (TTL) i un límit d'entrades; els serveis que modifiquen productes la
+invaliden i els canvis d'altres processos es detecten amb utils/coherence.py.
+També guarda els fragments HTML renderitzats del catàleg (FragmentCache) i
+altres entitats lligades a una família de canvis (EntityCache: usuaris,
+recomanacions...)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from utils.coherence import ChangeMonitor, get_change_monitor, reset_change_monitors
+from utils.database import get_connection
+
+# Paràmetres ajustables per variables d'entorn
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", "60"))
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", "1024"))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "256"))
+FRAGMENT_CACHE_TTL = float(os.environ.get("FRAGMENT_CACHE_TTL", "300"))
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "512"))
+ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", "60"))
+ENTITY_CACHE_SIZE = int(os.environ.get("ENTITY_CACHE_SIZE", "1024"))
+
+# Marca que indica que una clau no és a la memòria cau (None és un valor vàlid)
+MISSING = object()
+
+_ALL_PRODUCTS = "all"
+_FACETS = "facets"
+
+
+def _product_key(product_id: Any) -> tuple:
+    """Clau d'un producte (els carretons de la sessió guarden els IDs com a text)."""
+    return ("product", int(product_id))
+
+
+class TTLCache:
+    """Memòria cau LRU amb caducitat i límit d'entrades, segura entre fils"""
+
+    def __init__(self, max_size: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        """
+        Inicialitza la memòria cau.
+
+        Args:
+            max_size (int): Nombre màxim d'entrades (les menys usades s'expulsen)
+            ttl (float): Segons de vida de cada entrada (0 desactiva la memòria cau)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Obtenir el valor d'una clau.
+
+        Args:
+            key: Clau de l'entrada
+
+        Returns:
+            El valor guardat, o MISSING si no hi és o ha caducat
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Guardar un valor, expulsant les entrades menys usades si cal.
+
+        Args:
+            key: Clau de l'entrada
+            value: Valor a guardar
+        """
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Eliminar una entrada.
+
+        Args:
+            key: Clau de l'entrada
+
+        Returns:
+            bool: True si l'entrada existia
+        """
+        with self._lock:
+            return self._entries.pop(key, MISSING) is not MISSING
+
+    def clear(self):
+        """Eliminar totes les entrades (els comptadors es mantenen)."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors de la memòria cau.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations i size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+            }
+
+
+class CatalogCache:
+    """Memòria cau del catàleg de productes d'una base de dades"""
+
+    def __init__(self, max_size: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL,
+                 monitor: Optional[ChangeMonitor] = None):
+        """
+        Inicialitza la memòria cau.
+
+        Args:
+            max_size (int): Nombre màxim d'entrades
+            ttl (float): Segons de vida de cada entrada
+            monitor (ChangeMonitor, optional): Monitor de canvis de la base de
+                dades; si canvia la família 'product' es buida tot el catàleg, i
+                si canvia 'stock' només s'invaliden els productes afectats
+        """
+        self._entries = TTLCache(max_size, ttl)
+        # Resultats de cerca per consulta normalitzada (LRU independent)
+        self._search = TTLCache(min(max_size, SEARCH_CACHE_SIZE), ttl)
+        self._monitor = monitor
+        if monitor is not None:
+            monitor.subscribe("product", self.clear)
+            monitor.subscribe_versions("stock", self._stock_changed)
+        # Cada invalidació incrementa la generació: una càrrega que ha començat
+        # abans d'una escriptura no guarda el seu resultat (ja antic)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def _get_or_load(self, key: Hashable, loader: Callable[[], Any],
+                     entries: Optional[TTLCache] = None) -> Any:
+        entries = self._entries if entries is None else entries
+        if self._monitor is not None:
+            self._monitor.poll()
+        value = entries.get(key)
+        if value is not MISSING:
+            return value
+        generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                entries.set(key, value)
+        return value
+
+    @contextmanager
+    def local_write(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        """
+        Bloc d'escriptura de productes que qui escriu invalida amb invalidate_products().
+
+        Fa commit en sortir; amb monitor, els canvis de 'product' i 'stock'
+        del bloc no tornen a buidar el catàleg (ChangeMonitor.local_write).
+
+        Args:
+            conn (sqlite3.Connection): Connexió on es fan les escriptures
+        """
+        if self._monitor is None:
+            yield conn
+            conn.commit()
+            return
+        with self._monitor.local_write(conn, ('product', 'stock')):
+            yield conn
+
+    def _stock_changed(self, previous: int, current: int):
+        """Invalidar els productes que un altre procés ha canviat només d'estoc."""
+        try:
+            with get_connection(self._monitor.db_path) as conn:
+                rows = conn.execute(
+                    "SELECT product_id FROM StockChange WHERE version > ? AND version <= ?",
+                    (previous, current)
+                ).fetchall()
+        except sqlite3.Error:
+            self.clear()
+            return
+        self.invalidate_products((row[0] for row in rows), names_changed=False)
+
+    def version(self) -> int:
+        """
+        Obtenir la versió actual del catàleg.
+
+        Comprova abans els canvis d'altres processos: qualsevol escriptura de
+        productes (o d'estoc) canvia la versió.
+
+        Returns:
+            int: Versió que canvia a cada invalidació
+        """
+        if self._monitor is not None:
+            self._monitor.poll()
+        return self._generation
+
+    def get_all_products(self, loader: Callable[[], List[Any]]) -> List[Any]:
+        """
+        Obtenir el llistat complet de productes.
+
+        Args:
+            loader: Funció que llegeix el llistat de la base de dades si no és a
+                la memòria cau (les excepcions es propaguen i no es guarda res)
+
+        Returns:
+            List: Còpia de la llista guardada (els productes són compartits i
+                s'han de tractar com a només lectura)
+        """
+        return list(self._get_or_load(_ALL_PRODUCTS, loader))
+
+    def get_product(self, product_id: int, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """
+        Obtenir un producte per ID (també es guarda que no existeix).
+
+        Args:
+            product_id (int): ID del producte
+            loader: Funció que llegeix el producte de la base de dades
+
+        Returns:
+            El producte (compartit, només lectura) o None si no existeix
+        """
+        return self._get_or_load(_product_key(product_id), loader)
+
+    def get_facets(self, loader: Callable[[], Any]) -> Any:
+        """
+        Obtenir els recomptes de facetes del catàleg.
+
+        Args:
+            loader: Funció que llegeix els recomptes de la base de dades
+
+        Returns:
+            El resultat guardat (compartit, només lectura)
+        """
+        return self._get_or_load(_FACETS, loader)
+
+    def get_search_results(self, query: str, loader: Callable[[], Any]) -> Any:
+        """
+        Obtenir els resultats d'una cerca.
+
+        Args:
+            query (str): Consulta normalitzada (clau de la memòria cau)
+            loader: Funció que executa la cerca si no és a la memòria cau
+
+        Returns:
+            El resultat guardat (p. ex. la tupla d'IDs ordenats per rellevància)
+        """
+        return self._get_or_load(query, loader, self._search)
+
+    def invalidate_products(self, product_ids: Iterable[int], names_changed: bool = True):
+        """
+        Invalidar uns productes concrets, el llistat complet i les facetes.
+
+        Args:
+            product_ids: IDs dels productes creats, modificats o eliminats
+            names_changed (bool): Si pot haver canviat algun nom (o s'ha creat o
+                eliminat un producte), també s'invaliden els resultats de cerca;
+                un canvi només d'estoc no els afecta
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.delete(_ALL_PRODUCTS)
+            self._entries.delete(_FACETS)
+            for product_id in product_ids:
+                self._entries.delete(_product_key(product_id))
+            if names_changed:
+                self._search.clear()
+
+    def clear(self):
+        """Invalidar tot el catàleg i els resultats de cerca."""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._search.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors de la memòria cau.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations, size i invalidations
+        """
+        stats = self._entries.stats()
+        stats["invalidations"] = self.invalidations
+        return stats
+
+    def search_stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors dels resultats de cerca.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations i size
+        """
+        return self._search.stats()
+
+
+class EntityCache:
+    """Memòria cau d'entitats que depenen d'unes famílies de canvis"""
+
+    def __init__(self, families: Iterable[str] = (), max_size: int = ENTITY_CACHE_SIZE,
+                 ttl: float = ENTITY_CACHE_TTL, monitor: Optional[ChangeMonitor] = None):
+        """
+        Inicialitza la memòria cau.
+
+        Args:
+            families: Famílies de ChangeCounter de què depenen les entrades; si
+                un altre procés en modifica alguna, es buida tota la memòria cau
+            max_size (int): Nombre màxim d'entrades
+            ttl (float): Segons de vida de cada entrada
+            monitor (ChangeMonitor, optional): Monitor de canvis de la base de dades
+        """
+        self._entries = TTLCache(max_size, ttl)
+        self._monitor = monitor
+        self._families = tuple(families)
+        if monitor is not None:
+            for family in self._families:
+                monitor.subscribe(family, self.clear)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Obtenir una entrada o carregar-la si no hi és.
+
+        Args:
+            key: Clau de l'entrada
+            loader: Funció que la llegeix de la base de dades; si retorna None
+                (no existeix o error) no es guarda res
+
+        Returns:
+            El valor guardat (compartit, només lectura) o el que retorna loader
+        """
+        if self._monitor is not None:
+            self._monitor.poll()
+        value = self._entries.get(key)
+        if value is not MISSING:
+            return value
+        generation = self._generation
+        value = loader()
+        with self._lock:
+            if value is not None and generation == self._generation:
+                self._entries.set(key, value)
+        return value
+
+    @contextmanager
+    def local_write(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        """
+        Bloc d'escriptura que qui escriu invalida amb delete().
+
+        Fa commit en sortir; amb monitor, els canvis de les famílies d'aquesta
+        memòria cau no la tornen a buidar sencera (ChangeMonitor.local_write).
+
+        Args:
+            conn (sqlite3.Connection): Connexió on es fan les escriptures
+        """
+        if self._monitor is None:
+            yield conn
+            conn.commit()
+            return
+        with self._monitor.local_write(conn, self._families):
+            yield conn
+
+    def delete(self, key: Hashable):
+        """
+        Invalidar una entrada després d'haver-la modificat en aquest procés.
+
+        Args:
+            key: Clau de l'entrada
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.delete(key)
+
+    def clear(self):
+        """Invalidar totes les entrades."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors de la memòria cau.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations i size
+        """
+        return self._entries.stats()
+
+
+class FragmentCache:
+    """Memòria cau de fragments HTML renderitzats (límit d'entrades i TTL)"""
+
+    def __init__(self, max_size: int = FRAGMENT_CACHE_SIZE, ttl: float = FRAGMENT_CACHE_TTL):
+        """
+        Inicialitza la memòria cau.
+
+        Args:
+            max_size (int): Nombre màxim de fragments
+            ttl (float): Segons de vida de cada fragment (0 la desactiva)
+        """
+        self._entries = TTLCache(max_size, ttl)
+
+    def get_or_render(self, key: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        Obtenir un fragment o renderitzar-lo si no hi és.
+
+        La clau ha d'incloure tot allò de què depèn el fragment (idioma,
+        versió del catàleg, pàgina...): les versions antigues no s'esborren,
+        simplement deixen de consultar-se i surten per LRU o TTL.
+
+        Args:
+            key: Clau del fragment
+            render: Funció que el renderitza
+
+        Returns:
+            El fragment guardat o acabat de renderitzar
+        """
+        value = self._entries.get(key)
+        if value is MISSING:
+            value = render()
+            self._entries.set(key, value)
+        return value
+
+    def clear(self):
+        """Eliminar tots els fragments."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors de la memòria cau.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations i size
+        """
+        return self._entries.stats()
+
+
+_fragment_cache = FragmentCache()
+
+
+def get_fragment_cache() -> FragmentCache:
+    """
+    Obtenir la memòria cau de fragments del procés.
+
+    Returns:
+        FragmentCache: Memòria cau compartida
+    """
+    return _fragment_cache
+
+
+_catalog_caches: Dict[str, CatalogCache] = {}
+_catalog_caches_lock = threading.Lock()
+
+
+def get_catalog_cache(db_path: str) -> CatalogCache:
+    """
+    Obtenir la memòria cau del catàleg compartida per a una base de dades.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        CatalogCache: Memòria cau única per procés i ruta
+    """
+    key = os.path.abspath(db_path) if db_path != ":memory:" else db_path
+    cache = _catalog_caches.get(key)
+    if cache is None:
+        with _catalog_caches_lock:
+            cache = _catalog_caches.get(key)
+            if cache is None:
+                cache = CatalogCache(monitor=get_change_monitor(db_path))
+                _catalog_caches[key] = cache
+    return cache
+
+
+_entity_caches: Dict[tuple, EntityCache] = {}
+
+
+def get_entity_cache(db_path: str, name: str, families: Iterable[str]) -> EntityCache:
+    """
+    Obtenir una memòria cau d'entitats compartida per a una base de dades.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        name (str): Nom de la memòria cau ('users', 'recommendations'...)
+        families: Famílies de ChangeCounter que la invaliden
+
+    Returns:
+        EntityCache: Memòria cau única per procés, ruta i nom
+    """
+    key = (os.path.abspath(db_path) if db_path != ":memory:" else db_path, name)
+    cache = _entity_caches.get(key)
+    if cache is None:
+        with _catalog_caches_lock:
+            cache = _entity_caches.get(key)
+            if cache is None:
+                cache = EntityCache(families, monitor=get_change_monitor(db_path))
+                _entity_caches[key] = cache
+    return cache
+
+
+def get_catalog_cache_stats(search: bool = False) -> Dict[str, int]:
+    """
+    Sumar els comptadors de les memòries cau del catàleg de totes les bases de dades.
+
+    Args:
+        search (bool): Sumar els comptadors dels resultats de cerca en lloc
+            dels del catàleg
+
+    Returns:
+        Dict[str, int]: hits, misses, evictions, expirations, size i
+            invalidations (aquest últim només per al catàleg)
+    """
+    with _catalog_caches_lock:
+        caches = list(_catalog_caches.values())
+    totals = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "size": 0, "invalidations": 0}
+    for cache in caches:
+        for name, value in (cache.search_stats() if search else cache.stats()).items():
+            totals[name] += value
+    return totals
+
+
+def clear_catalog_caches():
+    """
+    Invalidar el catàleg i les entitats de totes les bases de dades del procés i els fragments.
+
+    També es reinicien els monitors de canvis: les versions que recorden
+    (i les escriptures locals) són de la base de dades anterior.
+    """
+    with _catalog_caches_lock:
+        caches = list(_catalog_caches.values()) + list(_entity_caches.values())
+    for cache in caches:
+        cache.clear()
+    _fragment_cache.clear()
+    reset_change_monitors()
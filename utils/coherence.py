@@ -0,0 +1,258 @@
+"""
+Coherència de les memòries cau entre processos
+Cada procés consulta periòdicament la taula ChangeCounter (mantinguda per
+triggers, migració v6) i invalida les memòries cau de les famílies d'entitats
+que un altre procés ha modificat. Les versions que escriu el mateix procés
+(ChangeMonitor.local_write) no es tornen a invalidar: qui escriu ja ho ha fet
+amb precisió
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.database import get_connection
+
+# Segons mínims entre dues consultes de ChangeCounter (0 = a cada lectura)
+COHERENCE_INTERVAL = float(os.environ.get("CACHE_COHERENCE_INTERVAL", "0.5"))
+
+
+class ChangeMonitor:
+    """Detecta canvis d'altres processos a una base de dades per família d'entitats"""
+
+    def __init__(self, db_path: str, interval: float = COHERENCE_INTERVAL):
+        """
+        Inicialitza el monitor.
+
+        Args:
+            db_path (str): Ruta a la base de dades
+            interval (float): Segons mínims entre consultes
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self._versions: Optional[Dict[str, int]] = None
+        # Rangs de versions (anterior, posterior] escrits per aquest procés
+        self._local: Dict[str, List[Tuple[int, int]]] = {}
+        self._listeners: Dict[str, List[Callable[[], None]]] = {}
+        self._version_listeners: Dict[str, List[Callable[[int, int], None]]] = {}
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        self.polls = 0
+        self.changes = 0
+        self.local_skips = 0
+
+    def subscribe(self, entity: str, callback: Callable[[], None]):
+        """
+        Registrar una funció que s'executa quan canvia una família.
+
+        Args:
+            entity (str): Família d'entitats ('product', 'stock', 'user', 'order' o 'image')
+            callback: Funció sense arguments (normalment buida una memòria cau)
+        """
+        with self._lock:
+            self._listeners.setdefault(entity, []).append(callback)
+
+    def subscribe_versions(self, entity: str, callback: Callable[[int, int], None]):
+        """
+        Registrar una funció que rep la versió anterior i l'actual d'una família.
+
+        Serveix per invalidar només el que ha canviat entre les dues versions
+        (p. ex. els productes apuntats a StockChange).
+
+        Args:
+            entity (str): Família d'entitats
+            callback: Funció amb arguments (versió anterior, versió actual)
+        """
+        with self._lock:
+            self._version_listeners.setdefault(entity, []).append(callback)
+
+    def _read_versions(self, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict[str, int]]:
+        try:
+            if conn is not None:
+                rows = conn.execute("SELECT entity, version FROM ChangeCounter").fetchall()
+            else:
+                with get_connection(self.db_path) as own:
+                    rows = own.execute("SELECT entity, version FROM ChangeCounter").fetchall()
+        except sqlite3.Error:
+            # Base de dades sense la migració v6: només actua el TTL
+            return None
+        return {entity: version for entity, version in rows}
+
+    @contextmanager
+    def local_write(self, conn: sqlite3.Connection, families: Iterable[str]) -> Iterator[sqlite3.Connection]:
+        """
+        Escriure en un bloc les dades que aquest procés ja invalida amb precisió.
+
+        Obre la transacció amb BEGIN IMMEDIATE (si no n'hi ha cap d'oberta),
+        llegeix els comptadors abans i després de les escriptures del bloc i fa
+        commit en sortir. Amb el bloqueig d'escriptura pres, tots els
+        increments entremig són d'aquest procés: poll() no avisa per aquestes
+        versions de `families`, de manera que la invalidació precisa de qui
+        escriu no s'acaba convertint en un buidatge sencer de la memòria cau.
+        Les altres famílies que toqui el bloc (p. ex. 'order' en una comanda)
+        s'avisen com sempre. Si el bloc fa rollback no es registra res.
+
+        Ús:
+            with get_connection(db_path) as conn:
+                with monitor.local_write(conn, ('product',)):
+                    conn.execute("UPDATE Product ...")
+                cache.invalidate_products(...)
+
+        Args:
+            conn (sqlite3.Connection): Connexió on es fan les escriptures
+            families: Famílies que qui escriu invalida per si mateix
+
+        Yields:
+            sqlite3.Connection: La mateixa connexió
+        """
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        before = self._read_versions(conn)
+        yield conn
+        if not conn.in_transaction:
+            return
+        after = self._read_versions(conn)
+        conn.commit()
+        if before is None or after is None:
+            return
+        with self._lock:
+            for entity in families:
+                version = after.get(entity, 0)
+                if version > before.get(entity, 0):
+                    self._local.setdefault(entity, []).append((before.get(entity, 0), version))
+
+    def _remote_ranges(self, entity: str, previous: int, current: int) -> List[Tuple[int, int]]:
+        """
+        Rangs de versions (anterior, posterior] d'una família escrits per altres processos.
+
+        Treu de (previous, current] els rangs locals i oblida els que ja s'han
+        superat. S'ha de cridar amb self._lock pres.
+        """
+        if current < previous:
+            # Comptador reiniciat (base de dades nova): cap rang local és vàlid
+            self._local.pop(entity, None)
+            return [(0, current)]
+        ranges = []
+        start = previous
+        for before, after in sorted(self._local.get(entity, ())):
+            if after <= start or before >= current:
+                continue
+            if before > start:
+                ranges.append((start, before))
+            start = max(start, after)
+        if start < current:
+            ranges.append((start, current))
+        pending = [span for span in self._local.get(entity, ()) if span[1] > current]
+        if pending:
+            self._local[entity] = pending
+        else:
+            self._local.pop(entity, None)
+        return ranges
+
+    def poll(self, force: bool = False) -> List[str]:
+        """
+        Consultar els comptadors i avisar les famílies que han canviat.
+
+        Args:
+            force (bool): Consultar encara que no hagi passat l'interval
+
+        Returns:
+            List[str]: Famílies que altres processos han canviat des de la
+                darrera consulta
+        """
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return []
+        with self._lock:
+            if not force and now < self._next_poll:
+                return []
+            self._next_poll = now + self.interval
+            self.polls += 1
+            versions = self._read_versions()
+            if versions is None:
+                return []
+            previous = self._versions
+            self._versions = versions
+            if previous is None:
+                # Primera consulta: no hi ha res guardat d'abans
+                return []
+            remote = {}
+            for entity, version in versions.items():
+                if previous.get(entity) == version:
+                    continue
+                ranges = self._remote_ranges(entity, previous.get(entity, 0), version)
+                if ranges:
+                    remote[entity] = ranges
+                else:
+                    self.local_skips += 1
+            changed = list(remote)
+            callbacks = [callback for entity in changed for callback in self._listeners.get(entity, [])]
+            version_callbacks = [
+                (callback, before, after)
+                for entity, ranges in remote.items() for before, after in ranges
+                for callback in self._version_listeners.get(entity, [])
+            ]
+            self.changes += len(changed)
+
+        for callback in callbacks:
+            callback()
+        for callback, before, after in version_callbacks:
+            callback(before, after)
+        return changed
+
+    def reset(self):
+        """Oblidar les versions llegides i les escriptures locals (la base de dades s'ha substituït)."""
+        with self._lock:
+            self._versions = None
+            self._local.clear()
+            self._next_poll = 0.0
+
+    def current_versions(self) -> Dict[str, int]:
+        """
+        Llegir ara mateix els comptadors de totes les famílies.
+
+        Serveix de validador barat entre processos (p. ex. per a les ETag):
+        a diferència de la versió de CatalogCache, és la mateixa a tots els
+        processos. També avisa les famílies que han canviat.
+
+        Returns:
+            Dict[str, int]: Versió de cada família (buit sense la migració v6)
+        """
+        self.poll(force=True)
+        return dict(self._versions or {})
+
+
+_monitors: Dict[str, ChangeMonitor] = {}
+_monitors_lock = threading.Lock()
+
+
+def get_change_monitor(db_path: str) -> ChangeMonitor:
+    """
+    Obtenir el monitor de canvis compartit per a una base de dades.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        ChangeMonitor: Monitor únic per procés i ruta
+    """
+    key = os.path.abspath(db_path) if db_path != ":memory:" else db_path
+    monitor = _monitors.get(key)
+    if monitor is None:
+        with _monitors_lock:
+            monitor = _monitors.get(key)
+            if monitor is None:
+                monitor = ChangeMonitor(db_path)
+                _monitors[key] = monitor
+    return monitor
+
+
+def reset_change_monitors():
+    """Reiniciar els monitors de totes les bases de dades del procés."""
+    with _monitors_lock:
+        monitors = list(_monitors.values())
+    for monitor in monitors:
+        monitor.reset()
@@ -0,0 +1,319 @@
+"""
+Gestor de connexions SQLite compartit per tots els serveis
+Manté un pool de connexions preconfigurades per cada base de dades
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from migrations.migrate_database import SCHEMA_VERSION, migrate
+
+DEFAULT_DB_PATH = "techshop.db"
+
+# Paràmetres ajustables per variables d'entorn
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "8192"))
+
+
+# Marca que indica que encara no s'ha comprovat l'esquema de cap fitxer
+_UNCHECKED = object()
+
+# Funció opcional que embolcalla les connexions prestades (p. ex. el perfilador
+# SQL de utils/profiler.py). L'embolcall ha d'exposar la connexió original a `raw`.
+_connection_wrapper: Optional[Callable[[sqlite3.Connection], Any]] = None
+
+
+def _file_identity(db_path: str) -> Optional[Tuple[int, int]]:
+    """
+    Identificar el fitxer de la base de dades (dispositiu, inode).
+
+    Permet detectar si el fitxer s'ha esborrat o substituït mentre hi havia
+    connexions obertes (p. ex. després d'executar init_database.py).
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        Optional[Tuple[int, int]]: (st_dev, st_ino) o None si no existeix
+    """
+    if db_path == ":memory:":
+        return None
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+class ConnectionPool:
+    """Pool de connexions SQLite reutilitzables per a una base de dades"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, pool_size: int = POOL_SIZE):
+        """
+        Inicialitza el pool.
+
+        Args:
+            db_path (str): Ruta a la base de dades SQLite
+            pool_size (int): Nombre màxim de connexions inactives que es conserven
+        """
+        self.db_path = db_path
+        self.pool_size = max(0, pool_size)
+        self._idle: List[sqlite3.Connection] = []
+        self._identities: Dict[int, Optional[Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+        self._wal_identity: Optional[Tuple[int, int]] = None
+        self._schema_identity: object = _UNCHECKED
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def _configure(self, conn: sqlite3.Connection):
+        """
+        Aplicar els PRAGMA de rendiment a una connexió nova.
+
+        Args:
+            conn (sqlite3.Connection): Connexió acabada d'obrir
+        """
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+
+        # El mode WAL és persistent al fitxer: només cal activar-lo un cop
+        identity = _file_identity(self.db_path)
+        if identity is not None and identity != self._wal_identity:
+            try:
+                mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()
+                if mode and str(mode[0]).lower() == "wal":
+                    self._wal_identity = identity
+            except sqlite3.OperationalError:
+                pass  # Base de dades bloquejada: es tornarà a intentar amb la següent connexió
+
+    def _open(self) -> Tuple[sqlite3.Connection, Optional[Tuple[int, int]]]:
+        """
+        Obrir i configurar una connexió nova.
+
+        Returns:
+            Tuple[sqlite3.Connection, Optional[Tuple[int, int]]]: (connexió, identitat del fitxer)
+        """
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        self._configure(conn)
+        return conn, _file_identity(self.db_path)
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Obtenir una connexió del pool (o obrir-ne una de nova si no n'hi ha).
+
+        Returns:
+            sqlite3.Connection: Connexió exclusiva fins que es retorni amb release()
+        """
+        current = _file_identity(self.db_path)
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if self._identities.get(id(candidate)) == current:
+                    conn = candidate
+                    self.hits += 1
+                    break
+                stale.append(candidate)
+                self._identities.pop(id(candidate), None)
+                self.discarded += 1
+            if conn is None:
+                self.misses += 1
+
+        for candidate in stale:
+            candidate.close()
+
+        fresh = conn is None
+        if fresh:
+            conn, current = self._open()
+            with self._lock:
+                self._identities[id(conn)] = current
+
+        # Les connexions noves sempre comproven l'esquema: un fitxer recreat
+        # pot reutilitzar el mateix inode que un d'anterior ja migrat
+        if fresh or current != self._schema_identity:
+            self._ensure_schema(conn, current)
+        if _connection_wrapper is not None:
+            return _connection_wrapper(conn)
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection, identity: Optional[Tuple[int, int]]):
+        """
+        Aplicar les migracions pendents el primer cop que es fa servir un fitxer.
+
+        Els serveis poden assumir així la darrera versió de l'esquema i fer una
+        única consulta, sense reintents per columnes inexistents.
+
+        Args:
+            conn (sqlite3.Connection): Connexió sense transacció oberta
+            identity: Identitat del fitxer en el moment de la comprovació
+        """
+        try:
+            if migrate(conn) >= SCHEMA_VERSION:
+                self._schema_identity = identity
+        except sqlite3.Error:
+            pass  # Es tornarà a intentar amb la següent connexió
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Retornar una connexió al pool.
+
+        Si queda alguna transacció oberta es desfà, perquè la següent
+        petició rebi sempre una connexió neta.
+
+        Args:
+            conn (sqlite3.Connection): Connexió obtinguda amb acquire()
+        """
+        conn = getattr(conn, "raw", conn)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+            self._identities.pop(id(conn), None)
+        conn.close()
+
+    def _discard(self, conn: sqlite3.Connection):
+        """
+        Tancar una connexió que no es pot reutilitzar.
+
+        Args:
+            conn (sqlite3.Connection): Connexió a descartar
+        """
+        with self._lock:
+            self.discarded += 1
+            self._identities.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Context manager equivalent a `with sqlite3.connect(...) as conn`.
+
+        Fa commit en sortir normalment i rollback si hi ha una excepció,
+        i després retorna la connexió al pool en lloc de tancar-la.
+
+        Yields:
+            sqlite3.Connection: Connexió preconfigurada
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            self.release(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors del pool.
+
+        Returns:
+            Dict[str, int]: hits, misses, discarded i connexions inactives
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "idle": len(self._idle),
+            }
+
+    def close_all(self):
+        """Tancar totes les connexions inactives del pool."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            for conn in idle:
+                self._identities.pop(id(conn), None)
+        for conn in idle:
+            conn.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = DEFAULT_DB_PATH) -> ConnectionPool:
+    """
+    Obtenir el pool compartit per a una base de dades.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        ConnectionPool: Pool únic per procés i ruta
+    """
+    key = os.path.abspath(db_path) if db_path != ":memory:" else db_path
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[key] = pool
+    return pool
+
+
+def get_connection(db_path: str = DEFAULT_DB_PATH):
+    """
+    Obtenir una connexió del pool com a context manager.
+
+    Ús:
+        with get_connection(self.db_path) as conn:
+            cursor = conn.cursor()
+
+    Args:
+        db_path (str): Ruta a la base de dades
+
+    Returns:
+        Context manager que proporciona una sqlite3.Connection
+    """
+    return get_pool(db_path).connection()
+
+
+def set_connection_wrapper(wrapper: Optional[Callable[[sqlite3.Connection], Any]]):
+    """
+    Registrar (o treure amb None) l'embolcall de les connexions prestades.
+
+    Args:
+        wrapper: Funció que rep la connexió del pool i retorna la connexió a
+            usar; si retorna un embolcall, aquest ha de tenir l'atribut `raw`
+    """
+    global _connection_wrapper
+    _connection_wrapper = wrapper
+
+
+def close_all_pools():
+    """Tancar les connexions inactives de tots els pools del procés."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
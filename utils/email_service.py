@@ -9,6 +9,7 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
+from decimal import Decimal
 from typing import Tuple, Optional
 from pathlib import Path
 import base64
@@ -203,7 +204,7 @@ def send_order_confirmation_email(
     email_to: str, 
     username: str, 
     order_id: int, 
-    order_total: float,
+    order_total: Decimal,
     order_date: str,
     order_items: list,
     invoice_pdf: Optional[bytes] = None
@@ -218,7 +219,7 @@ def send_order_confirmation_email(
         email_to (str): Email del destinatario
         username (str): Nombre de usuario
         order_id (int): ID de la orden
-        order_total (float): Total de la orden
+        order_total (Decimal): Total de la orden
         order_date (str): Fecha de la orden
         order_items (list): Lista de items con formato [{'product_id': int, 'quantity': int, 'name': str, 'price': Decimal}, ...]
         invoice_pdf (bytes, optional): PDF de la factura para adjuntar
@@ -307,7 +308,7 @@ def send_order_confirmation_email(
                         <div class="product-name">{name}</div>
                         <p><strong>Cantidad:</strong> {quantity}</p>
                         <p><strong>Precio unitario:</strong> {price:.2f}€</p>
-                        <p><strong>Subtotal:</strong> {float(price) * quantity:.2f}€</p>
+                        <p><strong>Subtotal:</strong> {price * quantity:.2f}€</p>
                     </div>
                     """
             else:
@@ -316,7 +317,7 @@ def send_order_confirmation_email(
                         <div class="product-name">{name}</div>
                         <p><strong>Cantidad:</strong> {quantity}</p>
                         <p><strong>Precio unitario:</strong> {price:.2f}€</p>
-                        <p><strong>Subtotal:</strong> {float(price) * quantity:.2f}€</p>
+                        <p><strong>Subtotal:</strong> {price * quantity:.2f}€</p>
                     </div>
                 """
         
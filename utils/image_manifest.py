@@ -0,0 +1,246 @@
+"""
+Índex persistent de les imatges dels productes
+Guarda a la taula ProductImage (migració v10) els fitxers de
+static/img/products/<id> i en manté una còpia en memòria, de manera que
+renderitzar una pàgina no fa cap crida al sistema de fitxers
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.coherence import ChangeMonitor, get_change_monitor
+from utils.database import get_connection
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+# Inserir només les imatges de productes que existeixen (els directoris
+# d'un producte eliminat es conserven al disc però no s'indexen)
+INSERT_IMAGE_SQL = (
+    "INSERT INTO ProductImage (product_id, position, filename) "
+    "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM Product WHERE id = ?)"
+)
+
+
+def scan_product_images(images_dir: Path) -> List[str]:
+    """
+    Llistar les imatges d'un directori de producte en ordre.
+
+    Args:
+        images_dir (Path): Directori static/img/products/<id>
+
+    Returns:
+        List[str]: Noms dels fitxers d'imatge (buida si el directori no existeix)
+    """
+    try:
+        entries = sorted(images_dir.iterdir())
+    except OSError:
+        return []
+    return [path.name for path in entries
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS]
+
+
+class ImageManifest:
+    """Índex de les imatges dels productes d'una base de dades"""
+
+    def __init__(self, db_path: str, images_root: str, monitor: Optional[ChangeMonitor] = None):
+        """
+        Inicialitza l'índex.
+
+        Args:
+            db_path (str): Ruta a la base de dades
+            images_root (str): Directori static/img/products
+            monitor (ChangeMonitor, optional): Monitor de canvis; si un altre
+                procés modifica ProductImage (família 'image') es torna a llegir
+        """
+        self.db_path = db_path
+        self.images_root = Path(images_root)
+        self._images: Optional[Dict[int, Tuple[str, ...]]] = None
+        self._lock = threading.Lock()
+        self._monitor = monitor
+        if monitor is not None:
+            monitor.subscribe("image", self.invalidate)
+        self._build_attempted = False
+        self._version = 0
+        self.loads = 0
+        self.rebuilds = 0
+
+    def version(self) -> int:
+        """
+        Obtenir la versió de l'índex (canvia a cada modificació o recàrrega).
+
+        Returns:
+            int: Versió actual
+        """
+        if self._monitor is not None:
+            self._monitor.poll()
+        return self._version
+
+    def get_images(self, product_id: int) -> Tuple[str, ...]:
+        """
+        Obtenir les imatges d'un producte sense accedir al disc.
+
+        Args:
+            product_id (int): ID del producte
+
+        Returns:
+            Tuple[str, ...]: Noms dels fitxers en ordre (buida si no en té)
+        """
+        if self._monitor is not None:
+            self._monitor.poll()
+        images = self._images
+        if images is None:
+            images = self._load()
+        return images.get(int(product_id), ())
+
+    def _load(self) -> Dict[int, Tuple[str, ...]]:
+        """Llegir tot l'índex de la base de dades (o construir-lo si és buit)."""
+        with self._lock:
+            if self._images is not None:
+                return self._images
+            grouped: Dict[int, List[str]] = {}
+            try:
+                with get_connection(self.db_path) as conn:
+                    rows = conn.execute(
+                        "SELECT product_id, filename FROM ProductImage ORDER BY product_id, position"
+                    ).fetchall()
+            except sqlite3.Error:
+                # Base de dades sense la migració v10: cap imatge
+                return {}
+            for product_id, filename in rows:
+                grouped.setdefault(product_id, []).append(filename)
+            self.loads += 1
+            images = {product_id: tuple(names) for product_id, names in grouped.items()}
+            self._images = images
+            # Índex encara buit després de la migració: es construeix un sol cop
+            # per procés (si no hi ha cap directori, és una única crida al disc)
+            needs_build = not rows and not self._build_attempted
+            self._build_attempted = True
+        if needs_build and self._has_image_dirs():
+            self.rebuild()
+            return self._load()
+        return images
+
+    def _has_image_dirs(self) -> bool:
+        try:
+            return any(path.is_dir() for path in self.images_root.iterdir())
+        except OSError:
+            return False
+
+    def refresh_product(self, product_id: int) -> Tuple[str, ...]:
+        """
+        Tornar a indexar les imatges d'un producte després d'escriure-les o eliminar-les.
+
+        Args:
+            product_id (int): ID del producte
+
+        Returns:
+            Tuple[str, ...]: Imatges indexades del producte
+        """
+        product_id = int(product_id)
+        filenames = scan_product_images(self.images_root / str(product_id))
+        with get_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM ProductImage WHERE product_id = ?", (product_id,))
+            conn.executemany(INSERT_IMAGE_SQL, [
+                (product_id, position, filename, product_id)
+                for position, filename in enumerate(filenames)
+            ])
+            conn.commit()
+        with self._lock:
+            self._version += 1
+            if self._images is not None:
+                if filenames:
+                    self._images[product_id] = tuple(filenames)
+                else:
+                    self._images.pop(product_id, None)
+        return tuple(filenames)
+
+    def rebuild(self) -> int:
+        """
+        Reconstruir tot l'índex a partir dels fitxers del disc.
+
+        Returns:
+            int: Nombre d'imatges indexades
+        """
+        rows = []
+        try:
+            directories = sorted(path for path in self.images_root.iterdir() if path.is_dir())
+        except OSError:
+            directories = []
+        for directory in directories:
+            if not directory.name.isdigit():
+                continue
+            product_id = int(directory.name)
+            rows.extend((product_id, position, filename, product_id)
+                        for position, filename in enumerate(scan_product_images(directory)))
+
+        with get_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM ProductImage")
+            indexed = conn.executemany(INSERT_IMAGE_SQL, rows).rowcount
+            conn.commit()
+        with self._lock:
+            self._images = None
+            self._build_attempted = True
+            self._version += 1
+            self.rebuilds += 1
+        return max(indexed, 0)
+
+    def invalidate(self):
+        """Descartar la còpia en memòria (es tornarà a llegir de la base de dades)."""
+        with self._lock:
+            self._images = None
+            self._version += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtenir els comptadors de l'índex.
+
+        Returns:
+            Dict[str, int]: products (amb imatges), images, loads i rebuilds
+        """
+        images = self._images or {}
+        return {
+            "products": len(images),
+            "images": sum(len(names) for names in images.values()),
+            "loads": self.loads,
+            "rebuilds": self.rebuilds,
+        }
+
+
+_manifests: Dict[Tuple[str, str], ImageManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def get_image_manifest(db_path: str, images_root: str) -> ImageManifest:
+    """
+    Obtenir l'índex d'imatges compartit per a una base de dades i un directori.
+
+    Args:
+        db_path (str): Ruta a la base de dades
+        images_root (str): Directori static/img/products
+
+    Returns:
+        ImageManifest: Índex únic per procés, base de dades i directori
+    """
+    # Camí ràpid amb les rutes tal com arriben (es crida per cada producte
+    # renderitzat o exportat): evita normalitzar-les cada cop
+    manifest = _manifests.get((db_path, images_root))
+    if manifest is not None:
+        return manifest
+    db_key = os.path.abspath(db_path) if db_path != ":memory:" else db_path
+    key = (db_key, os.path.abspath(images_root))
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = ImageManifest(db_path, images_root, monitor=get_change_monitor(db_path))
+            _manifests[key] = manifest
+        _manifests[(db_path, images_root)] = manifest
+    return manifest
+
+
+def clear_image_manifests():
+    """Oblidar tots els índexs del procés (p. ex. després de recrear la base de dades)."""
+    with _manifests_lock:
+        _manifests.clear()
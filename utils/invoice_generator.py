@@ -5,10 +5,12 @@ Utilitza ReportLab per generar factures PDF
 
 import sqlite3
 from io import BytesIO
-from decimal import Decimal
-from datetime import datetime
 from typing import Optional
 
+from models.mapper import parse_datetime
+from utils.database import get_connection
+from utils.money import format_cents
+
 try:
     from reportlab.lib.pagesizes import A4
     from reportlab.lib.units import mm
@@ -21,13 +23,14 @@ except ImportError:
     REPORTLAB_AVAILABLE = False
 
 
-def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
+def generate_invoice_pdf(order_id: int, user_id: int, db_path: str = "techshop.db") -> Optional[bytes]:
     """
     Generar una factura en format PDF per una comanda.
     
     Args:
         order_id (int): ID de la comanda
         user_id (int): ID de l'usuari (per verificar permisos)
+        db_path (str): Ruta a la base de dades
         
     Returns:
         bytes o None: Dades del PDF o None si hi ha error
@@ -39,13 +42,13 @@ def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
     print(f"🔍 Iniciando generación de factura para orden {order_id}, usuario {user_id}")
     
     try:
-        with sqlite3.connect('techshop.db') as conn:
+        with get_connection(db_path) as conn:
             cursor = conn.cursor()
             
             # Obtenir dades de la comanda
             print(f"📋 Buscando orden {order_id} para usuario {user_id}...")
             cursor.execute(
-                'SELECT id, total, created_at, user_id FROM "Order" WHERE id = ? AND user_id = ?',
+                'SELECT id, total_cents, created_at, user_id FROM "Order" WHERE id = ? AND user_id = ?',
                 (order_id, user_id)
             )
             order_result = cursor.fetchone()
@@ -55,84 +58,36 @@ def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
             
             print(f"✅ Orden encontrada: total={order_result[1]}, fecha={order_result[2]}")
             
-            order_id_db, total, created_at, user_id_db = order_result
+            order_id_db, total_cents, created_at, user_id_db = order_result
             
-            # Parsear fecha de forma más robusta
-            try:
-                if created_at:
-                    if isinstance(created_at, str):
-                        # Intentar diferentes formatos de fecha
-                        try:
-                            order_date = datetime.fromisoformat(created_at)
-                        except ValueError:
-                            try:
-                                # Formato alternativo: "YYYY-MM-DD HH:MM:SS"
-                                order_date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-                            except ValueError:
-                                try:
-                                    # Formato alternativo: "YYYY-MM-DD"
-                                    order_date = datetime.strptime(created_at, "%Y-%m-%d")
-                                except ValueError:
-                                    order_date = datetime.now()
-                    else:
-                        order_date = datetime.now()
-                else:
-                    order_date = datetime.now()
-            except Exception as e:
-                print(f"⚠️  Error parseando fecha: {e}, usando fecha actual")
-                order_date = datetime.now()
+            # Les comandes antigues sense data no n'inventen cap: la factura mostra "—"
+            order_date = parse_datetime(created_at)
+            order_date_text = order_date.strftime('%d/%m/%Y') if order_date else '—'
             
-            # Obtenir dades de l'usuari (con manejo de columnas opcionales)
+            # Obtenir dades de l'usuari
             print(f"👤 Buscando datos del usuario {user_id}...")
-            try:
-                cursor.execute(
-                    "SELECT username, email, address, account_type, dni, nif FROM User WHERE id = ?",
-                    (user_id,)
-                )
-                user_result = cursor.fetchone()
-                if not user_result:
-                    print(f"❌ No se encontró el usuario {user_id}")
-                    return None
-                
-                print(f"✅ Usuario encontrado, columnas: {len(user_result)}")
-                
-                if len(user_result) >= 6:
-                    username, email, address, account_type, dni, nif = user_result
-                    # Asegurar que dni y nif no sean None
-                    dni = dni or ""
-                    nif = nif or ""
-                    account_type = account_type or "user"
-                else:
-                    # Compatibilidad con esquema antiguo
-                    username = user_result[0] if len(user_result) > 0 else ""
-                    email = user_result[1] if len(user_result) > 1 else ""
-                    address = user_result[2] if len(user_result) > 2 else ""
-                    account_type = user_result[3] if len(user_result) > 3 else "user"
-                    dni = user_result[4] if len(user_result) > 4 else ""
-                    nif = user_result[5] if len(user_result) > 5 else ""
-                
-                print(f"📋 Datos usuario: username={username}, email={email}, account_type={account_type}, dni={dni}, nif={nif}")
-            except sqlite3.OperationalError:
-                # Si las columnas no existen
-                cursor.execute(
-                    "SELECT username, email, address FROM User WHERE id = ?",
-                    (user_id,)
-                )
-                user_result = cursor.fetchone()
-                if not user_result:
-                    return None
-                username, email, address = user_result
-                account_type = "user"
-                dni = ""
-                nif = ""
+            cursor.execute(
+                "SELECT username, email, address, account_type, dni, nif FROM User WHERE id = ?",
+                (user_id,)
+            )
+            user_result = cursor.fetchone()
+            if not user_result:
+                print(f"❌ No se encontró el usuario {user_id}")
+                return None
+            
+            username, email, address, account_type, dni, nif = user_result
+            # Asegurar que dni y nif no sean None
+            dni = dni or ""
+            nif = nif or ""
+            account_type = account_type or "user"
+            print(f"📋 Datos usuario: username={username}, email={email}, account_type={account_type}, dni={dni}, nif={nif}")
             
-            # Obtenir items de la comanda
+            # Obtenir items de la comanda (nom i preu guardats en el moment de la compra)
             cursor.execute("""
-                SELECT oi.quantity, p.name, p.price
-                FROM OrderItem oi
-                JOIN Product p ON oi.product_id = p.id
-                WHERE oi.order_id = ?
-                ORDER BY p.name
+                SELECT quantity, product_name, unit_price_cents
+                FROM OrderItem
+                WHERE order_id = ?
+                ORDER BY product_name
             """, (order_id,))
             items = cursor.fetchall()
             
@@ -193,9 +148,9 @@ def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
             
             # Añadir email solo si existe
             if email:
-                client_info_lines.append(["08001 Barcelona, Espanya", f"Email: {email}", f"Data: {order_date.strftime('%d/%m/%Y')}"])
+                client_info_lines.append(["08001 Barcelona, Espanya", f"Email: {email}", f"Data: {order_date_text}"])
             else:
-                client_info_lines.append(["08001 Barcelona, Espanya", "", f"Data: {order_date.strftime('%d/%m/%Y')}"])
+                client_info_lines.append(["08001 Barcelona, Espanya", "", f"Data: {order_date_text}"])
             
             # Añadir dirección solo si existe
             if address:
@@ -235,14 +190,12 @@ def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
             # Taula d'items
             items_data = [["Producte", "Quantitat", "Preu Unitari", "Total"]]
             
-            for quantity, product_name, price in items:
-                unit_price = Decimal(str(price))
-                item_total = unit_price * quantity
+            for quantity, product_name, price_cents in items:
                 items_data.append([
-                    product_name,
+                    product_name or "",
                     str(quantity),
-                    f"{unit_price:.2f} €",
-                    f"{item_total:.2f} €"
+                    f"{format_cents(price_cents)} €",
+                    f"{format_cents((price_cents or 0) * quantity)} €"
                 ])
             
             items_table = Table(items_data, colWidths=[80*mm, 30*mm, 35*mm, 35*mm])
@@ -277,7 +230,7 @@ def generate_invoice_pdf(order_id: int, user_id: int) -> Optional[bytes]:
             total_data = [
                 ["", "", 
                  Paragraph("<b>TOTAL:</b>", total_bold_style), 
-                 Paragraph(f"<b>{Decimal(str(total)):.2f} €</b>", total_bold_style)]
+                 Paragraph(f"<b>{format_cents(total_cents)} €</b>", total_bold_style)]
             ]
             total_table = Table(total_data, colWidths=[80*mm, 30*mm, 35*mm, 35*mm])
             total_table.setStyle(TableStyle([
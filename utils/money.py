@@ -0,0 +1,58 @@
+"""
+Representació dels imports en cèntims
+Els preus i totals es guarden i es calculen com a enters de cèntims; aquest
+mòdul és l'únic punt de conversió cap a Decimal i text per mostrar-los
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any
+
+_CENT = Decimal("0.01")
+
+
+def to_cents(value: Any) -> int:
+    """
+    Convertir un import en euros a cèntims, arrodonint a la unitat.
+
+    Args:
+        value: Import en euros (Decimal, str, int o float)
+
+    Returns:
+        int: Import en cèntims
+
+    Raises:
+        ValueError: Si el valor no és un número vàlid
+    """
+    if value is None:
+        return 0
+    try:
+        amount = value if isinstance(value, Decimal) else Decimal(str(value))
+        return int((amount * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError) as e:
+        raise ValueError(f"Import no vàlid: {value}") from e
+
+
+def from_cents(cents: Any) -> Decimal:
+    """
+    Convertir cèntims a euros amb dos decimals.
+
+    Args:
+        cents: Import en cèntims (None es considera 0)
+
+    Returns:
+        Decimal: Import en euros (p. ex. Decimal('10.50'))
+    """
+    return (Decimal(int(cents or 0)) * _CENT).quantize(_CENT)
+
+
+def format_cents(cents: Any) -> str:
+    """
+    Formatar cèntims com a text per mostrar (sense símbol de moneda).
+
+    Args:
+        cents: Import en cèntims
+
+    Returns:
+        str: Import amb dos decimals (p. ex. '10.50')
+    """
+    return f"{from_cents(cents):.2f}"
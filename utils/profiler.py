@@ -0,0 +1,322 @@
+"""
+Perfilador SQL per petició
+Registra cada sentència executada amb les connexions del pool durant una
+petició Flask (SQL normalitzat, durada i files) i n'exposa els totals
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from flask import g, has_request_context, request
+
+from utils.database import set_connection_wrapper
+
+# Paràmetres ajustables per variables d'entorn
+PROFILER_ENABLED = os.environ.get("SQL_PROFILER", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("SQL_SLOW_QUERY_LOG", "slow_queries.log")
+PROFILE_HISTORY = int(os.environ.get("SQL_PROFILE_HISTORY", "50"))
+
+PROFILE_HEADER = "X-SQL-Profile"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalitzar una sentència per agrupar-la amb les equivalents.
+
+    Substitueix literals de text i números per '?' i compacta els espais.
+
+    Args:
+        sql (str): Sentència SQL original
+
+    Returns:
+        str: Sentència normalitzada
+    """
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    return _SPACE_RE.sub(" ", sql).strip()
+
+
+class QueryRecord:
+    """Una sentència executada durant la petició"""
+
+    __slots__ = ("sql", "duration_ms", "rows")
+
+    def __init__(self, sql: str):
+        self.sql = normalize_sql(sql)
+        self.duration_ms = 0.0
+        self.rows = 0
+
+
+class RequestProfile:
+    """Sentències executades durant una petició"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started_at = datetime.now()
+        self.queries: List[QueryRecord] = []
+
+    def record(self, sql: str) -> QueryRecord:
+        """
+        Afegir una sentència nova al perfil.
+
+        Args:
+            sql (str): Sentència SQL executada
+
+        Returns:
+            QueryRecord: Registre on s'acumulen la durada i les files
+        """
+        query = QueryRecord(sql)
+        self.queries.append(query)
+        return query
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(q.duration_ms for q in self.queries)
+
+    @property
+    def rows(self) -> int:
+        return sum(q.rows for q in self.queries)
+
+
+class ProfiledCursor:
+    """Cursor que mesura el temps d'execució i de lectura de cada sentència"""
+
+    def __init__(self, cursor: Any, profile: RequestProfile):
+        self._cursor = cursor
+        self._profile = profile
+        self._query: Optional[QueryRecord] = None
+
+    def _run(self, method, sql: str, *args):
+        self._query = self._profile.record(sql)
+        start = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            self._query.duration_ms += (time.perf_counter() - start) * 1000
+        if self._cursor.rowcount > 0:
+            self._query.rows += self._cursor.rowcount
+        return self
+
+    def execute(self, sql: str, parameters: Iterable = ()):
+        return self._run(self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable):
+        return self._run(self._cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str):
+        return self._run(self._cursor.executescript, sql_script)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if self._query is not None:
+            self._query.duration_ms += (time.perf_counter() - start) * 1000
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None and self._query is not None:
+            self._query.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self._cursor.fetchmany, *args)
+        if self._query is not None:
+            self._query.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        if self._query is not None:
+            self._query.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """Embolcall d'una connexió del pool que registra les sentències al perfil"""
+
+    def __init__(self, conn: Any, profile: RequestProfile):
+        self.raw = conn
+        self._profile = profile
+
+    def cursor(self, *args) -> ProfiledCursor:
+        return ProfiledCursor(self.raw.cursor(*args), self._profile)
+
+    def execute(self, sql: str, parameters: Iterable = ()) -> ProfiledCursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable) -> ProfiledCursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str) -> ProfiledCursor:
+        return self.cursor().executescript(sql_script)
+
+    def __enter__(self):
+        self.raw.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.raw.__exit__(*exc_info)
+
+    def __getattr__(self, name: str):
+        return getattr(self.raw, name)
+
+
+def _wrap_connection(conn: Any) -> Any:
+    """
+    Embolcallar la connexió si hi ha una petició amb perfil actiu.
+
+    Args:
+        conn: Connexió prestada pel pool
+
+    Returns:
+        La connexió embolcallada o l'original fora d'una petició
+    """
+    if has_request_context():
+        profile = g.get("sql_profile")
+        if profile is not None:
+            return ProfiledConnection(conn, profile)
+    return conn
+
+
+_history: Deque[RequestProfile] = deque(maxlen=PROFILE_HISTORY)
+_history_lock = threading.Lock()
+_slow_log_lock = threading.Lock()
+
+
+def write_slow_queries(profile: RequestProfile, threshold_ms: Optional[float] = None,
+                       log_path: Optional[str] = None) -> int:
+    """
+    Escriure al registre les sentències que superen el llindar.
+
+    Args:
+        profile (RequestProfile): Perfil de la petició
+        threshold_ms (float, optional): Llindar en ms (per defecte SQL_SLOW_QUERY_MS)
+        log_path (str, optional): Fitxer de registre (per defecte SQL_SLOW_QUERY_LOG)
+
+    Returns:
+        int: Nombre de sentències escrites
+    """
+    threshold_ms = SLOW_QUERY_MS if threshold_ms is None else threshold_ms
+    log_path = log_path or SLOW_QUERY_LOG
+    slow = [q for q in profile.queries if q.duration_ms >= threshold_ms]
+    if not slow:
+        return 0
+
+    timestamp = profile.started_at.isoformat(timespec="seconds")
+    lines = [
+        f"{timestamp} {profile.method} {profile.path} {q.duration_ms:.1f}ms rows={q.rows} {q.sql}\n"
+        for q in slow
+    ]
+    try:
+        with _slow_log_lock, open(log_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+    except OSError as e:
+        print(f"⚠️  No s'ha pogut escriure el registre de consultes lentes: {e}")
+        return 0
+    return len(slow)
+
+
+def get_recent_profiles() -> List[RequestProfile]:
+    """
+    Obtenir els perfils de les darreres peticions (la més recent primer).
+
+    Returns:
+        List[RequestProfile]: Perfils guardats
+    """
+    with _history_lock:
+        return list(reversed(_history))
+
+
+def get_statement_summary(profiles: Iterable[RequestProfile]) -> List[Dict[str, Any]]:
+    """
+    Agrupar les sentències de diversos perfils per SQL normalitzat.
+
+    Args:
+        profiles (Iterable[RequestProfile]): Perfils a agrupar
+
+    Returns:
+        List[Dict[str, Any]]: sql, count, total_ms, max_ms i rows, ordenat per temps total
+    """
+    summary: Dict[str, Dict[str, Any]] = {}
+    for profile in profiles:
+        for q in profile.queries:
+            entry = summary.setdefault(q.sql, {"sql": q.sql, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0})
+            entry["count"] += 1
+            entry["total_ms"] += q.duration_ms
+            entry["max_ms"] = max(entry["max_ms"], q.duration_ms)
+            entry["rows"] += q.rows
+    return sorted(summary.values(), key=lambda e: e["total_ms"], reverse=True)
+
+
+def clear_profiles():
+    """Buidar l'historial de perfils."""
+    with _history_lock:
+        _history.clear()
+
+
+def init_profiler(app):
+    """
+    Activar el perfilador SQL a l'aplicació Flask.
+
+    Afegeix la capçalera X-SQL-Profile (i Server-Timing) a cada resposta,
+    guarda les darreres peticions per a la vista d'administració i escriu
+    les sentències lentes al registre.
+
+    Args:
+        app: Instància de Flask
+    """
+    if not PROFILER_ENABLED:
+        return
+
+    set_connection_wrapper(_wrap_connection)
+
+    @app.before_request
+    def _start_sql_profile():
+        g.sql_profile = RequestProfile(request.method, request.path)
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        profile = g.pop("sql_profile", None)
+        if profile is None:
+            return response
+
+        profile.status = response.status_code
+        total_ms = profile.total_ms
+        response.headers[PROFILE_HEADER] = f"queries={profile.count}; time_ms={total_ms:.3f}; rows={profile.rows}"
+        response.headers.add("Server-Timing", f'sql;dur={total_ms:.3f};desc="{profile.count} queries"')
+
+        write_slow_queries(profile)
+        # Les peticions sense SQL (fitxers estàtics) i la mateixa vista no es guarden
+        if profile.count and request.endpoint != "admin.admin_sql_profile":
+            with _history_lock:
+                _history.append(profile)
+        return response
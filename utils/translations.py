@@ -141,6 +141,58 @@ TRANSLATIONS = {
         'reset_password': 'Restablir Contrasenya',
         'edit_product': 'Editar Producte',
         'create_product': 'Crear Nou Producte',
+        'cart_stock_short': 'Stock insuficient: només en queden {stock}',
+        'import_products': 'Importar Productes',
+        'import_file_label': 'Fitxer de productes (CSV o NDJSON)',
+        'import_images_label': 'Imatges (ZIP opcional)',
+        'import_upsert_label': 'Actualitzar els productes amb un SKU existent',
+        'import_help': 'Columnes: name, price, stock i sku (opcional). Les imatges del ZIP s\'anomenen SKU.jpg, SKU_2.jpg o SKU/1.jpg.',
+        'import_submit': 'Importar',
+        'import_rows': 'Files llegides',
+        'import_inserted': 'Creats',
+        'import_updated': 'Actualitzats',
+        'import_images_attached': 'Productes amb imatges',
+        'import_errors': 'Errors',
+        'import_line': 'Línia',
+        'sql_profile_title': 'Perfil SQL',
+        'sql_profile_slow_threshold': 'Llindar de consulta lenta',
+        'sql_profile_requests': 'Peticions recents',
+        'sql_profile_time': 'Hora',
+        'sql_profile_request': 'Petició',
+        'sql_profile_queries': 'Consultes',
+        'sql_profile_rows': 'Files',
+        'sql_profile_statements': 'Sentències agrupades',
+        'sql_profile_executions': 'Execucions',
+        'sql_profile_total_ms': 'Total (ms)',
+        'sql_profile_max_ms': 'Màxim (ms)',
+        'sql_profile_empty': 'Encara no hi ha dades',
+        'catalog_cache_title': 'Memòria cau del catàleg',
+        'catalog_cache_hits': 'Encerts',
+        'catalog_cache_misses': 'Fallades',
+        'catalog_cache_evictions': 'Expulsions',
+        'catalog_cache_expirations': 'Caducades',
+        'catalog_cache_invalidations': 'Invalidacions',
+        'catalog_cache_size': 'Entrades',
+        'filter_price': 'Preu',
+        'filter_all': 'Tots',
+        'filter_availability': 'Disponibilitat',
+        'filter_in_stock': 'Només amb estoc',
+        'filter_company': 'Venedor',
+        'filter_apply': 'Filtrar',
+        'filter_clear': 'Treure els filtres',
+        'search': 'Cercar',
+        'fragment_cache': 'Fragments HTML',
+        'search_placeholder': 'Cerca productes...',
+        'search_results': 'Resultats de la cerca',
+        'search_found': 'productes trobats',
+        'no_search_results': "No s'ha trobat cap producte",
+        'previous_page': 'Anterior',
+        'next_page': 'Següent',
+        'sort_by': 'Ordenar per',
+        'sort_id': 'Per defecte',
+        'sort_price': 'Preu',
+        'sort_name': 'Nom',
+        'load_more': 'Carregar més',
         
         # Company
         'my_products_title': 'Els Meus Productes',
@@ -413,6 +465,58 @@ TRANSLATIONS = {
         'reset_password': 'Restablecer Contraseña',
         'edit_product': 'Editar Producto',
         'create_product': 'Crear Nuevo Producto',
+        'cart_stock_short': 'Stock insuficiente: solo quedan {stock}',
+        'import_products': 'Importar Productos',
+        'import_file_label': 'Fichero de productos (CSV o NDJSON)',
+        'import_images_label': 'Imágenes (ZIP opcional)',
+        'import_upsert_label': 'Actualizar los productos con un SKU existente',
+        'import_help': 'Columnas: name, price, stock y sku (opcional). Las imágenes del ZIP se llaman SKU.jpg, SKU_2.jpg o SKU/1.jpg.',
+        'import_submit': 'Importar',
+        'import_rows': 'Filas leídas',
+        'import_inserted': 'Creados',
+        'import_updated': 'Actualizados',
+        'import_images_attached': 'Productos con imágenes',
+        'import_errors': 'Errores',
+        'import_line': 'Línea',
+        'sql_profile_title': 'Perfil SQL',
+        'sql_profile_slow_threshold': 'Umbral de consulta lenta',
+        'sql_profile_requests': 'Peticiones recientes',
+        'sql_profile_time': 'Hora',
+        'sql_profile_request': 'Petición',
+        'sql_profile_queries': 'Consultas',
+        'sql_profile_rows': 'Filas',
+        'sql_profile_statements': 'Sentencias agrupadas',
+        'sql_profile_executions': 'Ejecuciones',
+        'sql_profile_total_ms': 'Total (ms)',
+        'sql_profile_max_ms': 'Máximo (ms)',
+        'sql_profile_empty': 'Todavía no hay datos',
+        'catalog_cache_title': 'Caché del catálogo',
+        'catalog_cache_hits': 'Aciertos',
+        'catalog_cache_misses': 'Fallos',
+        'catalog_cache_evictions': 'Expulsiones',
+        'catalog_cache_expirations': 'Caducadas',
+        'catalog_cache_invalidations': 'Invalidaciones',
+        'catalog_cache_size': 'Entradas',
+        'filter_price': 'Precio',
+        'filter_all': 'Todos',
+        'filter_availability': 'Disponibilidad',
+        'filter_in_stock': 'Solo con stock',
+        'filter_company': 'Vendedor',
+        'filter_apply': 'Filtrar',
+        'filter_clear': 'Quitar los filtros',
+        'search': 'Buscar',
+        'fragment_cache': 'Fragmentos HTML',
+        'search_placeholder': 'Busca productos...',
+        'search_results': 'Resultados de la búsqueda',
+        'search_found': 'productos encontrados',
+        'no_search_results': 'No se ha encontrado ningún producto',
+        'previous_page': 'Anterior',
+        'next_page': 'Siguiente',
+        'sort_by': 'Ordenar por',
+        'sort_id': 'Por defecto',
+        'sort_price': 'Precio',
+        'sort_name': 'Nombre',
+        'load_more': 'Cargar más',
         
         # Company
         'my_products_title': 'Mis Productos',
@@ -580,6 +684,58 @@ TRANSLATIONS = {
         'reset_password': 'Reset Password',
         'edit_product': 'Edit Product',
         'create_product': 'Create New Product',
+        'cart_stock_short': 'Not enough stock: only {stock} left',
+        'import_products': 'Import Products',
+        'import_file_label': 'Products file (CSV or NDJSON)',
+        'import_images_label': 'Images (optional ZIP)',
+        'import_upsert_label': 'Update products with an existing SKU',
+        'import_help': 'Columns: name, price, stock and sku (optional). ZIP images are named SKU.jpg, SKU_2.jpg or SKU/1.jpg.',
+        'import_submit': 'Import',
+        'import_rows': 'Rows read',
+        'import_inserted': 'Created',
+        'import_updated': 'Updated',
+        'import_images_attached': 'Products with images',
+        'import_errors': 'Errors',
+        'import_line': 'Line',
+        'sql_profile_title': 'SQL Profile',
+        'sql_profile_slow_threshold': 'Slow query threshold',
+        'sql_profile_requests': 'Recent requests',
+        'sql_profile_time': 'Time',
+        'sql_profile_request': 'Request',
+        'sql_profile_queries': 'Queries',
+        'sql_profile_rows': 'Rows',
+        'sql_profile_statements': 'Grouped statements',
+        'sql_profile_executions': 'Executions',
+        'sql_profile_total_ms': 'Total (ms)',
+        'sql_profile_max_ms': 'Max (ms)',
+        'sql_profile_empty': 'No data yet',
+        'catalog_cache_title': 'Catalog cache',
+        'catalog_cache_hits': 'Hits',
+        'catalog_cache_misses': 'Misses',
+        'catalog_cache_evictions': 'Evictions',
+        'catalog_cache_expirations': 'Expired',
+        'catalog_cache_invalidations': 'Invalidations',
+        'catalog_cache_size': 'Entries',
+        'filter_price': 'Price',
+        'filter_all': 'All',
+        'filter_availability': 'Availability',
+        'filter_in_stock': 'In stock only',
+        'filter_company': 'Vendor',
+        'filter_apply': 'Filter',
+        'filter_clear': 'Clear filters',
+        'search': 'Search',
+        'fragment_cache': 'HTML fragments',
+        'search_placeholder': 'Search products...',
+        'search_results': 'Search results',
+        'search_found': 'products found',
+        'no_search_results': 'No products found',
+        'previous_page': 'Previous',
+        'next_page': 'Next',
+        'sort_by': 'Sort by',
+        'sort_id': 'Default',
+        'sort_price': 'Price',
+        'sort_name': 'Name',
+        'load_more': 'Load more',
         
         # Company
         'my_products_title': 'My Products',